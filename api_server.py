@@ -1,16 +1,29 @@
 """
 API Server for Lyra
 Provides HTTP API for external applications to interact with Lyra
+
+Served over ASGI (FastAPI on uvicorn). Requests that do real work (chat,
+memory recall, thinking tasks, and each item of a batch) go through admission
+control: a fixed number run at once, a bounded number wait for a slot, and the
+rest are turned away with 429 and a Retry-After header. Every response carries Server-Timing,
+X-Queue-Time-Ms and X-Response-Time-Ms headers.
+
+Chat replies can be streamed as server-sent events by sending "stream": true
+(or Accept: text/event-stream) to /api/chat.
 """
 
 import os
 import sys
 import json
 import time
+import socket
+import asyncio
 import argparse
 import logging
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 # Configure logging
 logging.basicConfig(
@@ -23,32 +36,198 @@ logging.basicConfig(
 )
 logger = logging.getLogger("api_server")
 
-# Try to import Flask
+from modules.inference_scheduler import get_scheduler, model_key_for, QueueFullError
+from modules.tracing import span, current_trace_id
+
+# Try to import FastAPI and uvicorn
 try:
-    from flask import Flask, request, jsonify
-    FLASK_AVAILABLE = True
+    from fastapi import FastAPI, Request, Body
+    from fastapi.responses import JSONResponse, StreamingResponse
+    import uvicorn
+    FASTAPI_AVAILABLE = True
 except ImportError:
-    logger.error("Flask not available. Install with: pip install flask")
-    FLASK_AVAILABLE = False
+    logger.error("FastAPI not available. Install with: pip install fastapi uvicorn")
+    FASTAPI_AVAILABLE = False
+
+DEFAULT_SERVER_SETTINGS = {
+    "max_concurrent": 4,      # admitted requests doing work at once
+    "max_pending": 16,        # admitted requests waiting for a slot
+    "retry_after": 1,         # seconds suggested to rejected clients
+    "batch_max_items": 32,
+    "batch_concurrency": 4,   # items of one batch running at once
+    "stream_heartbeat": 10.0  # seconds between SSE keep-alive comments
+}
+
+# Paths that go through admission control; status endpoints stay reachable under load.
+# Batches are not listed: each of their items is admitted on its own.
+ADMITTED_PATHS = {"/api/chat", "/api/memory/recall", "/api/thinking/create_task"}
+
+class AdmissionController:
+    """
+    Bounds the work the server accepts
+    
+    At most max_concurrent admitted requests run at once and at most
+    max_pending more wait for a slot. Anything beyond that is rejected
+    immediately so clients back off instead of piling up timeouts.
+    Only used from the server's event loop, so no locking is needed.
+    """
+    
+    def __init__(self, max_concurrent: int = 4, max_pending: int = 16):
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.admitted = 0  # running plus waiting
+        self.running = 0
+        self.stats = {"admitted": 0, "rejected": 0, "completed": 0}
+        self.queue_times = deque(maxlen=1000)
+    
+    def try_admit(self) -> bool:
+        if self.admitted >= self.max_concurrent + self.max_pending:
+            self.stats["rejected"] += 1
+            return False
+        self.admitted += 1
+        self.stats["admitted"] += 1
+        return True
+    
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the seconds spent waiting"""
+        started = time.perf_counter()
+        await self.semaphore.acquire()
+        self.running += 1
+        waited = time.perf_counter() - started
+        self.queue_times.append(waited)
+        return waited
+    
+    def release(self):
+        self.running -= 1
+        self.semaphore.release()
+    
+    def leave(self):
+        self.admitted -= 1
+        self.stats["completed"] += 1
+    
+    def get_status(self) -> Dict[str, Any]:
+        waits = sorted(self.queue_times)
+        def percentile(fraction):
+            return round(waits[min(len(waits) - 1, int(fraction * len(waits)))] * 1000, 2) if waits else 0.0
+        return dict(self.stats, running=self.running, waiting=self.admitted - self.running,
+                    max_concurrent=self.max_concurrent, max_pending=self.max_pending,
+                    queue_ms_p50=percentile(0.50), queue_ms_p95=percentile(0.95))
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying admission control and adding timing headers
+    
+    Runs around the whole response, streamed bodies included, so a slot is
+    held until the last byte is sent or the client disconnects.
+    """
+    
+    def __init__(self, app, admission: AdmissionController, retry_after: int = 1):
+        self.app = app
+        self.admission = admission
+        self.retry_after = retry_after
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        admitted = scope["path"] in ADMITTED_PATHS
+        if admitted and not self.admission.try_admit():
+            await self._reject(send, started)
+            return
+        
+        queue_wait = 0.0
+        
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total = (time.perf_counter() - started) * 1000
+                queue_ms = queue_wait * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", (f"queue;dur={queue_ms:.2f}, app;dur={total - queue_ms:.2f}, "
+                                                   f"total;dur={total:.2f}").encode("latin-1")))
+                headers.append((b"x-queue-time-ms", f"{queue_ms:.2f}".encode("latin-1")))
+                headers.append((b"x-response-time-ms", f"{total:.2f}".encode("latin-1")))
+                trace_id = current_trace_id()
+                if trace_id:
+                    headers.append((b"x-trace-id", trace_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+        
+        with span("api.request", method=scope["method"], path=scope["path"]):
+            if not admitted:
+                await self.app(scope, receive, send_with_timing)
+                return
+            try:
+                queue_wait = await self.admission.acquire()
+                try:
+                    await self.app(scope, receive, send_with_timing)
+                finally:
+                    self.admission.release()
+            finally:
+                self.admission.leave()
+    
+    async def _reject(self, send, started):
+        body = json.dumps({
+            "error": "Server busy, retry later",
+            "retry_after": self.retry_after
+        }).encode("utf-8")
+        total = f"{(time.perf_counter() - started) * 1000:.2f}".encode("latin-1")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(self.retry_after).encode("latin-1")),
+                (b"server-timing", b"total;dur=" + total),
+                (b"x-response-time-ms", total)
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
 class LyraAPI:
     """API server for Lyra"""
     
-    def __init__(self, port: int = 5000):
-        if not FLASK_AVAILABLE:
-            raise ImportError("Flask is required for the API server")
-            
+    def __init__(self, port: int = 5000, host: str = "0.0.0.0", lyra_interface=None,
+                 modules: Dict[str, Any] = None, load_modules: bool = True, **settings):
+        """
+        Initialize the API server
+        
+        Args:
+            port: Port to listen on
+            host: Interface to bind
+            lyra_interface: Chat interface to use instead of loading LyraBot
+            modules: Cognitive modules to use (name -> instance)
+            load_modules: Whether to load the bot and modules on startup
+            **settings: Overrides for DEFAULT_SERVER_SETTINGS
+        """
+        if not FASTAPI_AVAILABLE:
+            raise ImportError("FastAPI and uvicorn are required for the API server")
+        
         self.port = port
-        self.app = Flask("LyraAPI")
-        self.lyra_interface = None
-        self.modules = {}
+        self.host = host
+        self.settings = dict(DEFAULT_SERVER_SETTINGS, **settings)
+        self.app = FastAPI(title="Lyra API")
+        self.admission = AdmissionController(self.settings["max_concurrent"], self.settings["max_pending"])
+        self.app.add_middleware(AdmissionMiddleware, admission=self.admission,
+                                retry_after=self.settings["retry_after"])
+        self.lyra_interface = lyra_interface
+        self.modules = dict(modules or {})
         self.base_path = os.path.dirname(os.path.abspath(__file__))
+        self.server = None
+        self.server_thread = None
         
         # Set up routes
         self._setup_routes()
         
         # Load modules
-        self._load_modules()
+        if load_modules:
+            self._load_modules()
     
     def _load_modules(self):
         """Load Lyra modules for API integration"""
@@ -83,7 +262,7 @@ class LyraAPI:
                             logger.info(f"Connected API to Phi model: {phi_models[0].name}")
             except ImportError as e:
                 logger.warning(f"Could not load model loader: {e}")
-                
+        
         except ImportError as e:
             logger.warning(f"Could not load Lyra bot interface: {e}")
             
@@ -134,66 +313,241 @@ class LyraAPI:
         except ImportError:
             logger.warning("Deep memory module not available")
     
+    def _respond(self, status: int, body: Dict[str, Any]):
+        headers = {"Retry-After": str(self.settings["retry_after"])} if status == 429 else None
+        return JSONResponse(body, status_code=status, headers=headers)
+    
+    def _generate(self, message: str, user_id: str) -> str:
+        """Run a chat turn at API priority, queued fairly per user"""
+        if hasattr(self.lyra_interface, 'chat'):
+            return self.lyra_interface.chat(message, priority="api", caller=user_id)
+        return get_scheduler().run(
+            model_key_for(self.lyra_interface),
+            lambda: self.lyra_interface.generate_response(message),
+            priority="api",
+            caller=user_id
+        )
+    
+    def _handle_chat(self, data: Optional[Dict[str, Any]]) -> Tuple[int, Dict[str, Any]]:
+        if not data or 'message' not in data:
+            return 400, {"error": "Invalid request, 'message' field required"}
+        if not self.lyra_interface:
+            return 503, {"error": "Lyra bot interface not available"}
+        
+        try:
+            response = self._generate(data['message'], data.get('user_id', 'api_user'))
+            return 200, {
+                "response": response,
+                "timestamp": time.time()
+            }
+        except QueueFullError as e:
+            return 429, e.to_dict()
+        except Exception as e:
+            logger.error(f"Error processing message: {e}")
+            return 500, {"error": str(e)}
+    
+    def _handle_recall(self, data: Optional[Dict[str, Any]]) -> Tuple[int, Dict[str, Any]]:
+        if "deep_memory" not in self.modules:
+            return 503, {"error": "Deep memory module not available"}
+        if not data or 'query' not in data:
+            return 400, {"error": "Invalid request, 'query' field required"}
+        
+        try:
+            memory = self.modules["deep_memory"]
+            results = memory.recall_similar(data['query'], limit=int(data.get('limit', 5)))
+            return 200, {
+                "query": data['query'],
+                "results": results
+            }
+        except Exception as e:
+            logger.error(f"Error recalling memories: {e}")
+            return 500, {"error": str(e)}
+    
+    def _chat_chunks(self, message: str, user_id: str):
+        """
+        Reply text as it is produced
+        
+        Interfaces that can stream provide chat_stream() yielding text chunks
+        (LyraBot streams llama.cpp tokens); for the others the whole reply
+        arrives as one chunk.
+        """
+        if hasattr(self.lyra_interface, 'chat_stream'):
+            yield from self.lyra_interface.chat_stream(message, priority="api", caller=user_id)
+        else:
+            yield self._generate(message, user_id)
+    
+    async def _stream_chat(self, message: str, user_id: str):
+        """Server-sent events for one chat turn: start, token..., then done or error"""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        stop = threading.Event()
+        started = time.perf_counter()
+        
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, item)
+            except RuntimeError:
+                stop.set()  # the event loop has gone away
+        
+        def produce():
+            try:
+                for chunk in self._chat_chunks(message, user_id):
+                    if stop.is_set():
+                        return
+                    put(("token", chunk))
+                put(("done", None))
+            except Exception as e:
+                put(("error", e))
+        
+        producer = asyncio.ensure_future(asyncio.to_thread(produce))
+        parts = []
+        first_token_ms = None
+        try:
+            yield _sse("start", {"timestamp": time.time()})
+            while True:
+                try:
+                    kind, value = await asyncio.wait_for(events.get(), self.settings["stream_heartbeat"])
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                
+                if kind == "token":
+                    if first_token_ms is None:
+                        first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+                    parts.append(value)
+                    yield _sse("token", {"text": value})
+                elif kind == "done":
+                    yield _sse("done", {
+                        "response": "".join(parts),
+                        "first_token_ms": first_token_ms,
+                        "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                        "timestamp": time.time()
+                    })
+                    return
+                else:
+                    status = 429 if isinstance(value, QueueFullError) else 500
+                    body = value.to_dict() if isinstance(value, QueueFullError) else {"error": str(value)}
+                    logger.error(f"Error streaming response: {value}")
+                    yield _sse("error", dict(body, status=status))
+                    return
+        finally:
+            # The client may have gone; stop the producer at its next chunk
+            stop.set()
+            if not producer.done():
+                producer.add_done_callback(lambda future: future.exception())
+    
+    async def _run_batch_item(self, item: Any, limiter: asyncio.Semaphore) -> Dict[str, Any]:
+        handlers = {"chat": self._handle_chat, "recall": self._handle_recall}
+        if not isinstance(item, dict) or item.get("type") not in handlers:
+            return {"status": 400, "body": {"error": f"Item type must be one of: {', '.join(handlers)}"}}
+        
+        async with limiter:
+            # Each item takes an admission slot like a single request would
+            if not self.admission.try_admit():
+                return {"status": 429, "body": {"error": "Server busy, retry later",
+                                                "retry_after": self.settings["retry_after"]}}
+            try:
+                await self.admission.acquire()
+                try:
+                    started = time.perf_counter()
+                    status, body = await asyncio.to_thread(handlers[item["type"]], item)
+                finally:
+                    self.admission.release()
+            finally:
+                self.admission.leave()
+        return {"status": status, "body": body, "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
+    
     def _setup_routes(self):
         """Set up API routes"""
-        @self.app.route('/api/health', methods=['GET'])
+        @self.app.get('/api/health')
         def health_check():
             """Health check endpoint"""
-            return jsonify({
+            return {
                 "status": "ok",
                 "timestamp": time.time(),
                 "modules_available": list(self.modules.keys())
-            })
-        
-        @self.app.route('/api/chat', methods=['POST'])
-        def chat():
-            """Chat endpoint"""
-            data = request.get_json()
-            if not data or 'message' not in data:
-                return jsonify({"error": "Invalid request, 'message' field required"}), 400
+            }
+        
+        @self.app.post('/api/chat')
+        async def chat(request: Request, data: Optional[Dict[str, Any]] = Body(None)):
+            """Chat endpoint; streams server-sent events if asked to"""
+            stream = bool(data and data.get("stream")) or \
+                "text/event-stream" in request.headers.get("accept", "")
+            if not stream or not data or 'message' not in data or not self.lyra_interface:
+                return self._respond(*await asyncio.to_thread(self._handle_chat, data))
             
-            message = data['message']
-            user_id = data.get('user_id', 'api_user')
+            return StreamingResponse(
+                self._stream_chat(data['message'], data.get('user_id', 'api_user')),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
+        @self.app.post('/api/batch')
+        async def batch(data: Optional[Dict[str, Any]] = Body(None)):
+            """
+            Run several chat and recall requests in one call
             
-            if not self.lyra_interface:
-                return jsonify({"error": "Lyra bot interface not available"}), 503
+            Body: {"requests": [{"type": "chat", "message": ...}, {"type": "recall", "query": ...}]}
+            Results come back in request order, each with its own status.
+            """
+            items = data.get("requests") if isinstance(data, dict) else None
+            if not isinstance(items, list) or not items:
+                return self._respond(400, {"error": "Invalid request, non-empty 'requests' list required"})
+            if len(items) > self.settings["batch_max_items"]:
+                return self._respond(400, {"error": f"At most {self.settings['batch_max_items']} requests per batch"})
             
-            try:
-                # Process the message
-                response = self.lyra_interface.generate_response(message)
-                
-                return jsonify({
-                    "response": response,
-                    "timestamp": time.time()
-                })
-            except Exception as e:
-                logger.error(f"Error processing message: {e}")
-                return jsonify({"error": str(e)}), 500
+            started = time.perf_counter()
+            limiter = asyncio.Semaphore(self.settings["batch_concurrency"])
+            results = await asyncio.gather(*(self._run_batch_item(item, limiter) for item in items))
+            return {
+                "results": results,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+                "timestamp": time.time()
+            }
         
-        @self.app.route('/api/thinking/status', methods=['GET'])
+        @self.app.get('/api/server/metrics')
+        def server_metrics():
+            """Admission control counters and queue times"""
+            return self.admission.get_status()
+        
+        @self.app.get('/api/inference/metrics')
+        def inference_metrics():
+            """Inference queue depth and wait-time metrics"""
+            return get_scheduler().get_metrics()
+        
+        @self.app.get('/api/inference/models')
+        def inference_models():
+            """Resident models with their generation and speculative decoding stats"""
+            from modules.model_manager import get_instance as get_model_manager
+            return get_model_manager().get_residency_status()
+        
+        @self.app.get('/api/inference/cache')
+        def inference_cache_metrics():
+            """Response cache hit rates"""
+            from modules.response_cache import get_instance as get_response_cache
+            return get_response_cache().get_stats()
+        
+        @self.app.get('/api/thinking/status')
         def thinking_status():
             """Get thinking status"""
             if "extended_thinking" not in self.modules:
-                return jsonify({"error": "Extended thinking module not available"}), 503
+                return self._respond(503, {"error": "Extended thinking module not available"})
             
             try:
                 thinking = self.modules["extended_thinking"]
-                status = thinking.get_thinking_state()
-                
-                return jsonify(status)
+                return thinking.get_thinking_state()
             except Exception as e:
                 logger.error(f"Error getting thinking status: {e}")
-                return jsonify({"error": str(e)}), 500
+                return self._respond(500, {"error": str(e)})
         
-        @self.app.route('/api/thinking/create_task', methods=['POST'])
-        def create_thinking_task():
+        @self.app.post('/api/thinking/create_task')
+        def create_thinking_task(data: Optional[Dict[str, Any]] = Body(None)):
             """Create a new thinking task"""
             if "extended_thinking" not in self.modules:
-                return jsonify({"error": "Extended thinking module not available"}), 503
+                return self._respond(503, {"error": "Extended thinking module not available"})
             
-            data = request.get_json()
             if not data or 'description' not in data:
-                return jsonify({"error": "Invalid request, 'description' field required"}), 400
+                return self._respond(400, {"error": "Invalid request, 'description' field required"})
             
             try:
                 thinking = self.modules["extended_thinking"]
@@ -204,88 +558,123 @@ class LyraAPI:
                     max_duration=int(data.get('max_duration', 600))
                 )
                 
-                return jsonify({
+                return {
                     "task_id": task_id,
                     "status": "created"
-                })
+                }
             except Exception as e:
                 logger.error(f"Error creating thinking task: {e}")
-                return jsonify({"error": str(e)}), 500
+                return self._respond(500, {"error": str(e)})
         
-        @self.app.route('/api/emotional/status', methods=['GET'])
+        @self.app.get('/api/emotional/status')
         def emotional_status():
             """Get emotional status"""
             if "emotional_core" not in self.modules:
-                return jsonify({"error": "Emotional core module not available"}), 503
+                return self._respond(503, {"error": "Emotional core module not available"})
             
             try:
                 emotional = self.modules["emotional_core"]
                 dominant, intensity = emotional.get_dominant_emotion()
                 mood = emotional.get_mood_description()
                 
-                return jsonify({
+                return {
                     "dominant_emotion": dominant,
                     "intensity": intensity,
                     "mood": mood
-                })
+                }
             except Exception as e:
                 logger.error(f"Error getting emotional status: {e}")
-                return jsonify({"error": str(e)}), 500
+                return self._respond(500, {"error": str(e)})
         
-        @self.app.route('/api/boredom/status', methods=['GET'])
+        @self.app.get('/api/boredom/status')
         def boredom_status():
             """Get boredom status"""
             if "boredom" not in self.modules:
-                return jsonify({"error": "Boredom module not available"}), 503
+                return self._respond(503, {"error": "Boredom module not available"})
             
             try:
                 boredom = self.modules["boredom"]
-                state = boredom.get_boredom_state()
-                
-                return jsonify(state)
+                return boredom.get_boredom_state()
             except Exception as e:
                 logger.error(f"Error getting boredom status: {e}")
-                return jsonify({"error": str(e)}), 500
+                return self._respond(500, {"error": str(e)})
         
-        @self.app.route('/api/memory/recall', methods=['POST'])
-        def recall_memory():
+        @self.app.post('/api/memory/recall')
+        def recall_memory(data: Optional[Dict[str, Any]] = Body(None)):
             """Recall memories based on query"""
-            if "deep_memory" not in self.modules:
-                return jsonify({"error": "Deep memory module not available"}), 503
-            
-            data = request.get_json()
-            if not data or 'query' not in data:
-                return jsonify({"error": "Invalid request, 'query' field required"}), 400
-            
-            try:
-                memory = self.modules["deep_memory"]
-                results = memory.recall_similar(data['query'], limit=int(data.get('limit', 5)))
-                
-                return jsonify({
-                    "query": data['query'],
-                    "results": results
-                })
-            except Exception as e:
-                logger.error(f"Error recalling memories: {e}")
-                return jsonify({"error": str(e)}), 500
+            return self._respond(*self._handle_recall(data))
     
     def run(self):
         """Run the API server"""
-        logger.info(f"Starting API server on port {self.port}")
-        self.app.run(host='0.0.0.0', port=self.port)
+        logger.info(f"Starting API server on {self.host}:{self.port}")
+        uvicorn.run(self.app, host=self.host, port=self.port, log_level="info")
+    
+    def start_background(self, host: str = "127.0.0.1", port: Optional[int] = None, timeout: float = 10.0) -> int:
+        """
+        Serve from a background thread (for tests and the load-test harness)
+        
+        Args:
+            host: Interface to bind
+            port: Port to bind; 0 picks a free one. Defaults to self.port
+            timeout: Seconds to wait for the server to start
+        
+        Returns:
+            The bound port
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, self.port if port is None else port))
+        self.host, self.port = host, sock.getsockname()[1]
+        
+        config = uvicorn.Config(self.app, log_level="warning", lifespan="off")
+        self.server = uvicorn.Server(config)
+        self.server_thread = threading.Thread(target=self.server.run, kwargs={"sockets": [sock]},
+                                              name="api-server", daemon=True)
+        self.server_thread.start()
+        
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self.server_thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError(f"API server failed to start on {host}:{self.port}")
+            time.sleep(0.01)
+        logger.info(f"API server listening on {host}:{self.port}")
+        return self.port
+    
+    def stop(self):
+        """Stop a server started with start_background()"""
+        if self.server:
+            self.server.should_exit = True
+            self.server_thread.join(timeout=10)
+            self.server = None
+            self.server_thread = None
 
 def main():
     """Main entry point"""
     parser = argparse.ArgumentParser(description="Lyra API Server")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to bind")
     parser.add_argument("--port", type=int, default=5000, help="Port to run the API server on")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_SERVER_SETTINGS["max_concurrent"],
+                        help="Requests doing work at once")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_SERVER_SETTINGS["max_pending"],
+                        help="Requests allowed to wait for a slot before new ones get 429")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve health and queue metrics for Prometheus on this port (off by default)")
     args = parser.parse_args()
     
+    if args.metrics_port is not None:
+        from utils.health_monitor import get_health_monitor
+        monitor = get_health_monitor()
+        monitor.start_monitoring()
+        if monitor.start_exporter(args.metrics_port):
+            logger.info(f"Serving health metrics on port {args.metrics_port}")
+    
     try:
-        api = LyraAPI(port=args.port)
+        api = LyraAPI(port=args.port, host=args.host, max_concurrent=args.max_concurrent,
+                      max_pending=args.max_pending)
         api.run()
     except ImportError:
         logger.error("Required dependencies not available")
-        logger.info("Please install Flask: pip install flask")
+        logger.info("Please install FastAPI and uvicorn: pip install fastapi uvicorn")
     except Exception as e:
         logger.error(f"Error starting API server: {e}")
 
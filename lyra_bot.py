@@ -4,13 +4,18 @@ Lyra Bot - Main controller for the Lyra AI assistant
 import os
 import json
 import time
+import queue
 import random
 import threading
+import contextvars
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Callable, Dict, List, Optional, Any, Tuple
 import uuid
 from model_config import ModelConfig, get_manager
 from model_loader import ModelLoader, ModelInterface
+from modules.inference_scheduler import get_scheduler, model_key_for, QueueFullError
+from modules.model_manager import ModelConfig as ResidentModelConfig, get_instance as get_model_manager
+from modules.tracing import span, traced
 
 # Define paths for all resources
 MEMORY_DIR = Path('G:/AI/Lyra/memories')
@@ -547,6 +552,8 @@ class MemoryManager:
         self.memories_path = MEMORY_DIR
         self.active_memory = None
         self.memories = self._load_memories()
+        # Session memories are written from several chat threads at once
+        self.lock = threading.RLock()
     
     def _load_memories(self) -> Dict[str, List[Dict]]:
         """Load all available memories"""
@@ -596,17 +603,21 @@ class MemoryManager:
         self.active_memory = name
         return True
     
-    def add_message(self, role: str, content: str) -> bool:
-        """Add a message to the active memory""" 
-        if not self.active_memory:
+    def add_message(self, role: str, content: str, name: str = None) -> bool:
+        """Add a message to the named memory, or the active memory if no name is given""" 
+        name = name or self.active_memory
+        if not name:
             return False
         
-        self.memories[self.active_memory].append({
-            "role": role,
-            "content": content,
-            "timestamp": time.time()
-        })
-        self._save_memory(self.active_memory)
+        with self.lock:
+            if name not in self.memories:
+                self.memories[name] = []
+            self.memories[name].append({
+                "role": role,
+                "content": content,
+                "timestamp": time.time()
+            })
+            self._save_memory(name)
         return True
     
     def _clean_text(self, text: str) -> str:
@@ -616,6 +627,14 @@ class MemoryManager:
         text = ''.join(c for c in text if ord(c) >= 32 or c == '\n')
         return text.strip()
     
+    def get_recent_messages(self, name: str = None, limit: int = 12) -> List[Dict]:
+        """Get a copy of the last messages in the named memory, or the active memory"""
+        name = name or self.active_memory
+        if not name or limit <= 0:
+            return []
+        with self.lock:
+            return list(self.memories.get(name, [])[-limit:])
+    
     def get_active_memory_messages(self) -> List[Dict]:
         """Get all messages in the active memory"""
         if not self.active_memory:
@@ -1328,6 +1347,7 @@ class LyraBot:
         self.model_manager = get_manager()
         self.memory_manager = MemoryManager()
         self.active_model_interface = None
+        self.active_model_name = None  # set when the model is resident in the shared ModelManager
         self.personality = BotPersonality()
         self.user_profile = UserProfile()
         self.context_manager = ContextManager()
@@ -1360,7 +1380,7 @@ class LyraBot:
         active_model = self.model_manager.get_active_model()
         if active_model:
             try:
-                self.active_model_interface = self.model_loader.get_model(active_model)
+                self.active_model_interface = self._load_interface(active_model)
                 if self.active_model_interface:
                     print(f"Loaded model: {active_model.name}")
                 else:
@@ -1392,7 +1412,7 @@ class LyraBot:
                 if interface.can_load():
                     print(f"Attempting to load fallback model: {model.name}")
                     self.model_manager.set_active_model(model.name)
-                    self.active_model_interface = self.model_loader.get_model(model)
+                    self.active_model_interface = self._load_interface(model)
                     if self.active_model_interface:
                         print(f"Successfully loaded fallback model: {model.name}")
                         return
@@ -1417,24 +1437,62 @@ class LyraBot:
             print(f"Queuing model for background loading: {model.name}")
             self.model_loader.preload_model(model)
     
+    def _load_interface(self, model: ModelConfig):
+        """Load a model, through the shared ModelManager when it is a llama.cpp model"""
+        if not self._register_resident(model):
+            self.active_model_name = None
+            return self.model_loader.get_model(model)
+        instance = get_model_manager().load_model(model.name)
+        self.active_model_name = model.name if instance is not None else None
+        return instance
+    
+    def _register_resident(self, model: ModelConfig) -> bool:
+        """
+        Describe a llama.cpp model to the shared ModelManager so it is loaded
+        once and generation, preloading and eviction all use the same instance.
+        Returns False for other model types, which still go through the model loader.
+        """
+        if model.type != "llama-cpp":
+            return False
+        get_model_manager().register_model(ResidentModelConfig(
+            model.name,
+            model.path,
+            "llama",
+            context_size=model.n_ctx,
+            n_gpu_layers=model.n_gpu_layers,
+            format=model.chat_format
+        ))
+        return True
+    
     def _preload_frequent_models(self):
         """Preload frequently used models in the background"""
         try:
-            # Logic for preloading models would go here
-            pass
+            active = self.model_manager.get_active_model()
+            names = [
+                model.name for model in self.model_manager.get_frequent_models(3)
+                if (not active or model.name != active.name) and self._register_resident(model)
+            ]
+            if names:
+                print(f"Preloading frequently used models in the background: {', '.join(names)}")
+                get_model_manager().preload_models(names)
         except Exception as e:
             print(f"Warning: Error during model preloading: {e}")
             # Continue execution even if preloading fails
     
     def unload_model(self):
         """Unload the active model"""
+        if self.active_model_name:
+            get_model_manager().unload_model(self.active_model_name)
         self.active_model_interface = None
+        self.active_model_name = None
         return True
     
     def load_model(self, model_name: str) -> bool:
         """Load a specific model"""
-        # First unload current model reference
+        # First drop the current model reference; the previous model stays
+        # resident in the ModelManager until its memory is needed
         self.active_model_interface = None
+        self.active_model_name = None
         
         # Set active model in config
         success = self.model_manager.set_active_model(model_name)
@@ -1760,10 +1818,24 @@ class LyraBot:
                 # Reset boredom slightly since Lyra did something
                 self.personality.update_trait("boredom", -0.1)
     
+    @traced("lyra_bot.chat")
     def chat(self, message: str, memory_name: str = None, gen_config: Dict = None, 
              include_profile: bool = True, include_system_instructions: bool = True, 
-             include_extras: bool = True, active_attachments: List[str] = None) -> str:
-        """Send a message to the bot and get a response with context integration"""
+             include_extras: bool = True, active_attachments: List[str] = None,
+             priority: str = "interactive", caller: Any = None, session_id: str = None,
+             history_messages: int = 12, on_token: Callable[[str], None] = None) -> str:
+        """
+        Send a message to the bot and get a response with context integration
+        
+        priority and caller are passed to the inference scheduler ("interactive",
+        "api" or "background"; caller identifies the client for fair queuing).
+        session_id keeps a separate conversation memory per remote user without
+        touching the active memory, so concurrent sessions do not interleave.
+        The last history_messages messages of that conversation are included
+        in the prompt. on_token is called with the reply text as the model
+        produces it (see chat_stream). Raises QueueFullError when the model's
+        request queue is full; other generation errors come back as the reply.
+        """
         
         # Stop humming when user interacts
         if hasattr(self.voice_handler, 'is_humming') and self.voice_handler.is_humming:
@@ -1806,27 +1878,37 @@ class LyraBot:
                 return "Documentation folder not found. Please check the installation."
         
         if message.strip().lower() == "/clear":
-            if self.memory_manager.active_memory:
-                self.memory_manager.memories[self.memory_manager.active_memory] = []
-                self.memory_manager._save_memory(self.memory_manager.active_memory)
+            target_memory = session_id or self.memory_manager.active_memory
+            if target_memory:
+                with self.memory_manager.lock:
+                    self.memory_manager.memories[target_memory] = []
+                    self.memory_manager._save_memory(target_memory)
                 return "Chat history cleared."
         
         # If not a help command, proceed with normal chat
         if not self.active_model_interface:
             return "No model loaded. Please load a model first."
         
-        # Set active memory if provided
-        if memory_name and memory_name != self.memory_manager.active_memory:
-            self.memory_manager.set_active_memory(memory_name)
+        if session_id:
+            # Remote sessions write to their own memory
+            caller = caller or session_id
+        else:
+            # Set active memory if provided
+            if memory_name and memory_name != self.memory_manager.active_memory:
+                self.memory_manager.set_active_memory(memory_name)
+            
+            # Create a new memory if none is active
+            if not self.memory_manager.active_memory:
+                timestamp = int(time.time())
+                memory_name = f"chat_{timestamp}"
+                self.memory_manager.create_memory(memory_name)
         
-        # Create a new memory if none is active
-        if not self.memory_manager.active_memory:
-            timestamp = int(time.time())
-            memory_name = f"chat_{timestamp}"
-            self.memory_manager.create_memory(memory_name)
+        # Earlier turns of this conversation, read before the new message is stored
+        history = self.memory_manager.get_recent_messages(session_id, history_messages)
         
         # Add user message to memory
-        self.memory_manager.add_message("user", message)
+        with span("memory.add_message", role="user"):
+            self.memory_manager.add_message("user", message, session_id)
         
         # Generate response
         try:
@@ -1871,14 +1953,20 @@ class LyraBot:
                         except Exception as e:
                             full_prompt += f"Attachment '{attachment['label']}' could not be read: {str(e)}\n\n"
             
+            # Add the conversation so far
+            if history:
+                lines = [f"{'User' if m['role'] == 'user' else 'Lyra'}: {m['content']}" for m in history]
+                full_prompt += "Conversation so far:\n" + "\n".join(lines) + "\n\n"
+            
             # Add the user's actual message at the end
             full_prompt += f"User message: {message}"
             
             # Generate response
-            response = self.active_model_interface.generate(full_prompt, gen_config)
+            response = self._generate(full_prompt, gen_config, priority, caller, on_token)
             
             # Add bot response to memory
-            self.memory_manager.add_message("assistant", response)
+            with span("memory.add_message", role="assistant"):
+                self.memory_manager.add_message("assistant", response, session_id)
             
             # Check if this is first boot and avatar hasn't been created
             if self.personality.settings.get("_first_boot", True) and not self.personality.settings.get("_avatar_created", False):
@@ -1888,15 +1976,75 @@ class LyraBot:
                     self.personality.settings["_avatar_created"] = True
                     self.personality.save_settings()
                     
-                    # Add avatar suggestion to the response
-                    response = self.active_model_interface.generate(full_prompt, gen_config)
+                    # Add avatar suggestion to the response that was stored and streamed
                     return response + "\n\nWould you like to help me create a visual appearance? We could work together to generate an avatar that represents how you see me."
             
             return response
+        except QueueFullError:
+            # Let callers answer with backpressure instead of an error reply
+            raise
         except Exception as e:
             error_msg = f"Error generating response: {str(e)}"
             print(error_msg)
             return error_msg
+    
+    def chat_stream(self, message: str, **kwargs):
+        """
+        Like chat(), but yields the reply in pieces as the model produces them
+        
+        Command replies, errors and text chat() appends after generation
+        arrive as a final piece. Takes the same keyword arguments as chat().
+        """
+        pieces = queue.Queue()
+        done = object()
+        outcome = {}
+        
+        def run():
+            try:
+                outcome["response"] = self.chat(message, on_token=pieces.put, **kwargs)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                pieces.put(done)
+        
+        # chat() keeps going if the consumer stops early, so the turn is still stored
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), name="lyra-chat-stream", daemon=True).start()
+        streamed = []
+        while True:
+            piece = pieces.get()
+            if piece is done:
+                break
+            streamed.append(piece)
+            yield piece
+        
+        if "error" in outcome:
+            raise outcome["error"]
+        text = "".join(streamed)
+        response = outcome.get("response") or ""
+        if response.startswith(text) and len(response) > len(text):
+            yield response[len(text):]
+    
+    def _generate(self, prompt: str, gen_config: Dict, priority: str, caller: Any,
+                  on_token: Callable[[str], None] = None) -> str:
+        """Generate with the active model through the inference scheduler"""
+        if self.active_model_name:
+            # Holds a ModelManager reference so the model is not evicted mid-generation
+            return get_model_manager().generate(
+                prompt, priority=priority, caller=caller, model_name=self.active_model_name,
+                on_token=on_token, **gen_config
+            )
+        model_interface = self.active_model_interface
+        response = get_scheduler().run(
+            model_key_for(model_interface),
+            lambda: model_interface.generate(prompt, gen_config),
+            priority=priority,
+            caller=caller
+        )
+        if on_token is not None and response:
+            on_token(response)
+        return response
+    
     def collaboratively_generate_avatar(self, base_prompt: str, suggestions: List[str]) -> str:
         """Generate an avatar collaboratively with the user"""
         # Combine base prompt with selected suggestions
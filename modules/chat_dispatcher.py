@@ -0,0 +1,73 @@
+"""
+Chat dispatcher for Lyra's messaging front ends
+Runs replies concurrently across chats while keeping each chat in order
+"""
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+class ChatDispatcher:
+    """
+    Runs message jobs on a thread pool: in order within a chat, concurrently
+    across chats. Each chat gets one job at a time and is requeued behind the
+    other chats after every job, so a busy chat cannot starve the rest.
+    """
+    
+    def __init__(self, max_workers: int = 4, max_pending_per_chat: int = 20,
+                 thread_name_prefix: str = "chat-dispatch"):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_pending_per_chat = max_pending_per_chat
+        # chat_id -> jobs; the job at the head is the one running
+        self.pending: Dict[Any, deque] = {}
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+    
+    def submit(self, chat_id, job: Callable[[], None]) -> bool:
+        """Queue a job for a chat; returns False if the chat's backlog is full"""
+        with self.lock:
+            jobs = self.pending.get(chat_id)
+            if jobs is not None:
+                if len(jobs) >= self.max_pending_per_chat:
+                    return False
+                jobs.append(job)
+                return True
+            self.pending[chat_id] = deque([job])
+        self.executor.submit(self._run_next, chat_id)
+        return True
+    
+    def _run_next(self, chat_id):
+        with self.lock:
+            job = self.pending[chat_id][0]
+        
+        try:
+            job()
+        except Exception as e:
+            logger.error(f"Error handling message for chat {chat_id}: {e}")
+        
+        with self.lock:
+            jobs = self.pending[chat_id]
+            jobs.popleft()
+            if not jobs:
+                del self.pending[chat_id]
+                self.idle.notify_all()
+                return
+        self.executor.submit(self._run_next, chat_id)
+    
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "active_chats": len(self.pending),
+                "queued_messages": sum(len(jobs) for jobs in self.pending.values())
+            }
+    
+    def shutdown(self, wait: bool = True, timeout: float = 30.0):
+        """Stop the pool, first letting queued jobs finish if wait is set"""
+        if wait:
+            with self.idle:
+                self.idle.wait_for(lambda: not self.pending, timeout=timeout)
+        self.executor.shutdown(wait=wait)
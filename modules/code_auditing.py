@@ -5,10 +5,15 @@ Enables self-code review and improvement capabilities
 
 import os
 import re
+import sys
 import ast
+import json
 import time
+import hashlib
 import logging
+import builtins
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Any, Tuple, Set
 import importlib.util
@@ -17,22 +22,147 @@ import inspect
 # Set up logging
 logger = logging.getLogger("code_auditing")
 
+# Bump when the analysis output changes so cached results are recomputed
+AUDIT_CACHE_VERSION = 1
+
+# Names every module has without defining them
+MODULE_GLOBALS = {"__file__", "__name__", "__doc__", "__spec__", "__package__", "__path__", "__builtins__", "__loader__"}
+
+class _StructureVisitor(ast.NodeVisitor):
+    """Single AST pass collecting structure and name usage for a file"""
+    
+    def __init__(self, code_file: "CodeFile"):
+        self.code_file = code_file
+        self.imports = []
+        self.classes = []
+        self.functions = []
+        self.defined_names = set()
+        self.loaded_names = []  # (name, line)
+    
+    def visit_Import(self, node):
+        for name in node.names:
+            self.defined_names.add(name.asname or name.name.split(".")[0])
+            self.imports.append({
+                "name": name.name,
+                "alias": name.asname,
+                "line": node.lineno
+            })
+        self.generic_visit(node)
+    
+    def visit_ImportFrom(self, node):
+        module = node.module or ""
+        for name in node.names:
+            self.defined_names.add(name.asname or name.name)
+            self.imports.append({
+                "name": f"{module}.{name.name}",
+                "alias": name.asname,
+                "line": node.lineno
+            })
+        self.generic_visit(node)
+    
+    def visit_ClassDef(self, node):
+        self.defined_names.add(node.name)
+        methods = []
+        for item in node.body:
+            if isinstance(item, ast.FunctionDef):
+                methods.append({
+                    "name": item.name,
+                    "line": item.lineno,
+                    "args": self.code_file._get_function_args(item)
+                })
+        
+        self.classes.append({
+            "name": node.name,
+            "line": node.lineno,
+            "methods": methods,
+            "bases": [self.code_file._format_expr(base) for base in node.bases]
+        })
+        
+        # Direct children of a class body are methods, not top-level functions
+        for child in node.body:
+            if isinstance(child, ast.FunctionDef):
+                self.defined_names.add(child.name)
+                self.generic_visit(child)
+            else:
+                self.visit(child)
+        for child in node.bases + node.keywords + node.decorator_list:
+            self.visit(child)
+    
+    def visit_FunctionDef(self, node):
+        self.defined_names.add(node.name)
+        self.functions.append({
+            "name": node.name,
+            "line": node.lineno,
+            "args": self.code_file._get_function_args(node)
+        })
+        self.generic_visit(node)
+    
+    def visit_AsyncFunctionDef(self, node):
+        self.defined_names.add(node.name)
+        self.generic_visit(node)
+    
+    def visit_arg(self, node):
+        self.defined_names.add(node.arg)
+        self.generic_visit(node)
+    
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.defined_names.add(node.name)
+        self.generic_visit(node)
+    
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Store):
+            self.defined_names.add(node.id)
+        elif isinstance(node.ctx, ast.Load):
+            self.loaded_names.append((node.id, getattr(node, "lineno", 0)))
+
+
+def _analyze_source(file_path: str, content: str) -> Dict[str, Any]:
+    """
+    Parse and analyze file content without external linters
+    
+    Module-level so it can run in a worker process.
+    """
+    code_file = CodeFile(file_path, content=content)
+    if not code_file.parse():
+        return {
+            "file_path": file_path,
+            "status": "parse_error",
+            "issues": code_file.issues
+        }
+    
+    code_file.compute_metrics()
+    code_file.run_static_analysis(run_linters=False)
+    return {
+        "file_path": file_path,
+        "status": "analyzed",
+        "metrics": code_file.metrics,
+        "issues": code_file.issues,
+        "classes": code_file.classes,
+        "functions": code_file.functions,
+        "imports": code_file.imports
+    }
+
+
 class CodeFile:
     """Represents a Python code file for analysis"""
     
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, content: str = None):
         self.file_path = file_path
-        self.content = None
+        self.content = content
         self.ast = None
         self.imports = []
         self.classes = []
         self.functions = []
+        self.defined_names = set()
+        self.loaded_names = []
         self.issues = []
         self.last_analyzed = None
         self.metrics = {}
         
         # Load file content
-        self.load_content()
+        if content is None:
+            self.load_content()
     
     def load_content(self) -> bool:
         """Load content from file"""
@@ -67,52 +197,23 @@ class CodeFile:
             return False
     
     def _extract_structure(self):
-        """Extract structural elements from AST"""
+        """Extract structural elements and name usage from AST in a single pass"""
         self.imports = []
         self.classes = []
         self.functions = []
+        self.defined_names = set()
+        self.loaded_names = []
         
         if not self.ast:
             return
-            
-        for node in ast.walk(self.ast):
-            if isinstance(node, ast.Import):
-                for name in node.names:
-                    self.imports.append({
-                        "name": name.name,
-                        "alias": name.asname,
-                        "line": node.lineno
-                    })
-            elif isinstance(node, ast.ImportFrom):
-                module = node.module or ""
-                for name in node.names:
-                    self.imports.append({
-                        "name": f"{module}.{name.name}",
-                        "alias": name.asname,
-                        "line": node.lineno
-                    })
-            elif isinstance(node, ast.ClassDef):
-                methods = []
-                for item in node.body:
-                    if isinstance(item, ast.FunctionDef):
-                        methods.append({
-                            "name": item.name,
-                            "line": item.lineno,
-                            "args": self._get_function_args(item)
-                        })
-                
-                self.classes.append({
-                    "name": node.name,
-                    "line": node.lineno,
-                    "methods": methods,
-                    "bases": [self._format_expr(base) for base in node.bases]
-                })
-            elif isinstance(node, ast.FunctionDef) and not isinstance(node.parent, ast.ClassDef):
-                self.functions.append({
-                    "name": node.name,
-                    "line": node.lineno,
-                    "args": self._get_function_args(node)
-                })
+        
+        visitor = _StructureVisitor(self)
+        visitor.visit(self.ast)
+        self.imports = visitor.imports
+        self.classes = visitor.classes
+        self.functions = visitor.functions
+        self.defined_names = visitor.defined_names
+        self.loaded_names = visitor.loaded_names
     
     def _get_function_args(self, func_node) -> List[str]:
         """Get function arguments as strings"""
@@ -152,8 +253,14 @@ class CodeFile:
         
         return self.metrics
     
-    def run_static_analysis(self) -> List[Dict[str, Any]]:
-        """Run static analysis to find issues"""
+    def run_static_analysis(self, run_linters: bool = True) -> List[Dict[str, Any]]:
+        """
+        Run static analysis to find issues
+        
+        Args:
+            run_linters: Also run pylint and flake8 on this file. CodeAuditor
+                disables this and lints all changed files in one batch instead.
+        """
         self.issues = []
         
         if not self.content:
@@ -169,35 +276,20 @@ class CodeFile:
                     "message": f"Line too long ({len(line)} > 100 characters)"
                 })
         
-        # Check for undefined names (basic)
+        # Check for undefined names (basic), using names collected while parsing
         if self.ast:
-            defined_names = set()
-            for node in ast.walk(self.ast):
-                if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-                    defined_names.add(node.name)
-                elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
-                    defined_names.add(node.id)
-            
-            for node in ast.walk(self.ast):
-                if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
-                    if node.id not in defined_names and node.id not in __builtins__:
-                        # Check if it might be an import
-                        import_match = False
-                        for imp in self.imports:
-                            if imp["name"] == node.id or imp["alias"] == node.id:
-                                import_match = True
-                                break
-                        
-                        if not import_match:
-                            self.issues.append({
-                                "type": "possible_undefined",
-                                "line": getattr(node, "lineno", 0),
-                                "message": f"Possibly undefined name: {node.id}"
-                            })
+            for name, line in self.loaded_names:
+                if name not in self.defined_names and name not in MODULE_GLOBALS and not hasattr(builtins, name):
+                    self.issues.append({
+                        "type": "possible_undefined",
+                        "line": line,
+                        "message": f"Possibly undefined name: {name}"
+                    })
         
         # Run external linters if available
-        self._run_pylint()
-        self._run_flake8()
+        if run_linters:
+            self._run_pylint()
+            self._run_flake8()
         
         return self.issues
     
@@ -516,11 +608,17 @@ class CodeAuditor:
     Enables Lyra to audit and improve her own code
     """
     
-    def __init__(self, base_path: str = None):
+    def __init__(self, base_path: str = None, cache_path: str = None, max_workers: int = None):
         self.base_path = base_path or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.analyzed_files = {}  # path -> analysis results
         self.improvement_suggestions = {}  # path -> suggestions
         self.llm_interface = None
+        
+        # Per-file results keyed by content hash, reused across runs
+        self.cache_path = cache_path or os.path.join(self.base_path, "data", "code_audit_cache.json")
+        self.max_workers = max_workers
+        self._tool_versions = None
+        self._cache = None
     
     def set_llm_interface(self, llm_interface):
         """Set LLM interface for advanced analysis"""
@@ -532,9 +630,11 @@ class CodeAuditor:
         python_files = []
         module_dirs = []
         
+        excluded_dirs = ['.git', '__pycache__', '.venv', 'venv', 'env']
         for root, dirs, files in os.walk(self.base_path):
-            # Skip common directories to exclude
-            if any(excluded in root for excluded in ['.git', '__pycache__', '.venv', 'venv', 'env']):
+            # Skip common directories to exclude, without descending into them
+            dirs[:] = [d for d in dirs if not any(excluded in d for excluded in excluded_dirs)]
+            if any(excluded in root for excluded in excluded_dirs):
                 continue
                 
             # Check if this is a Python module directory
@@ -572,35 +672,186 @@ class CodeAuditor:
         # Check if file exists
         if not os.path.exists(file_path):
             return {"error": f"File not found: {file_path}"}
+        
+        # analyze_files leaves out files it could not read
+        result = self.analyze_files([file_path]).get(file_path)
+        if result is None:
+            return {"error": f"Could not read file: {file_path}"}
+        return result
+    
+    def analyze_files(self, file_paths: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Analyze many files, reusing cached results for unchanged files
+        
+        Changed files are parsed in a process pool and linted with a single
+        pylint and flake8 invocation each.
+        
+        Args:
+            file_paths: Paths to Python files (relative or absolute)
             
-        # Create and analyze code file
-        code_file = CodeFile(file_path)
-        parsed = code_file.parse()
+        Returns:
+            Dict mapping absolute file path to analysis results
+        """
+        start = time.time()
+        cache = self._load_cache()
+        results = {}
+        pending = {}  # path -> (content hash, content)
         
-        if not parsed:
-            return {
-                "file_path": file_path,
-                "status": "parse_error",
-                "issues": code_file.issues
-            }
+        for file_path in file_paths:
+            if not os.path.isabs(file_path):
+                file_path = os.path.join(self.base_path, file_path)
+            try:
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+            except Exception as e:
+                logger.error(f"Error loading file {file_path}: {e}")
+                continue
             
-        # Run analysis
-        code_file.compute_metrics()
-        code_file.run_static_analysis()
+            digest = hashlib.sha256(raw).hexdigest()
+            cached = cache["files"].get(file_path)
+            if cached and cached.get("hash") == digest:
+                results[file_path] = cached["analysis"]
+            else:
+                pending[file_path] = (digest, raw.decode('utf-8', errors='replace'))
         
-        # Store analysis results
-        analysis = {
-            "file_path": file_path,
-            "status": "analyzed",
-            "metrics": code_file.metrics,
-            "issues": code_file.issues,
-            "classes": code_file.classes,
-            "functions": code_file.functions,
-            "imports": code_file.imports
-        }
+        if pending:
+            analyses = self._analyze_sources({path: content for path, (_, content) in pending.items()})
+            lint_issues = self._run_linters([path for path, a in analyses.items() if a["status"] == "analyzed"])
+            
+            for file_path, analysis in analyses.items():
+                analysis["issues"].extend(lint_issues.get(file_path, []))
+                results[file_path] = analysis
+                cache["files"][file_path] = {"hash": pending[file_path][0], "analysis": analysis}
+        
+        if self._prune_cache() or pending:
+            self._save_cache()
+        
+        self.analyzed_files.update(results)
+        logger.info(
+            f"Audited {len(results)} files ({len(pending)} changed) in {time.time() - start:.2f}s"
+        )
+        return results
+    
+    def _analyze_sources(self, sources: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """Run the AST analysis for each file, in parallel when there are several"""
+        if len(sources) < 4:
+            return {path: _analyze_source(path, content) for path, content in sources.items()}
+        
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                paths = list(sources)
+                analyses = executor.map(_analyze_source, paths, [sources[p] for p in paths], chunksize=8)
+                return dict(zip(paths, analyses))
+        except Exception as e:
+            logger.warning(f"Process pool unavailable, analyzing sequentially: {e}")
+            return {path: _analyze_source(path, content) for path, content in sources.items()}
+    
+    def _run_linters(self, file_paths: List[str], batch_size: int = 200) -> Dict[str, List[Dict[str, Any]]]:
+        """Run pylint and flake8 once over a set of files and group issues by file"""
+        issues = {}
+        if not file_paths:
+            return issues
+        
+        rel_paths = {os.path.relpath(path, self.base_path): path for path in file_paths}
+        names = list(rel_paths)
+        
+        def resolve(path):
+            return rel_paths.get(os.path.normpath(path), os.path.join(self.base_path, path))
+        
+        # Batches only guard against command-line length limits on huge runs
+        for i in range(0, len(names), batch_size):
+            batch = names[i:i + batch_size]
+            
+            try:
+                result = subprocess.run(
+                    ["pylint", "--output-format=json", "--jobs=0"] + batch,
+                    capture_output=True,
+                    text=True,
+                    cwd=self.base_path
+                )
+                if result.returncode != 0:
+                    for issue in json.loads(result.stdout or "[]"):
+                        issues.setdefault(resolve(issue.get("path", "")), []).append({
+                            "type": "pylint",
+                            "line": issue.get("line", 0),
+                            "message": issue.get("message", "Unknown pylint issue"),
+                            "symbol": issue.get("symbol", "")
+                        })
+            except Exception:
+                pass  # pylint not available or output could not be parsed
+            
+            try:
+                result = subprocess.run(
+                    ["flake8", "--format=default"] + batch,
+                    capture_output=True,
+                    text=True,
+                    cwd=self.base_path
+                )
+                # Parse flake8 output (format: file:line:char: code message)
+                pattern = r'(.*):(\d+):(\d+): ([A-Z]\d+) (.*)'
+                for line in result.stdout.split('\n'):
+                    match = re.match(pattern, line)
+                    if match:
+                        path, line_num, char, code, message = match.groups()
+                        issues.setdefault(resolve(path), []).append({
+                            "type": "flake8",
+                            "line": int(line_num),
+                            "message": f"{code}: {message}"
+                        })
+            except Exception:
+                pass  # flake8 not available or other error
+        
+        return issues
+    
+    def _get_tool_versions(self) -> str:
+        """Version string of the analysis and linters, part of the cache key"""
+        if self._tool_versions is None:
+            versions = [f"audit={AUDIT_CACHE_VERSION}", f"python={sys.version_info[0]}.{sys.version_info[1]}"]
+            for tool in ("pylint", "flake8"):
+                try:
+                    result = subprocess.run([tool, "--version"], capture_output=True, text=True)
+                    versions.append(f"{tool}={result.stdout.strip().splitlines()[0] if result.stdout.strip() else 'unknown'}")
+                except Exception:
+                    versions.append(f"{tool}=unavailable")
+            self._tool_versions = ";".join(versions)
+        return self._tool_versions
+    
+    def _load_cache(self) -> Dict[str, Any]:
+        """Load the per-file result cache, discarding it if tool versions changed"""
+        if self._cache is not None:
+            return self._cache
         
-        self.analyzed_files[file_path] = analysis
-        return analysis
+        tool_versions = self._get_tool_versions()
+        self._cache = {"tool_versions": tool_versions, "files": {}}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                if cache.get("tool_versions") == tool_versions:
+                    self._cache = cache
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable audit cache: {e}")
+        return self._cache
+    
+    def _prune_cache(self) -> int:
+        """Drop cached results for files that no longer exist; returns how many were dropped"""
+        files = self._load_cache()["files"]
+        deleted = [path for path in files if not os.path.isfile(path)]
+        for path in deleted:
+            del files[path]
+            self.analyzed_files.pop(path, None)
+        return len(deleted)
+    
+    def _save_cache(self):
+        """Write the result cache atomically"""
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            logger.error(f"Error saving audit cache: {e}")
     
     def analyze_module(self, module_name: str) -> Dict[str, Any]:
         """
@@ -649,9 +900,11 @@ class CodeAuditor:
         if self.analyzed_files[file_path].get("status") == "parse_error":
             return []
             
-        # Create code file for suggestion generation
+        # Create code file for suggestion generation, reusing the stored analysis
         code_file = CodeFile(file_path)
         code_file.parse()
+        code_file.metrics = self.analyzed_files[file_path].get("metrics", {})
+        code_file.issues = list(self.analyzed_files[file_path].get("issues", []))
         
         # Generate suggestions
         suggestions = code_file.suggest_improvements(self.llm_interface)
@@ -821,8 +1074,7 @@ class CodeAuditor:
         if not self.analyzed_files:
             # Analyze all Python files first
             structure = self.scan_project_structure()
-            for file_path in structure["python_files"]:
-                self.analyze_file(file_path)
+            self.analyze_files(structure["python_files"])
         
         # Extract all imports
         all_imports = {}
@@ -898,11 +1150,13 @@ class CodeAuditor:
         core_module_paths = [os.path.join("modules", module) for module in core_modules]
         
         # Analyze core modules
-        core_analyses = {}
-        for module_path in core_module_paths:
-            if module_path in structure["python_files"]:
-                analysis = self.analyze_file(module_path)
-                core_analyses[module_path] = analysis
+        core_module_paths = [path for path in core_module_paths if path in structure["python_files"]]
+        analyses = self.analyze_files(core_module_paths)
+        core_analyses = {
+            module_path: analyses[os.path.join(self.base_path, module_path)]
+            for module_path in core_module_paths
+            if os.path.join(self.base_path, module_path) in analyses
+        }
         
         # Generate a summary report
         summary = self.get_audit_summary()
@@ -919,6 +1173,15 @@ class CodeAuditor:
             "improvement_suggestions": self.improvement_suggestions,
             "project_structure": structure
         }
+    
+    def audit_project(self) -> Dict[str, Any]:
+        """Audit every Python file in the project, skipping files unchanged since the last run"""
+        structure = self.scan_project_structure()
+        self.analyze_files(structure["python_files"])
+        return {
+            "summary": self.get_audit_summary(),
+            "project_structure": structure
+        }
 
 # Singleton instance
 _code_auditor_instance = None
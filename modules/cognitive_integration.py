@@ -101,6 +101,42 @@ class CognitiveArchitecture:
         Returns:
             Dict containing results from all components and integrated insights
         """
+        return self.combine_analyses(
+            self.analyze_metacognition(message),
+            self.analyze_emotion(message),
+            self.recall_memories(message)
+        )
+    
+    # The analyses below are independent of each other, so callers such as
+    # LyraCore can run them concurrently and combine whatever finished in time.
+    
+    def analyze_metacognition(self, message: str) -> Optional[Dict[str, Any]]:
+        """Run the message through metacognition, or None if disabled"""
+        if self.modules_loaded.get("metacognition") and self.metacognition_enabled:
+            return self.components["metacognition"].process_message(message)
+        return None
+    
+    def analyze_emotion(self, message: str) -> Optional[Dict[str, Any]]:
+        """Run the message through the emotional core, or None if unavailable"""
+        if self.modules_loaded.get("emotional_core"):
+            return self.components["emotional_core"].process_user_message(message)
+        return None
+    
+    def recall_memories(self, message: str, limit: int = 3) -> Optional[List[Dict[str, Any]]]:
+        """Recall memories similar to the message, or None if deep memory is disabled"""
+        # We'll store the actual interaction later when we have the response
+        if self.modules_loaded.get("deep_memory") and self.deep_memory_enabled:
+            return self.components["deep_memory"].recall_similar(message, limit=limit)
+        return None
+    
+    def combine_analyses(self, meta_results: Optional[Dict[str, Any]],
+                         emotion_results: Optional[Dict[str, Any]],
+                         similar_memories: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Combine the individual analyses into integrated insights
+        
+        Any analysis may be None (disabled, failed or too slow).
+        """
         results = {
             "metacognition": None,
             "emotional": None,
@@ -109,18 +145,14 @@ class CognitiveArchitecture:
             "insights": []
         }
         
-        # Process through metacognition if available
-        if self.modules_loaded.get("metacognition") and self.metacognition_enabled:
-            meta_results = self.components["metacognition"].process_message(message)
+        if meta_results is not None:
             results["metacognition"] = meta_results
             
             # Extract insights
             if "insights" in meta_results:
                 results["insights"].extend(meta_results["insights"])
         
-        # Process through emotional core if available
-        if self.modules_loaded.get("emotional_core"):
-            emotion_results = self.components["emotional_core"].process_user_message(message)
+        if emotion_results is not None:
             results["emotional"] = emotion_results
             
             # Look for significant emotional changes
@@ -128,12 +160,7 @@ class CognitiveArchitecture:
             if significant_emotions:
                 results["insights"].append(f"Notable emotional response: {', '.join(significant_emotions)}")
         
-        # Store in deep memory if available
-        if self.modules_loaded.get("deep_memory") and self.deep_memory_enabled:
-            # We'll store the actual interaction later when we have the response
-            
-            # For now, recall similar memories
-            similar_memories = self.components["deep_memory"].recall_similar(message, limit=3)
+        if similar_memories is not None:
             results["memories"] = similar_memories
             
             # Extract insights from memories
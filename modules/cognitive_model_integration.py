@@ -10,6 +10,8 @@ import json
 from typing import Dict, List, Optional, Any, Tuple
 from pathlib import Path
 
+from modules.inference_scheduler import get_scheduler, model_key_for
+
 # Set up logging
 logger = logging.getLogger("cognitive_model_integration")
 
@@ -136,7 +138,12 @@ Format your response as a comprehensive but concise explanation of this concept.
             
             # Get the active model and generate the description
             active_model = self.model_manager.get_active_model()
-            response = active_model.generate(prompt, max_tokens=500)
+            response = get_scheduler().run(
+                model_key_for(active_model),
+                lambda: active_model.generate(prompt, max_tokens=500),
+                priority="background",
+                caller="concept_description"
+            )
             
             # Return the response in a structured format
             return {
@@ -220,7 +227,12 @@ Format your response as a comprehensive but concise explanation of this concept.
             
             # Generate the reflection
             active_model = self.model_manager.get_active_model()
-            reflection = active_model.generate(prompt, max_tokens=800)
+            reflection = get_scheduler().run(
+                model_key_for(active_model),
+                lambda: active_model.generate(prompt, max_tokens=800),
+                priority="background",
+                caller="reflection"
+            )
             
             return {
                 "success": True,
@@ -310,7 +322,8 @@ Write in first person as if I (Lyra) am reflecting on my own cognitive processes
         return full_prompt
     
     def enhance_cognitive_response(self, base_response: str, user_message: str, 
-                                  context: Dict[str, Any] = None) -> str:
+                                  context: Dict[str, Any] = None,
+                                  priority: str = "interactive") -> str:
         """
         Enhance a response with cognitive awareness
         
@@ -318,6 +331,8 @@ Write in first person as if I (Lyra) am reflecting on my own cognitive processes
             base_response: The original response to enhance
             user_message: The user's message that prompted the response
             context: Additional context for enhancement
+            priority: Inference scheduler priority; use "background" when the
+                user already has the base response
             
         Returns:
             Enhanced response with cognitive elements
@@ -394,8 +409,15 @@ Enhance the response by:
 Keep the enhanced response concise and natural. Maintain the core information from the original response.
 """
             
-            # Generate the enhanced response
-            enhanced_response = active_model.generate(prompt, max_tokens=len(base_response) + 200)
+            # Generate the enhanced response; a rewrite needs about as many
+            # tokens as the original (roughly 4 characters per token) plus slack
+            max_tokens = len(base_response) // 4 + 64
+            enhanced_response = get_scheduler().run(
+                model_key_for(active_model),
+                lambda: active_model.generate(prompt, max_tokens=max_tokens),
+                priority=priority,
+                caller="enhancement"
+            )
             
             return enhanced_response
             
@@ -13,6 +13,9 @@ from pathlib import Path
 from typing import Dict, List, Optional, Any, Tuple, Set
 from datetime import datetime, timedelta
 
+from modules.inference_scheduler import get_scheduler, model_key_for
+from modules.model_manager import get_instance as get_model_manager
+
 # Set up logging
 logger = logging.getLogger("extended_thinking")
 
@@ -499,11 +502,23 @@ class LLMThinkingInterface:
             
             # Different interfaces based on model source
             if model_to_use == "model_manager" and self.model_manager:
-                active_model = self.model_manager.get_active_model()
-                thinking_output = active_model.generate_text(prompt, max_tokens=2048)
-                model_name = active_model.model_name
+                # Generate on the shared resident instance; the ModelManager
+                # holds a reference so the model is not evicted mid-thought
+                model_name = self._resident_model_name()
+                thinking_output = get_model_manager().generate(
+                    prompt,
+                    priority="background",
+                    caller="extended_thinking",
+                    model_name=model_name,
+                    max_tokens=2048
+                )
             elif model_to_use == "core" and self.fallback_llm:
-                thinking_output = self.fallback_llm.generate_text(prompt, max_tokens=800)
+                thinking_output = get_scheduler().run(
+                    model_key_for(self.fallback_llm),
+                    lambda: self.fallback_llm.generate_text(prompt, max_tokens=800),
+                    priority="background",
+                    caller="extended_thinking"
+                )
                 model_name = self.fallback_llm.model_path
             else:
                 return {
@@ -545,10 +560,8 @@ class LLMThinkingInterface:
         # Determine task complexity and requirements
         is_complex = task.max_duration > 300 or "complex" in task.tags
         
-        # Check if we have a model manager with an active model
-        has_manager_model = (self.model_manager is not None and 
-                            hasattr(self.model_manager, 'get_active_model') and 
-                            self.model_manager.get_active_model() is not None)
+        # Check if we have a model manager with an active model that is loaded
+        has_manager_model = self._resident_model_name() is not None
         
         # Use the best available model for complex tasks
         if is_complex and has_manager_model:
@@ -565,6 +578,19 @@ class LLMThinkingInterface:
         # No suitable model available
         return None
     
+    def _resident_model_name(self) -> Optional[str]:
+        """
+        Name of the connected manager's active model if the shared ModelManager
+        has it loaded. Thinking never loads a model of its own.
+        """
+        if self.model_manager is None or not hasattr(self.model_manager, 'get_active_model'):
+            return None
+        active_model = self.model_manager.get_active_model()
+        if active_model is None:
+            return None
+        model_name = model_key_for(active_model)
+        return model_name if model_name in get_model_manager().resident else None
+    
     def _create_thinking_prompt(self, task: ThinkingTask) -> str:
         """
         Create a prompt for the thinking task
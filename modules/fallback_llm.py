@@ -30,8 +30,11 @@ class FallbackLLM:
         self.generation_config = {
             "temperature": 0.7,
             "top_p": 0.9,
-            "max_length": 512
+            "max_length": 512,
+            # Draft tokens per step for prompt-lookup decoding, None disables it
+            "prompt_lookup_num_tokens": None
         }
+        self.last_generation_stats = {}
         
         # Initialize model in background
         self.initialize_thread = threading.Thread(target=self.initialize_model)
@@ -154,7 +157,14 @@ class FallbackLLM:
             # Format prompt for better results
             formatted_prompt = self._format_prompt(prompt)
             
+            # Prompt-lookup speculative decoding (opt-in): drafts tokens from
+            # n-grams already in the prompt, which pays off when replies quote it
+            extra_args = {}
+            if self.generation_config.get("prompt_lookup_num_tokens"):
+                extra_args["prompt_lookup_num_tokens"] = self.generation_config["prompt_lookup_num_tokens"]
+            
             # Generate text
+            started = time.time()
             with self.lock:
                 result = self.pipeline(
                     formatted_prompt,
@@ -162,7 +172,8 @@ class FallbackLLM:
                     temperature=self.generation_config["temperature"],
                     top_p=self.generation_config["top_p"],
                     repetition_penalty=1.1,
-                    do_sample=True
+                    do_sample=True,
+                    **extra_args
                 )[0]["generated_text"]
             
             # Extract just the generated part (remove the prompt)
@@ -170,6 +181,15 @@ class FallbackLLM:
                 generated_text = result[len(formatted_prompt):]
             else:
                 generated_text = result
+            
+            elapsed = time.time() - started
+            completion_tokens = len(self.tokenizer.encode(generated_text))
+            self.last_generation_stats = {
+                "completion_tokens": completion_tokens,
+                "elapsed": elapsed,
+                "tokens_per_second": completion_tokens / elapsed if elapsed > 0 else 0.0,
+                "speculative": "prompt_lookup" if extra_args else None
+            }
                 
             return generated_text.strip()
             
@@ -0,0 +1,454 @@
+"""
+Inference scheduler for Lyra
+Serializes access to each loaded model and orders requests by priority so
+interactive chat stays responsive while background cognition runs.
+"""
+
+import time
+import heapq
+import logging
+import threading
+import itertools
+import contextvars
+from collections import deque
+from concurrent.futures import Future, CancelledError
+from enum import Enum
+from typing import Dict, Any, Optional, Callable, Hashable, List
+
+from modules.errors import LyraError, ErrorCode
+from modules.tracing import span
+
+logger = logging.getLogger("inference_scheduler")
+
+# The request whose fn is running on the current worker thread
+_current_request = contextvars.ContextVar("inference_request", default=None)
+
+class Priority(Enum):
+    """Request priority classes, lower value runs first"""
+    INTERACTIVE = 0
+    API = 1
+    BACKGROUND = 2
+
+    @classmethod
+    def parse(cls, value) -> "Priority":
+        """Accept a Priority, its name ("interactive") or its value"""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, str):
+            return cls[value.upper()]
+        return cls(value)
+
+class QueueFullError(LyraError):
+    """Raised when a model's request queue is at capacity"""
+    def __init__(self, model_key, depth, details=None):
+        message = f"Inference queue for '{model_key}' is full ({depth} pending requests)"
+        super().__init__(message, ErrorCode.RESOURCE_UNAVAILABLE, details)
+
+class Preempted(Exception):
+    """
+    Raised from a generation loop (see check_preemption) to hand the model to
+    waiting foreground requests. The scheduler re-queues the request and runs
+    it again from the start once the foreground work is done.
+    """
+
+class _Request:
+    """A queued inference call"""
+
+    def __init__(self, fn: Callable[[], Any], priority: Priority, caller: Hashable):
+        self.fn = fn
+        self.priority = priority
+        self.caller = caller
+        self.future = Future()
+        self.enqueued_at = time.time()
+        self.preemptions = 0
+        self.queue: Optional["_ModelQueue"] = None
+        # Run in the submitter's context so the call joins its trace
+        self.context = contextvars.copy_context()
+
+    def preemptible(self) -> bool:
+        return (self.priority == Priority.BACKGROUND and self.queue is not None
+                and self.preemptions < self.queue.scheduler.max_preemptions)
+
+class _ModelQueue:
+    """
+    Pending requests and the worker thread for a single model
+
+    Requests are ordered by (priority, fair-share turn, arrival). Each caller
+    gets its own turn counter, so within a priority class one chatty caller
+    cannot starve the others.
+    """
+
+    def __init__(self, scheduler: "InferenceScheduler", model_key: Hashable):
+        self.scheduler = scheduler
+        self.model_key = model_key
+        self.heap = []
+        self.sequence = itertools.count()
+        self.caller_turns: Dict[Hashable, int] = {}
+        self.current_turn = 0
+        self.condition = threading.Condition()
+        self.running: Optional[_Request] = None
+        self.last_foreground_time = 0.0
+        self.closed = False
+
+        # Metrics
+        self.completed = {p.name.lower(): 0 for p in Priority}
+        self.rejected = {p.name.lower(): 0 for p in Priority}
+        self.preempted = 0
+        self.wait_times = {p.name.lower(): deque(maxlen=500) for p in Priority}
+        self.run_times = deque(maxlen=500)
+
+        self.worker = threading.Thread(
+            target=self._worker_loop, name=f"inference-{model_key}", daemon=True
+        )
+        self.worker.start()
+
+    def depth(self, priority: Priority = None) -> int:
+        """Number of queued (not running) requests, optionally for one priority"""
+        if priority is None:
+            return len(self.heap)
+        return sum(1 for entry in self.heap if entry[3].priority == priority)
+
+    def put(self, request: _Request):
+        """Queue a request, shedding background work first when full"""
+        request.queue = self
+        with self.condition:
+            if len(self.heap) >= self.scheduler.max_queue_size:
+                victim = self._lowest_priority_entry()
+                if victim is not None and victim[3].priority.value > request.priority.value:
+                    # Make room by dropping the least important queued request
+                    self.heap.remove(victim)
+                    heapq.heapify(self.heap)
+                    self._reject(victim[3])
+                else:
+                    self._reject(request)
+                    return
+
+            # Fair share: a caller's next turn starts no earlier than the current turn
+            turn = max(self.caller_turns.get(request.caller, 0), self.current_turn) + 1
+            self.caller_turns[request.caller] = turn
+
+            if request.priority != Priority.BACKGROUND:
+                self.last_foreground_time = time.time()
+
+            heapq.heappush(self.heap, (request.priority.value, turn, next(self.sequence), request))
+            self.condition.notify()
+
+    def _lowest_priority_entry(self):
+        if not self.heap:
+            return None
+        return max(self.heap, key=lambda entry: (entry[0], entry[1], entry[2]))
+
+    def _reject(self, request: _Request):
+        self.rejected[request.priority.name.lower()] += 1
+        request.future.set_exception(QueueFullError(self.model_key, len(self.heap)))
+
+    def _next_request(self) -> Optional[_Request]:
+        """Pop the next runnable request, deferring background work while foreground is active"""
+        while not self.closed:
+            if self.heap:
+                priority_value, turn, _, request = self.heap[0]
+                if request.priority != Priority.BACKGROUND:
+                    heapq.heappop(self.heap)
+                    self.current_turn = turn
+                    return request
+
+                # Only background work is queued; give recent foreground callers a grace period
+                quiet_for = time.time() - self.last_foreground_time
+                starved = time.time() - request.enqueued_at >= self.scheduler.background_max_wait
+                if quiet_for >= self.scheduler.background_cooldown or starved:
+                    heapq.heappop(self.heap)
+                    self.current_turn = turn
+                    return request
+                self.condition.wait(self.scheduler.background_cooldown - quiet_for)
+            else:
+                self.condition.wait()
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self.condition:
+                request = self._next_request()
+                if request is None:
+                    return
+                self.running = request
+
+            # A preempted request's future is already running
+            if not request.preemptions and not request.future.set_running_or_notify_cancel():
+                with self.condition:
+                    self.running = None
+                continue
+
+            started = time.time()
+            self.wait_times[request.priority.name.lower()].append(started - request.enqueued_at)
+            preempted = False
+            try:
+                result = request.context.run(self._run_request, request, started - request.enqueued_at)
+            except Preempted:
+                preempted = True
+            except BaseException as e:
+                request.future.set_exception(e)
+            else:
+                request.future.set_result(result)
+            finally:
+                self.run_times.append(time.time() - started)
+                with self.condition:
+                    self.running = None
+                    requeued = True
+                    if preempted:
+                        requeued = self._requeue(request)
+                    else:
+                        self.completed[request.priority.name.lower()] += 1
+                if not requeued:
+                    # Completion callbacks run outside the queue lock
+                    request.future.set_exception(CancelledError())
+
+    def _requeue(self, request: _Request) -> bool:
+        """Put a preempted request back behind the foreground work that displaced it"""
+        self.preempted += 1
+        request.preemptions += 1
+        request.enqueued_at = time.time()
+        if self.closed:
+            return False
+        logger.debug(f"Background request on {self.model_key} preempted ({request.preemptions}x)")
+        heapq.heappush(self.heap, (request.priority.value, self.current_turn, next(self.sequence), request))
+        self.condition.notify()
+        return True
+
+    def _run_request(self, request: _Request, wait: float):
+        with span("inference", model=str(self.model_key), priority=request.priority.name.lower(),
+                  queue_wait_ms=round(wait * 1000, 2), preemptions=request.preemptions):
+            _current_request.set(request)
+            return request.fn()
+
+    def should_yield(self) -> bool:
+        """True if foreground requests are waiting behind the running request"""
+        with self.condition:
+            return any(entry[3].priority != Priority.BACKGROUND for entry in self.heap)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            pending = [entry[3] for entry in self.heap]
+            self.heap.clear()
+            self.condition.notify_all()
+        for request in pending:
+            # Cancel a preempted request's future too, even though it is already running
+            if not request.future.cancel() and not request.future.done():
+                request.future.set_exception(CancelledError())
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self.condition:
+            return {
+                "queue_depth": {p.name.lower(): self.depth(p) for p in Priority},
+                "running": self.running.priority.name.lower() if self.running else None,
+                "completed": dict(self.completed),
+                "rejected": dict(self.rejected),
+                "preempted": self.preempted,
+                "wait_time": {name: _summarize(times) for name, times in self.wait_times.items()},
+                "run_time": _summarize(self.run_times)
+            }
+
+def _summarize(samples) -> Dict[str, float]:
+    """Mean/p50/p95/max of a sample window"""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": values[len(values) // 2],
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1]
+    }
+
+class InferenceScheduler:
+    """
+    Central scheduler for model inference
+
+    Every model gets its own queue and worker thread, so a single model is
+    never driven by two threads at once while different models still run in
+    parallel. Interactive requests run before API requests, which run before
+    background thinking/reflection. Background work is deferred while
+    foreground traffic is active and shed first when a queue is full.
+    """
+
+    def __init__(self, max_queue_size: int = 32, background_cooldown: float = 2.0,
+                 background_max_wait: float = 120.0, max_preemptions: int = 3,
+                 monitor_name: str = None):
+        """
+        Initialize the scheduler
+
+        Args:
+            max_queue_size: Maximum pending requests per model before rejecting
+            background_cooldown: Seconds after the last foreground request before background work may start
+            background_max_wait: Seconds after which a deferred background request runs regardless
+            max_preemptions: Times a background request may be preempted before it runs to completion
+            monitor_name: Register each model's queue depth with the health monitor as "<monitor_name>:<model>"
+        """
+        self.max_queue_size = max_queue_size
+        self.background_cooldown = background_cooldown
+        self.background_max_wait = background_max_wait
+        self.max_preemptions = max_preemptions
+        self.monitor_name = monitor_name
+        self.queues: Dict[Hashable, _ModelQueue] = {}
+        self.outstanding: Dict[Hashable, int] = {}
+        self.idle_listeners: List[Callable[[Hashable], None]] = []
+        self.lock = threading.Lock()
+
+    def _get_queue(self, model_key: Hashable) -> _ModelQueue:
+        with self.lock:
+            queue = self.queues.get(model_key)
+            if queue is not None:
+                return queue
+            queue = _ModelQueue(self, model_key)
+            self.queues[model_key] = queue
+        if self.monitor_name:
+            self._monitor(model_key, queue)
+        return queue
+
+    def _monitor(self, model_key: Hashable, queue: Optional[_ModelQueue]):
+        """Register (or with queue=None, unregister) a model queue with the health monitor"""
+        try:
+            from utils.health_monitor import register_queue, unregister_queue
+        except ImportError:
+            return
+        name = f"{self.monitor_name}:{model_key}"
+        if queue is None:
+            unregister_queue(name)
+        else:
+            register_queue(name, queue.depth)
+
+    def submit(self, model_key: Hashable, fn: Callable[[], Any], priority="api",
+               caller: Hashable = None) -> Future:
+        """
+        Queue an inference call
+
+        Args:
+            model_key: Identifies the model the call runs on (usually its name)
+            fn: Zero-argument callable performing the generation
+            priority: Priority or its name ("interactive", "api", "background")
+            caller: Identifies the caller for fair queuing (defaults to the priority class)
+
+        Returns:
+            Future resolving to fn's result, or failing with QueueFullError
+        """
+        priority = Priority.parse(priority)
+        request = _Request(fn, priority, caller if caller is not None else priority.name)
+        with self.lock:
+            self.outstanding[model_key] = self.outstanding.get(model_key, 0) + 1
+        request.future.add_done_callback(lambda _: self._release(model_key))
+        self._get_queue(model_key).put(request)
+        return request.future
+
+    def _release(self, model_key: Hashable):
+        with self.lock:
+            count = self.outstanding.get(model_key, 0) - 1
+            if count > 0:
+                self.outstanding[model_key] = count
+                return
+            self.outstanding.pop(model_key, None)
+            listeners = list(self.idle_listeners)
+        for listener in listeners:
+            try:
+                listener(model_key)
+            except Exception as e:
+                logger.warning(f"Idle listener failed for {model_key}: {e}")
+
+    def outstanding_requests(self, model_key: Hashable) -> int:
+        """Requests submitted for a model that have not finished yet, queued or running"""
+        with self.lock:
+            return self.outstanding.get(model_key, 0)
+
+    def add_idle_listener(self, callback: Callable[[Hashable], None]):
+        """
+        Call callback(model_key) whenever a model's last outstanding request
+        finishes, so owners can defer unloading until submitted work is done
+        """
+        with self.lock:
+            self.idle_listeners.append(callback)
+
+    def run(self, model_key: Hashable, fn: Callable[[], Any], priority="api",
+            caller: Hashable = None, timeout: float = None) -> Any:
+        """
+        Queue an inference call and wait for its result
+
+        Calls made from a model's own worker thread (nested generation) run
+        inline instead of deadlocking on the queue.
+        """
+        queue = self._get_queue(model_key)
+        if threading.current_thread() is queue.worker:
+            return fn()
+        return self.submit(model_key, fn, priority, caller).result(timeout)
+
+    def should_yield(self, model_key: Hashable) -> bool:
+        """Whether foreground requests are waiting on a model (generation loops use check_preemption)"""
+        queue = self.queues.get(model_key)
+        return queue.should_yield() if queue else False
+
+    def remove_model(self, model_key: Hashable):
+        """Drop a model's queue, cancelling anything still pending"""
+        with self.lock:
+            queue = self.queues.pop(model_key, None)
+        if queue:
+            queue.close()
+            if self.monitor_name:
+                self._monitor(model_key, None)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Queue depth, wait-time and run-time metrics for every model"""
+        with self.lock:
+            queues = dict(self.queues)
+        return {str(key): queue.get_metrics() for key, queue in queues.items()}
+
+    def shutdown(self):
+        """Stop all workers"""
+        with self.lock:
+            queues = list(self.queues.items())
+            self.queues.clear()
+        for model_key, queue in queues:
+            queue.close()
+            if self.monitor_name:
+                self._monitor(model_key, None)
+
+def is_preemptible() -> bool:
+    """True if the calling code runs as a background request that may still be preempted"""
+    request = _current_request.get()
+    return request is not None and request.preemptible()
+
+def should_yield() -> bool:
+    """True if the calling background request should give way to waiting foreground requests"""
+    request = _current_request.get()
+    return request is not None and request.preemptible() and request.queue.should_yield()
+
+def check_preemption():
+    """
+    Yield point for generation loops: raises Preempted when the calling
+    background request should give the model to foreground requests.
+    A no-op outside the scheduler and for foreground requests.
+    """
+    if should_yield():
+        raise Preempted()
+
+def model_key_for(model) -> Hashable:
+    """Derive a scheduler key from a model instance"""
+    for attr in ("model_name", "name"):
+        value = getattr(model, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    config = getattr(model, "config", None)
+    name = getattr(config, "model_name", None)
+    if isinstance(name, str) and name:
+        return name
+    return id(model)
+
+# Singleton instance
+_scheduler_instance = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> InferenceScheduler:
+    """Get the shared inference scheduler"""
+    global _scheduler_instance
+    with _scheduler_lock:
+        if _scheduler_instance is None:
+            _scheduler_instance = InferenceScheduler(monitor_name="inference")
+        return _scheduler_instance
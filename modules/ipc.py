@@ -0,0 +1,385 @@
+"""
+IPC for Lyra
+Framed JSON request/response protocol used between the persistent process and
+the UI, the tray and external tools.
+
+Every frame is a 4-byte big-endian length followed by that many bytes of
+UTF-8 JSON. Requests carry an "id" that is echoed in every response frame, so
+a client can pipeline many requests over one persistent connection. A handler
+may emit partial frames ("partial": true) before its final response.
+
+    request:  {"id": 7, "action": "process_message", "params": {...}}
+    partial:  {"id": 7, "partial": true, "data": ...}
+    final:    {"id": 7, "success": true, "data": ...}
+              {"id": 7, "success": false, "error": "..."}
+
+Clients that send a bare JSON object without a length prefix are still served
+once in the old style (raw JSON reply, then the connection is closed).
+"""
+
+import json
+import socket
+import struct
+import asyncio
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger("ipc")
+
+HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+class IPCError(Exception):
+    """Raised by IPCClient for failed requests and broken connections"""
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """Serialize a message as a length-prefixed JSON frame"""
+    payload = json.dumps(message, default=str).encode("utf-8")
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {len(payload)} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return HEADER.pack(len(payload)) + payload
+
+# Handlers take (params, emit) and return the final response data.
+# emit(data) sends a partial response for the same request.
+Handler = Callable[[Dict[str, Any], Callable[[Any], None]], Any]
+
+class IPCServer:
+    """
+    Asyncio server for the framed protocol
+
+    Connections are persistent and served concurrently. Handlers run on a
+    bounded thread pool; once max_pending requests are in flight the server
+    stops reading new requests until one finishes. The event loop runs on its
+    own thread, so start() and stop() can be called from synchronous code.
+    """
+
+    def __init__(self, handlers: Dict[str, Handler], host: str = "localhost", port: Optional[int] = None,
+                 unix_path: Optional[str] = None, max_workers: int = 8, max_pending: int = 64):
+        """
+        Initialize the server
+
+        Args:
+            handlers: Action name -> handler(params, emit)
+            host: TCP host to listen on
+            port: TCP port, or None to skip TCP (0 picks a free port)
+            unix_path: Unix socket path to listen on, if any
+            max_workers: Threads running handlers
+            max_pending: Requests in flight before reads are paused
+        """
+        self.handlers = dict(handlers)
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.loop = None
+        self.servers = []
+        self.thread = None
+        self.ready = threading.Event()
+        self.start_error = None
+        self.stats = {"connections": 0, "active_connections": 0, "requests": 0, "errors": 0}
+
+    def register(self, action: str, handler: Handler):
+        self.handlers[action] = handler
+
+    def start(self, timeout: float = 5.0) -> bool:
+        """Start serving on a background thread; returns False if the server could not bind"""
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ipc-handler")
+        self.thread = threading.Thread(target=self._run_loop, name="ipc-server", daemon=True)
+        self.thread.start()
+        self.ready.wait(timeout)
+        if self.start_error:
+            logger.error(f"Error starting IPC server: {self.start_error}")
+            return False
+        return self.ready.is_set()
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._listen())
+        except Exception as e:
+            self.start_error = e
+            self.ready.set()
+            return
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    async def _listen(self):
+        self.pending = asyncio.Semaphore(self.max_pending)
+        if self.port is not None:
+            server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+            self.port = server.sockets[0].getsockname()[1]
+            self.servers.append(server)
+            logger.info(f"IPC server listening on {self.host}:{self.port}")
+        if self.unix_path:
+            server = await asyncio.start_unix_server(self._serve_connection, self.unix_path)
+            self.servers.append(server)
+            logger.info(f"IPC server listening on {self.unix_path}")
+
+    def stop(self):
+        """Stop accepting connections and shut down the handler pool"""
+        if self.loop and self.loop.is_running():
+            async def close():
+                for server in self.servers:
+                    server.close()
+                    await server.wait_closed()
+                self.loop.stop()
+            asyncio.run_coroutine_threadsafe(close(), self.loop)
+        if self.thread:
+            self.thread.join(timeout=5.0)
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        self.stats["active_connections"] += 1
+        tasks = set()
+        try:
+            first = await reader.read(1)
+            if not first:
+                return
+            if first == b"{":
+                await self._serve_legacy(first, reader, writer)
+                return
+
+            buffered = first
+            while True:
+                header = buffered + await reader.readexactly(HEADER.size - len(buffered))
+                buffered = b""
+                (length,) = HEADER.unpack(header)
+                if length > MAX_FRAME_SIZE:
+                    # The frame is not read, so the stream cannot be resynchronised
+                    logger.warning(f"Closing IPC connection after oversized frame ({length} bytes)")
+                    await self._send_error(writer, None, f"Request frame of {length} bytes exceeds the "
+                                                         f"{MAX_FRAME_SIZE} byte limit")
+                    return
+                payload = await reader.readexactly(length)
+                try:
+                    request = json.loads(payload)
+                except ValueError as e:
+                    # Framing is intact, so only this request is lost
+                    self.stats["errors"] += 1
+                    await self._send_error(writer, None, f"Invalid request: {e}")
+                    buffered = await reader.read(1)
+                    if not buffered:
+                        break
+                    continue
+
+                # Back-pressure: stop reading until a handler slot frees up
+                await self.pending.acquire()
+                task = asyncio.ensure_future(self._dispatch(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+                buffered = await reader.read(1)
+                if not buffered:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Error on IPC connection: {e}")
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            self.stats["active_connections"] -= 1
+            writer.close()
+
+    async def _dispatch(self, request: Dict[str, Any], writer: asyncio.StreamWriter):
+        request_id = request.get("id") if isinstance(request, dict) else None
+        try:
+            response = await self._run_handler(request, writer, request_id)
+            response["id"] = request_id
+            try:
+                frame = encode_frame(response)
+            except ValueError as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error encoding IPC response: {e}")
+                frame = encode_frame({"id": request_id, "success": False, "error": str(e)})
+            if not writer.is_closing():
+                writer.write(frame)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.pending.release()
+
+    async def _send_error(self, writer: asyncio.StreamWriter, request_id, error: str):
+        try:
+            if not writer.is_closing():
+                writer.write(encode_frame({"id": request_id, "success": False, "error": error}))
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _run_handler(self, request, writer, request_id) -> Dict[str, Any]:
+        self.stats["requests"] += 1
+        if not isinstance(request, dict) or not request.get("action"):
+            return {"success": False, "error": "No action specified"}
+        handler = self.handlers.get(request["action"])
+        if handler is None:
+            return {"success": False, "error": f"Unknown action: {request['action']}"}
+
+        loop = asyncio.get_running_loop()
+
+        def emit(data):
+            frame = encode_frame({"id": request_id, "partial": True, "data": data})
+            loop.call_soon_threadsafe(lambda: writer.is_closing() or writer.write(frame))
+
+        try:
+            data = await loop.run_in_executor(self.executor, handler, request.get("params") or {}, emit)
+            return {"success": True, "data": data}
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Error handling IPC action {request['action']}: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def _serve_legacy(self, first: bytes, reader, writer):
+        """Serve one unframed JSON request, as sent by older clients"""
+        data = first
+        request = None
+        while len(data) < MAX_FRAME_SIZE:
+            try:
+                request = json.loads(data.decode("utf-8"))
+                break
+            except ValueError:
+                chunk = await asyncio.wait_for(reader.read(65536), timeout=5.0)
+                if not chunk:
+                    break
+                data += chunk
+        if request is None:
+            response = {"success": False, "error": "Invalid request"}
+        else:
+            await self.pending.acquire()
+            try:
+                response = await self._run_handler(request, writer, None)
+            finally:
+                self.pending.release()
+        writer.write(json.dumps(response, default=str).encode("utf-8"))
+        await writer.drain()
+
+    def get_status(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+class IPCClient:
+    """
+    Thread-safe client for the framed protocol
+
+    One persistent connection is shared by all calling threads; requests are
+    pipelined and matched to responses by id.
+    """
+
+    def __init__(self, host: str = "localhost", port: Optional[int] = None,
+                 unix_path: Optional[str] = None, timeout: float = 60.0):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.timeout = timeout
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, tuple] = {}
+        self.pending_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.reader_thread = None
+
+    def connect(self):
+        if self.unix_path:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.unix_path)
+        else:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        self.sock = sock
+        self.reader_thread = threading.Thread(target=self._read_loop, name="ipc-client", daemon=True)
+        self.reader_thread.start()
+        return self
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self.connect() if self.sock is None else self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _recv_exactly(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("IPC connection closed")
+            data += chunk
+        return bytes(data)
+
+    def _read_loop(self):
+        error = None
+        try:
+            while True:
+                (length,) = HEADER.unpack(self._recv_exactly(HEADER.size))
+                message = json.loads(self._recv_exactly(length))
+                with self.pending_lock:
+                    entry = self.pending.get(message.get("id"))
+                if entry is None:
+                    continue
+                future, on_partial = entry
+                if message.get("partial"):
+                    if on_partial:
+                        try:
+                            on_partial(message.get("data"))
+                        except Exception as e:
+                            logger.error(f"Error in IPC partial callback: {e}")
+                    continue
+                with self.pending_lock:
+                    self.pending.pop(message.get("id"), None)
+                future.set_result(message)
+        except Exception as e:
+            error = e
+        # Fail everything still waiting
+        with self.pending_lock:
+            waiting, self.pending = list(self.pending.values()), {}
+        for future, _ in waiting:
+            if not future.done():
+                future.set_exception(IPCError(f"IPC connection lost: {error}"))
+
+    def submit(self, action: str, params: Dict[str, Any] = None,
+               on_partial: Callable[[Any], None] = None) -> Future:
+        """Send a request without waiting; the future resolves to the final response message"""
+        if self.sock is None:
+            self.connect()
+        request_id = next(self.ids)
+        future = Future()
+        with self.pending_lock:
+            self.pending[request_id] = (future, on_partial)
+        frame = encode_frame({"id": request_id, "action": action, "params": params or {}})
+        try:
+            with self.send_lock:
+                self.sock.sendall(frame)
+        except OSError as e:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            raise IPCError(f"Error sending IPC request: {e}")
+        return future
+
+    def call(self, action: str, params: Dict[str, Any] = None,
+             on_partial: Callable[[Any], None] = None, timeout: float = None) -> Any:
+        """Send a request and return its data, raising IPCError if it failed"""
+        response = self.submit(action, params, on_partial).result(timeout or self.timeout)
+        if not response.get("success"):
+            raise IPCError(response.get("error", "Unknown error"))
+        return response.get("data")
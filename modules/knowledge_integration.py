@@ -1,24 +1,423 @@
 import logging
 import json
+import re
+import hashlib
+import sqlite3
+import threading
 import requests
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 from pathlib import Path
 
 logger = logging.getLogger("knowledge_integration")
 
+class KnowledgeCache:
+    """
+    Two-tier cache for knowledge query results.
+    
+    A bounded in-memory LRU sits in front of a single SQLite store. Entries
+    expire after a TTL and the store is trimmed to a maximum number of entries,
+    least recently used first. Keys are stable content hashes, so the cache
+    survives restarts. Memory hits are written back to the store in batches,
+    at most every access_flush_interval seconds, so hot entries are not
+    evicted as unused.
+    """
+    
+    def __init__(self, db_path, ttl=86400, max_entries=5000, memory_entries=256,
+                 access_flush_interval=30.0):
+        self.db_path = str(db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.access_flush_interval = access_flush_interval
+        self.memory = OrderedDict()
+        self.pending_access = {}  # key -> last memory hit not yet written to SQLite
+        self.last_access_flush = time.time()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._ensure_db()
+    
+    @staticmethod
+    def make_key(*parts):
+        """Build a deterministic key from JSON-serializable parts."""
+        canonical = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+    
+    def _ensure_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed)")
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get(self, key):
+        """Return cached data for key, or None if missing or expired."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if now - entry["timestamp"] < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.pending_access[key] = now
+                    self.stats["hits"] += 1
+                    flush = now - self.last_access_flush >= self.access_flush_interval
+                    data = entry["data"]
+                else:
+                    del self.memory[key]
+                    entry = None
+        if entry is not None:
+            if flush:
+                self.flush_access()
+            return data
+        
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                with self.lock:
+                    self.stats["misses"] += 1
+                return None
+            data, created = row
+            if now - created >= self.ttl:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                conn.commit()
+                with self.lock:
+                    self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+        finally:
+            conn.close()
+        
+        data = json.loads(data)
+        self._remember(key, {"timestamp": created, "data": data})
+        with self.lock:
+            self.stats["hits"] += 1
+        return data
+    
+    def set(self, key, data):
+        """Store data under key and evict old entries if over capacity."""
+        now = time.time()
+        self._remember(key, {"timestamp": now, "data": data})
+        
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, data, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(data), now, now)
+            )
+            # Recent memory hits must count before choosing what to evict
+            self._write_access(conn)
+            self._evict(conn, now)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing to cache: {e}")
+        finally:
+            conn.close()
+    
+    def _write_access(self, conn):
+        """Write pending memory-hit times to the accessed column."""
+        with self.lock:
+            pending = self.pending_access
+            self.pending_access = {}
+            self.last_access_flush = time.time()
+        if pending:
+            conn.executemany(
+                "UPDATE cache SET accessed = MAX(accessed, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in pending.items()]
+            )
+    
+    def flush_access(self):
+        """Write recent memory hits to SQLite now instead of on the next batch."""
+        conn = self._connect()
+        try:
+            self._write_access(conn)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing cache access times: {e}")
+        finally:
+            conn.close()
+    
+    def _remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+    
+    def _evict(self, conn, now):
+        """Drop expired entries, then the least recently used beyond max_entries."""
+        expired = conn.execute("DELETE FROM cache WHERE created < ?", (now - self.ttl,)).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed ASC LIMIT ?)",
+                (overflow,)
+            )
+        with self.lock:
+            self.stats["evictions"] += max(expired, 0) + max(overflow, 0)
+    
+    def clear(self):
+        """Remove every cached entry."""
+        with self.lock:
+            self.memory.clear()
+            self.pending_access.clear()
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM cache")
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_stats(self):
+        """Return hit/miss/eviction counters."""
+        with self.lock:
+            return dict(self.stats, memory_entries=len(self.memory))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key so the work runs only once;
+    every caller waiting on the key receives the same result.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+    
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+        
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["event"].set()
+
+
+class LocalKnowledgeIndex:
+    """
+    Full-text index over the local fact base.
+    
+    facts.json is loaded into a SQLite FTS5 table next to it and only rebuilt
+    when the file's mtime or size changes. Queries are ranked with BM25,
+    weighting keywords over title over content, and can optionally be
+    reranked with embeddings from the shared DeepMemory embedder.
+    """
+    
+    FIELD_WEIGHTS = (3.0, 2.0, 1.0)  # keywords, title, content
+    # Fact embeddings kept for reranking, least recently used dropped first
+    EMBEDDING_CACHE_SIZE = 2048
+    
+    def __init__(self, facts_path, index_path=None):
+        self.facts_path = Path(facts_path)
+        self.index_path = str(index_path or self.facts_path.with_suffix(".fts.db"))
+        self.lock = threading.Lock()
+        self.signature = None
+        self.embedder = None
+        self.embedding_cache = OrderedDict()
+    
+    def _connect(self):
+        return sqlite3.connect(self.index_path, timeout=10)
+    
+    def _file_signature(self):
+        stat = self.facts_path.stat()
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+    
+    def ensure_current(self):
+        """Rebuild the index if facts.json changed since it was built."""
+        signature = self._file_signature()
+        if signature == self.signature:
+            return
+        
+        with self.lock:
+            if signature == self.signature:
+                return
+            
+            conn = self._connect()
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+                row = conn.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+                if row is None or row[0] != signature:
+                    self._rebuild(conn, signature)
+            finally:
+                conn.close()
+            
+            self.signature = signature
+            self.embedding_cache.clear()
+    
+    def _rebuild(self, conn, signature):
+        start = time.time()
+        with open(self.facts_path, 'r') as f:
+            database = json.load(f)
+        
+        conn.execute("DROP TABLE IF EXISTS facts")
+        conn.execute("""
+            CREATE VIRTUAL TABLE facts USING fts5(
+                keywords, title, content, item UNINDEXED,
+                tokenize = 'porter unicode61'
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO facts (rowid, keywords, title, content, item) VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    i,
+                    " ".join(item.get("keywords", [])),
+                    item.get("title", ""),
+                    item.get("content", ""),
+                    json.dumps(item)
+                )
+                for i, item in enumerate(database)
+            )
+        )
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('signature', ?)", (signature,))
+        conn.commit()
+        logger.info(f"Indexed {len(database)} local facts in {time.time() - start:.2f}s")
+    
+    @staticmethod
+    def _match_expression(query):
+        """Turn free text into an FTS5 OR query of quoted terms."""
+        terms = re.findall(r"\w+", query.lower())
+        return " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+    
+    def search(self, query, max_results, rerank=False, rerank_candidates=20):
+        """
+        Search the fact base.
+        
+        Args:
+            query: Free-text query
+            max_results: Number of results to return
+            rerank: Rerank the top BM25 candidates by embedding similarity
+            rerank_candidates: How many BM25 candidates to consider for reranking
+            
+        Returns:
+            List of fact dicts with a relevance_score field, best first
+        """
+        self.ensure_current()
+        expression = self._match_expression(query)
+        if not expression:
+            return []
+        
+        limit = max(max_results, rerank_candidates) if rerank else max_results
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT rowid, item, bm25(facts, ?, ?, ?) AS rank FROM facts "
+                "WHERE facts MATCH ? ORDER BY rank LIMIT ?",
+                (*self.FIELD_WEIGHTS, expression, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        
+        results = []
+        for rowid, item, rank in rows:
+            item = json.loads(item)
+            # FTS5 bm25() is negative, lower is better
+            item["relevance_score"] = -rank
+            item["_rowid"] = rowid
+            results.append(item)
+        
+        if rerank and results:
+            results = self._rerank(query, results)
+        
+        for item in results:
+            item.pop("_rowid", None)
+        return results[:max_results]
+    
+    def _get_embedder(self):
+        if self.embedder is None:
+            from modules.deep_memory import get_instance as get_deep_memory
+            self.embedder = get_deep_memory().embedder
+        return self.embedder
+    
+    def _rerank(self, query, results):
+        """Reorder candidates by cosine similarity to the query embedding."""
+        try:
+            embedder = self._get_embedder()
+        except Exception as e:
+            logger.warning(f"Embedding rerank unavailable: {e}")
+            return results
+        
+        query_vector = embedder.embed_text(query)
+        for item in results:
+            rowid = item["_rowid"]
+            with self.lock:
+                vector = self.embedding_cache.get(rowid)
+                if vector is not None:
+                    self.embedding_cache.move_to_end(rowid)
+            if vector is None:
+                vector = embedder.embed_text(f"{item.get('title', '')}. {item.get('content', '')}")
+                with self.lock:
+                    self.embedding_cache[rowid] = vector
+                    while len(self.embedding_cache) > self.EMBEDDING_CACHE_SIZE:
+                        self.embedding_cache.popitem(last=False)
+            item["semantic_score"] = round(float(embedder.compute_similarity(query_vector, vector)), 4)
+        
+        results.sort(key=lambda x: x["semantic_score"], reverse=True)
+        return results
+
+
 class KnowledgeIntegrator:
     """
     Integrates external knowledge sources to enhance the AI's understanding
     and provide more accurate information during conversations.
     """
     
+    # Sources queried fresh every time. The local index watches facts.json
+    # itself, so caching its results would hide edits until the TTL ran out.
+    UNCACHED_SOURCES = ("local_database",)
+    
     def __init__(self, config_path=None):
         self.config = self._load_config(config_path)
         self.knowledge_sources = {}
-        self.cache = {}
         self.cache_dir = Path(self.config.get("cache_dir", "knowledge_cache"))
         self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.cache = KnowledgeCache(
+            self.cache_dir / "knowledge_cache.db",
+            ttl=self.config.get("cache_expiry", 86400),
+            max_entries=self.config.get("cache_max_entries", 5000),
+            memory_entries=self.config.get("cache_memory_entries", 256)
+        )
+        self._remove_legacy_cache_files()
+        self.single_flight = SingleFlight()
+        self.local_indexes = {}
+        self.local_indexes_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config.get("max_parallel_queries", 4),
+            thread_name_prefix="knowledge"
+        )
         
         # Initialize knowledge sources
         self._init_knowledge_sources()
@@ -41,11 +440,17 @@ class KnowledgeIntegrator:
                 },
                 "local_database": {
                     "enabled": True,
-                    "path": "knowledge_base/facts.json"
+                    "path": "knowledge_base/facts.json",
+                    "rerank": False,
+                    "rerank_candidates": 20
                 }
             },
             "cache_dir": "knowledge_cache",
-            "cache_expiry": 86400  # 24 hours
+            "cache_expiry": 86400,  # 24 hours
+            "cache_max_entries": 5000,
+            "cache_memory_entries": 256,
+            "max_parallel_queries": 4,
+            "request_timeout": 15
         }
         
         if not config_path:
@@ -93,13 +498,6 @@ class KnowledgeIntegrator:
         if not query:
             return {"error": "Empty query"}
         
-        # Check cache first
-        cache_key = f"{query}_{sources}_{max_results}"
-        cached_result = self._get_from_cache(cache_key)
-        if cached_result:
-            logger.info(f"Knowledge query cache hit: {query}")
-            return cached_result
-        
         # If no specific sources provided, use all enabled ones
         if not sources:
             sources = list(self.knowledge_sources.keys())
@@ -107,18 +505,54 @@ class KnowledgeIntegrator:
             # Filter to make sure we only use enabled sources
             sources = [s for s in sources if s in self.knowledge_sources]
         
+        cached_sources = [s for s in sources if s not in self.UNCACHED_SOURCES]
+        live_sources = [s for s in sources if s in self.UNCACHED_SOURCES]
+        
         results = {}
+        if cached_sources:
+            # Check cache first
+            cache_key = KnowledgeCache.make_key(query, sorted(cached_sources), max_results)
+            cached_result = self.cache.get(cache_key)
+            if cached_result:
+                logger.info(f"Knowledge query cache hit: {query}")
+                results.update(cached_result)
+            else:
+                # Identical concurrent queries share a single fan-out
+                results.update(self.single_flight.do(
+                    cache_key, lambda: self._query_sources(cache_key, query, cached_sources, max_results)
+                ))
+        
+        for source in live_sources:
+            try:
+                results[source] = self._query_source(source, query, max_results)
+            except Exception as e:
+                logger.error(f"Error querying {source}: {e}")
+                results[source] = {"error": str(e)}
         
-        for source in sources:
+        return results
+    
+    def _query_sources(self, cache_key, query, sources, max_results):
+        """Query all sources concurrently and cache the combined results."""
+        futures = {
+            source: self.executor.submit(self._query_source, source, query, max_results)
+            for source in sources
+        }
+        
+        results = {}
+        errors = False
+        for source, future in futures.items():
             try:
-                source_results = self._query_source(source, query, max_results)
-                results[source] = source_results
+                results[source] = future.result()
             except Exception as e:
                 logger.error(f"Error querying {source}: {e}")
                 results[source] = {"error": str(e)}
+            # Sources also report failures as an "error" entry instead of raising
+            if isinstance(results[source], dict) and "error" in results[source]:
+                errors = True
         
-        # Cache the results
-        self._add_to_cache(cache_key, results)
+        # Don't let a transient failure stick around for the whole TTL
+        if not errors:
+            self.cache.set(cache_key, results)
         
         return results
     
@@ -163,7 +597,7 @@ class KnowledgeIntegrator:
             "gsrsearch": query
         }
         
-        response = requests.get(api_url, params=params)
+        response = requests.get(api_url, params=params, timeout=self.config.get("request_timeout", 15))
         data = response.json()
         
         results = []
@@ -194,7 +628,7 @@ class KnowledgeIntegrator:
             "sortOrder": "descending"
         }
         
-        response = requests.get(api_url, params=params)
+        response = requests.get(api_url, params=params, timeout=self.config.get("request_timeout", 15))
         
         # Parse XML response
         from xml.etree import ElementTree
@@ -249,32 +683,18 @@ class KnowledgeIntegrator:
             }
         
         try:
-            with open(db_path, 'r') as f:
-                database = json.load(f)
-            
-            # Simple search implementation
-            # In a real system, this would use more sophisticated search algorithms
-            query_terms = query.lower().split()
-            results = []
+            with self.local_indexes_lock:
+                index = self.local_indexes.get(db_path)
+                if index is None:
+                    index = LocalKnowledgeIndex(db_path, config.get("index_path"))
+                    self.local_indexes[db_path] = index
             
-            for item in database:
-                # Calculate a simple relevance score
-                score = 0
-                for term in query_terms:
-                    if term in item.get("keywords", []):
-                        score += 3
-                    if term in item.get("title", "").lower():
-                        score += 2
-                    if term in item.get("content", "").lower():
-                        score += 1
-                
-                if score > 0:
-                    item["relevance_score"] = score
-                    results.append(item)
-            
-            # Sort by relevance and limit results
-            results.sort(key=lambda x: x.get("relevance_score", 0), reverse=True)
-            results = results[:max_results]
+            results = index.search(
+                query,
+                max_results,
+                rerank=config.get("rerank", False),
+                rerank_candidates=config.get("rerank_candidates", 20)
+            )
             
             return {
                 "results": results,
@@ -292,44 +712,15 @@ class KnowledgeIntegrator:
                 "error": str(e)
             }
     
-    def _get_from_cache(self, cache_key):
-        """Get results from cache if available and not expired."""
-        # Check in-memory cache first
-        if cache_key in self.cache:
-            entry = self.cache[cache_key]
-            if time.time() - entry["timestamp"] < self.config.get("cache_expiry", 86400):
-                return entry["data"]
-        
-        # Check file cache
-        cache_file = self.cache_dir / f"{hash(cache_key)}.json"
-        if cache_file.exists():
-            try:
-                with open(cache_file, 'r') as f:
-                    entry = json.load(f)
-                
-                if time.time() - entry["timestamp"] < self.config.get("cache_expiry", 86400):
-                    # Update in-memory cache
-                    self.cache[cache_key] = entry
-                    return entry["data"]
-            except:
-                pass
-        
-        return None
-    
-    def _add_to_cache(self, cache_key, data):
-        """Add results to cache."""
-        entry = {
-            "timestamp": time.time(),
-            "data": data
-        }
-        
-        # Add to in-memory cache
-        self.cache[cache_key] = entry
-        
-        # Add to file cache
-        cache_file = self.cache_dir / f"{hash(cache_key)}.json"
-        try:
-            with open(cache_file, 'w') as f:
-                json.dump(entry, f)
-        except Exception as e:
-            logger.error(f"Error writing to cache: {e}")
+    def _remove_legacy_cache_files(self):
+        """Remove per-key JSON files left by the old hash()-named cache."""
+        for cache_file in self.cache_dir.glob("*.json"):
+            if re.fullmatch(r"-?\d+\.json", cache_file.name):
+                try:
+                    cache_file.unlink()
+                except OSError:
+                    pass
+    
+    def get_cache_stats(self):
+        """Return cache hit/miss/eviction counters."""
+        return self.cache.get_stats()
@@ -1,4 +1,5 @@
 from modules.llm_providers.base_provider import BaseModel
+from modules.tracing import traced
 
 class GPTModel(BaseModel):
     """Provider implementation for GPT models."""
@@ -8,6 +9,7 @@ class GPTModel(BaseModel):
         self.model = None
         # Initialize GPT-specific configuration here
     
+    @traced("gpt.generate")
     def generate(self, prompt, **kwargs):
         """Generate text using a GPT model."""
         try:
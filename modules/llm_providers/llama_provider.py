@@ -1,16 +1,288 @@
 import logging
 import os
-from typing import Dict, Any, Optional
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional, Sequence, Tuple
+
+from modules.tracing import traced, current_span
+from modules.inference_scheduler import Preempted, is_preemptible, check_preemption
 
 logger = logging.getLogger("llama_provider")
 
+class PromptStateCache:
+    """
+    Two-tier cache of llama.cpp model states keyed by token prefix
+
+    llama-cpp-python looks up the longest cached prefix of each prompt,
+    restores that state and only evaluates the remaining suffix, then stores
+    the state after generation. Recent states stay in an in-RAM LRU bounded
+    by bytes; states evicted from RAM spill to an optional on-disk cache so
+    older conversations can still resume without re-evaluating their history.
+
+    Prefixes are matched in blocks of min_prefix_tokens tokens: every cached
+    key is indexed by a chained hash of each of its whole blocks, so a lookup
+    costs one dict probe per block of the prompt instead of a scan over every
+    cached key.
+
+    Implements the same interface as llama_cpp.LlamaRAMCache so it can be
+    passed to Llama.set_cache().
+    """
+
+    def __init__(self, capacity_bytes: int, disk_cache=None, min_prefix_tokens: int = 16):
+        """
+        Initialize the cache
+
+        Args:
+            capacity_bytes: Maximum total size of states kept in RAM
+            disk_cache: Optional diskcache.Cache (or any mapping) used as the
+                second tier, keyed by token tuples
+            min_prefix_tokens: Block size of the prefix index, which is also
+                the shortest prefix restored
+        """
+        self.capacity_bytes = capacity_bytes
+        self.disk_cache = disk_cache
+        self.min_prefix_tokens = min_prefix_tokens
+        self.states: "OrderedDict[Tuple[int, ...], Any]" = OrderedDict()
+        self.ram_bytes = 0
+        self.disk_keys = set()
+        self.index: Dict[int, set] = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "tokens_reused": 0, "evictions": 0,
+                      "oversized": 0}
+
+        if disk_cache is not None:
+            # Index states left on disk by earlier runs; only keys are read
+            try:
+                for key in disk_cache:
+                    if isinstance(key, tuple):
+                        self.disk_keys.add(key)
+                        self._index_key(key)
+            except Exception as e:
+                logger.warning(f"Could not index on-disk prompt cache: {e}")
+
+    @staticmethod
+    def _state_size(state) -> int:
+        size = getattr(state, "llama_state_size", None)
+        if size is None:
+            size = len(getattr(state, "llama_state", b""))
+        return size
+
+    @staticmethod
+    def _common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+        length = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            length += 1
+        return length
+
+    @property
+    def cache_size(self) -> int:
+        return self.ram_bytes
+
+    def _block_hashes(self, key: Tuple[int, ...]):
+        """Chained hash of each whole block of the key, shortest prefix first"""
+        block = self.min_prefix_tokens
+        hashes, h = [], 0
+        for end in range(block, len(key) + 1, block):
+            h = hash((h, key[end - block:end]))
+            hashes.append(h)
+        return hashes
+
+    def _index_key(self, key: Tuple[int, ...]):
+        for h in self._block_hashes(key):
+            self.index.setdefault(h, set()).add(key)
+
+    def _unindex_key(self, key: Tuple[int, ...]):
+        for h in self._block_hashes(key):
+            keys = self.index.get(h)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.index[h]
+
+    def _lookup(self, key: Tuple[int, ...]):
+        """Return (cached key, prefix length, from_disk) for the best cached prefix"""
+        block = self.min_prefix_tokens
+        hashes = self._block_hashes(key)
+        for blocks in range(len(hashes), 0, -1):
+            candidates = self.index.get(hashes[blocks - 1])
+            if not candidates:
+                continue
+            # Every candidate shares these blocks and diverges within the next
+            # one, so any of them is as good; prefer one already in RAM
+            cached_key = next((k for k in candidates if k in self.states), None)
+            if cached_key is None:
+                cached_key = next(iter(candidates))
+            length = self._common_prefix(cached_key, key)
+            if length >= blocks * block:
+                return cached_key, length, cached_key not in self.states
+        return None, 0, False
+
+    def _read_disk(self, key: Tuple[int, ...]):
+        try:
+            state = self.disk_cache.get(key)
+        except Exception as e:
+            logger.warning(f"Disk prompt cache read failed: {e}")
+            state = None
+        if state is None:
+            # Evicted by the disk cache's own size limit
+            self.disk_keys.discard(key)
+            self._unindex_key(key)
+        return state
+
+    def __getitem__(self, key: Sequence[int]):
+        key = tuple(key)
+        with self.lock:
+            while True:
+                cached_key, length, from_disk = self._lookup(key)
+                if cached_key is None:
+                    self.stats["misses"] += 1
+                    raise KeyError("Key not found")
+                if not from_disk:
+                    self.states.move_to_end(cached_key)
+                    state = self.states[cached_key]
+                    break
+                state = self._read_disk(cached_key)
+                if state is not None:
+                    # Promote to RAM so the next turn of this conversation is fast
+                    self.stats["disk_hits"] += 1
+                    self._store(cached_key, state)
+                    break
+            self.stats["hits"] += 1
+            self.stats["tokens_reused"] += length
+            return state
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        with self.lock:
+            return self._lookup(tuple(key))[0] is not None
+
+    def __setitem__(self, key: Sequence[int], value):
+        with self.lock:
+            self._store(tuple(key), value)
+
+    def _spill(self, key: Tuple[int, ...], state) -> bool:
+        if self.disk_cache is None:
+            return False
+        if key in self.disk_keys:
+            return True
+        try:
+            self.disk_cache[key] = state
+        except Exception as e:
+            logger.warning(f"Failed to spill prompt state to disk: {e}")
+            return False
+        self.disk_keys.add(key)
+        return True
+
+    def _drop_ram(self, key: Tuple[int, ...]):
+        state = self.states.pop(key)
+        self.ram_bytes -= self._state_size(state)
+        return state
+
+    def _store(self, key: Tuple[int, ...], value):
+        size = self._state_size(value)
+        if key in self.states:
+            self._drop_ram(key)
+        elif key not in self.disk_keys:
+            self._index_key(key)
+
+        if size > self.capacity_bytes:
+            # Would evict everything, itself included
+            self.stats["oversized"] += 1
+            if not self._spill(key, value):
+                self._unindex_key(key)
+            return
+
+        self.states[key] = value
+        self.ram_bytes += size
+        while self.ram_bytes > self.capacity_bytes:
+            evicted_key = next(iter(self.states))
+            evicted_state = self._drop_ram(evicted_key)
+            self.stats["evictions"] += 1
+            if not self._spill(evicted_key, evicted_state):
+                self._unindex_key(evicted_key)
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.states):
+                self._drop_ram(key)
+                if key not in self.disk_keys:
+                    self._unindex_key(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+            stats["ram_entries"] = len(self.states)
+            stats["ram_bytes"] = self.ram_bytes
+            stats["disk_entries"] = len(self.disk_keys)
+            if self.disk_cache is not None and hasattr(self.disk_cache, "volume"):
+                try:
+                    stats["disk_bytes"] = self.disk_cache.volume()
+                except Exception:
+                    pass
+            return stats
+
+class GGUFDraftModel:
+    """
+    Small GGUF model that proposes draft tokens for speculative decoding
+
+    Implements the llama_cpp.llama_speculative.LlamaDraftModel interface. The
+    draft model must share the main model's vocabulary (same family, smaller
+    size). Drafting is greedy; llama.cpp's own prefix matching means only the
+    tokens added since the previous call are evaluated.
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 8, n_ctx: int = 4096, n_threads: int = None):
+        from llama_cpp import Llama
+        import numpy as np
+
+        self.np = np
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = []
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0.0, reset=True):
+            if token == self.llm.token_eos():
+                break
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return self.np.array(draft, dtype=self.np.intc)
+
+class _MeteredDraftModel:
+    """Counts draft calls and proposed tokens so acceptance can be reported"""
+
+    def __init__(self, draft_model):
+        self.draft_model = draft_model
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.proposed = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = self.draft_model(input_ids, **kwargs)
+        self.calls += 1
+        self.proposed += len(draft)
+        return draft
+
 class LlamaModel:
     """Provider for LLama models."""
     
+    # generate() accepts on_token and calls it with each piece of text as it is produced
+    streams_tokens = True
+    
     def __init__(self, config):
         self.config = config
         self.model = None
         self.tokenizer = None
+        self.prompt_cache = None
+        self.draft_model = None
+        self.last_generation_stats = {}
+        self.speculative_totals = {"generations": 0, "completion_tokens": 0, "draft_steps": 0,
+                                   "draft_proposed": 0, "draft_accepted": 0}
         
         # Initialize the model
         self._initialize()
@@ -93,6 +365,11 @@ class LlamaModel:
                 init_params["chat_format"] = chat_format
                 logger.info(f"Using chat format: {chat_format}")
             
+            # Verifying draft tokens needs logits for every position; the
+            # draft model itself is attached after the main model has loaded
+            if self.config.parameters.get("speculative"):
+                init_params["logits_all"] = True
+            
             # Add error handling for specific MOE models
             model_name = self.config.model_name.lower()
             if "moe" in model_name or "mixture" in model_name:
@@ -152,6 +429,10 @@ class LlamaModel:
                             raise  # Re-raise last exception
             
             logger.info(f"Successfully loaded Llama model: {self.config.model_name}")
+            # The draft model is only loaded once the main model is in memory,
+            # so a failed main load never leaves a draft model behind
+            self._attach_draft_model(context_size)
+            self._setup_prompt_cache()
         except ImportError as e:
             logger.error(f"Failed to import llama_cpp. Error: {e}")
             logger.error("Make sure llama-cpp-python is installed. Try: pip install llama-cpp-python")
@@ -160,6 +441,172 @@ class LlamaModel:
             logger.error(f"Error initializing Llama model: {e}", exc_info=True)
             raise
     
+    def _create_draft_model(self, context_size: int):
+        """
+        Build the draft model for speculative decoding, if enabled.
+        
+        Config parameters:
+            speculative: "prompt_lookup" (draft from n-grams already in the
+                prompt, no extra model) or "draft" (small GGUF draft model)
+            speculative_tokens: Tokens proposed per step
+            draft_model_path: GGUF file for "draft" mode
+        """
+        mode = self.config.parameters.get("speculative")
+        if not mode:
+            return None
+        
+        try:
+            if mode == "prompt_lookup":
+                from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+                num_pred_tokens = self.config.parameters.get("speculative_tokens", 10)
+                draft_model = LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens)
+            elif mode == "draft":
+                draft_path = self.config.parameters.get("draft_model_path")
+                if not draft_path or not os.path.exists(draft_path):
+                    logger.warning(f"Draft model not found: {draft_path}, speculative decoding disabled")
+                    return None
+                num_pred_tokens = self.config.parameters.get("speculative_tokens", 8)
+                draft_model = GGUFDraftModel(
+                    draft_path,
+                    num_pred_tokens=num_pred_tokens,
+                    n_ctx=context_size,
+                    n_threads=self.config.parameters.get("draft_threads")
+                )
+            else:
+                logger.warning(f"Unknown speculative decoding mode: {mode}")
+                return None
+        except ImportError as e:
+            logger.warning(f"Speculative decoding not supported by this llama-cpp-python version: {e}")
+            return None
+        except Exception as e:
+            logger.warning(f"Could not load the draft model, speculative decoding disabled: {e}")
+            return None
+        
+        logger.info(f"Speculative decoding enabled: {mode} ({num_pred_tokens} tokens per step)")
+        self.draft_model = _MeteredDraftModel(draft_model)
+        return self.draft_model
+    
+    def _attach_draft_model(self, context_size: int):
+        """Enable opt-in speculative decoding on the loaded main model."""
+        draft_model = self._create_draft_model(context_size)
+        if draft_model is None:
+            return
+        if hasattr(self.model, "draft_model"):
+            # Llama reads draft_model on every generation, so it can be set after loading
+            self.model.draft_model = draft_model
+        else:
+            logger.warning("This llama-cpp-python version does not support draft models, speculative decoding disabled")
+            self.draft_model = None
+    
+    def get_generation_stats(self) -> Dict[str, Any]:
+        """
+        Timing and speculative decoding stats of the last generation, plus
+        running speculative totals under "speculative_totals".
+        """
+        stats = dict(self.last_generation_stats)
+        if self.draft_model is not None:
+            totals = dict(self.speculative_totals)
+            totals["acceptance_rate"] = (
+                totals["draft_accepted"] / totals["draft_proposed"] if totals["draft_proposed"] else 0.0
+            )
+            stats["speculative_totals"] = totals
+        return stats
+    
+    def _record_generation_stats(self, output, elapsed: float):
+        """Fill last_generation_stats from a completion result."""
+        usage = output.get("usage", {}) if isinstance(output, dict) else {}
+        completion_tokens = usage.get("completion_tokens", 0)
+        stats = {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": completion_tokens,
+            "elapsed": elapsed,
+            "tokens_per_second": completion_tokens / elapsed if elapsed > 0 else 0.0
+        }
+        
+        if self.draft_model is not None:
+            # Every decoding step yields one sampled token plus the accepted
+            # draft tokens, so accepted drafts = generated tokens - steps
+            steps = self.draft_model.calls
+            accepted = max(0, completion_tokens - steps)
+            stats.update({
+                "speculative": self.config.parameters.get("speculative"),
+                "draft_steps": steps,
+                "draft_proposed": self.draft_model.proposed,
+                "draft_accepted": accepted,
+                "acceptance_rate": accepted / self.draft_model.proposed if self.draft_model.proposed else 0.0
+            })
+        
+        self.last_generation_stats = stats
+        span = current_span()
+        if span is not None:
+            for key in ("prompt_tokens", "completion_tokens", "draft_proposed", "draft_accepted"):
+                if key in stats:
+                    span.set_attribute(key, stats[key])
+        if self.draft_model is not None:
+            totals = self.speculative_totals
+            totals["generations"] += 1
+            totals["completion_tokens"] += completion_tokens
+            totals["draft_steps"] += stats["draft_steps"]
+            totals["draft_proposed"] += stats["draft_proposed"]
+            totals["draft_accepted"] += stats["draft_accepted"]
+        logger.info(
+            f"Generated {completion_tokens} tokens in {elapsed:.2f}s ({stats['tokens_per_second']:.1f} tok/s)"
+            + (f", draft acceptance {stats['acceptance_rate']:.0%}" if "acceptance_rate" in stats else "")
+        )
+    
+    def _setup_prompt_cache(self):
+        """
+        Attach a prefix state cache so turns sharing the system prompt and
+        history with an earlier turn only evaluate the new suffix.
+
+        Config parameters:
+            prompt_cache_mb: RAM budget for cached states; 0 (the default)
+                disables caching, "auto" uses a tenth of the available RAM
+            prompt_cache_disk_mb: Size cap of the on-disk tier (0 disables it)
+            prompt_cache_dir: Directory for the on-disk tier
+        """
+        self.prompt_cache = None
+        ram_mb = self._prompt_cache_budget_mb(self.config.parameters.get("prompt_cache_mb", 0))
+        if not ram_mb or not hasattr(self.model, "set_cache"):
+            return
+
+        disk_cache = None
+        disk_mb = self.config.parameters.get("prompt_cache_disk_mb", 0)
+        if disk_mb:
+            cache_dir = self.config.parameters.get(
+                "prompt_cache_dir",
+                os.path.join("data", "prompt_cache", os.path.basename(self.config.model_path))
+            )
+            try:
+                import diskcache
+                disk_cache = diskcache.Cache(cache_dir, size_limit=int(disk_mb * 1024 * 1024))
+                logger.info(f"On-disk prompt cache enabled at {cache_dir} ({disk_mb} MB)")
+            except ImportError:
+                logger.warning("On-disk prompt cache requires the 'diskcache' package, using RAM cache only")
+            except Exception as e:
+                logger.warning(f"Could not open on-disk prompt cache: {e}")
+
+        self.prompt_cache = PromptStateCache(int(ram_mb * 1024 * 1024), disk_cache)
+        self.model.set_cache(self.prompt_cache)
+        logger.info(f"Prompt prefix cache enabled ({ram_mb} MB RAM)")
+
+    @staticmethod
+    def _prompt_cache_budget_mb(setting) -> int:
+        """Resolve prompt_cache_mb, sizing "auto" from the currently available RAM"""
+        if setting != "auto":
+            return int(setting or 0)
+        try:
+            import psutil
+            return int(psutil.virtual_memory().available * 0.1 / (1024 * 1024))
+        except ImportError:
+            logger.warning("psutil is required to size the prompt cache automatically, prompt cache disabled")
+            return 0
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counts and reused token totals of the prompt cache"""
+        cache = getattr(self, "prompt_cache", None)
+        return cache.get_stats() if cache else {}
+
     def _map_format_to_library(self, format_name: str) -> str:
         """Map our format names to the names used by the llama-cpp library."""
         format_map = {
@@ -185,8 +632,14 @@ class LlamaModel:
         # Return None for default/unknown formats
         return None
     
-    def generate(self, prompt: str, **kwargs):
-        """Generate a response using the Llama model."""
+    @traced("llama.generate")
+    def generate(self, prompt: str, on_token: Callable[[str], None] = None, **kwargs):
+        """
+        Generate a response using the Llama model.
+        
+        With on_token the completion is streamed and on_token is called with
+        each piece of text; the full text is still returned.
+        """
         if not self.model:
             logger.error("Model not initialized")
             return "Error: Model not initialized"
@@ -204,6 +657,16 @@ class LlamaModel:
             
             # Call the model correctly - for llama_cpp.Llama the correct method is just calling the object
             try:
+                if self.draft_model is not None:
+                    self.draft_model.reset()
+                started = time.time()
+                
+                if on_token is not None or is_preemptible():
+                    return self._generate_stream(
+                        prompt, started, on_token, max_tokens=max_tokens, temperature=temperature, top_p=top_p,
+                        top_k=top_k
+                    )
+                
                 # First try with the modern API format
                 output = self.model(
                     prompt,
@@ -212,6 +675,7 @@ class LlamaModel:
                     top_p=top_p,
                     top_k=top_k
                 )
+                self._record_generation_stats(output, time.time() - started)
                 
                 # Handle different response formats
                 if isinstance(output, dict) and "choices" in output and len(output["choices"]) > 0:
@@ -254,13 +718,46 @@ class LlamaModel:
                 else:
                     raise
                 
+        except Preempted:
+            # The scheduler re-queues the request; this is not an error
+            raise
         except Exception as e:
             logger.error(f"Error generating response with Llama: {e}", exc_info=True)
             logger.error(f"Model type: {type(self.model)}")
             logger.error(f"Parameters that caused error: {kwargs}")
             return f"Error generating response: {str(e)}\n\nPlease check model configuration."
     
+    def _generate_stream(self, prompt: str, started: float, on_token: Callable[[str], None] = None,
+                         **params) -> str:
+        """
+        Stream a completion, passing each piece of text to on_token
+
+        Without on_token this is a background completion that gives the model
+        up between tokens when foreground requests are waiting (raises
+        Preempted). A stream the caller is watching is never preempted, since
+        re-running it would repeat text the caller has already seen.
+        """
+        pieces = []
+        for chunk in self.model(prompt, stream=True, **params):
+            if on_token is None:
+                check_preemption()
+            text = chunk["choices"][0].get("text", "")
+            pieces.append(text)
+            if on_token is not None and text:
+                on_token(text)
+        
+        # Streamed chunks carry no usage block; llama-cpp-python yields one chunk per token
+        prompt_tokens = len(self.model.tokenize(prompt.encode("utf-8"))) if hasattr(self.model, "tokenize") else 0
+        self._record_generation_stats(
+            {"usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces)}},
+            time.time() - started
+        )
+        return "".join(pieces)
+    
     def cleanup(self):
         """Clean up resources."""
         logger.info(f"Cleaning up Llama model: {self.config.model_name}")
+        if getattr(self, "prompt_cache", None):
+            self.prompt_cache.clear()
+            self.prompt_cache = None
         self.model = None
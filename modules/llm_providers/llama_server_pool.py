@@ -0,0 +1,325 @@
+"""
+Pool of llama-server workers
+Routes requests to the worker with the fewest outstanding requests, keeps each
+conversation on the same worker so its prompt cache stays warm, health-checks
+workers through /health and restarts crashed ones.
+"""
+
+import json
+import time
+import logging
+import threading
+import urllib.request
+import urllib.error
+from typing import Dict, Any, List, Callable, Hashable
+
+logger = logging.getLogger("llama_server_pool")
+
+class NoHealthyWorkerError(RuntimeError):
+    """Raised when no worker in the pool can take a request"""
+
+class ServerWorker:
+    """One llama-server process (or externally managed server) in the pool"""
+
+    def __init__(self, url: str, port: int = None, cpu_set: List[int] = None):
+        self.url = url.rstrip("/")
+        self.port = port
+        self.cpu_set = cpu_set
+        self.process = None
+        self.healthy = False
+        self.outstanding = 0
+        self.completed = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.restarts = 0
+        self.restarting = False
+        self.last_restart = 0.0
+        self.last_check = 0.0
+
+    def is_dead(self) -> bool:
+        """True if we launched this worker and its process has exited"""
+        return self.process is not None and hasattr(self.process, "poll") and self.process.poll() is not None
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "completed": self.completed,
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "cpu_set": self.cpu_set
+        }
+
+class LlamaServerPool:
+    """
+    Load balancer over several llama-server workers
+
+    Routing is least-outstanding-requests with session affinity: a session
+    stays on its worker unless that worker is unhealthy or has `affinity_slack`
+    more requests in flight than the least loaded one.
+    """
+
+    def __init__(self, workers: List[ServerWorker], launcher: Callable[[ServerWorker], Any] = None,
+                 health_interval: float = 5.0, affinity_slack: int = 2,
+                 affinity_ttl: float = 1800.0, max_affinity_entries: int = 10000,
+                 restart_backoff: float = 10.0, failure_threshold: int = 2):
+        """
+        Initialize the pool
+
+        Args:
+            workers: Workers to route across
+            launcher: Callable that starts a worker and returns its process; used for restarts
+            health_interval: Seconds between /health checks
+            affinity_slack: Extra in-flight requests tolerated before breaking session affinity
+            affinity_ttl: Seconds after which an idle session forgets its worker
+            max_affinity_entries: Cap on remembered sessions
+            restart_backoff: Minimum seconds between restarts of the same worker
+            failure_threshold: Consecutive request failures before a worker is marked unhealthy
+        """
+        self.workers = workers
+        self.launcher = launcher
+        self.health_interval = health_interval
+        self.affinity_slack = affinity_slack
+        self.affinity_ttl = affinity_ttl
+        self.max_affinity_entries = max_affinity_entries
+        self.restart_backoff = restart_backoff
+        self.failure_threshold = failure_threshold
+
+        self.affinity: Dict[Hashable, tuple] = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.health_thread = None
+
+    @classmethod
+    def from_urls(cls, urls: List[str], **kwargs) -> "LlamaServerPool":
+        """Pool over servers that are already running"""
+        return cls([ServerWorker(url) for url in urls], **kwargs)
+
+    def start(self, launch: bool = True, ready_timeout: float = 120.0):
+        """
+        Launch workers (if a launcher is set), wait for them to become healthy
+        and start the background health checker
+        """
+        if launch and self.launcher:
+            # Workers load their model concurrently
+            threads = [threading.Thread(target=self._launch, args=(worker,), daemon=True) for worker in self.workers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(ready_timeout)
+
+        deadline = time.time() + ready_timeout
+        while time.time() < deadline:
+            self.check_health()
+            if all(worker.healthy for worker in self.workers):
+                break
+            time.sleep(0.5)
+
+        healthy = sum(1 for worker in self.workers if worker.healthy)
+        logger.info(f"llama-server pool ready: {healthy}/{len(self.workers)} workers healthy")
+
+        self.health_thread = threading.Thread(target=self._health_loop, name="llama-pool-health", daemon=True)
+        self.health_thread.start()
+        return healthy
+
+    def _launch(self, worker: ServerWorker):
+        try:
+            process = self.launcher(worker)
+            # The launcher reports an already running server as a string
+            worker.process = process if hasattr(process, "poll") else None
+            worker.last_restart = time.time()
+        except Exception as e:
+            logger.error(f"Failed to launch llama-server worker {worker.url}: {e}")
+
+    def _health_loop(self):
+        while not self.stop_event.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"Error during llama-server health check: {e}")
+
+    def _restart(self, worker: ServerWorker):
+        try:
+            if not self.stop_event.is_set():
+                self._launch(worker)
+        finally:
+            worker.restarting = False
+
+    def check_health(self):
+        """
+        Probe every worker's /health and restart dead ones
+
+        Restarts run on their own thread so a worker that takes a while to
+        launch does not hold up health checks of the others.
+        """
+        for worker in self.workers:
+            if worker.restarting:
+                continue
+            if worker.is_dead() and self.launcher:
+                if time.time() - worker.last_restart >= self.restart_backoff:
+                    logger.warning(f"llama-server worker {worker.url} exited, restarting")
+                    worker.healthy = False
+                    worker.restarts += 1
+                    worker.restarting = True
+                    worker.last_restart = time.time()
+                    threading.Thread(target=self._restart, args=(worker,),
+                                     name="llama-pool-restart", daemon=True).start()
+                continue
+
+            worker.last_check = time.time()
+            try:
+                with urllib.request.urlopen(f"{worker.url}/health", timeout=2) as response:
+                    healthy = response.status == 200
+            except urllib.error.HTTPError:
+                # 503 while the model is still loading
+                healthy = False
+            except Exception:
+                healthy = False
+
+            if healthy and not worker.healthy:
+                logger.info(f"llama-server worker {worker.url} is healthy")
+                worker.consecutive_failures = 0
+            elif not healthy and worker.healthy:
+                logger.warning(f"llama-server worker {worker.url} failed its health check")
+            worker.healthy = healthy
+
+    def _pick(self, session_key: Hashable = None, exclude=()) -> ServerWorker:
+        """Choose a worker and count the request as outstanding. Caller holds the lock."""
+        candidates = [w for w in self.workers if w.healthy and w not in exclude]
+        if not candidates:
+            raise NoHealthyWorkerError("No healthy llama-server workers available")
+
+        least = min(candidates, key=lambda w: w.outstanding)
+        chosen = least
+        if session_key is not None:
+            entry = self.affinity.get(session_key)
+            if entry:
+                sticky = entry[0]
+                if sticky in candidates and sticky.outstanding <= least.outstanding + self.affinity_slack:
+                    chosen = sticky
+            self._remember(session_key, chosen)
+
+        chosen.outstanding += 1
+        return chosen
+
+    def _remember(self, session_key: Hashable, worker: ServerWorker):
+        now = time.time()
+        self.affinity[session_key] = (worker, now)
+        if len(self.affinity) > self.max_affinity_entries:
+            expired = [k for k, (_, seen) in self.affinity.items() if now - seen > self.affinity_ttl]
+            for key in expired:
+                del self.affinity[key]
+            # Still too many: drop the oldest half
+            if len(self.affinity) > self.max_affinity_entries:
+                oldest = sorted(self.affinity, key=lambda k: self.affinity[k][1])
+                for key in oldest[:len(oldest) // 2]:
+                    del self.affinity[key]
+
+    def _report(self, worker: ServerWorker, ok: bool):
+        with self.lock:
+            if ok:
+                worker.completed += 1
+                worker.consecutive_failures = 0
+                return
+            worker.failures += 1
+            worker.consecutive_failures += 1
+            if worker.consecutive_failures >= self.failure_threshold and worker.healthy:
+                logger.warning(f"Marking llama-server worker {worker.url} unhealthy after {worker.consecutive_failures} failures")
+                worker.healthy = False
+
+    def post(self, path: str, payload: Dict[str, Any], session_key: Hashable = None,
+             timeout: float = 120.0, retries: int = 1) -> Dict[str, Any]:
+        """
+        POST a JSON request to a worker and return the decoded response
+
+        Connection failures are retried on a different worker. HTTP errors
+        returned by a healthy server are raised to the caller unchanged.
+        """
+        tried = []
+        last_error = None
+        for _ in range(retries + 1):
+            with self.lock:
+                try:
+                    worker = self._pick(session_key, exclude=tried)
+                except NoHealthyWorkerError:
+                    if last_error:
+                        raise last_error
+                    raise
+
+            try:
+                result = self._send(worker, path, payload, timeout)
+                self._report(worker, True)
+                return result
+            except urllib.error.HTTPError as e:
+                # The server answered; a 503 means all its slots are busy or it is loading
+                self._report(worker, e.code != 503)
+                if e.code != 503:
+                    raise
+                last_error = e
+            except (urllib.error.URLError, ConnectionError, TimeoutError, OSError) as e:
+                self._report(worker, False)
+                last_error = e
+            finally:
+                with self.lock:
+                    worker.outstanding -= 1
+
+            tried.append(worker)
+            logger.warning(f"Request to llama-server worker {worker.url} failed, retrying elsewhere: {last_error}")
+
+        raise last_error
+
+    @staticmethod
+    def _send(worker: ServerWorker, path: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        request = urllib.request.Request(
+            f"{worker.url}{path}",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "workers": [worker.get_status() for worker in self.workers],
+                "sessions": len(self.affinity)
+            }
+
+    def shutdown(self):
+        """Stop health checks and terminate launched workers"""
+        self.stop_event.set()
+        for worker in self.workers:
+            process = worker.process
+            if process is not None and hasattr(process, "terminate"):
+                try:
+                    process.terminate()
+                    process.wait(timeout=5)
+                except Exception as e:
+                    logger.error(f"Error stopping llama-server worker {worker.url}: {e}")
+                    if hasattr(process, "kill"):
+                        process.kill()
+            worker.process = None
+            worker.healthy = False
+
+def plan_workers(size: int, base_port: int = 8080, host: str = "127.0.0.1",
+                 cpu_count: int = None) -> List[ServerWorker]:
+    """
+    Lay out `size` workers on consecutive ports, splitting the CPUs into
+    disjoint sets so the workers do not compete for the same cores
+    """
+    import os
+    if cpu_count is None:
+        cpu_count = os.cpu_count() or 1
+    per_worker = max(1, cpu_count // size)
+
+    workers = []
+    for i in range(size):
+        cpu_set = None
+        if cpu_count >= size:
+            start = i * per_worker
+            cpu_set = list(range(start, min(start + per_worker, cpu_count)))
+        port = base_port + i
+        workers.append(ServerWorker(f"http://{host}:{port}", port=port, cpu_set=cpu_set))
+    return workers
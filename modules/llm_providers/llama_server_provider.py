@@ -8,9 +8,11 @@ import subprocess
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 import socket
+import hashlib
 
 # Import base provider
 from .base_provider import BaseModel
+from modules.tracing import traced
 
 logger = logging.getLogger("llama_server_provider")
 
@@ -27,6 +29,12 @@ class LlamaServerModel(BaseModel):
         self.server_process = None
         self.model_info = {}
         
+        # Optional pool of servers: pool_size workers launched on consecutive
+        # ports, or server_urls for servers that are already running
+        self.pool_size = config.parameters.get("pool_size", 1)
+        self.server_urls = config.parameters.get("server_urls")
+        self.pool = None
+        
         # Now call the parent class initializer
         super().__init__(config)
         
@@ -37,6 +45,10 @@ class LlamaServerModel(BaseModel):
         """Initialize the connection to the server."""
         # The code can now safely access self.port since it's defined before this method is called
         try:
+            if self.pool_size > 1 or self.server_urls:
+                self._start_pool()
+                return
+            
             # Check if we need to start the server
             if self.config.parameters.get("auto_start_server", True):
                 self._start_server()
@@ -85,6 +97,74 @@ class LlamaServerModel(BaseModel):
             logger.error(f"Error starting llama-server: {e}")
             raise
     
+    def _start_pool(self):
+        """Start (or connect to) a pool of llama-server workers."""
+        from .llama_server_pool import LlamaServerPool
+        
+        if self.pool:
+            return
+        
+        if self.server_urls:
+            self.pool = LlamaServerPool.from_urls(self.server_urls)
+            self.pool.start(launch=False, ready_timeout=10)
+        else:
+            sys.path.append(str(Path(__file__).parent.parent.parent))
+            from scripts.launch_llama_server import launch_pool
+            
+            logger.info(f"Starting {self.pool_size} llama-server workers for model: {self.config.model_name}")
+            self.pool = launch_pool(
+                model_name=self.config.model_name,
+                size=self.pool_size,
+                base_port=self.port,
+                n_parallel=self.config.parameters.get("n_parallel", 2)
+            )
+        
+        if not self.pool or not any(worker.healthy for worker in self.pool.workers):
+            raise RuntimeError("No llama-server worker in the pool became healthy")
+        
+        self.server_url = self.pool.workers[0].url
+        logger.info(f"Connected to llama-server pool: {[w.url for w in self.pool.workers]}")
+    
+    def _session_key(self, kwargs: Dict[str, Any], messages: List[Dict[str, str]] = None):
+        """
+        Key used to keep a conversation on one pool worker.
+        
+        Callers pass session_id (or conversation_id). Without one, a multi-turn
+        message list is identified by its system prompt and first user message,
+        which stay the same as the conversation grows. A prompt prefix is not
+        used: conversations sharing a long system prompt would all map to one
+        worker. Anything else gets no affinity and goes to the least loaded worker.
+        """
+        for name in ("session_id", "conversation_id"):
+            if kwargs.get(name) is not None:
+                return kwargs[name]
+        if not messages:
+            return None
+        turns = [msg for msg in messages if msg.get("role") != "system"]
+        if len(turns) < 2:
+            return None
+        system = next((msg for msg in messages if msg.get("role") == "system"), {})
+        opening = f"{system.get('content', '')}\n{turns[0].get('content', '')}"
+        return hashlib.sha1(opening.encode("utf-8", errors="ignore")).hexdigest()
+    
+    def _post(self, path: str, request_data: Dict[str, Any], session_key=None, timeout: float = 120):
+        """POST to the server, or to the pool worker chosen for this session."""
+        if self.pool:
+            return self.pool.post(path, request_data, session_key=session_key, timeout=timeout)
+        
+        response = requests.post(
+            f"{self.server_url}{path}",
+            json=request_data,
+            headers={"Content-Type": "application/json"},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def get_pool_status(self) -> Dict[str, Any]:
+        """Worker health and load when running in pool mode."""
+        return self.pool.get_status() if self.pool else {}
+    
     def _is_server_running(self):
         """Check if the server is already running."""
         try:
@@ -138,6 +218,7 @@ class LlamaServerModel(BaseModel):
             logger.error(f"Error getting model information: {e}")
             return {}
     
+    @traced("llama_server.generate")
     def generate(self, prompt: str, **kwargs):
         """Generate a response using the chat completion API."""
         try:
@@ -155,20 +236,14 @@ class LlamaServerModel(BaseModel):
                 "top_k": kwargs.get("top_k", 40),
                 "max_tokens": kwargs.get("max_tokens", 512),
                 "stop": kwargs.get("stop", []),
-                "stream": False
+                "stream": False,
+                # Reuse the slot's KV cache for the shared prompt prefix
+                "cache_prompt": True
             }
             
             logger.info(f"Sending completion request to server")
-            response = requests.post(
-                f"{self.server_url}/completion",
-                json=request_data,
-                headers={"Content-Type": "application/json"},
-                timeout=120  # Longer timeout for generation
-            )
-            
-            # Check for errors
-            response.raise_for_status()
-            result = response.json()
+            # Longer timeout for generation
+            result = self._post("/completion", request_data, self._session_key(kwargs), timeout=120)
             
             # Extract the generated text
             if "content" in result:
@@ -183,6 +258,7 @@ class LlamaServerModel(BaseModel):
             logger.error(f"Error generating response: {e}")
             return f"Error: {str(e)}"
     
+    @traced("llama_server.chat_completion")
     def chat_completion(self, messages: List[Dict[str, str]], **kwargs):
         """Generate a response using the chat completion API."""
         try:
@@ -203,7 +279,8 @@ class LlamaServerModel(BaseModel):
                 "top_p": kwargs.get("top_p", 0.95),
                 "top_k": kwargs.get("top_k", 40),
                 "max_tokens": kwargs.get("max_tokens", 512),
-                "stream": False
+                "stream": False,
+                "cache_prompt": True
             }
             
             # Rename max_tokens to n_predict if needed
@@ -212,16 +289,7 @@ class LlamaServerModel(BaseModel):
             
             # Send the chat completion request
             logger.info(f"Sending chat completion request to server")
-            response = requests.post(
-                f"{self.server_url}/v1/chat/completions",
-                json=request_data,
-                headers={"Content-Type": "application/json"},
-                timeout=120
-            )
-            
-            # Check for errors
-            response.raise_for_status()
-            result = response.json()
+            result = self._post("/v1/chat/completions", request_data, self._session_key(kwargs, messages), timeout=120)
             
             # Extract the generated message
             if "choices" in result and len(result["choices"]) > 0:
@@ -237,6 +305,9 @@ class LlamaServerModel(BaseModel):
     def cleanup(self):
         """Clean up resources."""
         logger.info("Cleaning up llama server model resources")
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
         if self.server_process and hasattr(self.server_process, 'terminate'):
             try:
                 logger.info("Stopping server process")
@@ -7,8 +7,14 @@ import logging
 import time
 import os
 import json
+import uuid
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional
+
+from modules.inference_scheduler import get_scheduler, model_key_for
+from modules.turn_pipeline import StageRunner, PostTurnQueue
+from modules.tracing import span, traced
+from utils.health_monitor import get_health_monitor
 
 logger = logging.getLogger("lyra_core")
 
@@ -27,8 +33,14 @@ class LyraCore:
             cls._instance = LyraCore()
         return cls._instance
     
-    def __init__(self):
-        """Initialize the core"""
+    def __init__(self, model_manager=None, cognitive_architecture=None, model_integration=None,
+                 io_manager=None):
+        """
+        Initialize the core
+        
+        Components can be passed in (for example stubs in tests); when none
+        are given they are loaded as usual.
+        """
         self.start_time = time.time()
         self.last_activity = time.time()
         
@@ -36,16 +48,59 @@ class LyraCore:
         self.components = {}
         
         # Initialize model manager first as other components depend on it
-        self._initialize_model_manager()
+        if model_manager is not None:
+            self.model_manager = model_manager
+            self.components["model_manager"] = model_manager
+        else:
+            self._initialize_model_manager()
         
         # Initialize cognitive components
-        self._initialize_cognitive_components()
+        if cognitive_architecture is not None or model_integration is not None:
+            self.cognitive_architecture = cognitive_architecture
+            self.model_integration = model_integration
+            self.io_manager = io_manager
+            for name, component in (("cognitive_architecture", cognitive_architecture),
+                                    ("model_integration", model_integration),
+                                    ("io_manager", io_manager)):
+                if component is not None:
+                    self.components[name] = component
+        else:
+            self._initialize_cognitive_components()
         
         # Track persistent connections
         self.connected_clients = {}
         
+        # Turn pipeline: concurrent pre-generation analyses, background post-turn work
+        pipeline_config = self.get_config().get("pipeline", {})
+        self.stage_deadlines = pipeline_config.get("stage_deadlines", {
+            "metacognition": 1.5,
+            "emotional": 0.5,
+            "memories": 1.0
+        })
+        self.enhance_responses = pipeline_config.get("enhance_responses", False)
+        self.stage_runner = StageRunner()
+        self.post_turn_queue = PostTurnQueue(maxsize=pipeline_config.get("post_turn_queue_size", 32))
+        get_health_monitor().register_queue("post_turn", self.post_turn_queue.queue.qsize)
+        
+        # Prometheus endpoint for the sampled health metrics, off unless configured
+        monitoring_config = self.get_config().get("monitoring", {})
+        if monitoring_config.get("metrics_exporter", False):
+            self._start_metrics_exporter(monitoring_config)
+        
         logger.info("Lyra Core initialized")
     
+    def _start_metrics_exporter(self, monitoring_config: Dict[str, Any]):
+        """Start health sampling and serve the metrics for Prometheus"""
+        monitor = get_health_monitor()
+        if not monitor.monitoring:
+            monitor.start_monitoring()
+        port = monitoring_config.get("metrics_port", 9464)
+        host = monitoring_config.get("metrics_host", "127.0.0.1")
+        if monitor.start_exporter(port, host):
+            logger.info(f"Serving health metrics at http://{host}:{port}/metrics")
+        else:
+            logger.warning(f"Could not start the health metrics exporter on {host}:{port}")
+    
     def _initialize_model_manager(self):
         """Initialize the model manager"""
         try:
@@ -88,39 +143,10 @@ class LyraCore:
                     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
                     from cognitive_integration import get_instance as get_cognitive_architecture
             
-        # Initialize model integration
-        try:
-            try:
-                # Try relative import first
-                from .cognitive_model_integration import get_instance as get_model_integration
-            except ImportError:
-                try:
-                    # Try absolute import from project root
-                    from modules.cognitive_model_integration import get_instance as get_model_integration
-                except ImportError:
-        # Initialize IO manager
-        try:
-            try:
-                # Try relative import first
-                from .io_manager import get_instance as get_io_manager
-            except ImportError:
-                try:
-                    # Try absolute import from project root
-                    from modules.io_manager import get_instance as get_io_manager
-                except ImportError:
-                    # Try importing from parent directory
-                    import sys
-                    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-                    from io_manager import get_instance as get_io_manager
-            
-            self.io_manager = get_io_manager(core_instance=self)
-            self.components["io_manager"] = self.io_manager
-            logger.info("IO manager initialized")
+            self.cognitive_architecture = get_cognitive_architecture()
+            self.components["cognitive_architecture"] = self.cognitive_architecture
+            logger.info("Cognitive architecture initialized")
         except ImportError:
-            logger.warning("IO manager not available")
-            self.io_manager = None
-            logger.warning("Cognitive model integration not available")
-            self.model_integration = None
             logger.warning("Cognitive architecture not available")
             self.cognitive_architecture = None
         
@@ -144,18 +170,27 @@ class LyraCore:
             logger.warning("IO manager not available")
             self.io_manager = None
     
+    @traced("lyra_core.process_message")
     def process_message(self, message, metadata=None):
         """
         Process a message and return a response
         
+        The turn runs in stages. Independent cognitive analyses run
+        concurrently, each with its own deadline. Then the prompt is built and
+        the reply is generated. Reflection, memory storage and the optional
+        enhancement rewrite run afterwards on the post-turn queue.
+        
         Args:
             message: The user's message
-            metadata: Additional metadata about the message
+            metadata: Additional metadata about the message. Set "enhance" to
+                override the enhance_responses setting for this turn, and
+                "on_update" to a callable to receive the enhanced response.
             
         Returns:
             Dictionary with the response and metadata
         """
         self.last_activity = time.time()
+        turn_start = time.monotonic()
         
         # Default metadata if none provided
         if metadata is None:
@@ -166,13 +201,7 @@ class LyraCore:
             logger.info(f"Processing message: {message[:50]}{'...' if len(message) > 50 else ''}")
             
             # Process through cognitive architecture if available
-            cognitive_results = None
-            if self.cognitive_architecture:
-                try:
-                    cognitive_results = self.cognitive_architecture.process_user_message(message)
-                    logger.debug(f"Cognitive processing results: {cognitive_results}")
-                except Exception as e:
-                    logger.error(f"Error in cognitive processing: {e}")
+            cognitive_results, timings = self._run_cognitive_stages(message)
             
             # Generate response using the model manager
             if self.model_manager:
@@ -182,49 +211,27 @@ class LyraCore:
                     
                     if active_model:
                         # Generate a response with the model
-                        prompt = self._build_prompt(message, cognitive_results)
-                        response_text = active_model.generate(prompt)
+                        with span("build_prompt"):
+                            prompt = self._build_prompt(message, cognitive_results)
+                        generation_start = time.monotonic()
+                        response_text = get_scheduler().run(
+                            model_key_for(active_model),
+                            lambda: active_model.generate(prompt),
+                            priority="interactive"
+                        )
+                        timings["generate"] = {"status": "ok", "seconds": round(time.monotonic() - generation_start, 4)}
                         
-                        # Enhance the response with cognitive awareness if available
-                        if self.model_integration:
-                            try:
-                                enhanced_response = self.model_integration.enhance_cognitive_response(
-                                    base_response=response_text,
-                                    user_message=message,
-                                    context={
-                                        "cognitive_results": cognitive_results,
-                                        "metadata": metadata
-                                    }
-                                )
-                                if enhanced_response:
-                                    response_text = enhanced_response
-                            except Exception as e:
-                                logger.error(f"Error enhancing response: {e}")
+                        turn_id = uuid.uuid4().hex[:12]
+                        enhance = bool(self.model_integration) and metadata.get("enhance", self.enhance_responses)
                         
-                        # Generate reflection if needed
-                        reflection = None
-                        if cognitive_results and cognitive_results.get("should_reflect", False) and self.cognitive_architecture:
-                            try:
-                                reflection = self.cognitive_architecture.generate_reflection(
-                                    user_message=message,
-                                    response=response_text,
-                                    processing_results=cognitive_results
-                                )
-                            except Exception as e:
-                                logger.error(f"Error generating reflection: {e}")
+                        # Everything else happens after the user has the reply
+                        queued = self.post_turn_queue.submit(
+                            lambda: self._post_turn(turn_id, message, response_text, cognitive_results,
+                                                    metadata, enhance),
+                            name=f"turn {turn_id}"
+                        )
                         
-                        # Store interaction in memory if cognitive architecture is available
-                        if self.cognitive_architecture:
-                            try:
-                                memory_id = self.cognitive_architecture.store_interaction_with_response(
-                                    user_message=message,
-                                    response=response_text,
-                                    reflection=reflection,
-                                    processing_results=cognitive_results
-                                )
-                                logger.debug(f"Stored interaction with ID: {memory_id}")
-                            except Exception as e:
-                                logger.error(f"Error storing interaction: {e}")
+                        timings["total"] = round(time.monotonic() - turn_start, 4)
                         
                         # Prepare the response
                         result = {
@@ -232,8 +239,10 @@ class LyraCore:
                             "response": response_text,
                             "source": "model",
                             "model": active_model.name if hasattr(active_model, 'name') else "unknown",
-                            "reflection": reflection,
+                            "turn_id": turn_id,
+                            "enhancement_pending": enhance and queued,
                             "insights": cognitive_results.get("insights", []) if cognitive_results else [],
+                            "timings": timings,
                             "timestamp": time.time()
                         }
                         
@@ -261,6 +270,106 @@ class LyraCore:
                 "timestamp": time.time()
             }
     
+    def _run_cognitive_stages(self, message: str):
+        """Run the pre-generation analyses concurrently; returns (cognitive_results, timings)"""
+        if not self.cognitive_architecture:
+            return None, {}
+        
+        architecture = self.cognitive_architecture
+        if not hasattr(architecture, "combine_analyses"):
+            # Architectures without separate stages are processed in one piece
+            results, timings = self.stage_runner.run(
+                {"cognitive": lambda: architecture.process_user_message(message)},
+                {"cognitive": max(self.stage_deadlines.values(), default=2.0)}
+            )
+            return results["cognitive"], timings
+        
+        results, timings = self.stage_runner.run({
+            "metacognition": lambda: architecture.analyze_metacognition(message),
+            "emotional": lambda: architecture.analyze_emotion(message),
+            "memories": lambda: architecture.recall_memories(message)
+        }, self.stage_deadlines)
+        
+        try:
+            cognitive_results = architecture.combine_analyses(
+                results["metacognition"], results["emotional"], results["memories"]
+            )
+            logger.debug(f"Cognitive processing results: {cognitive_results}")
+            return cognitive_results, timings
+        except Exception as e:
+            logger.error(f"Error in cognitive processing: {e}")
+            return None, timings
+    
+    def _post_turn(self, turn_id: str, message: str, response_text: str,
+                   cognitive_results: Optional[Dict[str, Any]], metadata: Dict[str, Any], enhance: bool):
+        """Work that does not need to delay the reply: enhancement, reflection and storage"""
+        # Enhance the response with cognitive awareness and publish it as an update
+        if enhance:
+            try:
+                enhanced_response = self.model_integration.enhance_cognitive_response(
+                    base_response=response_text,
+                    user_message=message,
+                    context={
+                        "cognitive_results": cognitive_results,
+                        "metadata": {k: v for k, v in metadata.items() if not callable(v)}
+                    },
+                    priority="background"
+                )
+                if enhanced_response and enhanced_response != response_text:
+                    response_text = enhanced_response
+                    self._publish_update(metadata, {
+                        "type": "enhanced_response",
+                        "turn_id": turn_id,
+                        "response": enhanced_response,
+                        "timestamp": time.time()
+                    })
+            except Exception as e:
+                logger.error(f"Error enhancing response: {e}")
+        
+        # Generate reflection if needed
+        reflection = None
+        if cognitive_results and cognitive_results.get("should_reflect", False) and self.cognitive_architecture:
+            try:
+                reflection = self.cognitive_architecture.generate_reflection(
+                    user_message=message,
+                    response=response_text,
+                    processing_results=cognitive_results
+                )
+            except Exception as e:
+                logger.error(f"Error generating reflection: {e}")
+        
+        # Store interaction in memory if cognitive architecture is available
+        if self.cognitive_architecture:
+            try:
+                memory_id = self.cognitive_architecture.store_interaction_with_response(
+                    user_message=message,
+                    response=response_text,
+                    reflection=reflection,
+                    processing_results=cognitive_results
+                )
+                logger.debug(f"Stored interaction with ID: {memory_id}")
+            except Exception as e:
+                logger.error(f"Error storing interaction: {e}")
+        
+        if reflection:
+            self._publish_update(metadata, {
+                "type": "reflection",
+                "turn_id": turn_id,
+                "reflection": reflection,
+                "timestamp": time.time()
+            })
+    
+    def _publish_update(self, metadata: Dict[str, Any], update: Dict[str, Any]):
+        """Deliver a post-turn update to the caller and to registered clients"""
+        callbacks = [metadata.get("on_update")]
+        callbacks += [client.get("callback") for client in list(self.connected_clients.values())]
+        for callback in callbacks:
+            if callable(callback):
+                try:
+                    callback(update)
+                except Exception as e:
+                    logger.error(f"Error delivering {update['type']} update: {e}")
+    
     def _build_prompt(self, message: str, cognitive_results: Optional[Dict[str, Any]] = None) -> str:
         """Build a prompt for the language model based on the message and cognitive results"""
         # Simple prompt with just the message
@@ -312,6 +421,8 @@ class LyraCore:
             else:
                 status["components"][name] = {"status": "active"}
         
+        status["post_turn_queue"] = self.post_turn_queue.get_status()
+        
         # Add model info if available
         if self.model_manager:
             active_model = self.model_manager.get_active_model()
@@ -385,6 +496,20 @@ class LyraCore:
             "io": {
                 "save_chat_history": True,
                 "max_chat_history": 100
+            },
+            "pipeline": {
+                "stage_deadlines": {
+                    "metacognition": 1.5,
+                    "emotional": 0.5,
+                    "memories": 1.0
+                },
+                "enhance_responses": False,
+                "post_turn_queue_size": 32
+            },
+            "monitoring": {
+                "metrics_exporter": False,
+                "metrics_port": 9464,
+                "metrics_host": "127.0.0.1"
             }
         }
     
@@ -443,6 +568,14 @@ class LyraCore:
             if "min_reflection_interval" in cognitive_config:
                 self.cognitive_architecture.min_reflection_interval = cognitive_config["min_reflection_interval"]
         
+        # Apply pipeline configuration updates
+        if "pipeline" in config_updates:
+            pipeline_config = config_updates["pipeline"]
+            if "stage_deadlines" in pipeline_config:
+                self.stage_deadlines.update(pipeline_config["stage_deadlines"])
+            if "enhance_responses" in pipeline_config:
+                self.enhance_responses = pipeline_config["enhance_responses"]
+        
         # Apply model configuration updates
         if "model" in config_updates and self.model_manager:
             model_config = config_updates["model"]
@@ -0,0 +1,323 @@
+"""
+Model catalog for Lyra
+Reads GGUF metadata headers without loading weights and keeps a persistent
+index keyed by (path, size, mtime), so refreshing the catalog only stats files
+and parses the ones that are new or changed.
+"""
+
+import os
+import json
+import struct
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Iterable
+
+logger = logging.getLogger("model_catalog")
+
+MODEL_EXTENSIONS = (".gguf", ".bin", ".ggml", ".pt", ".pth", ".safetensors")
+
+# Bumped when the parsed fields change so stale index entries are re-parsed
+CATALOG_VERSION = 1
+
+GGUF_MAGIC = b"GGUF"
+GGUF_SUPPORTED_VERSIONS = (1, 2, 3)
+
+# GGUF metadata value types
+_GGUF_SCALARS = {
+    0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i",
+    6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"
+}
+_GGUF_STRING = 8
+_GGUF_ARRAY = 9
+
+# Arrays longer than this (token lists, merges) are skipped, only their length is kept
+_MAX_ARRAY_ITEMS = 64
+
+# llama.cpp general.file_type values
+GGUF_FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S",
+    22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M",
+    28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16"
+}
+
+class GGUFReader:
+    """Minimal reader for the metadata section of a GGUF file"""
+
+    def __init__(self, f):
+        self.f = f
+        try:
+            self.size = os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            self.size = None
+
+    def _read(self, fmt: str):
+        size = struct.calcsize(fmt)
+        data = self.f.read(size)
+        if len(data) != size:
+            raise ValueError("Unexpected end of GGUF header")
+        return struct.unpack(fmt, data)[0]
+
+    def _read_string(self) -> str:
+        length = self._read("<Q")
+        data = self.f.read(length)
+        if len(data) != length:
+            raise ValueError("Unexpected end of GGUF header")
+        return data.decode("utf-8", errors="replace")
+
+    def _skip(self, size: int):
+        self.f.seek(size, os.SEEK_CUR)
+        # Seeking past the end does not fail by itself
+        if self.size is not None and self.f.tell() > self.size:
+            raise ValueError("Unexpected end of GGUF header")
+
+    def _skip_string(self):
+        self._skip(self._read("<Q"))
+
+    def _read_value(self, value_type: int):
+        if value_type in _GGUF_SCALARS:
+            return self._read(_GGUF_SCALARS[value_type])
+        if value_type == _GGUF_STRING:
+            return self._read_string()
+        if value_type == _GGUF_ARRAY:
+            item_type = self._read("<I")
+            count = self._read("<Q")
+            if count <= _MAX_ARRAY_ITEMS:
+                return [self._read_value(item_type) for _ in range(count)]
+            self._skip_array(item_type, count)
+            return {"array_length": count}
+        raise ValueError(f"Unknown GGUF value type: {value_type}")
+
+    def _skip_array(self, item_type: int, count: int):
+        if item_type in _GGUF_SCALARS:
+            self._skip(struct.calcsize(_GGUF_SCALARS[item_type]) * count)
+        elif item_type == _GGUF_STRING:
+            for _ in range(count):
+                self._skip_string()
+        else:
+            for _ in range(count):
+                self._read_value(item_type)
+
+    def read_header(self) -> Dict[str, Any]:
+        """Read the header and all metadata key/value pairs"""
+        if self.f.read(4) != GGUF_MAGIC:
+            raise ValueError("Not a GGUF file")
+        version = self._read("<I")
+        if version not in GGUF_SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported GGUF version: {version}")
+        # Version 1 used 32-bit counts
+        count_fmt = "<I" if version == 1 else "<Q"
+        tensor_count = self._read(count_fmt)
+        kv_count = self._read(count_fmt)
+
+        metadata = {}
+        for _ in range(kv_count):
+            key = self._read_string()
+            metadata[key] = self._read_value(self._read("<I"))
+
+        return {"version": version, "tensor_count": tensor_count, "metadata": metadata}
+
+def read_gguf_metadata(path: str) -> Dict[str, Any]:
+    """
+    Read the GGUF header of a model file without touching its weights
+
+    Returns:
+        Dictionary with version, tensor_count and the raw metadata
+    """
+    with open(path, "rb") as f:
+        return GGUFReader(f).read_header()
+
+def detect_chat_format(chat_template: Optional[str], architecture: Optional[str] = None) -> Optional[str]:
+    """Map an embedded chat template to one of our format names"""
+    if chat_template:
+        if "<|start_header_id|>" in chat_template:
+            return "llama3"
+        if "<|START_OF_TURN_TOKEN|>" in chat_template:
+            return "command-r"
+        if "<|im_start|>" in chat_template:
+            return "chatml"
+        if "[INST]" in chat_template:
+            return "default"
+        if "USER:" in chat_template and "ASSISTANT:" in chat_template:
+            return "vicuna"
+    if architecture == "command-r":
+        return "command-r"
+    return None
+
+def summarize_gguf(header: Dict[str, Any]) -> Dict[str, Any]:
+    """Pull the fields we care about out of a GGUF header"""
+    metadata = header["metadata"]
+    arch = metadata.get("general.architecture")
+
+    def arch_value(name):
+        return metadata.get(f"{arch}.{name}") if arch else None
+
+    block_count = arch_value("block_count")
+    embedding_length = arch_value("embedding_length")
+    head_count = arch_value("attention.head_count")
+    head_count_kv = arch_value("attention.head_count_kv") or head_count
+    chat_template = metadata.get("tokenizer.chat_template")
+    if not isinstance(chat_template, str):
+        chat_template = None
+
+    # f16 K and V for every layer; GQA models store fewer KV heads
+    kv_bytes_per_token = None
+    if block_count and embedding_length and isinstance(head_count, int) and isinstance(head_count_kv, int) and head_count:
+        kv_dim = embedding_length // head_count * head_count_kv
+        kv_bytes_per_token = 2 * block_count * kv_dim * 2
+
+    file_type = metadata.get("general.file_type")
+    return {
+        "format": "gguf",
+        "gguf_version": header["version"],
+        "tensor_count": header["tensor_count"],
+        "architecture": arch,
+        "model_name": metadata.get("general.name"),
+        "size_label": metadata.get("general.size_label"),
+        "context_length": arch_value("context_length"),
+        "block_count": block_count,
+        "embedding_length": embedding_length,
+        "head_count": head_count,
+        "head_count_kv": head_count_kv,
+        "quantization": GGUF_FILE_TYPES.get(file_type, file_type),
+        "chat_template": chat_template,
+        "chat_format": detect_chat_format(chat_template, arch),
+        "kv_bytes_per_token": kv_bytes_per_token
+    }
+
+class ModelCatalog:
+    """
+    Persistent index of model files and their header metadata
+
+    Entries are keyed by path and reused while the file's size and mtime are
+    unchanged, so a refresh walks the tree once and only parses new files.
+    """
+
+    def __init__(self, index_path: str = "data/model_catalog.json"):
+        self.index_path = index_path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.RLock()
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CATALOG_VERSION:
+                self.entries = data.get("entries", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not read model catalog index, rebuilding: {e}")
+
+    def _save_index(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CATALOG_VERSION, "entries": self.entries}, f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.error(f"Error saving model catalog index: {e}")
+
+    @staticmethod
+    def _walk(directory: str, extensions: Iterable[str]):
+        """Yield (path, stat) for model files below directory in a single pass"""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.name.lower().endswith(extensions):
+                                yield entry.path, entry.stat()
+                        except OSError:
+                            continue
+            except OSError as e:
+                logger.warning(f"Cannot scan {current}: {e}")
+
+    def _describe(self, path: str, size: int, mtime: float) -> Dict[str, Any]:
+        entry = {"path": path, "size": size, "mtime": mtime}
+        if path.lower().endswith(".gguf"):
+            try:
+                entry.update(summarize_gguf(read_gguf_metadata(path)))
+            except Exception as e:
+                logger.warning(f"Could not read GGUF header of {path}: {e}")
+                entry["error"] = str(e)
+        return entry
+
+    def _lookup(self, path: str, stat_result) -> Dict[str, Any]:
+        """Return a cached entry if still current, else parse the file"""
+        entry = self.entries.get(path)
+        if entry and entry["size"] == stat_result.st_size and entry["mtime"] == stat_result.st_mtime:
+            return entry
+        entry = self._describe(path, stat_result.st_size, stat_result.st_mtime)
+        self.entries[path] = entry
+        return entry
+
+    def scan(self, directories: Iterable[str], extensions: Iterable[str] = MODEL_EXTENSIONS) -> List[Dict[str, Any]]:
+        """
+        Refresh the catalog for the given directories
+
+        Args:
+            directories: Directories to walk recursively
+            extensions: File extensions that count as model files
+
+        Returns:
+            Catalog entries for every model file found
+        """
+        extensions = tuple(ext.lower() for ext in extensions)
+        results = []
+        with self.lock:
+            before = {path: (e["size"], e["mtime"]) for path, e in self.entries.items()}
+            scanned_roots = []
+            for directory in directories:
+                if not os.path.isdir(directory):
+                    continue
+                root = os.path.join(os.path.abspath(directory), "")
+                scanned_roots.append(root)
+                for path, stat_result in self._walk(directory, extensions):
+                    results.append(self._lookup(path, stat_result))
+
+            # Forget files that disappeared from the scanned directories
+            found = {entry["path"] for entry in results}
+            for path in list(self.entries):
+                in_scanned_root = any(os.path.abspath(path).startswith(root) for root in scanned_roots)
+                if in_scanned_root and path not in found:
+                    del self.entries[path]
+
+            after = {path: (e["size"], e["mtime"]) for path, e in self.entries.items()}
+            if after != before:
+                parsed = sum(1 for path in after if before.get(path) != after[path])
+                logger.info(f"Model catalog: {len(results)} models, {parsed} new or changed")
+                self._save_index()
+        return results
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """Catalog entry for one file, parsing it if it is not indexed yet"""
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            known = self.entries.get(path)
+            entry = self._lookup(path, stat_result)
+            if entry is not known:
+                self._save_index()
+            return entry
+
+# Singleton instance
+_catalog_instance = None
+_catalog_lock = threading.Lock()
+
+def get_instance() -> ModelCatalog:
+    """Get the shared model catalog"""
+    global _catalog_instance
+    with _catalog_lock:
+        if _catalog_instance is None:
+            _catalog_instance = ModelCatalog()
+        return _catalog_instance
@@ -64,27 +64,27 @@ class ModelLoader:
     def _scan_directory(self, directory):
         """Scan a directory for model files"""
         try:
+            from modules.model_catalog import get_instance as get_catalog
+            
             # Supported model extensions
             model_extensions = ['.bin', '.gguf', '.ggml', '.pt', '.pth', '.safetensors']
             
-            # Scan directory
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_ext = os.path.splitext(file)[1].lower()
-                    
-                    if file_ext in model_extensions:
-                        # Try to extract model info
-                        model_info = self._extract_model_info(file_path)
-                        self.models_cache[file_path] = model_info
+            # The catalog walks the tree once and only parses new or changed files
+            for entry in get_catalog().scan([directory], model_extensions):
+                model_info = self._extract_model_info(entry["path"], entry)
+                self.models_cache[entry["path"]] = model_info
                         
         except Exception as e:
             logger.error(f"Error scanning directory {directory}: {str(e)}")
     
-    def _extract_model_info(self, model_path):
-        """Extract model information from filename and metadata files"""
+    def _extract_model_info(self, model_path, catalog_entry=None):
+        """Extract model information from the GGUF header, filename and metadata files"""
         try:
-            file_size = os.path.getsize(model_path) / (1024 * 1024 * 1024)  # Convert to GB
+            catalog_entry = catalog_entry or {}
+            if "size" in catalog_entry:
+                file_size = catalog_entry["size"] / (1024 * 1024 * 1024)  # Convert to GB
+            else:
+                file_size = os.path.getsize(model_path) / (1024 * 1024 * 1024)
             
             # Skip files smaller than 1MB (likely not real models)
             if file_size < 0.001:
@@ -122,7 +122,7 @@ class ModelLoader:
             
             # Estimate model parameters based on file size
             # This is a rough estimate, different quantization methods impact this
-            param_estimate = self._estimate_parameters(file_size, model_path)
+            param_estimate = catalog_entry.get("size_label") or self._estimate_parameters(file_size, model_path)
             
             # Extract model type from name
             model_type = "Unknown"
@@ -136,6 +136,8 @@ class ModelLoader:
                 model_type = "Phi"
             elif "qwen" in model_name.lower():
                 model_type = "Qwen"
+            if catalog_entry.get("architecture"):
+                model_type = catalog_entry["architecture"]
             
             return {
                 "name": model_name,
@@ -144,8 +146,11 @@ class ModelLoader:
                 "parameters": param_estimate,
                 "type": model_type,
                 "config": model_config,
-                "valid": True,
-                "is_texting_model": self.texting_models_dir in model_path
+                "valid": "error" not in catalog_entry,
+                "is_texting_model": self.texting_models_dir in model_path,
+                "context_length": catalog_entry.get("context_length"),
+                "quantization": catalog_entry.get("quantization"),
+                "chat_format": catalog_entry.get("chat_format")
             }
         except Exception as e:
             logger.error(f"Error extracting model info for {model_path}: {str(e)}")
@@ -1,8 +1,15 @@
 import logging
 import json
 import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List
+
+from modules.inference_scheduler import get_scheduler, QueueFullError
+from modules.response_cache import get_instance as get_response_cache
 
 logger = logging.getLogger("model_manager")
 
@@ -43,10 +50,41 @@ class ModelConfig:
         )
 
 
+class _ResidentModel:
+    """Bookkeeping for a loaded model instance."""
+    
+    def __init__(self, name: str, instance, estimated_bytes: int):
+        self.name = name
+        self.instance = instance
+        self.estimated_bytes = estimated_bytes
+        self.refs = 0
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.pending_unload = False
+
+
+def _default_memory_budget() -> int:
+    """Default RAM budget for resident models: 60% of physical memory, 16 GB if unknown."""
+    try:
+        import psutil
+        return int(psutil.virtual_memory().total * 0.6)
+    except ImportError:
+        return 16 * 1024**3
+
+
 class ModelManager:
-    """Manages the loading, unloading, and configuration of language models."""
+    """
+    Manages the loading, unloading, and configuration of language models.
+    
+    Several models can stay resident at once within a RAM budget. Switching to
+    a resident model is free; loading a new one evicts the least recently used
+    models that are not in use. Models are ref-counted while generating so
+    they are never unloaded mid-generation; requests submitted to the shared
+    inference scheduler for a model count as uses too.
+    """
     
-    def __init__(self, config_dir: str = "configs", models_dir: str = "TT Models"):
+    def __init__(self, config_dir: str = "configs", models_dir: str = "TT Models",
+                 memory_budget_gb: float = None, max_resident_models: int = 4):
         self.config_dir = Path(config_dir)
         self.config_dir.mkdir(exist_ok=True)
         
@@ -78,6 +116,15 @@ class ModelManager:
         self.model_configs = {}
         self.model_instances = {}
         
+        # Residency tracking, most recently used last
+        self.memory_budget = int(memory_budget_gb * 1024**3) if memory_budget_gb else _default_memory_budget()
+        self.max_resident_models = max_resident_models
+        self.resident: "OrderedDict[str, _ResidentModel]" = OrderedDict()
+        self._residency_lock = threading.RLock()
+        self._loading: Dict[str, threading.Event] = {}
+        self._reserved: Dict[str, int] = {}  # bytes set aside for loads in progress
+        get_scheduler().add_idle_listener(self._on_scheduler_idle)
+        
         # Load existing configurations
         self._load_configs()
         
@@ -146,16 +193,215 @@ class ModelManager:
             logger.error(f"Error saving model configuration: {e}")
             return False
     
+    def register_model(self, model_config: ModelConfig, replace: bool = False):
+        """
+        Make a model known for this session without writing a config file.
+        
+        Lets callers with their own model lists (LyraBot, the web UI) load
+        models through the shared residency tracking. An existing config is
+        kept unless replace is set; a resident model keeps its config until
+        it is unloaded.
+        """
+        name = model_config.model_name
+        with self._residency_lock:
+            if name not in self.model_configs or (replace and name not in self.resident):
+                self.model_configs[name] = model_config
+        return name
+    
     def load_model(self, model_name: str):
-        """Load a model based on its configuration name."""
-        if (model_name not in self.model_configs):
+        """
+        Make a model active, loading it if it is not already resident.
+        
+        Other resident models stay loaded unless the memory budget requires
+        evicting them.
+        """
+        instance = self._ensure_resident(model_name)
+        if instance is not None:
+            with self._residency_lock:
+                self.active_model = model_name
+                self.active_model_instance = instance
+        return instance
+    
+    def preload_models(self, model_names: List[str]) -> threading.Thread:
+        """
+        Load models in a background thread without changing the active model.
+        
+        Preloading stops at the first model that would require evicting a
+        model that is currently in use or the active model.
+        """
+        def preload():
+            for name in model_names:
+                if name not in self.model_configs or name in self.resident:
+                    continue
+                needed = self.estimate_model_memory(self.model_configs[name])
+                if not self._can_fit(needed, protect=self.active_model):
+                    logger.info(f"Skipping preload of {name}: not enough memory budget")
+                    break
+                logger.info(f"Preloading model: {name}")
+                self._ensure_resident(name, protect=self.active_model)
+        
+        thread = threading.Thread(target=preload, name="model-preload", daemon=True)
+        thread.start()
+        return thread
+    
+    def estimate_model_memory(self, config: ModelConfig) -> int:
+        """
+        Estimate the RAM a model needs: weights plus KV cache for its context.
+        
+        Remote/server-backed models cost nothing locally. The KV cache estimate
+        uses kv_bytes_per_token from the config when set, then the GGUF header,
+        otherwise scales with the weights size.
+        """
+        if config.model_type != "llama" or config.parameters.get("use_server", False):
+            return 0
+        try:
+            weights = os.path.getsize(config.model_path)
+        except OSError:
+            return 0
+        
+        context_size = config.parameters.get("context_size", config.parameters.get("n_ctx", 4096))
+        kv_per_token = config.parameters.get("kv_bytes_per_token")
+        if kv_per_token is None and config.model_path.lower().endswith(".gguf"):
+            from modules.model_catalog import get_instance as get_catalog
+            entry = get_catalog().get(config.model_path) or {}
+            kv_per_token = entry.get("kv_bytes_per_token")
+        if kv_per_token is None:
+            kv_per_token = int(weights / 1024**3 * 64 * 1024)
+        
+        # Scratch buffers and allocator overhead
+        return int((weights + context_size * kv_per_token) * 1.1)
+    
+    def _resident_bytes(self) -> int:
+        return sum(entry.estimated_bytes for entry in self.resident.values()) + sum(self._reserved.values())
+    
+    @staticmethod
+    def _in_use(entry: _ResidentModel) -> bool:
+        """Referenced by a generation or with scheduler requests still outstanding."""
+        return entry.refs > 0 or get_scheduler().outstanding_requests(entry.name) > 0
+    
+    def _can_fit(self, needed: int, protect: str = None) -> bool:
+        """Whether `needed` bytes fit after evicting every idle, unprotected model."""
+        with self._residency_lock:
+            pinned = sum(
+                entry.estimated_bytes for entry in self.resident.values()
+                if self._in_use(entry) or entry.name == protect
+            )
+            return pinned + sum(self._reserved.values()) + needed <= self.memory_budget
+    
+    def _evict_for(self, needed: int, protect: str = None):
+        """Unload idle models, least recently used first, until `needed` bytes fit."""
+        with self._residency_lock:
+            for name in list(self.resident):
+                over_budget = self._resident_bytes() + needed > self.memory_budget
+                over_count = len(self.resident) + len(self._reserved) >= self.max_resident_models
+                if not (over_budget or over_count):
+                    break
+                entry = self.resident[name]
+                if self._in_use(entry) or name == protect:
+                    continue
+                self._unload_resident(name)
+            
+            if self._resident_bytes() + needed > self.memory_budget:
+                logger.warning("Model memory budget exceeded: models in use cannot be evicted")
+    
+    def _ensure_resident(self, model_name: str, protect: str = None):
+        """Return the loaded instance for a model, loading it at most once concurrently."""
+        if model_name not in self.model_configs:
             logger.error(f"No configuration found for model: {model_name}")
             return None
         
-        # Unload current model if any
-        if self.active_model_instance:
-            self.unload_model()
+        while True:
+            with self._residency_lock:
+                entry = self.resident.get(model_name)
+                if entry is not None:
+                    entry.pending_unload = False
+                    entry.last_used = time.time()
+                    self.resident.move_to_end(model_name)
+                    return entry.instance
+                
+                loading = self._loading.get(model_name)
+                if loading is None:
+                    loading = self._loading[model_name] = threading.Event()
+                    break
+            # Another thread is loading this model; wait and re-check
+            loading.wait()
+            if model_name not in self.resident:
+                return None
+        
+        try:
+            config = self.model_configs[model_name]
+            needed = self.estimate_model_memory(config)
+            # Evict and reserve in one step so concurrent loads of different
+            # models cannot both claim the same free memory
+            with self._residency_lock:
+                self._evict_for(needed, protect=protect)
+                self._reserved[model_name] = needed
+            
+            instance = self._create_model_instance(model_name)
+            if instance is not None:
+                with self._residency_lock:
+                    self.resident[model_name] = _ResidentModel(model_name, instance, needed)
+                    self.model_instances[model_name] = instance
+            return instance
+        finally:
+            with self._residency_lock:
+                self._reserved.pop(model_name, None)
+                self._loading.pop(model_name).set()
+    
+    @contextmanager
+    def use_model(self, model_name: str = None):
+        """
+        Hold a reference to a resident model for the duration of a generation.
         
+        Yields the instance (or None if it is not loaded). While referenced the
+        model is never evicted or unloaded.
+        """
+        with self._residency_lock:
+            model_name = model_name or self.active_model
+            entry = self.resident.get(model_name) if model_name else None
+            if entry is not None:
+                entry.refs += 1
+                entry.last_used = time.time()
+                self.resident.move_to_end(model_name)
+        try:
+            yield entry.instance if entry else None
+        finally:
+            if entry is not None:
+                with self._residency_lock:
+                    entry.refs -= 1
+                    if entry.pending_unload and not self._in_use(entry):
+                        self._unload_resident(model_name)
+    
+    def _on_scheduler_idle(self, model_name):
+        """Finish a deferred unload once the scheduler has no requests left for the model."""
+        with self._residency_lock:
+            entry = self.resident.get(model_name)
+            if entry is not None and entry.pending_unload and not self._in_use(entry):
+                self._unload_resident(model_name)
+    
+    def get_residency_status(self) -> Dict[str, Any]:
+        """Resident models, their estimated memory, reference counts and last generation stats."""
+        with self._residency_lock:
+            return {
+                "memory_budget_gb": self.memory_budget / 1024**3,
+                "resident_gb": self._resident_bytes() / 1024**3,
+                "active_model": self.active_model,
+                "models": [
+                    {
+                        "name": entry.name,
+                        "estimated_gb": entry.estimated_bytes / 1024**3,
+                        "refs": entry.refs,
+                        "scheduled": get_scheduler().outstanding_requests(entry.name),
+                        "idle_seconds": time.time() - entry.last_used,
+                        "generation": (entry.instance.get_generation_stats()
+                                       if hasattr(entry.instance, "get_generation_stats") else {})
+                    }
+                    for entry in reversed(self.resident.values())
+                ]
+            }
+    
+    def _create_model_instance(self, model_name: str):
+        """Instantiate the provider for a configured model."""
         try:
             config = self.model_configs[model_name]
             
@@ -210,10 +456,6 @@ class ModelManager:
                     raise
             
             logger.info(f"Successfully loaded model: {model_name}")
-            self.active_model = model_name
-            self.active_model_instance = model_instance
-            self.model_instances[model_name] = model_instance
-            
             return model_instance
             
         except Exception as e:
@@ -222,58 +464,126 @@ class ModelManager:
             logger.error(traceback.format_exc())
             return None
     
-    def unload_model(self):
-        """Unload the currently active model."""
-        if self.active_model_instance:
-            try:
-                # Call cleanup method if available
-                if hasattr(self.active_model_instance, 'cleanup'):
-                    self.active_model_instance.cleanup()
-                
-                logger.info(f"Unloaded model: {self.active_model}")
-                self.active_model = None
-                self.active_model_instance = None
+    def unload_model(self, model_name: str = None):
+        """
+        Unload a model, the active one by default.
+        
+        A model that is currently generating is unloaded as soon as its last
+        generation finishes.
+        """
+        with self._residency_lock:
+            model_name = model_name or self.active_model
+            entry = self.resident.get(model_name) if model_name else None
+            if entry is None:
                 return True
-            except Exception as e:
-                logger.error(f"Error unloading model: {e}")
-                return False
-        return True
+            if self._in_use(entry):
+                logger.info(f"Model {model_name} is in use, unloading after current generation")
+                entry.pending_unload = True
+                return True
+            return self._unload_resident(model_name)
     
-    def generate(self, prompt: str, **kwargs):
-        """Generate a response using the active model."""
-        if not self.active_model_instance:
+    def _unload_resident(self, model_name: str) -> bool:
+        """Release a resident model. Caller holds the residency lock."""
+        entry = self.resident.pop(model_name, None)
+        if entry is None:
+            return True
+        self.model_instances.pop(model_name, None)
+        if self.active_model == model_name:
+            self.active_model = None
+            self.active_model_instance = None
+        get_scheduler().remove_model(model_name)
+        try:
+            # Call cleanup method if available
+            if hasattr(entry.instance, 'cleanup'):
+                entry.instance.cleanup()
+            logger.info(f"Unloaded model: {model_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Error unloading model: {e}")
+            return False
+    
+    def generate(self, prompt: str, priority="interactive", caller=None, model_name: str = None,
+                 on_token: Callable[[str], None] = None, **kwargs):
+        """
+        Generate a response using the active model, or the resident model_name.
+        
+        Requests go through the shared inference scheduler, so concurrent callers
+        never drive the same model at once and interactive chat runs ahead of
+        API and background ("api", "background") work. Deterministic calls
+        (temperature 0 or a seed) are answered from the response cache; pass
+        cache=False to always generate.
+        
+        on_token is called with the text as it is produced. Models that cannot
+        stream, and cache hits, deliver the whole response in one call.
+        """
+        model_name = model_name or self.active_model
+        if not model_name:
             logger.error("No active model to generate response")
             return "Error: No model loaded. Please load a model first from the dropdown menu."
         
         try:
             # Log the request to help with debugging
-            logger.debug(f"Generating with model: {self.active_model}")
+            logger.debug(f"Generating with model: {model_name}")
             logger.debug(f"Generation parameters: {kwargs}")
             logger.debug(f"Prompt first 100 chars: {prompt[:100]}...")
             
+            use_cache = kwargs.pop("cache", True)
+            
             # Convert between parameter naming conventions if needed
-            adjusted_kwargs = self._adjust_generation_params(kwargs)
+            adjusted_kwargs = self._adjust_generation_params(kwargs, model_name)
+            if caller is not None:
+                # Lets pooled servers keep one caller's conversation on one worker
+                adjusted_kwargs.setdefault("session_id", caller)
             
             # Log the adjusted parameters
             logger.debug(f"Adjusted parameters for model type: {adjusted_kwargs}")
             
-            # Call generate
-            response = self.active_model_instance.generate(prompt, **adjusted_kwargs)
+            # Call generate through the scheduler, holding a reference so the
+            # model cannot be evicted while the request waits or runs
+            streamed = False
+            with self.use_model(model_name) as model_instance:
+                if model_instance is None:
+                    return "Error: No model loaded. Please load a model first from the dropdown menu."
+                generate_kwargs = dict(adjusted_kwargs)
+                if on_token is not None and getattr(model_instance, "streams_tokens", False):
+                    def emit(text):
+                        nonlocal streamed
+                        streamed = True
+                        on_token(text)
+                    generate_kwargs["on_token"] = emit
+                response = get_response_cache().cached_call(
+                    model_name,
+                    prompt,
+                    dict(adjusted_kwargs, cache=use_cache),
+                    lambda: get_scheduler().run(
+                        model_name,
+                        lambda: model_instance.generate(prompt, **generate_kwargs),
+                        priority=priority,
+                        caller=caller
+                    )
+                )
             
+            if on_token is not None and not streamed and response:
+                on_token(response)
             return response
+        except QueueFullError as e:
+            # Callers map a full queue to backpressure (e.g. HTTP 429), so let it through
+            logger.warning(str(e))
+            raise
         except Exception as e:
             logger.error(f"Error generating response: {e}", exc_info=True)
             return f"Error generating response: {str(e)}\n\nCheck the logs for more details."
     
-    def _adjust_generation_params(self, params: Dict[str, Any]) -> Dict[str, Any]:
+    def _adjust_generation_params(self, params: Dict[str, Any], model_name: str = None) -> Dict[str, Any]:
         """
         Adjust generation parameters for different model types.
         This handles parameter name differences between APIs.
         """
-        if not self.active_model or not self.active_model_instance:
+        model_name = model_name or self.active_model
+        if not model_name:
             return params
         
-        config = self.model_configs.get(self.active_model)
+        config = self.model_configs.get(model_name)
         if not config:
             return params
         
@@ -309,40 +619,17 @@ class ModelManager:
         
         logger.info(f"Scanning for models in {self.models_dir} and its subdirectories")
         
-        # Look for model files with common extensions
+        # Single walk of the tree; GGUF headers come from the persistent catalog
+        from modules.model_catalog import get_instance as get_catalog
         model_extensions = [".gguf", ".bin", ".ggml", ".pt", ".pth", ".safetensors"]
-        model_files = []
-        
-        # Recursive glob to find models in subdirectories with detailed logging
-        for ext in model_extensions:
-            try:
-                found_files = list(self.models_dir.glob(f"**/*{ext}"))
-                if found_files:
-                    logger.info(f"Found {len(found_files)} files with extension {ext}:")
-                    for f in found_files[:5]:  # Log first 5 for debugging
-                        logger.info(f"  - {f}")
-                    if len(found_files) > 5:
-                        logger.info(f"  - ... and {len(found_files) - 5} more")
-                model_files.extend(found_files)
-            except Exception as e:
-                logger.error(f"Error searching for {ext} files: {e}")
+        catalog_entries = {
+            Path(entry["path"]): entry
+            for entry in get_catalog().scan([str(self.models_dir)], model_extensions)
+        }
+        model_files = list(catalog_entries)
         
         logger.info(f"Found {len(model_files)} potential model files")
         
-        if len(model_files) == 0:
-            # Try direct file listing as fallback
-            try:
-                for root, dirs, files in os.walk(self.models_dir):
-                    for file in files:
-                        if any(file.endswith(ext) for ext in model_extensions):
-                            full_path = Path(root) / file
-                            logger.info(f"Found model via walk: {full_path}")
-                            model_files.append(full_path)
-            except Exception as e:
-                logger.error(f"Error walking directory: {e}")
-            
-            logger.info(f"Found {len(model_files)} models after directory walk")
-        
         # Create configurations for discovered models
         created_count = 0
         for model_file in model_files:
@@ -375,8 +662,17 @@ class ModelManager:
             elif "mistral" in str(model_file).lower() or "mistral" in parent_folder.lower():
                 model_format = "default"  # Mistral typically uses default format
             
+            # Prefer what the file itself declares over filename guesses
+            metadata = catalog_entries.get(model_file, {})
+            if metadata.get("chat_format"):
+                model_format = metadata["chat_format"]
+            context_size = min(metadata.get("context_length") or 4096, 4096)
+            
             # Calculate appropriate GPU layers based on model size and name
             n_gpu_layers = self._estimate_gpu_layers(model_file, model_name)
+            if metadata.get("block_count"):
+                # Offloading more layers than the model has gains nothing
+                n_gpu_layers = min(n_gpu_layers, metadata["block_count"] + 1)
             
             logger.info(f"Discovered model: {model_name} at {model_file} (format: {model_format}, gpu_layers: {n_gpu_layers})")
             
@@ -386,7 +682,7 @@ class ModelManager:
                 model_path=str(model_file),
                 model_type=model_type,
                 format=model_format,
-                context_size=4096,
+                context_size=context_size,
                 n_gpu_layers=n_gpu_layers
             )
             
@@ -476,3 +772,15 @@ class ModelManager:
                 logger.error(f"Error removing configuration for {model_name}: {e}")
         
         return len(to_remove)  # Return number of removed configurations
+
+# Shared instance
+_instance = None
+_instance_lock = threading.Lock()
+
+def get_instance() -> ModelManager:
+    """Get the shared ModelManager so all callers see the same resident models."""
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = ModelManager()
+        return _instance
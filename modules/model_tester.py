@@ -5,16 +5,36 @@ import os
 import sys
 import json
 import time
+import uuid
 import logging
+import platform
+import threading
+import itertools
 import traceback
+import statistics
+import gc
 from pathlib import Path
 
+# Try to import psutil for peak RSS sampling
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 # Set up logging
 logger = logging.getLogger("model_tester")
 
 # Constants
 TEST_RESULTS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
                                 "data", "model_test_results.json")
+BENCHMARK_HISTORY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      "data", "model_benchmark_history.jsonl")
 
 def ensure_test_results_dir():
     """Ensure the directory for test results exists"""
@@ -534,6 +554,496 @@ def check_untested_models(model_names=None):
         logger.error(f"Error checking untested models: {check_error}")
         return []
 
+# ---------------------------------------------------------------------------
+# Inference benchmarks
+# ---------------------------------------------------------------------------
+
+DEFAULT_BENCHMARK_PARAMS = {
+    "n_ctx": 4096,
+    "n_batch": 512,
+    "n_threads": None,
+    "n_gpu_layers": 0
+}
+
+# Metric name -> True if higher is better
+BENCHMARK_METRICS = {
+    "load_s": False,
+    "rss_growth_mb": False,
+    "ttft_ms": False,
+    "prompt_tps": True,
+    "gen_tps": True
+}
+
+# Changes smaller than this are treated as noise whatever their relative size
+METRIC_NOISE_FLOOR = {
+    "load_s": 0.02,
+    "rss_growth_mb": 4.0,
+    "ttft_ms": 2.0,
+    "prompt_tps": 1.0,
+    "gen_tps": 0.5
+}
+
+def _long_context_prompt(entries=40):
+    """A maintenance log with one fact buried two thirds of the way in"""
+    plants = ["ferns", "orchids", "tomatoes", "basil"]
+    lines = []
+    for i in range(entries):
+        lines.append(f"Entry {i}: the crew inspected section {i} of the north greenhouse, "
+                     f"recorded {40 + i % 30} percent humidity and watered the {plants[i % 4]}.")
+        if i == (entries * 2) // 3:
+            lines.append("Note: the spare key to the seed vault is kept under the blue watering can.")
+    return ("Read the following maintenance log.\n\n" + "\n".join(lines) +
+            "\n\nQuestion: Where is the spare key to the seed vault kept?\nAnswer:")
+
+# Fixed prompts so runs are comparable. "expect" is checked case-insensitively
+# against the completion; it only means something for a real model.
+BENCHMARK_PROMPTS = {
+    "short_chat": {
+        "prompt": "User: Hi Lyra! How has your day been so far?\nAssistant:",
+        "expect": None
+    },
+    "long_context_recall": {
+        "prompt": _long_context_prompt(),
+        "expect": "watering can"
+    },
+    "code": {
+        "prompt": ("Write a Python function `merge_intervals(intervals)` that merges overlapping "
+                   "(start, end) pairs and returns them sorted.\n\n```python\n"),
+        "expect": "def merge_intervals"
+    }
+}
+
+class PeakRSSSampler:
+    """
+    Tracks the peak resident set size of this process while active
+
+    Polls psutil on a background thread. growth_mb is the peak minus the RSS
+    on entry, so memory still held from earlier work (a previous model, the
+    allocator keeping freed pages) is not counted. Without psutil it falls
+    back to ru_maxrss, which is the peak over the process lifetime rather
+    than over the sampled window, and growth_mb is unavailable.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_bytes = 0
+        self.baseline_bytes = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._process = psutil.Process(os.getpid()) if PSUTIL_AVAILABLE else None
+
+    def _sample(self):
+        if self._process is not None:
+            try:
+                self.peak_bytes = max(self.peak_bytes, self._process.memory_info().rss)
+            except Exception:
+                pass
+        elif resource is not None:
+            # Kilobytes on Linux, bytes on macOS
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak_bytes = max(self.peak_bytes, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        if self._process is not None:
+            self.baseline_bytes = self.peak_bytes
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+    @property
+    def peak_mb(self):
+        return round(self.peak_bytes / (1024 * 1024), 1) if self.peak_bytes else None
+
+    @property
+    def growth_mb(self):
+        if self.baseline_bytes is None:
+            return None
+        return round((self.peak_bytes - self.baseline_bytes) / (1024 * 1024), 1)
+
+class StubLlama:
+    """
+    Stands in for llama_cpp.Llama so the benchmark runs without a model or GPU
+
+    Sleeps at fixed rates: the prompt is processed in n_batch sized chunks and
+    tokens are generated one at a time. A KV cache buffer proportional to
+    n_ctx is allocated so peak RSS follows the context size. Words stand in
+    for tokens.
+    """
+
+    def __init__(self, model_path=None, n_ctx=4096, n_batch=512, n_threads=None, n_gpu_layers=0,
+                 load_seconds=0.05, prompt_tps=4000.0, gen_tps=200.0, kv_bytes_per_token=1024, **kwargs):
+        time.sleep(load_seconds)
+        self.n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.prompt_tps = prompt_tps
+        self.gen_tps = gen_tps
+        self._kv_cache = bytearray(n_ctx * kv_bytes_per_token)
+        # Touch each page so the buffer is resident
+        for offset in range(0, len(self._kv_cache), 4096):
+            self._kv_cache[offset] = 1
+
+    def tokenize(self, text, add_bos=True, special=False):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="ignore")
+        return list(range(len(text.split()) + (1 if add_bos else 0)))
+
+    def reset(self):
+        pass
+
+    def _stream(self, prompt_tokens, max_tokens):
+        for start in range(0, prompt_tokens, self.n_batch):
+            time.sleep(min(self.n_batch, prompt_tokens - start) / self.prompt_tps)
+        for i in range(max_tokens):
+            if i:
+                time.sleep(1.0 / self.gen_tps)
+            yield {"choices": [{"text": f" tok{i}", "finish_reason": None if i < max_tokens - 1 else "length"}]}
+
+    def __call__(self, prompt, max_tokens=16, stream=False, **kwargs):
+        prompt_tokens = len(self.tokenize(prompt))
+        if prompt_tokens + max_tokens > self.n_ctx:
+            raise ValueError(f"Requested tokens ({prompt_tokens + max_tokens}) exceed context window of {self.n_ctx}")
+        chunks = self._stream(prompt_tokens, max_tokens)
+        if stream:
+            return chunks
+        return {"choices": [{"text": "".join(chunk["choices"][0]["text"] for chunk in chunks)}]}
+
+def load_llama(model_path, **params):
+    """Load a GGUF model with llama-cpp-python"""
+    from llama_cpp import Llama
+    return Llama(model_path=model_path, verbose=False, **params)
+
+def expand_param_grid(base=None, **choices):
+    """
+    Cartesian product of parameter choices over a base parameter set
+
+    expand_param_grid(n_ctx=[2048, 4096], n_batch=[256]) gives two parameter
+    dicts. Keys given as None or an empty list keep the base value.
+    """
+    base = dict(DEFAULT_BENCHMARK_PARAMS, **(base or {}))
+    keys = [key for key, values in choices.items() if values]
+    grid = []
+    for combination in itertools.product(*(choices[key] for key in keys)):
+        params = dict(base)
+        params.update(zip(keys, combination))
+        grid.append(params)
+    return grid
+
+def params_from_config(model_config):
+    """Default benchmark parameters for a model configuration"""
+    params = dict(DEFAULT_BENCHMARK_PARAMS)
+    context = model_config.get("n_ctx", model_config.get("context_length"))
+    if isinstance(context, int):
+        params["n_ctx"] = context
+    for key in ("n_batch", "n_threads", "n_gpu_layers"):
+        if isinstance(model_config.get(key), int):
+            params[key] = model_config[key]
+    return params
+
+def _run_prompt(llm, spec, max_tokens):
+    """Stream one completion and time it"""
+    if hasattr(llm, "reset"):
+        # Otherwise llama.cpp reuses the cached prefix from the previous run
+        llm.reset()
+    prompt_tokens = len(llm.tokenize(spec["prompt"].encode("utf-8")))
+    started = time.perf_counter()
+    first_token = None
+    completion_tokens = 0
+    text = []
+    # llama-cpp-python streams one chunk per sampled token
+    for chunk in llm(spec["prompt"], max_tokens=max_tokens, temperature=0.0, stream=True):
+        if first_token is None:
+            first_token = time.perf_counter()
+        completion_tokens += 1
+        text.append(chunk["choices"][0].get("text", ""))
+    finished = time.perf_counter()
+
+    first_token = first_token or finished
+    ttft = first_token - started
+    generation = finished - first_token
+    completion = "".join(text)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "ttft_ms": ttft * 1000,
+        "prompt_tps": prompt_tokens / ttft if ttft > 0 else 0.0,
+        "gen_tps": (completion_tokens - 1) / generation if completion_tokens > 1 and generation > 0 else 0.0,
+        "total_ms": (finished - started) * 1000,
+        "answer_ok": spec["expect"].lower() in completion.lower() if spec.get("expect") else None
+    }
+
+def _median_runs(runs):
+    summary = {}
+    for key, value in runs[0].items():
+        if isinstance(value, bool) or value is None:
+            summary[key] = all(run[key] for run in runs) if value is not None else None
+        elif key in ("ttft_ms", "prompt_tps", "gen_tps", "total_ms"):
+            summary[key] = round(statistics.median(run[key] for run in runs), 3)
+        else:
+            summary[key] = value
+    return summary
+
+def benchmark_model(model_name, model_config, param_sets=None, prompts=None, repeats=3, max_tokens=64,
+                    loader=None, verbose=True):
+    """
+    Benchmark one model under each parameter set
+
+    The model is loaded once per parameter set, warmed up with one short
+    completion, then every prompt is run `repeats` times and the median is
+    kept. Prompts that do not fit the context window are recorded as skipped.
+
+    Args:
+    - model_name: Name recorded in the results
+    - model_config: Model configuration; model_path is passed to the loader
+    - param_sets: List of loader parameter dicts, or None for the config defaults
+    - prompts: Names from BENCHMARK_PROMPTS, or None for all of them
+    - loader: Callable(model_path, **params) returning a Llama-like model;
+      defaults to llama-cpp-python
+
+    Returns:
+    - list: One result dict per parameter set
+    """
+    loader = loader or load_llama
+    param_sets = param_sets or [params_from_config(model_config)]
+    prompt_names = prompts or list(BENCHMARK_PROMPTS)
+    model_path = model_config.get("model_path")
+    results = []
+
+    for params in param_sets:
+        result = {
+            "model": model_name,
+            "params": dict(params),
+            "backend": "stub" if loader is StubLlama else "llama_cpp",
+            "load_s": None,
+            "peak_rss_mb": None,
+            "rss_growth_mb": None,
+            "prompts": {},
+            "error": None
+        }
+        if verbose:
+            print(f"Benchmarking {model_name} with {json.dumps(params, sort_keys=True)}")
+
+        llm = None
+        try:
+            # Memory growth is measured from here, after the previous set's model is gone
+            gc.collect()
+            with PeakRSSSampler() as sampler:
+                started = time.perf_counter()
+                llm = loader(model_path, **{key: value for key, value in params.items() if value is not None})
+                result["load_s"] = round(time.perf_counter() - started, 3)
+                _run_prompt(llm, BENCHMARK_PROMPTS["short_chat"], 4)
+
+                for name in prompt_names:
+                    spec = BENCHMARK_PROMPTS[name]
+                    prompt_tokens = len(llm.tokenize(spec["prompt"].encode("utf-8")))
+                    if prompt_tokens + max_tokens > params.get("n_ctx", DEFAULT_BENCHMARK_PARAMS["n_ctx"]):
+                        result["prompts"][name] = {"skipped": f"{prompt_tokens} prompt tokens do not fit n_ctx"}
+                        if verbose:
+                            print(f"  {name}: skipped, {prompt_tokens} prompt tokens do not fit n_ctx")
+                        continue
+                    summary = _median_runs([_run_prompt(llm, spec, max_tokens) for _ in range(repeats)])
+                    result["prompts"][name] = summary
+                    if verbose:
+                        print(f"  {name}: ttft {summary['ttft_ms']:.1f} ms, prompt {summary['prompt_tps']:.1f} tok/s, "
+                              f"generation {summary['gen_tps']:.1f} tok/s")
+            result["peak_rss_mb"] = sampler.peak_mb
+            result["rss_growth_mb"] = sampler.growth_mb
+            if verbose:
+                print(f"  load {result['load_s']:.2f} s, peak RSS {result['peak_rss_mb']} MB "
+                      f"(+{result['rss_growth_mb']} MB for this set)")
+        except Exception as e:
+            result["error"] = str(e)
+            logger.error(f"Benchmark of {model_name} failed: {e}")
+            if verbose:
+                print(f"  ✗ Benchmark failed: {e}")
+        finally:
+            # Release the model before loading the next parameter set
+            del llm
+            gc.collect()
+
+        results.append(result)
+    return results
+
+def run_benchmarks(models, param_grid=None, prompts=None, repeats=3, max_tokens=64, loader=None,
+                   label=None, history_file=None, verbose=True):
+    """
+    Benchmark several models and append the run to the history file
+
+    Args:
+    - models: Dict of model name -> model configuration
+    - param_grid: Dict of parameter name -> list of values, expanded over
+      each model's configured defaults; None benchmarks the defaults only
+    - label: Free-form tag stored with the run, e.g. the config change tested
+    - history_file: JSONL history path, or None for BENCHMARK_HISTORY_FILE
+
+    Returns:
+    - dict: The run as stored in the history
+    """
+    run = {
+        "run_id": uuid.uuid4().hex[:12],
+        "timestamp": time.time(),
+        "label": label,
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count()
+        },
+        "settings": {"repeats": repeats, "max_tokens": max_tokens},
+        "results": []
+    }
+    for model_name, model_config in models.items():
+        param_sets = expand_param_grid(params_from_config(model_config), **(param_grid or {}))
+        run["results"].extend(benchmark_model(model_name, model_config, param_sets, prompts, repeats,
+                                              max_tokens, loader, verbose))
+    append_benchmark_history(run, history_file)
+    return run
+
+def append_benchmark_history(run, history_file=None):
+    """Append a benchmark run to the JSONL history file"""
+    history_file = history_file or BENCHMARK_HISTORY_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(history_file)), exist_ok=True)
+    with open(history_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+
+def load_benchmark_history(history_file=None):
+    """Load all benchmark runs, oldest first, skipping unreadable lines"""
+    history_file = history_file or BENCHMARK_HISTORY_FILE
+    if not os.path.exists(history_file):
+        return []
+    runs = []
+    with open(history_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                runs.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping unreadable benchmark history line: {e}")
+    return runs
+
+def select_benchmark_run(history, ref):
+    """
+    Find a run by run id, label or index (negative counts from the latest)
+
+    The latest run with a matching label wins.
+    """
+    try:
+        return history[int(ref)]
+    except (ValueError, IndexError):
+        pass
+    for run in reversed(history):
+        if run.get("run_id") == ref or run.get("label") == ref:
+            return run
+    raise KeyError(f"No benchmark run matching {ref!r}")
+
+def _flatten_run(run):
+    """(model, params, metric path) -> value for every metric in a run"""
+    values = {}
+    for result in run.get("results", []):
+        if result.get("error"):
+            continue
+        key = (result["model"], json.dumps(result["params"], sort_keys=True))
+        for metric in ("load_s", "rss_growth_mb"):
+            values[key + (metric,)] = result.get(metric)
+        for prompt, summary in result.get("prompts", {}).items():
+            for metric in ("ttft_ms", "prompt_tps", "gen_tps"):
+                if metric in summary:
+                    values[key + (f"{prompt}.{metric}",)] = summary[metric]
+    return values
+
+def compare_benchmark_runs(baseline, current, threshold=0.10):
+    """
+    Compare two benchmark runs metric by metric
+
+    A metric regresses when it moves in the wrong direction by more than
+    `threshold` (a fraction of the baseline) and by more than its noise
+    floor. Only model and parameter combinations present in both runs are
+    compared; the rest are listed under "missing".
+
+    Returns:
+    - dict: rows, regressions and improvements, each row with model, params,
+      metric, baseline, current and change
+    """
+    before = _flatten_run(baseline)
+    after = _flatten_run(current)
+    rows, regressions, improvements = [], [], []
+
+    for key in sorted(set(before) & set(after)):
+        model, params, metric = key
+        old, new = before[key], after[key]
+        if old is None or new is None:
+            continue
+        base_metric = metric.rsplit(".", 1)[-1]
+        row = {
+            "model": model,
+            "params": json.loads(params),
+            "metric": metric,
+            "baseline": old,
+            "current": new,
+            "change": (new - old) / old if old else None
+        }
+        rows.append(row)
+        if row["change"] is None or abs(new - old) <= METRIC_NOISE_FLOOR.get(base_metric, 0.0):
+            continue
+        worse = -row["change"] if BENCHMARK_METRICS[base_metric] else row["change"]
+        if worse > threshold:
+            regressions.append(row)
+        elif worse < -threshold:
+            improvements.append(row)
+
+    missing = sorted({key[:2] for key in set(before) ^ set(after)})
+    return {
+        "baseline": baseline.get("run_id"),
+        "current": current.get("run_id"),
+        "threshold": threshold,
+        "rows": rows,
+        "regressions": regressions,
+        "improvements": improvements,
+        "missing": [{"model": model, "params": json.loads(params)} for model, params in missing]
+    }
+
+def format_comparison(comparison):
+    """Render a comparison as a plain text table"""
+    flagged = {id(row): "REGRESSION" for row in comparison["regressions"]}
+    flagged.update({id(row): "improved" for row in comparison["improvements"]})
+    lines = [f"Baseline {comparison['baseline']} -> current {comparison['current']} "
+             f"(threshold {comparison['threshold']:.0%})"]
+    last_group = None
+    for row in comparison["rows"]:
+        group = (row["model"], json.dumps(row["params"], sort_keys=True))
+        if group != last_group:
+            lines.append(f"{row['model']} {group[1]}")
+            last_group = group
+        change = f"{row['change']:+.1%}" if row["change"] is not None else "n/a"
+        lines.append(f"  {row['metric']:<32} {row['baseline']:>12.2f} {row['current']:>12.2f} "
+                     f"{change:>8}  {flagged.get(id(row), '')}".rstrip())
+    for entry in comparison["missing"]:
+        lines.append(f"Not in both runs: {entry['model']} {json.dumps(entry['params'], sort_keys=True)}")
+    lines.append(f"{len(comparison['regressions'])} regressions, {len(comparison['improvements'])} improvements")
+    return "\n".join(lines)
+
+def _benchmark_models(args):
+    """Model configurations to benchmark from the command line arguments"""
+    if args.model_path:
+        name = os.path.splitext(os.path.basename(args.model_path))[0]
+        return {name: {"model_path": args.model_path}}
+    models = load_models_manually(verbose=not args.quiet)
+    if args.models:
+        models = {name: models[name] for name in args.models if name in models}
+    if not models and args.stub:
+        models = {"stub": {}}
+    return models
+
 def main():
     """Command line interface for model testing"""
     import argparse
@@ -543,14 +1053,66 @@ def main():
     parser.add_argument("--force", action="store_true", help="Force retest of all models")
     parser.add_argument("--quiet", action="store_true", help="Minimal output")
     
+    benchmark = parser.add_argument_group("benchmarking")
+    benchmark.add_argument("--benchmark", action="store_true",
+                           help="Measure load time, time to first token, tokens/s and peak RSS")
+    benchmark.add_argument("--model-path", help="Benchmark this model file instead of configured models")
+    benchmark.add_argument("--stub", action="store_true", help="Use the stub backend (no model or GPU needed)")
+    benchmark.add_argument("--n-ctx", type=int, nargs="+", help="Context sizes to try")
+    benchmark.add_argument("--n-batch", type=int, nargs="+", help="Batch sizes to try")
+    benchmark.add_argument("--threads", type=int, nargs="+", help="Thread counts to try")
+    benchmark.add_argument("--gpu-layers", type=int, nargs="+", help="GPU layer counts to try")
+    benchmark.add_argument("--prompts", nargs="+", choices=list(BENCHMARK_PROMPTS), help="Prompts to run")
+    benchmark.add_argument("--repeats", type=int, default=3, help="Runs per prompt (the median is kept)")
+    benchmark.add_argument("--max-tokens", type=int, default=64, help="Tokens generated per prompt")
+    benchmark.add_argument("--label", help="Tag stored with the run")
+    benchmark.add_argument("--history", help=f"History file (default {BENCHMARK_HISTORY_FILE})")
+    benchmark.add_argument("--compare", nargs="*", metavar="RUN",
+                           help="Compare two runs by id, label or index (default: the last two); "
+                                "exits 1 on regressions")
+    benchmark.add_argument("--threshold", type=float, default=0.10,
+                           help="Relative change that counts as a regression (default 0.10)")
+    
     args = parser.parse_args()
     
     # Configure logging for command line use
     logging_level = logging.WARNING if args.quiet else logging.INFO
     logging.basicConfig(level=logging_level)
     
-    # Run tests
-    test_models(args.models, args.force, not args.quiet)
+    if not args.benchmark and args.compare is None:
+        # Run tests
+        test_models(args.models, args.force, not args.quiet)
+        return
+    
+    if args.benchmark:
+        models = _benchmark_models(args)
+        if not models:
+            print("ERROR: No models to benchmark. Use --model-path or --stub.")
+            sys.exit(2)
+        param_grid = {
+            "n_ctx": args.n_ctx,
+            "n_batch": args.n_batch,
+            "n_threads": args.threads,
+            "n_gpu_layers": args.gpu_layers
+        }
+        run = run_benchmarks(models, param_grid, args.prompts, args.repeats, args.max_tokens,
+                             StubLlama if args.stub else None, args.label, args.history, not args.quiet)
+        print(f"Saved benchmark run {run['run_id']}")
+    
+    if args.compare is not None:
+        history = load_benchmark_history(args.history)
+        refs = args.compare or ["-2", "-1"]
+        if len(refs) == 1:
+            refs.append("-1")
+        try:
+            baseline, current = (select_benchmark_run(history, ref) for ref in refs[:2])
+        except KeyError as e:
+            print(f"ERROR: {e.args[0]}")
+            sys.exit(2)
+        comparison = compare_benchmark_runs(baseline, current, args.threshold)
+        print(format_comparison(comparison))
+        if comparison["regressions"]:
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
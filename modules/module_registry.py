@@ -1,259 +1,395 @@
 """
 Module Registry for Lyra
 Manages module initialization order and dependencies
+
+Modules are registered by import path, so registering does not import
+anything. load_all_modules() initializes independent modules in parallel once
+their dependencies are ready, and leaves modules marked lazy behind a
+LazyModule proxy that loads them on first attribute access.
 """
 
 import os
 import sys
 import time
 import logging
+import argparse
 import importlib
-from typing import Dict, List, Any, Optional, Callable
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Callable, Union
 
 # Set up logging
 logger = logging.getLogger("module_registry")
 
+class LazyModule:
+    """
+    Stand-in for a deferred module
+
+    The first attribute access loads the real module (and its dependencies)
+    through the registry, then delegates to it.
+    """
+
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry: "ModuleRegistry", name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def _materialize(self):
+        registry = object.__getattribute__(self, "_registry")
+        name = object.__getattribute__(self, "_name")
+        instance = registry.modules.get(name)
+        if instance is None:
+            registry.load_module(name)
+            instance = registry.modules.get(name)
+            if instance is None:
+                raise ImportError(f"Module {name} could not be loaded ({registry.get_status(name)})")
+        return instance
+
+    def __getattr__(self, attr):
+        return getattr(self._materialize(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._materialize(), attr, value)
+
+    def __repr__(self):
+        name = object.__getattribute__(self, "_name")
+        registry = object.__getattribute__(self, "_registry")
+        return f"<LazyModule {name} ({registry.get_status(name)})>"
+
 class ModuleRegistry:
     """
     Manages Lyra's module initialization and dependencies
     Provides a central registry for all modules and their status
     """
-    
+
     def __init__(self):
         self.modules = {}  # name -> module instance
         self.module_status = {}  # name -> initialization status
         self.dependencies = {}  # name -> list of dependency names
         self.initialization_order = []  # ordered list for initialization
-        self.module_getters = {}  # name -> getter function
-    
-    def register_module(self, name: str, getter_func: Callable, 
-                       dependencies: List[str] = None, autoload: bool = True):
+        self.module_getters = {}  # name -> getter function or "package.module:attribute"
+        self.lazy = {}  # name -> defer until first use
+        self.proxies = {}  # name -> LazyModule for deferred modules
+        self.timings = {}  # name -> import/init timings
+        self.startup_seconds = None
+
+        self.lock = threading.RLock()
+        self._loading = {}  # name -> Event set when the load finishes
+        self._local = threading.local()
+
+    def register_module(self, name: str, getter_func: Union[Callable, str],
+                       dependencies: List[str] = None, autoload: bool = True,
+                       lazy: bool = False):
         """
         Register a module with the registry
-        
+
         Args:
             name: Module name
-            getter_func: Function to get module instance (typically get_instance)
+            getter_func: Function to get module instance (typically get_instance),
+                or an import path like "modules.deep_memory:get_instance" so the
+                module is only imported when it is loaded
             dependencies: List of modules this module depends on
             autoload: Whether to automatically load this module
+            lazy: Defer loading until the module is first used
         """
-        self.module_getters[name] = getter_func
-        self.module_status[name] = "registered"
-        self.dependencies[name] = dependencies or []
-        
-        # Calculate initialization order if not a circular dependency
-        self._update_initialization_order()
-        
+        with self.lock:
+            self.module_getters[name] = getter_func
+            self.module_status[name] = "registered"
+            self.dependencies[name] = dependencies or []
+            self.lazy[name] = lazy
+
+            # Calculate initialization order if not a circular dependency
+            self._update_initialization_order()
+
         # Autoload if requested
-        if autoload:
+        if autoload and not lazy:
             self.load_module(name)
-    
+
     def _update_initialization_order(self):
         """Calculate module initialization order based on dependencies"""
         # Start with modules with no dependencies
         order = []
         visited = set()
         temp_mark = set()
-        
+
         def visit(module_name):
             """DFS traversal for topological sort"""
             if module_name in temp_mark:
                 # Circular dependency, break it
                 logger.warning(f"Circular dependency detected for {module_name}")
                 return
-                
+
             if module_name not in visited and module_name in self.dependencies:
                 temp_mark.add(module_name)
-                
+
                 # Visit all dependencies first
                 for dep in self.dependencies[module_name]:
                     if dep in self.module_getters:
                         visit(dep)
-                
+
                 visited.add(module_name)
                 temp_mark.remove(module_name)
                 order.append(module_name)
-        
+
         # Visit all modules
         for module_name in self.module_getters.keys():
             if module_name not in visited:
                 visit(module_name)
-        
+
         self.initialization_order = order
-    
+
     def load_module(self, name: str) -> bool:
         """
         Load a specific module
-        
+
+        Safe to call from several threads: a module being loaded by another
+        thread is waited for rather than loaded twice.
+
         Args:
             name: Module name to load
-            
+
         Returns:
             True if successful, False otherwise
         """
         if name not in self.module_getters:
             logger.error(f"Module {name} not registered")
             return False
-            
-        if name in self.modules:
-            logger.debug(f"Module {name} already loaded")
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        if name in stack:
+            logger.warning(f"Circular dependency detected for {name}")
             return True
-            
-        # Check dependencies
-        for dep in self.dependencies.get(name, []):
-            if dep not in self.modules:
-                # Try to load dependency
-                success = self.load_module(dep)
-                if not success:
-                    logger.error(f"Failed to load dependency {dep} for module {name}")
-                    self.module_status[name] = "dependency_failed"
-                    return False
-        
-        # Load the module
+
+        with self.lock:
+            if name in self.modules:
+                logger.debug(f"Module {name} already loaded")
+                return True
+            event = self._loading.get(name)
+            owner = event is None
+            if owner:
+                event = self._loading[name] = threading.Event()
+
+        if not owner:
+            event.wait()
+            return name in self.modules
+
+        stack.append(name)
+        try:
+            # Check dependencies
+            for dep in self.dependencies.get(name, []):
+                if dep not in self.modules:
+                    # Try to load dependency
+                    success = self.load_module(dep)
+                    if not success:
+                        logger.error(f"Failed to load dependency {dep} for module {name}")
+                        self.module_status[name] = "dependency_failed"
+                        return False
+
+            # Load the module
+            return self._instantiate(name)
+        finally:
+            stack.pop()
+            with self.lock:
+                self._loading.pop(name, None)
+            event.set()
+
+    def _instantiate(self, name: str) -> bool:
+        """Import (if registered by path) and initialize a module, recording timings"""
+        getter = self.module_getters[name]
+        timing = {"import": 0.0, "init": 0.0, "thread": threading.current_thread().name}
+        self.timings[name] = timing
+
         try:
             self.module_status[name] = "loading"
-            module_instance = self.module_getters[name]()
-            self.modules[name] = module_instance
-            self.module_status[name] = "loaded"
-            logger.info(f"Loaded module: {name}")
+            if isinstance(getter, str):
+                module_path, _, attribute = getter.partition(":")
+                started = time.perf_counter()
+                getter = getattr(importlib.import_module(module_path), attribute or "get_instance")
+                timing["import"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            module_instance = getter()
+            timing["init"] = time.perf_counter() - started
+
+            with self.lock:
+                self.modules[name] = module_instance
+                self.module_status[name] = "loaded"
+            logger.info(f"Loaded module: {name} ({(timing['import'] + timing['init']) * 1000:.0f} ms)")
             return True
         except Exception as e:
             logger.error(f"Error loading module {name}: {e}")
             self.module_status[name] = "failed"
             return False
-    
-    def load_all_modules(self) -> Dict[str, bool]:
+
+    def load_all_modules(self, parallel: bool = True, max_workers: int = 4) -> Dict[str, bool]:
         """
         Load all registered modules in dependency order
-        
+
+        Lazy modules are not loaded; they are given a LazyModule proxy
+        instead. With parallel set, modules whose dependencies are ready
+        load concurrently.
+
         Returns:
             Dictionary of module names to success status
         """
+        started = time.perf_counter()
         results = {}
-        
-        # Load modules in initialization order
+        eager = []
+
         for name in self.initialization_order:
-            results[name] = self.load_module(name)
-            
+            if self.lazy.get(name) and name not in self.modules:
+                self.proxies.setdefault(name, LazyModule(self, name))
+                if self.module_status.get(name) == "registered":
+                    self.module_status[name] = "deferred"
+                results[name] = True
+            else:
+                eager.append(name)
+
+        if parallel and len(eager) > 1:
+            # Submitted in dependency order; a module whose dependency is still
+            # loading on another thread waits for it in load_module
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="module-init") as executor:
+                futures = {name: executor.submit(self.load_module, name) for name in eager}
+                for name, future in futures.items():
+                    results[name] = future.result()
+        else:
+            # Load modules in initialization order
+            for name in eager:
+                results[name] = self.load_module(name)
+
+        self.startup_seconds = time.perf_counter() - started
         return results
-    
+
+    def warm_deferred(self) -> threading.Thread:
+        """Load every deferred module on a background thread"""
+        def warm():
+            for name in self.initialization_order:
+                if self.lazy.get(name):
+                    self.load_module(name)
+
+        thread = threading.Thread(target=warm, name="module-warmup", daemon=True)
+        thread.start()
+        return thread
+
     def get_module(self, name: str) -> Any:
         """
         Get a module instance by name
-        
+
         Args:
             name: Module name
-            
+
         Returns:
-            Module instance or None if not loaded
+            Module instance, a LazyModule proxy if the module is deferred,
+            or None if not loaded
         """
-        return self.modules.get(name)
-    
+        if name in self.modules:
+            return self.modules[name]
+        return self.proxies.get(name)
+
     def get_all_modules(self) -> Dict[str, Any]:
         """Get all loaded modules"""
         return self.modules.copy()
-    
+
     def get_status(self, name: str) -> str:
         """
         Get module status by name
-        
+
         Args:
             name: Module name
-            
+
         Returns:
             Status string
         """
         return self.module_status.get(name, "unknown")
-    
+
     def get_all_status(self) -> Dict[str, str]:
         """Get status of all modules"""
         return self.module_status.copy()
 
+    def get_timings(self) -> Dict[str, Dict[str, Any]]:
+        """Import and init seconds for every module loaded so far"""
+        return {name: dict(timing) for name, timing in self.timings.items()}
+
+    def get_startup_report(self) -> str:
+        """Per-module startup timings as a table, slowest first"""
+        lines = [f"{'module':<24} {'status':<18} {'import ms':>10} {'init ms':>10}  thread"]
+        rows = sorted(
+            self.module_status.items(),
+            key=lambda item: -sum(v for k, v in self.timings.get(item[0], {}).items() if k != "thread")
+        )
+        for name, status in rows:
+            timing = self.timings.get(name)
+            if timing:
+                lines.append(f"{name:<24} {status:<18} {timing['import'] * 1000:>10.1f} "
+                             f"{timing['init'] * 1000:>10.1f}  {timing['thread']}")
+            else:
+                lines.append(f"{name:<24} {status:<18} {'-':>10} {'-':>10}")
+        if self.startup_seconds is not None:
+            lines.append(f"Startup took {self.startup_seconds * 1000:.1f} ms")
+        return "\n".join(lines)
+
+# Core modules: (name, import path, dependencies, lazy).
+# Only the modules a chat turn needs load at startup; the rest are deferred.
+CORE_MODULES = [
+    ("fallback_llm", "modules.fallback_llm:get_instance", [], False),
+    ("emotional_core", "modules.emotional_core:get_instance", [], False),
+    ("metacognition", "modules.metacognition:get_instance", ["emotional_core"], False),
+    ("boredom", "modules.boredom:get_instance", [], False),
+    ("extended_thinking", "modules.extended_thinking:get_instance", ["fallback_llm"], True),
+    ("boredom_integration", "modules.boredom_integration:get_instance", ["boredom", "extended_thinking"], True),
+    ("deep_memory", "modules.deep_memory:get_instance", [], True),
+    ("code_auditor", "modules.code_auditing:get_instance", [], True),
+    ("thinking_integration", "modules.thinking_integration:get_instance",
+     ["extended_thinking", "emotional_core", "metacognition"], True),
+    ("cognitive_integration", "modules.cognitive_integration:get_instance",
+     ["emotional_core", "deep_memory", "metacognition", "thinking_integration"], True),
+    ("voice_interface", "voice_interface:get_instance", [], True),
+]
+
 # Singleton instance
 _registry_instance = None
+_registry_lock = threading.Lock()
 
 def get_registry() -> ModuleRegistry:
     """Get the singleton registry instance"""
     global _registry_instance
-    if _registry_instance is None:
-        _registry_instance = ModuleRegistry()
-        
-        # Register core modules
-        try:
-            from modules.fallback_llm import get_instance as get_fallback_llm
-            _registry_instance.register_module("fallback_llm", get_fallback_llm, [])
-        except ImportError:
-            logger.warning("Fallback LLM not available for registration")
-        
-        try:
-            from modules.extended_thinking import get_instance as get_extended_thinking
-            _registry_instance.register_module("extended_thinking", get_extended_thinking, ["fallback_llm"])
-        except ImportError:
-            logger.warning("Extended thinking not available for registration")
-        
-        try:
-            from modules.boredom import get_instance as get_boredom
-            _registry_instance.register_module("boredom", get_boredom, [])
-        except ImportError:
-            logger.warning("Boredom system not available for registration")
-        
-        try:
-            from modules.boredom_integration import get_instance as get_boredom_integration
-            _registry_instance.register_module("boredom_integration", get_boredom_integration, 
-                                              ["boredom", "extended_thinking"])
-        except ImportError:
-            logger.warning("Boredom integration not available for registration")
-        
-        try:
-            from modules.emotional_core import get_instance as get_emotional_core
-            _registry_instance.register_module("emotional_core", get_emotional_core, [])
-        except ImportError:
-            logger.warning("Emotional core not available for registration")
-        
-        try:
-            from modules.metacognition import get_instance as get_metacognition
-            _registry_instance.register_module("metacognition", get_metacognition, 
-                                              ["emotional_core"])
-        except ImportError:
-            logger.warning("Metacognition not available for registration")
-        
-        try:
-            from modules.deep_memory import get_instance as get_deep_memory
-            _registry_instance.register_module("deep_memory", get_deep_memory, [])
-        except ImportError:
-            logger.warning("Deep memory not available for registration")
-        
-        try:
-            from modules.code_auditing import get_instance as get_code_auditor
-            _registry_instance.register_module("code_auditor", get_code_auditor, [])
-        except ImportError:
-            logger.warning("Code auditor not available for registration")
-        
-        try:
-            from modules.thinking_integration import get_instance as get_thinking_integration
-            _registry_instance.register_module("thinking_integration", get_thinking_integration, 
-                                              ["extended_thinking", "emotional_core", "metacognition"])
-        except ImportError:
-            logger.warning("Thinking integration not available for registration")
-        
-        try:
-            from modules.cognitive_integration import get_instance as get_cognitive_integration
-            _registry_instance.register_module("cognitive_integration", get_cognitive_integration,
-                                              ["emotional_core", "deep_memory", "metacognition", 
-                                               "thinking_integration"])
-        except ImportError:
-            logger.warning("Cognitive integration not available for registration")
-        
-        try:
-            from voice_interface import get_instance as get_voice_interface
-            _registry_instance.register_module("voice_interface", get_voice_interface, [])
-        except ImportError:
-            logger.warning("Voice interface not available for registration")
-            
+    with _registry_lock:
+        if _registry_instance is None:
+            _registry_instance = ModuleRegistry()
+
+            # Register core modules without importing them
+            for name, path, dependencies, lazy in CORE_MODULES:
+                _registry_instance.register_module(name, path, dependencies, autoload=False, lazy=lazy)
+
     return _registry_instance
 
-def initialize_all_modules() -> Dict[str, str]:
+def initialize_all_modules(parallel: bool = True) -> Dict[str, str]:
     """Initialize all modules and return their status"""
     registry = get_registry()
-    registry.load_all_modules()
+    registry.load_all_modules(parallel=parallel)
+    logger.info("Module startup timings:\n" + registry.get_startup_report())
     return registry.get_all_status()
+
+def main():
+    parser = argparse.ArgumentParser(description="Lyra module registry")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Initialize modules and print per-module import/init timings")
+    parser.add_argument("--sequential", action="store_true", help="Initialize modules one at a time")
+    parser.add_argument("--all", action="store_true", help="Also load deferred modules")
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        registry = get_registry()
+        registry.load_all_modules(parallel=not args.sequential)
+        if args.all:
+            registry.warm_deferred().join()
+        print(registry.get_startup_report())
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
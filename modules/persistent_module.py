@@ -387,112 +387,56 @@ class PersistentModule:
         self.command_queue.put(("exit", {}))
     
     def _start_socket_server(self) -> bool:
-        """Start the socket server for communication with the UI"""
+        """Start the IPC server for communication with the UI, tray and tools"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.bind(("localhost", self.port))
-            self.socket.listen(5)
-            self.socket.settimeout(1.0)  # 1 second timeout for accept()
-            
+            from modules.ipc import IPCServer
+        except ImportError:
+            sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            from modules.ipc import IPCServer
+        
+        self.socket = IPCServer(
+            {
+                "status": lambda params, emit: self._get_status_info(),
+                "process_message": self._handle_process_message,
+                "update_config": self._handle_update_config,
+                "ui_started": lambda params, emit: self._set_ui_running(True),
+                "ui_stopping": lambda params, emit: self._set_ui_running(False),
+                "get_config": lambda params, emit: self.config,
+                "open_ui": lambda params, emit: self.command_queue.put(("open_ui", {}))
+            },
+            host="localhost",
+            port=self.port,
+            unix_path=self.config.get("ipc_unix_socket"),
+            max_workers=self.config.get("ipc_workers", 8)
+        )
+        if self.socket.start():
             logger.info(f"Socket server started on port {self.port}")
             return True
-        except Exception as e:
-            logger.error(f"Error starting socket server: {e}")
-            return False
-    
-    def _socket_listener(self):
-        """Thread function for listening to socket connections"""
-        logger.info("Socket listener thread started")
         
-        # Prevent CPU spinning on repeated errors
-        consecutive_errors = 0
-        
-        while not self.exit_event.is_set():
-            try:
-                # Accept a connection with timeout
-                try:
-                    client, addr = self.socket.accept()
-                    logger.info(f"Connection from {addr}")
-                    
-                    # Set a timeout for receiving data
-                    client.settimeout(5.0)
-                    
-                    # Handle the connection
-                    self._handle_client_connection(client)
-                    
-                    # Reset error counter on successful connection
-                    consecutive_errors = 0
-                    
-                except socket.timeout:
-                    # Just a timeout, continue the loop
-                    continue
-                    
-            except Exception as e:
-                consecutive_errors += 1
-                logger.error(f"Error in socket listener: {e}")
-                
-                # Add delay if we're getting repeated errors
-                if consecutive_errors > 3:
-                    time.sleep(1.0)
-                    continue
+        logger.error("Error starting socket server")
+        self.socket = None
+        return False
     
-    def _handle_client_connection(self, client):
-        """Handle a client connection"""
-        try:
-            data = client.recv(1024).decode('utf-8')
-            command = json.loads(data)
-            action = command.get("action")
-            params = command.get("params", {})
-            
-            if not action:
-                client.send(json.dumps({"success": False, "error": "No action specified"}).encode('utf-8'))
-                return
-            
-            # Handle different actions
-            if action == "status":
-                response = self._get_status_info()
-                client.send(json.dumps({"success": True, "data": response}).encode('utf-8'))
-            
-            elif action == "process_message":
-                if self.status["core_connected"] and self.core:
-                    message = params.get("message", "")
-                    core_response = self.core.process_message(message)
-                    client.send(json.dumps({"success": True, "data": core_response}).encode('utf-8'))
-                else:
-                    client.send(json.dumps({"success": False, "error": "Core not connected"}).encode('utf-8'))
-            
-            elif action == "update_config":
-                new_config = params.get("config", {})
-                if new_config:
-                    self.config.update(new_config)
-                    self._save_config()
-                    client.send(json.dumps({"success": True}).encode('utf-8'))
-                else:
-                    client.send(json.dumps({"success": False, "error": "No config provided"}).encode('utf-8'))
-            
-            elif action == "ui_started":
-                self.status["ui_running"] = True
-                client.send(json.dumps({"success": True}).encode('utf-8'))
-            
-            elif action == "ui_stopping":
-                self.status["ui_running"] = False
-                client.send(json.dumps({"success": True}).encode('utf-8'))
-            
-            elif action == "get_config":
-                client.send(json.dumps({"success": True, "data": self.config}).encode('utf-8'))
-            
-            else:
-                client.send(json.dumps({"success": False, "error": f"Unknown action: {action}"}).encode('utf-8'))
-        
-        except Exception as e:
-            logger.error(f"Error handling client connection: {e}")
-            try:
-                client.send(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
-            except:
-                pass
-        finally:
-            client.close()
+    def _set_ui_running(self, running: bool):
+        self.status["ui_running"] = running
+        return None
+    
+    def _handle_process_message(self, params: Dict[str, Any], emit: Callable[[Any], None]):
+        """Process a message through the core, streaming progress as partial responses"""
+        if not (self.status["core_connected"] and self.core):
+            raise RuntimeError("Core not connected")
+        
+        self.status["last_activity"] = time.time()
+        emit({"status": "processing"})
+        return self.core.process_message(params.get("message", ""))
+    
+    def _handle_update_config(self, params: Dict[str, Any], emit: Callable[[Any], None]):
+        new_config = params.get("config", {})
+        if not new_config:
+            raise ValueError("No config provided")
+        self.config.update(new_config)
+        self._save_config()
+        return None
     
     def _get_status_info(self) -> Dict[str, Any]:
         """Get detailed status information"""
@@ -800,10 +744,6 @@ class PersistentModule:
             logger.error("Failed to start socket server")
             return False
         
-        # Start the socket listener thread
-        socket_thread = threading.Thread(target=self._socket_listener, daemon=True)
-        socket_thread.start()
-        
         # Start the command handler thread
         command_thread = threading.Thread(target=self._command_handler, daemon=True)
         command_thread.start()
@@ -832,13 +772,12 @@ class PersistentModule:
         
         # Wait for threads to finish
         logger.info("Waiting for threads to finish...")
-        socket_thread.join(timeout=5)
         command_thread.join(timeout=5)
         
         # Close the socket
         if self.socket:
             try:
-                self.socket.close()
+                self.socket.stop()
                 logger.info("Socket closed")
             except Exception as e:
                 logger.error(f"Error closing socket: {e}")
@@ -874,10 +813,9 @@ def main():
         # Try to focus the existing instance
         try:
             # Send a message to the existing instance to focus the UI
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect(('localhost', 37849))
-            s.sendall(json.dumps({"action": "open_ui"}).encode('utf-8'))
-            s.close()
+            from modules.ipc import IPCClient
+            with IPCClient(port=37849, timeout=5.0) as client:
+                client.call("open_ui")
             print("Focused the existing instance.")
         except:
             print("Could not communicate with the existing instance.")
@@ -0,0 +1,413 @@
+"""
+Response cache for Lyra
+Caches LLM responses for deterministic calls (temperature 0 or a fixed seed),
+keyed on the model, the normalised prompt and the sampling parameters. An
+optional embedding tier also serves near-duplicate prompts.
+
+The cache lives outside the source tree, in ~/.cache/lyra by default;
+LYRA_RESPONSE_CACHE overrides the file and LYRA_SEMANTIC_CACHE=1 enables the
+embedding tier for the shared instance.
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable
+
+logger = logging.getLogger("response_cache")
+
+# Call options that do not influence the generated text
+NON_SAMPLING_PARAMS = {"cache", "priority", "caller", "session_id", "timeout", "stream"}
+
+DEFAULT_DB_PATH = os.environ.get(
+    "LYRA_RESPONSE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "lyra", "response_cache.db")
+)
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return re.sub(r"\s+", " ", prompt).strip()
+
+def is_deterministic(params: Dict[str, Any]) -> bool:
+    """A call is cacheable if it samples greedily or with a fixed seed"""
+    temperature = params.get("temperature", params.get("temp"))
+    if temperature is not None and float(temperature) == 0.0:
+        return True
+    return params.get("seed") is not None and params.get("seed") != -1
+
+class ResponseCache:
+    """
+    Two-tier cache of LLM responses
+
+    Exact hits come from a bounded in-memory LRU in front of a SQLite store.
+    Entries expire after a TTL and the store is trimmed, least recently used
+    first, to max_entries and max_bytes. When an embedder is configured, a
+    miss falls back to the most similar cached prompt for the same model and
+    sampling parameters if its cosine similarity reaches semantic_threshold.
+
+    Memory hits are written back to the store in batches so eviction sees
+    them, and triggers keep a running entry count and byte total so a write
+    never has to scan the whole table.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, ttl=7 * 86400, max_entries=20000,
+                 max_bytes=256 * 1024 * 1024, memory_entries=512,
+                 embedder: Callable[[str], Any] = None, semantic_threshold=0.95,
+                 semantic_candidates=2000, access_flush_interval=30.0):
+        """
+        Initialize the cache
+
+        Args:
+            db_path: SQLite file holding the cache
+            ttl: Seconds an entry stays valid
+            max_entries: Maximum number of stored responses
+            max_bytes: Maximum total size of stored responses
+            memory_entries: Size of the in-memory LRU
+            embedder: Optional callable mapping text to a vector, enables the semantic tier
+            semantic_threshold: Minimum cosine similarity for a semantic hit
+            semantic_candidates: Most recently used entries considered for a semantic hit
+            access_flush_interval: Seconds between writes of memory-hit times to SQLite
+        """
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.embedder = embedder
+        self.semantic_threshold = semantic_threshold
+        self.semantic_candidates = semantic_candidates
+        self.access_flush_interval = access_flush_interval
+        self.memory = OrderedDict()
+        self.pending_access = {}  # key -> last memory hit not yet written to SQLite
+        self.last_access_flush = time.time()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "bypassed": 0}
+        self._ensure_db()
+
+    def enable_semantic(self, embedder: Callable[[str], Any] = None) -> bool:
+        """
+        Turn on the embedding tier, using the shared embedding model unless
+        an embedder is given. Returns whether the tier is enabled.
+        """
+        if self.embedder is None:
+            self.embedder = embedder or _default_embedder()
+        return self.embedder is not None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        # INSERT OR REPLACE only fires the delete trigger with recursive triggers on
+        conn.execute("PRAGMA recursive_triggers = ON")
+        return conn
+
+    def _ensure_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    embedding TEXT,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_scope ON responses(scope, accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_created ON responses(created)")
+
+            # Running totals for the size limits, maintained by triggers
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    entries INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL
+                )
+            """)
+            if conn.execute("SELECT 1 FROM totals").fetchone() is None:
+                # Caches created before the totals table are counted once
+                conn.execute(
+                    "INSERT INTO totals (id, entries, bytes) "
+                    "SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                )
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+                    UPDATE totals SET entries = entries + 1, bytes = bytes + new.size WHERE id = 1;
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+                    UPDATE totals SET entries = entries - 1, bytes = bytes - old.size WHERE id = 1;
+                END
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _scope(model: str, params: Dict[str, Any]) -> str:
+        """Hash of everything except the prompt; semantic matches stay within a scope"""
+        sampling = {k: v for k, v in params.items() if k not in NON_SAMPLING_PARAMS}
+        canonical = json.dumps([model, sampling], sort_keys=True, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(scope: str, prompt: str) -> str:
+        return hashlib.sha256(f"{scope}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, prompt: str, params: Dict[str, Any] = None) -> Optional[str]:
+        """Return a cached response, or None on a miss"""
+        params = params or {}
+        scope = self._scope(model, params)
+        key = self._key(scope, prompt)
+        now = time.time()
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self.memory.move_to_end(key)
+                    self.pending_access[key] = now
+                    self.stats["hits"] += 1
+                    flush = now - self.last_access_flush >= self.access_flush_interval
+                else:
+                    del self.memory[key]
+                    entry = None
+        if entry is not None:
+            if flush:
+                self.flush_access()
+            return entry[0]
+
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT response, created, key FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            semantic = False
+            if row is None and self.embedder is not None:
+                row = self._semantic_lookup(conn, scope, prompt, now)
+                semantic = row is not None
+            if row is None:
+                with self.lock:
+                    self.stats["misses"] += 1
+                return None
+            response, created, stored_key = row
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, stored_key))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._remember(key, response, created)
+        with self.lock:
+            self.stats["hits"] += 1
+            if semantic:
+                self.stats["semantic_hits"] += 1
+        return response
+
+    def _embed(self, prompt: str):
+        try:
+            return [float(x) for x in self.embedder(normalize_prompt(prompt))]
+        except Exception as e:
+            logger.warning(f"Response cache embedding failed: {e}")
+            return None
+
+    def _semantic_lookup(self, conn, scope: str, prompt: str, now: float):
+        """Find the most similar cached prompt in the same scope"""
+        query = self._embed(prompt)
+        if not query:
+            return None
+
+        rows = conn.execute(
+            "SELECT response, created, key, embedding FROM responses "
+            "WHERE scope = ? AND embedding IS NOT NULL AND created >= ? "
+            "ORDER BY accessed DESC LIMIT ?",
+            (scope, now - self.ttl, self.semantic_candidates)
+        ).fetchall()
+        if not rows:
+            return None
+
+        import numpy as np
+        matrix = np.array([json.loads(row[3]) for row in rows], dtype=np.float32)
+        vector = np.array(query, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+        norms[norms == 0] = 1.0
+        similarities = matrix @ vector / norms
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.semantic_threshold:
+            return rows[best][:3]
+        return None
+
+    def set(self, model: str, prompt: str, params: Dict[str, Any], response: str):
+        """Store a response and evict old entries if over capacity"""
+        params = params or {}
+        scope = self._scope(model, params)
+        key = self._key(scope, prompt)
+        now = time.time()
+        self._remember(key, response, now)
+
+        embedding = None
+        if self.embedder is not None:
+            vector = self._embed(prompt)
+            embedding = json.dumps(vector) if vector else None
+
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, scope, response, embedding, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, scope, response, embedding, len(response.encode("utf-8")), now, now)
+            )
+            # Recent memory hits must count before choosing what to evict
+            self._write_access(conn)
+            self._evict(conn, now)
+            conn.commit()
+            with self.lock:
+                self.stats["stores"] += 1
+        except Exception as e:
+            logger.error(f"Error writing to response cache: {e}")
+        finally:
+            conn.close()
+
+    def _write_access(self, conn):
+        """Write pending memory-hit times to the accessed column"""
+        with self.lock:
+            pending = self.pending_access
+            self.pending_access = {}
+            self.last_access_flush = time.time()
+        if pending:
+            conn.executemany(
+                "UPDATE responses SET accessed = MAX(accessed, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in pending.items()]
+            )
+
+    def flush_access(self):
+        """Write recent memory hits to SQLite now instead of on the next batch"""
+        conn = self._connect()
+        try:
+            self._write_access(conn)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing response cache access times: {e}")
+        finally:
+            conn.close()
+
+    def _remember(self, key: str, response: str, created: float):
+        with self.lock:
+            self.memory[key] = (response, created)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def _evict(self, conn, now: float):
+        """Drop expired entries, then the least recently used beyond the size limits"""
+        evicted = conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+        count, total = conn.execute("SELECT entries, bytes FROM totals WHERE id = 1").fetchone()
+        victims = []
+        if count > self.max_entries or total > self.max_bytes:
+            # Walks the accessed index from the oldest entry and stops once under the limits
+            cursor = conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC")
+            for key, size in cursor:
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                victims.append((key,))
+                count -= 1
+                total -= size
+            cursor.close()
+            conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        with self.lock:
+            for (key,) in victims:
+                self.memory.pop(key, None)
+            self.stats["evictions"] += max(evicted, 0) + len(victims)
+
+    def cached_call(self, model: str, prompt: str, params: Dict[str, Any],
+                    generate: Callable[[], str], allow_sampled: bool = False) -> str:
+        """
+        Return a cached response or run generate() and cache its result
+
+        Only deterministic calls are cached. With allow_sampled the caller
+        accepts reusing one sample of a non-deterministic call; those entries
+        are keyed apart from deterministic ones. Pass cache=False in params to
+        opt out for a single call. Error responses are never cached.
+        """
+        if params.get("cache") is False:
+            with self.lock:
+                self.stats["bypassed"] += 1
+            return generate()
+        if not is_deterministic(params):
+            if not allow_sampled:
+                with self.lock:
+                    self.stats["bypassed"] += 1
+                return generate()
+            params = dict(params, sampled=True)
+
+        cached = self.get(model, prompt, params)
+        if cached is not None:
+            return cached
+
+        response = generate()
+        if isinstance(response, str) and response and not response.startswith("Error"):
+            self.set(model, prompt, params, response)
+        return response
+
+    def clear(self):
+        """Remove every cached response"""
+        with self.lock:
+            self.memory.clear()
+            self.pending_access.clear()
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters plus the overall hit rate"""
+        with self.lock:
+            stats = dict(self.stats, memory_entries=len(self.memory))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+def _default_embedder():
+    """Embedder for the semantic tier, only if a real embedding model is loaded"""
+    try:
+        from modules.deep_memory import get_instance as get_deep_memory
+        embedder = get_deep_memory().embedder
+        if getattr(embedder, "model", None) is None and not hasattr(embedder, "hf_model"):
+            return None
+        return embedder.embed_text
+    except Exception as e:
+        logger.info(f"Semantic response cache disabled: {e}")
+        return None
+
+# Singleton instance
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+def get_instance(semantic: bool = None) -> ResponseCache:
+    """
+    Get the shared response cache
+
+    Args:
+        semantic: Enable the embedding tier; defaults to LYRA_SEMANTIC_CACHE
+    """
+    global _cache_instance
+    if semantic is None:
+        semantic = os.environ.get("LYRA_SEMANTIC_CACHE", "0").lower() in ("1", "true", "yes")
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = ResponseCache()
+        cache = _cache_instance
+    if semantic:
+        cache.enable_semantic()
+    return cache
@@ -7,7 +7,10 @@ import os
 import time
 import json
 import base64
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
@@ -58,6 +61,29 @@ class ScreenCapture:
             logger.error(f"Error capturing screenshot: {e}")
             return None
     
+    def grab_frame(self):
+        """
+        Capture the screen into memory without touching the disk
+        
+        Returns:
+            PIL Image of the screen, or None if no in-memory capture method is available
+        """
+        try:
+            from PIL import ImageGrab
+            frame = ImageGrab.grab()
+        except ImportError:
+            try:
+                import pyautogui
+                frame = pyautogui.screenshot()
+            except ImportError:
+                return None
+        except Exception as e:
+            logger.error(f"Error capturing screen frame: {e}")
+            return None
+        
+        self.last_capture_time = time.time()
+        return frame.convert("RGB")
+    
     def _capture_windows(self, output_path: str) -> bool:
         """Capture screenshot on Windows"""
         try:
@@ -249,6 +275,321 @@ class ScreenCapture:
             "last_screenshot": self.last_screenshot_path
         }
 
+class ScreenObserver:
+    """
+    Incremental screen observation pipeline
+    
+    Keeps a content hash per tile, so any pixel change marks a tile dirty.
+    Dirty tiles are merged into full-width bands, widened to cover every text
+    line they touch, and only those bands are sent to OCR. OCR results are
+    cached by band content hash, and the recognized lines are kept in an
+    inverted word index for fast lookups.
+    """
+    
+    def __init__(self, capture: ScreenCapture, tile_size: int = 128, band_margin: int = 48,
+                 full_frame_fraction: float = 0.6, ocr_cache_size: int = 128):
+        """
+        Initialize the observer
+        
+        Args:
+            capture: ScreenCapture used to grab frames
+            tile_size: Width/height in pixels of each change-detection tile
+            band_margin: Extra pixels above and below a dirty band given to OCR
+                so lines crossing the band edge are read whole
+            full_frame_fraction: OCR the whole frame when dirty bands cover more
+                than this fraction of its height
+            ocr_cache_size: Maximum number of band OCR results kept in memory
+        """
+        self.capture = capture
+        self.tile_size = tile_size
+        self.band_margin = band_margin
+        self.full_frame_fraction = full_frame_fraction
+        self.ocr_cache_size = ocr_cache_size
+        
+        self.last_frame = None
+        self.last_frame_time = 0
+        self.tile_hashes: Dict[Tuple[int, int], bytes] = {}
+        self.lines: List[Dict[str, Any]] = []
+        self.ocr_cache: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self.word_index: Dict[str, set] = {}
+        self.lock = threading.Lock()
+        
+        self.stats = {
+            "frames": 0,
+            "unchanged_frames": 0,
+            "regions_ocr": 0,
+            "full_frame_ocr": 0,
+            "ocr_cache_hits": 0
+        }
+    
+    def observe(self) -> Optional[Dict[str, Any]]:
+        """
+        Capture a frame and update OCR results for the regions that changed
+        
+        Returns:
+            Dict with the screen text and change statistics, or None if
+            in-memory capture is not available
+        """
+        frame = self.capture.grab_frame()
+        if frame is None:
+            return None
+        
+        with self.lock:
+            self.stats["frames"] += 1
+            if self.last_frame is None or frame.size != self.last_frame.size:
+                # Resolution changed, start over
+                self.tile_hashes.clear()
+                self.lines = []
+            
+            changed = self._changed_tiles(frame)
+            if not changed:
+                self.stats["unchanged_frames"] += 1
+            else:
+                for band in self._dirty_bands(changed, frame.size):
+                    self._update_band(frame, band)
+                self._rebuild_index()
+            
+            self.last_frame = frame
+            self.last_frame_time = time.time()
+            
+            return {
+                "timestamp": self.last_frame_time,
+                "text": self.get_text(),
+                "changed_tiles": len(changed),
+                "total_tiles": len(self.tile_hashes)
+            }
+    
+    def _tile_grid(self, size: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """Return the (column, row) coordinates of every tile for a frame size"""
+        width, height = size
+        cols = (width + self.tile_size - 1) // self.tile_size
+        rows = (height + self.tile_size - 1) // self.tile_size
+        return [(col, row) for row in range(rows) for col in range(cols)]
+    
+    def _changed_tiles(self, frame) -> List[Tuple[int, int]]:
+        """Hash every tile's pixels and return the tiles that differ from the previous frame"""
+        gray = frame.convert("L")
+        width, height = gray.size
+        pixels = gray.tobytes()
+        tile = self.tile_size
+        
+        changed = []
+        for col, row in self._tile_grid(gray.size):
+            left, right = col * tile, min((col + 1) * tile, width)
+            hasher = hashlib.blake2b(digest_size=16)
+            for y in range(row * tile, min((row + 1) * tile, height)):
+                hasher.update(pixels[y * width + left:y * width + right])
+            digest = hasher.digest()
+            if self.tile_hashes.get((col, row)) != digest:
+                changed.append((col, row))
+                self.tile_hashes[(col, row)] = digest
+        return changed
+    
+    def _dirty_bands(self, changed: List[Tuple[int, int]], size: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """
+        Merge dirty tiles into full-width (top, bottom) pixel bands
+        
+        Bands span the whole frame width so no line is cut horizontally, and
+        grow to cover any known line they overlap so a line straddling a tile
+        edge is always read again whole.
+        """
+        width, height = size
+        bands: List[List[int]] = []
+        for row in sorted({row for _, row in changed}):
+            top, bottom = row * self.tile_size, min((row + 1) * self.tile_size, height)
+            if bands and bands[-1][1] >= top:
+                bands[-1][1] = bottom
+            else:
+                bands.append([top, bottom])
+        
+        for band in bands:
+            for line in self.lines:
+                line_bottom = line["top"] + line["height"]
+                if line["top"] < band[1] and line_bottom > band[0]:
+                    band[0] = min(band[0], line["top"])
+                    band[1] = max(band[1], line_bottom)
+        
+        # Widening can make bands overlap
+        merged: List[List[int]] = []
+        for band in sorted(bands):
+            if merged and merged[-1][1] >= band[0]:
+                merged[-1][1] = max(merged[-1][1], band[1])
+            else:
+                merged.append(band)
+        
+        if sum(bottom - top for top, bottom in merged) > self.full_frame_fraction * height:
+            self.stats["full_frame_ocr"] += 1
+            return [(0, height)]
+        return [(top, bottom) for top, bottom in merged]
+    
+    def _update_band(self, frame, band: Tuple[int, int]):
+        """Re-read one dirty band and replace the lines centred inside it"""
+        top, bottom = band
+        box = (0, max(0, top - self.band_margin), frame.size[0], min(frame.size[1], bottom + self.band_margin))
+        lines = self._ocr_box(frame, box)
+        
+        def inside(line):
+            return top <= line["top"] + line["height"] / 2 < bottom
+        
+        # Lines centred in the margin belong to the neighbouring, unchanged region
+        self.lines = [line for line in self.lines if not inside(line)] + [line for line in lines if inside(line)]
+    
+    def _ocr_box(self, frame, box: Tuple[int, int, int, int]) -> List[Dict[str, Any]]:
+        """OCR a frame region into lines with absolute coordinates, using the cache for identical content"""
+        region = frame.crop(box)
+        region_hash = hashlib.blake2b(region.tobytes(), digest_size=16).hexdigest()
+        
+        lines = self.ocr_cache.get(region_hash)
+        if lines is not None:
+            self.ocr_cache.move_to_end(region_hash)
+            self.stats["ocr_cache_hits"] += 1
+        else:
+            lines = self._group_lines(self._ocr_region(region))
+            self.stats["regions_ocr"] += 1
+            self.ocr_cache[region_hash] = lines
+            if len(self.ocr_cache) > self.ocr_cache_size:
+                self.ocr_cache.popitem(last=False)
+        
+        left, top = box[0], box[1]
+        return [
+            dict(line, left=line["left"] + left, top=line["top"] + top,
+                 words=[dict(word, left=word["left"] + left, top=word["top"] + top) for word in line["words"]])
+            for line in lines
+        ]
+    
+    @staticmethod
+    def _group_lines(words: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Group OCR words into lines using the OCR engine's line numbering"""
+        grouped: Dict[Tuple[int, int, int], List[Dict[str, Any]]] = {}
+        for word in words:
+            grouped.setdefault(tuple(word["line"]), []).append(word)
+        
+        lines = []
+        for line_words in grouped.values():
+            line_words.sort(key=lambda w: w["left"])
+            left = min(w["left"] for w in line_words)
+            top = min(w["top"] for w in line_words)
+            lines.append({
+                "text": " ".join(w["text"] for w in line_words),
+                "left": left,
+                "top": top,
+                "width": max(w["left"] + w["width"] for w in line_words) - left,
+                "height": max(w["top"] + w["height"] for w in line_words) - top,
+                "words": line_words
+            })
+        return lines
+    
+    def _ocr_region(self, region) -> List[Dict[str, Any]]:
+        """Run OCR on a region and return recognized words with positions"""
+        try:
+            import pytesseract
+        except ImportError:
+            logger.warning("pytesseract not installed. Screen text will be unavailable.")
+            return []
+        
+        try:
+            data = pytesseract.image_to_data(region, output_type=pytesseract.Output.DICT)
+        except Exception as e:
+            logger.error(f"Error in OCR: {e}")
+            return []
+        
+        words = []
+        for i, text in enumerate(data.get("text", [])):
+            text = text.strip()
+            if not text:
+                continue
+            words.append({
+                "text": text,
+                "left": data["left"][i],
+                "top": data["top"][i],
+                "width": data["width"][i],
+                "height": data["height"][i],
+                "line": (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            })
+        return words
+    
+    def _ordered_lines(self) -> List[Dict[str, Any]]:
+        """
+        Lines in reading order: top to bottom, and left to right for lines
+        that sit on the same row (e.g. side-by-side columns or panes)
+        """
+        rows: List[List[Dict[str, Any]]] = []
+        for line in sorted(self.lines, key=lambda l: l["top"]):
+            center = line["top"] + line["height"] / 2
+            if rows:
+                anchor = rows[-1][0]
+                if abs(center - (anchor["top"] + anchor["height"] / 2)) <= max(anchor["height"], line["height"]) / 2:
+                    rows[-1].append(line)
+                    continue
+            rows.append([line])
+        return [line for row in rows for line in sorted(row, key=lambda l: l["left"])]
+    
+    def _rebuild_index(self):
+        """Order the lines and rebuild the word -> line positions inverted index"""
+        self.lines = self._ordered_lines()
+        index: Dict[str, set] = {}
+        for position, line in enumerate(self.lines):
+            for word in line["words"]:
+                key = self._normalize(word["text"])
+                if key:
+                    index.setdefault(key, set()).add(position)
+        self.word_index = index
+    
+    @staticmethod
+    def _normalize(word: str) -> str:
+        """Normalize a word for indexing"""
+        return word.strip(".,;:!?\"'()[]{}<>").lower()
+    
+    def get_text(self) -> str:
+        """Get the text of the current screen in reading order"""
+        return "\n".join(line["text"] for line in self.lines)
+    
+    def find(self, target: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Find text on the current screen using the inverted word index
+        
+        Args:
+            target: Word or phrase to look for
+            limit: Maximum number of matches to return
+            
+        Returns:
+            List of matches with the matching line and its screen position
+        """
+        terms = [self._normalize(t) for t in target.split()]
+        terms = [t for t in terms if t]
+        if not terms:
+            return []
+        
+        with self.lock:
+            candidates = None
+            for term in terms:
+                # Allow the last term to be a prefix so partial words still match
+                hits = self.word_index.get(term, set())
+                if term == terms[-1] and not hits:
+                    hits = set().union(*(p for w, p in self.word_index.items() if w.startswith(term)))
+                candidates = hits if candidates is None else candidates & hits
+                if not candidates:
+                    return []
+            
+            phrase = " ".join(terms)
+            matches = []
+            for position in sorted(candidates):
+                line = self.lines[position]
+                if phrase in " ".join(self._normalize(w["text"]) for w in line["words"]):
+                    matches.append({
+                        "text": line["text"],
+                        "position": (line["left"], line["top"])
+                    })
+                    if len(matches) >= limit:
+                        break
+            return matches
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get observation and cache statistics"""
+        with self.lock:
+            return dict(self.stats, ocr_cache_size=len(self.ocr_cache), indexed_words=len(self.word_index),
+                        lines=len(self.lines))
+
 class ScreenInteraction:
     """Allows Lyra to interact with elements on screen"""
     
@@ -317,7 +658,11 @@ class ScreenAwarenessModule:
     
     def __init__(self):
         self.capture = ScreenCapture()
+        self.observer = ScreenObserver(self.capture)
         self.interaction = ScreenInteraction()
+        self.max_frame_age = 1.0  # Seconds an observation is reused before capturing again
+        self.save_screenshots = False
+        self.windows = None
         self.enabled = False
         self.permission_granted = False
         self.last_analysis = None
@@ -355,11 +700,18 @@ class ScreenAwarenessModule:
             return {"error": "Screen awareness is not enabled"}
             
         try:
-            screenshot_path = None
-            if capture_new:
-                screenshot_path = self.capture.capture_screenshot()
-                
-            analysis = self.capture.analyze_screen_content(screenshot_path)
+            # Callers in the same turn share one observation instead of capturing again
+            fresh = self.last_analysis and time.time() - self.last_analysis.get("timestamp", 0) < self.max_frame_age
+            if self.last_analysis and "error" not in self.last_analysis and (fresh or not capture_new):
+                return self.last_analysis
+            
+            analysis = self._observe_screen()
+            if analysis is None:
+                # No in-memory capture available, fall back to a full screenshot on disk
+                screenshot_path = None
+                if capture_new:
+                    screenshot_path = self.capture.capture_screenshot()
+                analysis = self.capture.analyze_screen_content(screenshot_path)
             self.last_analysis = analysis
             
             # Add to history and trim if needed
@@ -376,6 +728,34 @@ class ScreenAwarenessModule:
             logger.error(f"Error getting screen state: {e}")
             return {"error": str(e)}
     
+    def _observe_screen(self) -> Optional[Dict[str, Any]]:
+        """Update the incremental observation and build an analysis from it"""
+        observation = self.observer.observe()
+        if observation is None:
+            return None
+        
+        # Window layout only needs refreshing when something on screen changed
+        if observation["changed_tiles"] or self.windows is None:
+            self.windows = self.capture.detect_application_windows(None)
+        
+        screenshot_path = None
+        if self.save_screenshots and observation["changed_tiles"]:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            screenshot_path = os.path.join(self.capture.screenshot_dir, f"screen_{timestamp}.png")
+            self.observer.last_frame.save(screenshot_path)
+            self.capture.last_screenshot_path = screenshot_path
+        
+        return {
+            "timestamp": observation["timestamp"],
+            "screenshot_path": screenshot_path or self.capture.last_screenshot_path,
+            "text": observation["text"],
+            "ui_elements": self.capture.detect_ui_elements(screenshot_path),
+            "windows": self.windows,
+            "changed_tiles": observation["changed_tiles"],
+            "total_tiles": observation["total_tiles"],
+            "incremental": True
+        }
+    
     def describe_screen(self, detailed: bool = False) -> str:
         """Generate a natural language description of what's on screen"""
         if not self.enabled:
@@ -435,11 +815,17 @@ class ScreenAwarenessModule:
                 return {"found": False, "error": screen_state["error"]}
             
             results = {"found": False, "target": target, "matches": []}
+            target_lower = target.lower()
             
             # Check text content
-            if screen_state.get("text"):
+            if screen_state.get("incremental"):
+                matches = self.observer.find(target)
+                if matches:
+                    results["found"] = True
+                    results["matches"] = matches
+                    results["text_context"] = [m["text"] for m in matches]
+            elif screen_state.get("text"):
                 text = screen_state["text"].lower()
-                target_lower = target.lower()
                 
                 if target_lower in text:
                     results["found"] = True
@@ -476,7 +862,8 @@ class ScreenAwarenessModule:
             "permission_granted": self.permission_granted,
             "can_interact": self.interaction.can_interact,
             "capture_active": self.capture.active,
-            "history_size": len(self.screen_history)
+            "history_size": len(self.screen_history),
+            "observer": self.observer.get_stats()
         }
 
 # Singleton instance
@@ -1,29 +1,98 @@
 import os
 import logging
 import time
+import heapq
+import random
 import threading
-import requests
 import json
-from typing import Optional, Dict, Any, List
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Optional, Dict, Any, List, Tuple
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+class TokenBucket:
+    """Token bucket allowing short bursts up to capacity at a sustained rate"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        
+    def wait_time(self, now: Optional[float] = None) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+        
+    def consume(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+
+class TelegramAPIError(Exception):
+    """A failed Bot API call; retry_after is set when Telegram asked us to slow down"""
+    
+    def __init__(self, message: str, status: int = 0, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        
+    @property
+    def retriable(self) -> bool:
+        # Network errors, flood control and server errors are worth retrying
+        return self.status == 0 or self.status == 429 or self.status >= 500
+
 class TelegramNotifier:
-    def __init__(self):
+    # Telegram allows about 30 messages per second overall and about one
+    # message per second to the same chat
+    GLOBAL_RATE = 30.0
+    CHAT_RATE = 1.0
+    CHAT_BURST = 3
+    MAX_RETRIES = 4
+    RETRY_BASE_DELAY = 1.0
+    
+    def __init__(self, config_path: Optional[str] = None, api_base: str = TELEGRAM_API_BASE):
         base_dir = Path(__file__).parent.parent
-        self.config_path = os.path.join(base_dir, "data", "telegram_config.json")
+        self.config_path = config_path or os.path.join(base_dir, "data", "telegram_config.json")
+        self.chat_cache_path = os.path.join(os.path.dirname(self.config_path), "telegram_chat_ids.json")
+        self.api_base = api_base.rstrip('/')
         self.api_token = None
         self.enabled = False
         self.notification_thread = None
         self.should_run = False
+        
+        # Heap of (-priority, sequence, message); higher priority is sent first
         self.queue = []
         self.queue_lock = threading.Lock()
+        self.queue_cond = threading.Condition(self.queue_lock)
+        self.sequence = 0
         self.max_queue_size = 100
+        
+        self.global_bucket = TokenBucket(self.GLOBAL_RATE, self.GLOBAL_RATE)
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+        
+        # username -> chat_id, persisted so getUpdates is only needed for new users
+        self.chat_ids: Dict[str, str] = {}
+        self.chat_ids_lock = threading.Lock()
+        
         self.last_error = None
         self.last_success_time = None
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "dropped": 0}
         
         # Load config
+        self._load_chat_ids()
         self.load_config()
         
     def load_config(self):
@@ -64,22 +133,73 @@ class TelegramNotifier:
             self.last_error = str(e)
             return False
             
+    def _load_chat_ids(self):
+        """Load the persisted username -> chat_id cache"""
+        try:
+            if os.path.exists(self.chat_cache_path):
+                with open(self.chat_cache_path, 'r', encoding='utf-8') as f:
+                    self.chat_ids = {k: str(v) for k, v in json.load(f).items()}
+        except Exception as e:
+            logger.warning(f"Error loading Telegram chat id cache: {str(e)}")
+            
+    def _save_chat_ids(self):
+        """Persist the chat_id cache atomically"""
+        try:
+            os.makedirs(os.path.dirname(self.chat_cache_path), exist_ok=True)
+            tmp_path = self.chat_cache_path + ".tmp"
+            with self.chat_ids_lock:
+                data = dict(self.chat_ids)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.chat_cache_path)
+        except Exception as e:
+            logger.warning(f"Error saving Telegram chat id cache: {str(e)}")
+            
+    def _api_call(self, method: str, payload: Optional[Dict[str, Any]] = None, timeout: float = 10) -> Any:
+        """
+        Call a Bot API method and return its result
+        
+        Raises:
+            TelegramAPIError: If the request fails or Telegram reports an error
+        """
+        url = f"{self.api_base}/bot{self.api_token}/{method}"
+        data = None
+        headers = {}
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(url, data=data, headers=headers)
+        
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                body = json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            try:
+                body = json.loads(e.read().decode("utf-8"))
+            except Exception:
+                body = {}
+            retry_after = body.get("parameters", {}).get("retry_after")
+            raise TelegramAPIError(body.get("description", str(e)), e.code, retry_after)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise TelegramAPIError(str(e))
+        
+        if not body.get("ok"):
+            raise TelegramAPIError(body.get("description", "Telegram API error"), body.get("error_code", 400))
+        return body.get("result")
+            
     def _validate_token(self) -> bool:
         """Validate the Telegram bot token"""
         try:
-            url = f"https://api.telegram.org/bot{self.api_token}/getMe"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("ok"):
-                    logger.info(f"Successfully validated Telegram bot: {data['result']['username']}")
-                    return True
-            logger.error("Invalid Telegram bot token")
-            self.last_error = "Invalid bot token"
-            return False
-        except Exception as e:
-            logger.error(f"Error validating Telegram token: {str(e)}")
-            self.last_error = str(e)
+            result = self._api_call("getMe")
+            logger.info(f"Successfully validated Telegram bot: {result['username']}")
+            return True
+        except TelegramAPIError as e:
+            if e.status:
+                logger.error("Invalid Telegram bot token")
+                self.last_error = "Invalid bot token"
+            else:
+                logger.error(f"Error validating Telegram token: {str(e)}")
+                self.last_error = str(e)
             return False
             
     def set_api_token(self, token: str) -> bool:
@@ -124,11 +244,16 @@ class TelegramNotifier:
         
     def get_status(self) -> Dict[str, Any]:
         """Get current status of the Telegram notifier"""
+        with self.queue_lock:
+            queue_size = len(self.queue)
+            stats = dict(self.stats)
         return {
             "enabled": self.enabled,
             "running": self.is_running(),
             "has_token": bool(self.api_token),
-            "queue_size": len(self.queue),
+            "queue_size": queue_size,
+            "known_chats": len(self.chat_ids),
+            "stats": stats,
             "last_error": self.last_error,
             "last_success": self.last_success_time
         }
@@ -139,9 +264,11 @@ class TelegramNotifier:
             return True
             
         try:
-            self.should_run = True
+            with self.queue_cond:
+                self.should_run = True
             self.notification_thread = threading.Thread(
                 target=self._process_notifications,
+                name="telegram-notify",
                 daemon=True
             )
             self.notification_thread.start()
@@ -158,7 +285,9 @@ class TelegramNotifier:
             return True
             
         try:
-            self.should_run = False
+            with self.queue_cond:
+                self.should_run = False
+                self.queue_cond.notify_all()
             self.notification_thread.join(timeout=5.0)
             self.notification_thread = None
             logger.info("Stopped Telegram notification thread")
@@ -169,7 +298,12 @@ class TelegramNotifier:
             return False
             
     def send_message(self, username: str, message: str, priority: int = 0) -> bool:
-        """Queue a message to be sent to a Telegram user"""
+        """
+        Queue a message to be sent to a Telegram user
+        
+        Messages with a higher priority are sent first; equal priorities
+        keep their queueing order.
+        """
         if not self.enabled:
             logger.warning("Telegram notifications are disabled")
             return False
@@ -179,100 +313,195 @@ class TelegramNotifier:
             return False
             
         try:
-            with self.queue_lock:
+            with self.queue_cond:
                 if len(self.queue) >= self.max_queue_size:
                     logger.warning("Telegram message queue is full")
                     return False
                     
-                self.queue.append({
+                self.sequence += 1
+                heapq.heappush(self.queue, (-priority, self.sequence, {
                     "username": username.lstrip('@'),
                     "message": message,
                     "priority": priority,
-                    "timestamp": time.time()
-                })
+                    "timestamp": time.time(),
+                    "attempts": 0,
+                    "not_before": 0.0
+                }))
+                self.queue_cond.notify()
+            
+            if not self.is_running():
+                self.start_notification_thread()
             return True
         except Exception as e:
             logger.error(f"Error queueing message: {str(e)}")
             self.last_error = str(e)
             return False
             
+    def _chat_bucket(self, username: str) -> TokenBucket:
+        bucket = self.chat_buckets.get(username)
+        if bucket is None:
+            bucket = self.chat_buckets[username] = TokenBucket(self.CHAT_RATE, self.CHAT_BURST)
+        return bucket
+            
+    def _wait_time(self, msg: Dict[str, Any], now: float) -> float:
+        """Seconds until a message may be sent under backoff and rate limits"""
+        return max(
+            msg["not_before"] - now,
+            self._chat_bucket(msg["username"]).wait_time(now),
+            self.global_bucket.wait_time(now)
+        )
+            
+    def _next_message(self) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+        """
+        Take the highest-priority message that may be sent now
+        
+        Must be called with queue_lock held. Returns (message, None), or
+        (None, seconds until the next message becomes sendable), or
+        (None, None) if the queue is empty.
+        """
+        if not self.queue:
+            return None, None
+        
+        now = time.monotonic()
+        if self._wait_time(self.queue[0][2], now) <= 0:
+            entry = heapq.heappop(self.queue)
+        else:
+            # The head is rate limited or backing off; look further down
+            entry, soonest = None, None
+            for candidate in sorted(self.queue):
+                wait = self._wait_time(candidate[2], now)
+                if wait <= 0:
+                    entry = candidate
+                    break
+                soonest = wait if soonest is None else min(soonest, wait)
+            if entry is None:
+                return None, soonest
+            self.queue.remove(entry)
+            heapq.heapify(self.queue)
+        
+        msg = entry[2]
+        self._chat_bucket(msg["username"]).consume(now)
+        self.global_bucket.consume(now)
+        return msg, None
+            
     def _process_notifications(self):
-        """Background thread to process notification queue"""
-        while self.should_run:
+        """Background thread that sends queued messages as rate limits allow"""
+        while True:
+            with self.queue_cond:
+                while True:
+                    if not self.should_run:
+                        return
+                    msg, wait = self._next_message()
+                    if msg is not None:
+                        break
+                    self.queue_cond.wait(timeout=wait)
+            
+            # Network I/O happens outside the lock so send_message never blocks on it
             try:
-                # Process all queued messages
-                with self.queue_lock:
-                    if self.queue:
-                        msg = self.queue.pop(0)
-                        success = self._send_telegram_message(
-                            msg["username"],
-                            msg["message"]
-                        )
-                        if success:
-                            self.last_success_time = time.time()
-                            self.last_error = None
+                self._deliver(msg)
             except Exception as e:
                 logger.error(f"Error processing notifications: {str(e)}")
                 self.last_error = str(e)
+                
+    def _deliver(self, msg: Dict[str, Any]):
+        """Send one queued message and requeue it with backoff on a transient failure"""
+        try:
+            self._send_or_raise(msg["username"], msg["message"])
+            self.last_success_time = time.time()
+            self.last_error = None
+            with self.queue_lock:
+                self.stats["sent"] += 1
+            return
+        except TelegramAPIError as e:
+            logger.error(f"Error sending Telegram message to {msg['username']}: {str(e)}")
+            self.last_error = str(e)
+            error = e
+        
+        msg["attempts"] += 1
+        with self.queue_cond:
+            if not error.retriable or msg["attempts"] > self.MAX_RETRIES:
+                self.stats["failed"] += 1
+                return
+            if len(self.queue) >= self.max_queue_size:
+                self.stats["dropped"] += 1
+                return
+            
+            if error.retry_after is not None:
+                delay = float(error.retry_after)
+            else:
+                delay = self.RETRY_BASE_DELAY * (2 ** (msg["attempts"] - 1))
+                delay *= random.uniform(0.8, 1.2)
+            msg["not_before"] = time.monotonic() + delay
             
-            # Sleep briefly to prevent busy-waiting
-            time.sleep(0.1)
+            self.stats["retried"] += 1
+            self.sequence += 1
+            heapq.heappush(self.queue, (-msg["priority"], self.sequence, msg))
+            self.queue_cond.notify()
             
     def _get_chat_id(self, username: str) -> Optional[str]:
-        """Get chat_id for a Telegram username"""
+        """Get chat_id for a Telegram username, from the cache if possible"""
         if not username:
             return None
             
+        # Strip @ if present
+        username = username.lstrip('@')
+        with self.chat_ids_lock:
+            chat_id = self.chat_ids.get(username)
+        if chat_id:
+            return chat_id
+            
         try:
-            # Strip @ if present
-            username = username.lstrip('@')
-            
-            # Try to get chat updates to find the user
-            url = f"https://api.telegram.org/bot{self.api_token}/getUpdates"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("ok"):
-                    # Look for messages from this user
-                    for update in data["result"]:
-                        message = update.get("message", {})
-                        from_user = message.get("from", {})
-                        if from_user.get("username") == username:
-                            return str(message["chat"]["id"])
-            return None
-        except Exception as e:
+            # Record every user seen in recent updates, not just this one
+            updates = self._api_call("getUpdates")
+        except TelegramAPIError as e:
             logger.error(f"Error getting chat ID: {str(e)}")
             self.last_error = str(e)
             return None
             
+        found = {}
+        for update in updates or []:
+            message = update.get("message", {})
+            from_user = message.get("from", {})
+            if from_user.get("username") and "chat" in message:
+                found[from_user["username"]] = str(message["chat"]["id"])
+                
+        if found:
+            with self.chat_ids_lock:
+                changed = any(self.chat_ids.get(k) != v for k, v in found.items())
+                self.chat_ids.update(found)
+            if changed:
+                self._save_chat_ids()
+        return found.get(username)
+            
+    def _send_or_raise(self, username: str, message: str):
+        """Send a message to Telegram, raising TelegramAPIError on failure"""
+        # First we need to get the chat_id for the username
+        chat_id = self._get_chat_id(username)
+        if not chat_id:
+            raise TelegramAPIError(f"Could not find chat_id for Telegram user {username}", 400)
+        
+        payload = {
+            "chat_id": chat_id,
+            "text": message,
+            "parse_mode": "Markdown"
+        }
+        try:
+            self._api_call("sendMessage", payload)
+        except TelegramAPIError as e:
+            if e.status in (400, 403) and "chat" in str(e).lower():
+                # The cached chat is gone (bot blocked or chat deleted); look it up again next time
+                with self.chat_ids_lock:
+                    self.chat_ids.pop(username, None)
+                self._save_chat_ids()
+            raise
+        logger.info(f"Sent Telegram message to {username}")
+            
     def _send_telegram_message(self, username: str, message: str) -> bool:
         """Send a message directly to Telegram"""
         try:
-            # First we need to get the chat_id for the username
-            chat_id = self._get_chat_id(username)
-            if not chat_id:
-                logger.warning(f"Could not find chat_id for Telegram user {username}")
-                return False
-            
-            # Now send the message
-            url = f"https://api.telegram.org/bot{self.api_token}/sendMessage"
-            payload = {
-                "chat_id": chat_id,
-                "text": message,
-                "parse_mode": "Markdown"
-            }
-            
-            response = requests.post(url, json=payload, timeout=10)
-            if response.status_code == 200:
-                logger.info(f"Sent Telegram message to {username}")
-                return True
-            else:
-                logger.error(f"Error sending Telegram message: {response.text}")
-                self.last_error = response.text
-                return False
-                
-        except Exception as e:
+            self._send_or_raise(username, message)
+            return True
+        except TelegramAPIError as e:
             logger.error(f"Error sending Telegram message: {str(e)}")
             self.last_error = str(e)
             return False
@@ -0,0 +1,447 @@
+"""
+Tracing for Lyra
+Lightweight in-process spans that show where a conversation turn spends its time.
+
+    from modules.tracing import span, traced
+
+    with span("memory.get_context", k=5):
+        ...
+
+    @traced("llama.generate")
+    def generate(self, prompt, **kwargs):
+        ...
+
+The current span is held in a context variable, so spans opened inside
+another one (including in threads started with a copied context, see wrap())
+share its trace id and record it as their parent. Finished spans are buffered
+and written when the root span of a trace ends.
+
+Tracing is off unless LYRA_TRACE names an output file or configure() is
+called; while it is off span() returns a shared no-op object.
+
+Environment:
+    LYRA_TRACE         Output file. A .json file gets Chrome trace events
+                       (load it in chrome://tracing or Perfetto), anything else JSONL
+    LYRA_TRACE_SAMPLE  Fraction of turns to trace (default 1.0)
+    LYRA_TRACE_FORMAT  "jsonl" or "chrome", overriding the file extension
+
+Summarize a trace file with:
+    python -m modules.tracing summarize data/traces.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import logging
+import argparse
+import functools
+import threading
+import contextvars
+from typing import Dict, Any, List, Optional, Callable
+
+logger = logging.getLogger("tracing")
+
+_current_span = contextvars.ContextVar("lyra_current_span", default=None)
+
+# Marks a context whose root span was not sampled; its children are no-ops too
+_UNSAMPLED = object()
+
+class _NoopSpan:
+    """Returned while tracing is disabled or the trace was not sampled"""
+    __slots__ = ()
+    trace_id = None
+    span_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+class _UnsampledRoot(_NoopSpan):
+    """Root of a trace that sampling skipped; keeps its children from starting a new trace"""
+    __slots__ = ("token",)
+
+    def __enter__(self):
+        self.token = _current_span.set(_UNSAMPLED)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self.token)
+        return False
+
+class Span:
+    """A timed, named section of work within a trace"""
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes",
+                 "start", "start_time", "duration", "thread", "thread_id", "token")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = None
+        self.start_time = None
+        self.duration = None
+        self.thread = None
+        self.thread_id = None
+        self.token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.token = _current_span.set(self)
+        self.thread = threading.current_thread().name
+        self.thread_id = threading.get_ident()
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        self.tracer._finish(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "thread": self.thread,
+            "attributes": self.attributes
+        }
+
+class JsonlExporter:
+    """Appends one JSON object per span"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+class ChromeTraceExporter:
+    """
+    Writes complete ("X") events in the Chrome trace-event format
+
+    The file is a JSON array that is left open so spans can keep being
+    appended; the trace viewers accept that, and load_spans() does too.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pid = os.getpid()
+
+    def export(self, spans: List[Span]):
+        events = []
+        for span in spans:
+            args = dict(span.attributes, trace_id=span.trace_id, span_id=span.span_id,
+                        parent_id=span.parent_id, thread=span.thread)
+            events.append(json.dumps({
+                "name": span.name,
+                "cat": "lyra",
+                "ph": "X",
+                "ts": round(span.start_time * 1e6),
+                "dur": round(span.duration * 1e6),
+                "pid": self.pid,
+                "tid": span.thread_id,
+                "args": args
+            }, default=str))
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(("[\n" if new_file else "") + "".join(event + ",\n" for event in events))
+
+EXPORTERS = {"jsonl": JsonlExporter, "chrome": ChromeTraceExporter}
+
+class Tracer:
+    """Creates spans and hands finished traces to an exporter"""
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.exporter = None
+        self.buffer = []
+        self.max_buffer = 512  # flush before a long-running trace grows without bound
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock()
+        self.stats = {"traces": 0, "spans": 0, "unsampled": 0, "export_errors": 0}
+        self._atexit_registered = False
+
+    def configure(self, path: Optional[str] = None, sample_rate: float = 1.0,
+                  format: Optional[str] = None, exporter=None):
+        """
+        Enable tracing
+
+        Args:
+            path: File to write spans to
+            sample_rate: Fraction of root spans (turns) to trace
+            format: "jsonl" or "chrome"; by default .json files get Chrome events
+            exporter: Object with an export(spans) method, used instead of a file
+        """
+        self.flush()
+        if exporter is None:
+            if not path:
+                raise ValueError("A trace path or an exporter is required")
+            if format is None:
+                format = "chrome" if path.endswith(".json") else "jsonl"
+            if format not in EXPORTERS:
+                raise ValueError(f"Unknown trace format: {format}")
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            exporter = EXPORTERS[format](path)
+        self.exporter = exporter
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.enabled = True
+        if not self._atexit_registered:
+            atexit.register(self.flush)
+            self._atexit_registered = True
+        logger.info(f"Tracing enabled ({type(exporter).__name__}, sample rate {self.sample_rate})")
+
+    def disable(self):
+        """Stop tracing and write out anything still buffered"""
+        self.enabled = False
+        self.flush()
+        self.exporter = None
+
+    def span(self, name: str, **attributes):
+        """Start a span as a child of the current one, or as the root of a new trace"""
+        if not self.enabled:
+            return NOOP_SPAN
+        parent = _current_span.get()
+        if parent is _UNSAMPLED:
+            return NOOP_SPAN
+        if parent is None:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                self.stats["unsampled"] += 1
+                return _UnsampledRoot()
+            return Span(self, name, os.urandom(8).hex(), None, attributes)
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def _finish(self, span: Span):
+        with self.lock:
+            self.buffer.append(span)
+            self.stats["spans"] += 1
+            if span.parent_id is None:
+                self.stats["traces"] += 1
+            flush = span.parent_id is None or len(self.buffer) >= self.max_buffer
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Export buffered spans"""
+        with self.lock:
+            spans, self.buffer = self.buffer, []
+        exporter = self.exporter
+        if not spans or exporter is None:
+            return
+        with self.export_lock:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                self.stats["export_errors"] += 1
+                logger.error(f"Error exporting {len(spans)} spans: {e}")
+
+_tracer = Tracer()
+
+def get_tracer() -> Tracer:
+    """Get the process-wide tracer"""
+    return _tracer
+
+def configure(path: Optional[str] = None, sample_rate: float = 1.0, format: Optional[str] = None,
+              exporter=None):
+    """Enable the process-wide tracer (see Tracer.configure)"""
+    _tracer.configure(path, sample_rate, format, exporter)
+
+def span(name: str, **attributes):
+    """Context manager timing a stage of the current trace"""
+    if not _tracer.enabled:
+        return NOOP_SPAN
+    return _tracer.span(name, **attributes)
+
+def traced(name: Optional[str] = None):
+    """Decorator running the function inside a span (named after the function by default)"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _tracer.enabled:
+                return func(*args, **kwargs)
+            with _tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def current_span():
+    """The active span, or None outside a (sampled) trace"""
+    current = _current_span.get()
+    return None if current is _UNSAMPLED else current
+
+def current_trace_id() -> Optional[str]:
+    current = current_span()
+    return current.trace_id if current is not None else None
+
+def wrap(func: Callable) -> Callable:
+    """
+    Bind func to a copy of the current context so spans it opens in another
+    thread join the current trace. Wrap once per submission: a copied context
+    cannot be entered by two threads at the same time.
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+def _configure_from_environment():
+    path = os.environ.get("LYRA_TRACE")
+    if not path:
+        return
+    try:
+        sample_rate = float(os.environ.get("LYRA_TRACE_SAMPLE", "1.0"))
+    except ValueError:
+        logger.warning("Invalid LYRA_TRACE_SAMPLE, tracing every turn")
+        sample_rate = 1.0
+    try:
+        configure(path, sample_rate, os.environ.get("LYRA_TRACE_FORMAT") or None)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not enable tracing to {path}: {e}")
+
+_configure_from_environment()
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    """Read spans back from a JSONL or Chrome trace-event file"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    if not text.lstrip().startswith("["):
+        spans = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning("Skipping malformed trace line")
+        return spans
+
+    # The array is normally left open for appending
+    body = text.strip().rstrip(",")
+    if not body.endswith("]"):
+        body += "]"
+    events = json.loads(body)
+    if isinstance(events, dict):
+        events = events.get("traceEvents", [])
+    spans = []
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        args = dict(event.get("args", {}))
+        spans.append({
+            "trace_id": args.pop("trace_id", None),
+            "span_id": args.pop("span_id", None),
+            "parent_id": args.pop("parent_id", None),
+            "name": event["name"],
+            "start": event.get("ts", 0) / 1e6,
+            "duration_ms": event.get("dur", 0) / 1000.0,
+            "thread": args.pop("thread", event.get("tid")),
+            "attributes": args
+        })
+    return spans
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    position = fraction * (len(ordered) - 1)
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def summarize(spans: List[Dict[str, Any]], root: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Per-stage latency statistics
+
+    Args:
+        spans: Spans as returned by load_spans()
+        root: Only count traces whose root span has this name
+
+    Returns:
+        One row per span name with count, p50, p95, max and total (ms) and
+        share, the stage's total as a fraction of the root spans' total
+    """
+    if root is not None:
+        traces = {span["trace_id"] for span in spans if span.get("parent_id") is None and span["name"] == root}
+        spans = [span for span in spans if span["trace_id"] in traces]
+
+    durations = {}
+    for span in spans:
+        durations.setdefault(span["name"], []).append(span["duration_ms"])
+    root_total = sum(span["duration_ms"] for span in spans if span.get("parent_id") is None)
+
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        total = sum(values)
+        rows.append({
+            "name": name,
+            "count": len(values),
+            "p50": _percentile(values, 0.50),
+            "p95": _percentile(values, 0.95),
+            "max": values[-1],
+            "total": total,
+            "share": total / root_total if root_total else None
+        })
+    rows.sort(key=lambda row: row["total"], reverse=True)
+    return rows
+
+def format_summary(rows: List[Dict[str, Any]]) -> str:
+    width = max([len("stage")] + [len(row["name"]) for row in rows])
+    lines = [f"{'stage':<{width}}  {'count':>6}  {'p50 ms':>9}  {'p95 ms':>9}  {'max ms':>9}  {'share':>6}"]
+    for row in rows:
+        share = f"{row['share'] * 100:5.1f}%" if row["share"] is not None else "     -"
+        lines.append(f"{row['name']:<{width}}  {row['count']:>6}  {row['p50']:>9.2f}  "
+                     f"{row['p95']:>9.2f}  {row['max']:>9.2f}  {share:>6}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lyra trace tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summarize_parser = subparsers.add_parser("summarize", help="Per-stage p50/p95 latency of a trace file")
+    summarize_parser.add_argument("path", help="JSONL or Chrome trace-event file")
+    summarize_parser.add_argument("--root", help="Only include traces rooted at this span name")
+    summarize_parser.add_argument("--json", action="store_true", help="Print the rows as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        spans = load_spans(args.path)
+    except (OSError, ValueError) as e:
+        print(f"Could not read {args.path}: {e}", file=sys.stderr)
+        return 1
+    rows = summarize(spans, args.root)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        traces = len({span["trace_id"] for span in spans if span.get("parent_id") is None})
+        print(f"{len(spans)} spans in {traces} traces")
+        print(format_summary(rows))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Turn pipeline helpers for Lyra
+Runs the independent stages of a conversation turn concurrently with
+per-stage deadlines, and moves post-turn work onto a bounded background queue.
+"""
+
+import time
+import queue
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Callable, Tuple
+
+from modules.tracing import span, current_trace_id
+
+logger = logging.getLogger("turn_pipeline")
+
+class StageRunner:
+    """
+    Runs named stages in parallel and collects the results that finish in time
+
+    Each stage runs on its own daemon thread, so a turn never waits behind
+    another turn's stages. A stage that misses its deadline or raises
+    contributes None; the turn carries on without it. A late stage keeps
+    running, but its result is discarded. While max_abandoned late runs of a
+    stage are still going, later turns skip that stage instead of piling more
+    threads onto a hung call.
+    """
+
+    def __init__(self, default_deadline: float = 2.0, max_abandoned: int = 1):
+        self.default_deadline = default_deadline
+        self.max_abandoned = max_abandoned
+        self.abandoned: Dict[str, int] = {}  # stage name -> late runs still going
+        self.lock = threading.Lock()
+
+    def _start(self, name: str, fn: Callable[[], Any], start: float,
+               finished: Dict[str, float], state: Dict[str, bool]) -> Future:
+        future = Future()
+
+        def target():
+            try:
+                with span(f"stage.{name}"):
+                    outcome = (future.set_result, fn())
+            except Exception as e:
+                outcome = (future.set_exception, e)
+            finished[name] = time.monotonic() - start
+            with self.lock:
+                state["done"] = True
+                if state["abandoned"]:
+                    self.abandoned[name] -= 1
+                    if not self.abandoned[name]:
+                        del self.abandoned[name]
+            outcome[0](outcome[1])
+
+        # The stage runs in a copy of the caller's context so its span joins the turn's trace
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(target,), name=f"turn-stage-{name}", daemon=True).start()
+        return future
+
+    def run(self, stages: Dict[str, Callable[[], Any]],
+            deadlines: Dict[str, float] = None) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        """
+        Run stages concurrently
+
+        Args:
+            stages: Stage name -> zero-argument callable
+            deadlines: Stage name -> seconds allowed, measured from the start of the run
+
+        Returns:
+            (results, timings) where timings holds each stage's status and duration
+        """
+        deadlines = deadlines or {}
+        start = time.monotonic()
+        finished = {}
+        futures, states, results, timings = {}, {}, {}, {}
+
+        for name, fn in stages.items():
+            with self.lock:
+                hung = self.abandoned.get(name, 0) >= self.max_abandoned
+            if hung:
+                results[name] = None
+                timings[name] = {"status": "skipped", "seconds": 0.0}
+                logger.warning(f"Stage {name} skipped, an earlier run is still going")
+                continue
+            states[name] = {"done": False, "abandoned": False}
+            futures[name] = self._start(name, fn, start, finished, states[name])
+
+        for name, future in futures.items():
+            remaining = start + deadlines.get(name, self.default_deadline) - time.monotonic()
+            try:
+                results[name] = future.result(timeout=max(0.0, remaining))
+                status = "ok"
+            except FutureTimeoutError:
+                with self.lock:
+                    if not states[name]["done"]:
+                        states[name]["abandoned"] = True
+                        self.abandoned[name] = self.abandoned.get(name, 0) + 1
+                results[name] = None
+                status = "timeout"
+                logger.warning(f"Stage {name} missed its {deadlines.get(name, self.default_deadline)}s deadline")
+            except Exception as e:
+                results[name] = None
+                status = "error"
+                logger.error(f"Error in stage {name}: {e}")
+            timings[name] = {
+                "status": status,
+                "seconds": round(finished.get(name, time.monotonic() - start), 4)
+            }
+        return {name: results[name] for name in stages}, {name: timings[name] for name in stages}
+
+    def get_status(self) -> Dict[str, int]:
+        """Late stage runs still going, by stage name"""
+        with self.lock:
+            return dict(self.abandoned)
+
+class PostTurnQueue:
+    """
+    Bounded queue of work to do after a reply has been returned
+
+    submit() waits up to put_timeout for space when the queue is full, which
+    slows producers down, and drops the job if there is still no room.
+
+    Jobs run after the turn's trace has been written, so each one is traced
+    as its own root span that records the turn's trace id.
+    """
+
+    def __init__(self, maxsize: int = 32, put_timeout: float = 0.5):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.put_timeout = put_timeout
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "dropped": 0}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._worker, name="post-turn", daemon=True)
+                self.thread.start()
+
+    def submit(self, job: Callable[[], Any], name: str = "post_turn") -> bool:
+        """Queue a job; returns False if it was dropped because the queue stayed full"""
+        self._ensure_worker()
+        try:
+            self.queue.put((name, job, current_trace_id()), timeout=self.put_timeout)
+        except queue.Full:
+            with self.lock:
+                self.stats["dropped"] += 1
+            logger.warning(f"Post-turn queue full, dropped {name}")
+            return False
+        with self.lock:
+            self.stats["submitted"] += 1
+        return True
+
+    def _worker(self):
+        while True:
+            name, job, turn_trace_id = self.queue.get()
+            try:
+                with span("post_turn", job=name, turn_trace_id=turn_trace_id):
+                    job()
+                outcome = "completed"
+            except Exception as e:
+                logger.error(f"Error in post-turn job {name}: {e}")
+                outcome = "failed"
+            finally:
+                self.queue.task_done()
+            with self.lock:
+                self.stats[outcome] += 1
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait until every queued job has run; returns False on timeout"""
+        with self.queue.all_tasks_done:
+            return self.queue.all_tasks_done.wait_for(lambda: self.queue.unfinished_tasks == 0, timeout)
+
+    def get_status(self) -> Dict[str, Any]:
+        with self.lock:
+            return dict(self.stats, depth=self.queue.qsize(), capacity=self.queue.maxsize)
@@ -1,5 +1,25 @@
 # ...existing code...
 
+def _load_resident_model(model_path, replace=False, **parameters):
+    """
+    Load a GGUF model through the shared ModelManager and make it active
+
+    The web UI, LyraBot and the API all see the same resident instance, so a
+    model is never held in memory twice. Returns the model name, or None if
+    loading failed.
+    """
+    from modules.model_manager import ModelConfig, get_instance as get_model_manager
+    
+    manager = get_model_manager()
+    model_name = os.path.basename(model_path)
+    manager.register_model(ModelConfig(model_name, model_path, "llama", **parameters), replace=replace)
+    return model_name if manager.load_model(model_name) is not None else None
+
+def _format_chat_prompt(messages):
+    """Flatten chat messages into a plain completion prompt"""
+    lines = [f"{'User' if m['role'] == 'user' else 'Lyra'}: {m['content']}" for m in messages]
+    return "\n".join(lines) + "\nLyra:"
+
 def create_models_tab():
     """Create the models tab with better error handling and UI"""
     with gr.Tab("Models"):
@@ -154,30 +174,26 @@ def create_models_tab():
                     if model_info.get("size_gb", 0) < 0.01:
                         return "❌ Model file is too small or empty. Please select a valid model."
                 
-                # Create model config
-                from modules.model import ModelConfig, load_model, is_model_loaded
-                
-                # Check if model is already loaded
-                if is_model_loaded():
-                    from modules.model import unload_model
-                    unload_model()
-                    
-                config = ModelConfig(
-                    model_name=os.path.basename(model_path),
-                    model_path=model_path,
-                    context_size=int(context_size),
-                    gpu_layers=int(gpu_layers),
-                    threads=int(threads),
-                    n_batch=int(n_batch),
-                    lora_path=lora_path if lora_path else "",
-                    mmproj=mmproj if mmproj else "",
-                    rope_freq_base=float(rope_freq_base) if rope_freq_base else 0,
-                    rope_freq_scale=float(rope_freq_scale) if rope_freq_scale else 0,
-                    chat_template=chat_template if chat_template else None
-                )
+                # Other resident models stay loaded until their memory is needed
+                parameters = {
+                    "context_size": int(context_size),
+                    "n_gpu_layers": int(gpu_layers),
+                    "n_threads": int(threads),
+                    "n_batch": int(n_batch)
+                }
+                if lora_path:
+                    parameters["lora_path"] = lora_path
+                if mmproj:
+                    parameters["mmproj"] = mmproj
+                if rope_freq_base:
+                    parameters["rope_freq_base"] = float(rope_freq_base)
+                if rope_freq_scale:
+                    parameters["rope_freq_scale"] = float(rope_freq_scale)
+                if chat_template:
+                    parameters["format"] = chat_template
                 
                 # Load the model
-                success = load_model(config)
+                success = _load_resident_model(model_path, replace=True, **parameters) is not None
                 
                 if success:
                     return "✅ Model loaded successfully"
@@ -189,10 +205,11 @@ def create_models_tab():
         # Function to unload model
         def unload_model():
             try:
-                from modules.model import unload_model, is_model_loaded
+                from modules.model_manager import get_instance as get_model_manager
                 
-                if is_model_loaded():
-                    unload_model()
+                manager = get_model_manager()
+                if manager.active_model:
+                    manager.unload_model()
                     return "✅ Model unloaded"
                 else:
                     return "ℹ️ No model currently loaded"
@@ -1025,28 +1042,19 @@ def create_texting_tab():
             history.append((message, ""))
             
             try:
-                # Check if the model is loaded, if not load it
-                from modules.model import get_model, load_model, ModelConfig, is_model_loaded
+                # Load the model if it is not resident already
+                from modules.model_manager import get_instance as get_model_manager
                 
-                current_model = get_model()
-                if not is_model_loaded() or (current_model and current_model.model_config.model_path != model_path):
-                    # Load the selected model
-                    config = ModelConfig(
-                        model_name=os.path.basename(model_path),
-                        model_path=model_path,
-                        context_size=4096,
-                        gpu_layers=40,  # Default value, can be adjusted
-                        threads=4,
-                        n_batch=512
-                    )
-                    
-                    success = load_model(config)
-                    if not success:
-                        history[-1] = (message, "Failed to load the texting model.")
-                        return history, ""
-                        
-                # Get the model instance
-                model = get_model()
+                model_name = _load_resident_model(
+                    model_path,
+                    context_size=4096,
+                    n_gpu_layers=40,  # Default value, can be adjusted
+                    n_threads=4,
+                    n_batch=512
+                )
+                if model_name is None:
+                    history[-1] = (message, "Failed to load the texting model.")
+                    return history, ""
                 
                 # Process special phrase
                 if message.lower().strip() == "frogger frogger frogger":
@@ -1082,14 +1090,15 @@ def create_texting_tab():
                     
                     messages = context_messages + messages
                 
-                # Get response from model
-                from modules.api.chat import chat_completion
-                response_data, status_code = chat_completion(messages, model)
-                
-                if status_code == 200 and "response" in response_data:
-                    response = response_data["response"]
-                else:
-                    response = f"Error: {response_data.get('error', 'Unknown error')}"
+                # Get response from the resident model through the scheduler
+                response = get_model_manager().generate(
+                    _format_chat_prompt(messages),
+                    model_name=model_name,
+                    temperature=0.7,
+                    top_p=0.9,
+                    top_k=40,
+                    max_tokens=1024
+                )
                 
                 # Update history with response
                 history[-1] = (message, response)
@@ -297,6 +297,8 @@ def main():
     parser.add_argument("--use-core-model", action="store_true", help="Use core LLM for text generation")
     parser.add_argument("--telegram", action="store_true", help="Enable Telegram bot integration")
     parser.add_argument("--disable-boredom", action="store_true", help="Disable boredom checker")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Initialize modules, print per-module import/init timings and exit")
     args = parser.parse_args()
 
     # Get the directory this script is in
@@ -315,6 +317,14 @@ def main():
         test_models_local()
         return
 
+    # Profile module startup if requested
+    if args.profile_startup:
+        from modules.module_registry import get_registry
+        registry = get_registry()
+        registry.load_all_modules()
+        print(registry.get_startup_report())
+        return
+
     # Initialize cognitive modules - ALWAYS initialize extended thinking
     initialize_cognitive_modules()
     
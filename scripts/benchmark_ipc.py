@@ -0,0 +1,123 @@
+"""
+Throughput and latency benchmark for the persistent-process IPC server.
+
+Starts an IPCServer on a local Unix socket (or TCP where Unix sockets are
+unavailable) with a handler that simulates work, then drives it from several
+clients, each keeping a number of pipelined requests in flight.
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmark_ipc")
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from modules.ipc import IPCServer, IPCClient
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_benchmark(clients=4, requests=2000, pipeline=8, payload_bytes=256, work_ms=0.0, workers=8):
+    """Run the benchmark and return a dict of results"""
+    tmpdir = tempfile.mkdtemp()
+    use_unix = hasattr(__import__("socket"), "AF_UNIX")
+    unix_path = os.path.join(tmpdir, "lyra_ipc.sock") if use_unix else None
+
+    def handler(params, emit):
+        if work_ms:
+            time.sleep(work_ms / 1000.0)
+        return params
+
+    server = IPCServer({"echo": handler}, port=None if use_unix else 0, unix_path=unix_path,
+                       max_workers=workers, max_pending=max(64, clients * pipeline))
+    if not server.start():
+        raise RuntimeError("Could not start IPC server")
+
+    payload = {"text": "x" * payload_bytes}
+    per_client = requests // clients
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def drive():
+        client = IPCClient(port=server.port, unix_path=unix_path).connect()
+        window = threading.Semaphore(pipeline)
+        done = threading.Event()
+        remaining = [per_client]
+        local = []
+        lock = threading.Lock()
+
+        def finished(started):
+            def callback(future):
+                local.append(time.perf_counter() - started)
+                window.release()
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        done.set()
+            return callback
+
+        for _ in range(per_client):
+            window.acquire()
+            started = time.perf_counter()
+            client.submit("echo", payload).add_done_callback(finished(started))
+        done.wait(120)
+        client.close()
+        with latencies_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=drive) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.stop()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        "transport": "unix" if use_unix else "tcp",
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Lyra IPC server")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent client connections")
+    parser.add_argument("--requests", type=int, default=2000, help="Total requests")
+    parser.add_argument("--pipeline", type=int, default=8, help="Requests in flight per client")
+    parser.add_argument("--payload-bytes", type=int, default=256, help="Size of each request payload")
+    parser.add_argument("--work-ms", type=float, default=0.0, help="Simulated handler time")
+    parser.add_argument("--workers", type=int, default=8, help="Server handler threads")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.clients, args.requests, args.pipeline, args.payload_bytes,
+                            args.work_ms, args.workers)
+    logger.info(
+        f"{results['requests']} requests over {results['transport']} in {results['seconds']:.2f}s: "
+        f"{results['requests_per_second']:.0f} req/s, p50 {results['p50_ms']:.2f} ms, "
+        f"p95 {results['p95_ms']:.2f} ms, p99 {results['p99_ms']:.2f} ms"
+    )
+
+if __name__ == "__main__":
+    main()
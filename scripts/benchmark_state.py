@@ -0,0 +1,144 @@
+"""
+Save latency benchmark for the state manager.
+
+Several components update one key of a large state and save it from their own
+threads. The journaled StateManager, either diffing the whole state or told
+which key changed, is compared with the previous scheme: a full json.dump of
+the component state (after renaming the old file to a backup) under one
+global lock.
+"""
+import argparse
+import json
+import logging
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmark_state")
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.state_manager import StateManager
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class FullRewriteSaver:
+    """The previous save path: backup rename plus full rewrite under a global lock"""
+
+    def __init__(self, data_dir):
+        self.data_dir = Path(data_dir)
+        self.lock = threading.RLock()
+        self.getters = {}
+
+    def register_component(self, component_id, get_state_func, set_state_func=None):
+        self.getters[component_id] = get_state_func
+
+    def save_state(self, component_id, keys=None):
+        with self.lock:
+            state = {"component_id": component_id, "timestamp": time.time(), "version": "1.0",
+                     "state": self.getters[component_id]()}
+            state_file = self.data_dir / f"{component_id}.json"
+            backup_file = self.data_dir / f"{component_id}.backup.json"
+            if state_file.exists():
+                if backup_file.exists():
+                    backup_file.unlink()
+                state_file.rename(backup_file)
+            with open(state_file, 'w') as f:
+                json.dump(state, f, indent=2)
+            return True
+
+    def close(self):
+        pass
+
+def run_benchmark(mode="journal", components=4, saves=200, keys=200, value_bytes=200, fsync=True):
+    """Run the benchmark and return a dict of results"""
+    tmpdir = tempfile.mkdtemp()
+    if mode in ("journal", "journal-keys"):
+        manager = StateManager(data_dir=tmpdir, fsync=fsync)
+    else:
+        manager = FullRewriteSaver(tmpdir)
+
+    states = []
+    for i in range(components):
+        state = {f"key_{k}": "x" * value_bytes for k in range(keys)}
+        states.append(state)
+        manager.register_component(f"component_{i}", lambda state=state: dict(state))
+
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def drive(index):
+        state = states[index]
+        local = []
+        for n in range(saves):
+            key = f"key_{n % keys}"
+            state[key] = f"{n}-" + "y" * value_bytes
+            started = time.perf_counter()
+            manager.save_state(f"component_{index}", keys=[key] if mode == "journal-keys" else None)
+            local.append(time.perf_counter() - started)
+        with latencies_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=drive, args=(i,)) for i in range(components)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # Time until everything is durable, which the journal defers to its writer
+    drain_started = time.perf_counter()
+    manager.close()
+    drain = time.perf_counter() - drain_started
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        "mode": mode,
+        "saves": len(latencies),
+        "seconds": elapsed,
+        "drain_seconds": drain,
+        "saves_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark state manager save latency")
+    parser.add_argument("--mode", choices=["journal", "journal-keys", "full", "all"], default="all",
+                        help="Journaled saves (diffing the whole state or given the changed keys), "
+                             "the previous full rewrite, or all of them")
+    parser.add_argument("--components", type=int, default=4, help="Components saving concurrently")
+    parser.add_argument("--saves", type=int, default=200, help="Saves per component")
+    parser.add_argument("--keys", type=int, default=200, help="Keys in each component state")
+    parser.add_argument("--value-bytes", type=int, default=200, help="Size of each value")
+    parser.add_argument("--no-fsync", action="store_true", help="Skip fsync in the journaled store")
+    args = parser.parse_args()
+
+    modes = ["journal", "journal-keys", "full"] if args.mode == "all" else [args.mode]
+    for mode in modes:
+        results = run_benchmark(mode, args.components, args.saves, args.keys, args.value_bytes,
+                                fsync=not args.no_fsync)
+        logger.info(
+            f"{results['mode']}: {results['saves']} saves in {results['seconds']:.2f}s "
+            f"({results['saves_per_second']:.0f}/s), p50 {results['p50_ms']:.2f} ms, "
+            f"p95 {results['p95_ms']:.2f} ms, p99 {results['p99_ms']:.2f} ms, "
+            f"drain {results['drain_seconds'] * 1000:.0f} ms"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -162,6 +162,15 @@ def launch_server(model_name=None, port=8080, model_manager=None, **kwargs):
     if "grammar_file" in kwargs and kwargs["grammar_file"]:
         cmd.extend(["--grammar-file", kwargs["grammar_file"]])
     
+    # Pin the server to a set of CPUs so pooled workers do not share cores
+    preexec_fn = None
+    cpu_set = kwargs.get("cpu_set")
+    if cpu_set:
+        if not kwargs.get("n_threads"):
+            cmd.extend(["--threads", str(len(cpu_set))])
+        if hasattr(os, "sched_setaffinity"):
+            preexec_fn = lambda: os.sched_setaffinity(0, cpu_set)
+    
     # Launch the server
     logger.info(f"Launching llama-server with command: {' '.join(cmd)}")
     
@@ -171,7 +180,8 @@ def launch_server(model_name=None, port=8080, model_manager=None, **kwargs):
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         text=True,
-        bufsize=1
+        bufsize=1,
+        preexec_fn=preexec_fn
     )
     
     # Register cleanup handler
@@ -202,6 +212,34 @@ def launch_server(model_name=None, port=8080, model_manager=None, **kwargs):
         kill_server()
         return None
 
+def launch_pool(model_name=None, size=2, base_port=8080, model_manager=None, **kwargs):
+    """
+    Launch `size` llama-server workers on consecutive ports, each pinned to
+    its own share of the CPUs, behind a health-checked load balancer.
+    
+    Returns:
+        A started LlamaServerPool, or None if no worker became healthy
+    """
+    from modules.llm_providers.llama_server_pool import LlamaServerPool, plan_workers
+    
+    if model_manager is None:
+        model_manager = ModelManager()
+    
+    def launcher(worker):
+        return launch_server(
+            model_name=model_name,
+            port=worker.port,
+            model_manager=model_manager,
+            cpu_set=worker.cpu_set,
+            **kwargs
+        )
+    
+    pool = LlamaServerPool(plan_workers(size, base_port), launcher=launcher)
+    if not pool.start():
+        pool.shutdown()
+        return None
+    return pool
+
 def main():
     parser = argparse.ArgumentParser(description="Launch llama-server for Lyra models")
     parser.add_argument("--model", "-m", type=str, help="Name of the model to use")
@@ -211,6 +249,7 @@ def main():
     parser.add_argument("--n-parallel", "-np", type=int, default=1, help="Number of parallel inference requests")
     parser.add_argument("--n-threads", "-t", type=int, default=0, help="Number of threads (0=auto)")
     parser.add_argument("--grammar-file", "-g", type=str, help="Path to a grammar file")
+    parser.add_argument("--pool-size", type=int, default=1, help="Number of server workers, each on its own port and CPU set")
     args = parser.parse_args()
     
     # Initialize model manager
@@ -253,6 +292,30 @@ def main():
     if args.grammar_file:
         kwargs["grammar_file"] = args.grammar_file
     
+    if args.pool_size > 1:
+        pool = launch_pool(
+            model_name=args.model,
+            size=args.pool_size,
+            base_port=args.port,
+            model_manager=model_manager,
+            **kwargs
+        )
+        if pool is None:
+            print("Failed to start llama-server pool. Check the logs for details.")
+            return 1
+        
+        print(f"\nllama-server pool running with {len(pool.workers)} workers:")
+        for worker in pool.workers:
+            print(f"  {worker.url} (CPUs: {worker.cpu_set})")
+        print("\nPress Ctrl+C to stop the servers...")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\nStopping servers...")
+            pool.shutdown()
+        return 0
+    
     # Launch server
     server_process = launch_server(
         model_name=args.model,
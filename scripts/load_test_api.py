@@ -0,0 +1,209 @@
+"""
+Load test for the Lyra API server.
+
+Starts LyraAPI in-process with a stub chat interface and stub deep memory (so
+no model is needed), then drives it from concurrent client threads and
+reports throughput, tail latency and how many requests were turned away with
+429. Exits non-zero if --max-p95-ms or --max-error-rate is exceeded, so it can
+gate CI.
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("load_test_api")
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from api_server import LyraAPI
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class StubChatInterface:
+    """Stands in for LyraBot: sleeps like a model would, streaming in chunks"""
+
+    def __init__(self, latency=0.05, chunks=8):
+        self.latency = latency
+        self.chunks = chunks
+
+    def chat_stream(self, message, priority="api", caller=None):
+        for i in range(self.chunks):
+            time.sleep(self.latency / self.chunks)
+            yield f"word{i} "
+
+    def chat(self, message, priority="api", caller=None):
+        return "".join(self.chat_stream(message, priority, caller))
+
+class StubMemory:
+    def __init__(self, latency=0.005):
+        self.latency = latency
+
+    def recall_similar(self, query, limit=5):
+        time.sleep(self.latency)
+        return [{"content": f"memory about {query}", "score": 1.0 / (i + 1)} for i in range(limit)]
+
+MIX = {
+    "chat": 0.4,
+    "stream": 0.3,
+    "recall": 0.2,
+    "batch": 0.1
+}
+
+def _request(session, base_url, kind, n):
+    """Send one request; returns (status, first_byte_seconds or None)"""
+    started = time.perf_counter()
+    if kind == "chat":
+        response = session.post(f"{base_url}/api/chat", json={"message": f"hello {n}", "user_id": f"user{n % 8}"})
+        return response.status_code, None
+    if kind == "recall":
+        response = session.post(f"{base_url}/api/memory/recall", json={"query": f"topic {n}", "limit": 3})
+        return response.status_code, None
+    if kind == "batch":
+        response = session.post(f"{base_url}/api/batch", json={"requests": [
+            {"type": "recall", "query": f"topic {n}"},
+            {"type": "chat", "message": f"hello {n}"},
+            {"type": "recall", "query": f"other {n}"}
+        ]})
+        return response.status_code, None
+
+    first_token = None
+    with session.post(f"{base_url}/api/chat", json={"message": f"hello {n}", "stream": True},
+                      stream=True) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        for line in response.iter_lines():
+            if first_token is None and line.startswith(b"event: token"):
+                first_token = time.perf_counter() - started
+            if line.startswith(b"event: done"):
+                break
+            if line.startswith(b"event: error"):
+                return 500, first_token
+    return 200, first_token
+
+def run_load_test(clients=16, requests_per_client=25, latency=0.05, max_concurrent=4, max_pending=16,
+                  mix=None, seed=0):
+    """Run the load test and return a dict of results"""
+    mix = mix or MIX
+    api = LyraAPI(
+        lyra_interface=StubChatInterface(latency),
+        modules={"deep_memory": StubMemory()},
+        load_modules=False,
+        max_concurrent=max_concurrent,
+        max_pending=max_pending
+    )
+    base_url = f"http://127.0.0.1:{api.start_background(port=0)}"
+
+    samples = []
+    samples_lock = threading.Lock()
+
+    def drive(index):
+        rng = random.Random(seed + index)
+        kinds, weights = zip(*mix.items())
+        local = []
+        with requests.Session() as session:
+            for n in range(requests_per_client):
+                kind = rng.choices(kinds, weights)[0]
+                started = time.perf_counter()
+                try:
+                    status, first_token = _request(session, base_url, kind, n)
+                except requests.RequestException:
+                    status, first_token = 0, None
+                local.append((kind, status, time.perf_counter() - started, first_token))
+        with samples_lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=drive, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server_metrics = requests.get(f"{base_url}/api/server/metrics").json()
+    api.stop()
+
+    ok = [sample for sample in samples if sample[1] == 200]
+    rejected = sum(1 for sample in samples if sample[1] == 429)
+    errors = len(samples) - len(ok) - rejected
+    latencies = [sample[2] for sample in ok]
+    first_tokens = [sample[3] for sample in ok if sample[3] is not None]
+    per_kind = {}
+    for kind in mix:
+        kind_latencies = [sample[2] for sample in ok if sample[0] == kind]
+        per_kind[kind] = {
+            "count": len(kind_latencies),
+            "p50_ms": percentile(kind_latencies, 0.50) * 1000,
+            "p95_ms": percentile(kind_latencies, 0.95) * 1000
+        }
+
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "rejected": rejected,
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "seconds": elapsed,
+        "requests_per_second": len(ok) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "first_token_p95_ms": percentile(first_tokens, 0.95) * 1000,
+        "per_kind": per_kind,
+        "server": server_metrics
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Lyra API server with a stub model")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent client threads")
+    parser.add_argument("--requests", type=int, default=25, help="Requests per client")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub generation time in seconds")
+    parser.add_argument("--max-concurrent", type=int, default=4, help="Server admission: requests running at once")
+    parser.add_argument("--max-pending", type=int, default=16, help="Server admission: requests waiting")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail if p95 latency exceeds this")
+    parser.add_argument("--max-error-rate", type=float, default=0.0,
+                        help="Fail if more than this fraction of requests error (429s are not errors)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = run_load_test(args.clients, args.requests, args.latency, args.max_concurrent, args.max_pending)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        logger.info(
+            f"{results['ok']}/{results['requests']} ok in {results['seconds']:.2f}s "
+            f"({results['requests_per_second']:.1f} req/s), {results['rejected']} rejected with 429, "
+            f"{results['errors']} errors"
+        )
+        logger.info(
+            f"latency p50 {results['p50_ms']:.1f} ms, p95 {results['p95_ms']:.1f} ms, "
+            f"p99 {results['p99_ms']:.1f} ms, stream first token p95 {results['first_token_p95_ms']:.1f} ms"
+        )
+        for kind, stats in results["per_kind"].items():
+            logger.info(f"  {kind}: {stats['count']} ok, p50 {stats['p50_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms")
+
+    failed = results["error_rate"] > args.max_error_rate
+    if args.max_p95_ms is not None and results["p95_ms"] > args.max_p95_ms:
+        failed = True
+    if failed:
+        logger.error("Load test thresholds exceeded")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
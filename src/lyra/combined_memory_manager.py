@@ -1,6 +1,10 @@
 import os
 import json
+import queue
+import hashlib
+import threading
 import numpy as np
+from collections import OrderedDict
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 
@@ -59,6 +63,25 @@ except ImportError:
     print("Warning: Sentence-transformers not found. Using random embeddings.")
     SENTENCE_TRANSFORMERS_AVAILABLE = False
 
+try:
+    from modules.response_cache import get_instance as get_response_cache
+except ImportError:
+    get_response_cache = None
+
+try:
+    from modules.inference_scheduler import get_scheduler
+except ImportError:
+    get_scheduler = None
+
+try:
+    from modules.tracing import span, traced
+except ImportError:
+    from contextlib import nullcontext
+    def span(name, **attributes):
+        return nullcontext()
+    def traced(name=None):
+        return lambda func: func
+
 # Import config
 try:
     from lyra.config import get_config
@@ -68,16 +91,33 @@ except ImportError:
     print("Warning: Config module not found. Using default settings.")
 
 class CombinedMemoryManager:
+    # Retrieved-set summaries kept in memory
+    SUMMARY_CACHE_SIZE = 256
+    # Most recent entry ids remembered as covered by the rolling summary
+    SUMMARIZED_IDS_SIZE = 4096
+    
     def __init__(self):
         """
         Initialize the combined memory manager that integrates multiple storage systems.
         """
         print("Initializing Combined Memory Manager...")
+        
+        # Summaries are produced by a background worker, never on the request path.
+        # The rolling summary covers recent turns and is extended incrementally;
+        # summaries of retrieved sets are cached by a hash of the set.
+        self.rolling_summary = ""
+        self.summarized_ids = OrderedDict()
+        self.summary_cache = OrderedDict()
+        self.summary_lock = threading.Lock()
+        self.summary_queue = queue.Queue()
+        self.pending_sets = set()
+        
         json_file = os.path.join(os.getcwd(), "conversation_history.json")
         self.json_manager = JSONMemoryManager(file_path=json_file)
         self.faiss_manager = FAISSMemoryManager(dim=384, index_file="faiss_index.bin")
         
         # Use conversation chain based on config
+        model_path = None
         if CONFIG_AVAILABLE:
             config = get_config()
             use_local_llm = config.get("llm", "use_local_llm", True)
@@ -85,6 +125,8 @@ class CombinedMemoryManager:
             self.conversation_chain = create_conversation_chain(model_path=model_path)
         else:
             self.conversation_chain = create_conversation_chain()
+        # Scheduler queue for summary generation, shared with chats on the same model
+        self.summary_model_key = os.path.splitext(os.path.basename(model_path))[0] if model_path else "conversation_chain"
         
         # Load sentence transformer model for embeddings
         self.embedding_model = None
@@ -99,7 +141,21 @@ class CombinedMemoryManager:
                 print(f"Sentence transformer model loaded successfully: {model_name}")
             except Exception as e:
                 print(f"Error loading sentence transformer: {e}")
+        
+        # Summaries are sampled, so reusing them across restarts is opt-in. Near-duplicate
+        # prompts can be matched by embedding when a sentence transformer is loaded.
+        self.cache_sampled_summaries = False
+        semantic_cache = True
+        if CONFIG_AVAILABLE:
+            self.cache_sampled_summaries = get_config().get("memory", "cache_sampled_summaries", False)
+            semantic_cache = get_config().get("memory", "semantic_response_cache", True)
+        if get_response_cache is not None and semantic_cache and self.embedding_model is not None:
+            get_response_cache().enable_semantic(self.embedding_model.encode)
+        
+        self.summary_thread = threading.Thread(target=self._summary_worker, name="memory-summary", daemon=True)
+        self.summary_thread.start()
                 
+    @traced("memory.add_memory")
     def add_memory(self, user_message: str, bot_response: str, tags: Optional[List[str]] = None, conversation_id: Optional[str] = None):
         """
         Add a memory entry to all storage systems.
@@ -143,6 +199,9 @@ class CombinedMemoryManager:
         except Exception as e:
             print(f"Error adding to FAISS: {e}")
         
+        # Fold the new turn into the rolling summary after the reply has gone out
+        self.summary_queue.put(("turn", memory_entry))
+        
     def text_to_embedding(self, text: str) -> np.ndarray:
         """
         Convert text to embedding vector.
@@ -164,6 +223,7 @@ class CombinedMemoryManager:
         print("Using fallback random embedding")
         return np.random.rand(384)
         
+    @traced("memory.get_context")
     def get_context(self, query_text: str, k: int = 5) -> Dict[str, Any]:
         """
         Get relevant context based on a query text.
@@ -176,8 +236,10 @@ class CombinedMemoryManager:
             Dictionary with context and summary
         """
         try:
-            query_embedding = self.text_to_embedding(query_text)
-            distances, results = self.faiss_manager.search(query_embedding, k=k)
+            with span("memory.embed"):
+                query_embedding = self.text_to_embedding(query_text)
+            with span("memory.search", k=k):
+                distances, results = self.faiss_manager.search(query_embedding, k=k)
 
             if not results:
                 return {"context": [], "summary": "No relevant context found."}
@@ -201,16 +263,138 @@ class CombinedMemoryManager:
             results.sort(key=lambda x: x.get("score", 0), reverse=True)
             unique_results = self.faiss_manager.deduplicate_entries(results)
 
-            try:
-                summary = self.conversation_chain.run(f"Summarize these past conversations: {unique_results}")
-            except:
-                summary = "Could not generate summary."
-
-            return {"context": unique_results, "summary": summary}
+            return {"context": unique_results, "summary": self._get_summary(unique_results)}
         except Exception as e:
             print(f"Error retrieving context: {e}")
             return {"context": [], "summary": "Error retrieving context."}
 
+    @staticmethod
+    def _entry_id(entry: Dict[str, Any]) -> str:
+        return f"{entry.get('timestamp', '')}|{entry.get('user', '')}"
+    
+    @staticmethod
+    def _format_entries(entries: List[Dict[str, Any]]) -> str:
+        return "\n".join(f"User: {e.get('user', '')}\nLyra: {e.get('bot', '')}" for e in entries)
+    
+    def _get_summary(self, entries: List[Dict[str, Any]]) -> str:
+        """
+        Return the best summary available right now without calling the LLM.
+        
+        A cached summary of exactly this retrieved set is served if present;
+        otherwise the latest rolling summary is returned and the set is
+        summarised in the background for next time. Sets the rolling summary
+        already covers are not summarised separately.
+        """
+        entry_ids = sorted(self._entry_id(e) for e in entries)
+        set_hash = hashlib.sha256("\n".join(entry_ids).encode("utf-8")).hexdigest()
+        
+        with self.summary_lock:
+            summary = self.summary_cache.get(set_hash)
+            if summary is not None:
+                self.summary_cache.move_to_end(set_hash)
+                return summary
+            if self.rolling_summary and all(entry_id in self.summarized_ids for entry_id in entry_ids):
+                return self.rolling_summary
+            if set_hash not in self.pending_sets:
+                self.pending_sets.add(set_hash)
+                self.summary_queue.put(("set", set_hash, entries))
+            return self.rolling_summary or "No summary available yet."
+    
+    def _summarize(self, prompt: str) -> str:
+        def generate():
+            # Summaries yield to chats and API calls waiting on the same model
+            if get_scheduler is None:
+                return self.conversation_chain.run(prompt)
+            return get_scheduler().run(
+                self.summary_model_key,
+                lambda: self.conversation_chain.run(prompt),
+                priority="background",
+                caller="memory_summary"
+            )
+        
+        if get_response_cache is not None:
+            return get_response_cache().cached_call(
+                "conversation_chain", prompt, {},
+                generate,
+                allow_sampled=self.cache_sampled_summaries
+            )
+        return generate()
+    
+    def _summary_worker(self):
+        """Background loop that keeps summaries up to date."""
+        while True:
+            job = self.summary_queue.get()
+            
+            # Batch every queued turn into one incremental update
+            turns, sets = [], []
+            while True:
+                if job[0] == "turn":
+                    turns.append(job[1])
+                else:
+                    sets.append(job)
+                try:
+                    job = self.summary_queue.get_nowait()
+                except queue.Empty:
+                    break
+            
+            try:
+                if turns:
+                    self._update_rolling_summary(turns)
+                for _, set_hash, entries in sets:
+                    self._summarize_set(set_hash, entries)
+            except Exception as e:
+                print(f"Error updating memory summary: {e}")
+            finally:
+                with self.summary_lock:
+                    for _, set_hash, _ in sets:
+                        self.pending_sets.discard(set_hash)
+    
+    def _update_rolling_summary(self, turns: List[Dict[str, Any]]):
+        """Extend the rolling summary with new turns instead of re-summarising everything."""
+        with self.summary_lock:
+            previous = self.rolling_summary
+        
+        if previous:
+            prompt = (
+                f"Here is a summary of the conversation so far:\n{previous}\n\n"
+                f"Update it to also cover these new exchanges, keeping it concise:\n{self._format_entries(turns)}"
+            )
+        else:
+            prompt = f"Summarize these past conversations: {self._format_entries(turns)}"
+        summary = self._summarize(prompt)
+        
+        with self.summary_lock:
+            self.rolling_summary = summary
+            for turn in turns:
+                entry_id = self._entry_id(turn)
+                self.summarized_ids[entry_id] = True
+                self.summarized_ids.move_to_end(entry_id)
+            # Forgotten ids only make a set summary include those entries again
+            while len(self.summarized_ids) > self.SUMMARIZED_IDS_SIZE:
+                self.summarized_ids.popitem(last=False)
+    
+    def _summarize_set(self, set_hash: str, entries: List[Dict[str, Any]]):
+        """Summarise a retrieved set, reusing the rolling summary for entries it already covers."""
+        with self.summary_lock:
+            rolling = self.rolling_summary
+            new_entries = [e for e in entries if self._entry_id(e) not in self.summarized_ids]
+        
+        if not new_entries and rolling:
+            summary = rolling
+        elif rolling and len(new_entries) < len(entries):
+            summary = self._summarize(
+                f"Here is a summary of earlier conversations:\n{rolling}\n\n"
+                f"Write a concise summary that also covers these exchanges:\n{self._format_entries(new_entries)}"
+            )
+        else:
+            summary = self._summarize(f"Summarize these past conversations: {self._format_entries(entries)}")
+        
+        with self.summary_lock:
+            self.summary_cache[set_hash] = summary
+            self.summary_cache.move_to_end(set_hash)
+            while len(self.summary_cache) > self.SUMMARY_CACHE_SIZE:
+                self.summary_cache.popitem(last=False)
+
 if __name__ == "__main__":
     cmm = CombinedMemoryManager()
     cmm.add_memory("Test", "Test response", ["important"])
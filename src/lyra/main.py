@@ -29,6 +29,16 @@ except ImportError:
         def detect_tags(text: str) -> List[str]:
             return []
 
+# Per-turn tracing (optional); see modules/tracing.py
+try:
+    from modules.tracing import span, traced
+except ImportError:
+    from contextlib import nullcontext
+    def span(name, **attributes):
+        return nullcontext()
+    def traced(name=None):
+        return lambda func: func
+
 # Try to import video generation (optional)
 try:
     from lyra.video_generation import generate_video
@@ -178,6 +188,7 @@ class Lyra:
         return {"suggestions": self.self_improvement.get_improvement_suggestions()}
     
     # Add the capability router to the process_input method
+    @traced("lyra.process_input")
     def process_input(self, user_input: str) -> str:
         """
         Process user input and generate a response
@@ -191,7 +202,8 @@ class Lyra:
         self.interaction_count += 1
         
         # Check for capability routing first
-        route_result = self.capability_router.route_request(user_input)
+        with span("capability_route"):
+            route_result = self.capability_router.route_request(user_input)
         if route_result["success"]:
             # A capability was found and executed successfully
             result = route_result["result"]
@@ -210,8 +222,10 @@ class Lyra:
             return self._handle_video_command(user_input[7:])
         
         # Detect sentiment and tags
-        sentiment = TextBlob(user_input).sentiment
-        tags = detect_tags(user_input)
+        with span("sentiment"):
+            sentiment = TextBlob(user_input).sentiment
+        with span("detect_tags"):
+            tags = detect_tags(user_input)
         
         # Get relevant context from memory
         memory_data = self.memory_manager.get_context(user_input, k=3)
@@ -236,7 +250,8 @@ class Lyra:
             context_type = "creative"
             
         # Adjust personality based on sentiment
-        self.personality_engine.adjust_personality(user_input, sentiment.polarity)
+        with span("personality"):
+            self.personality_engine.adjust_personality(user_input, sentiment.polarity)
         
         # Build enriched prompt
         tag_str = ", ".join(tags) if tags else "none"
@@ -251,25 +266,28 @@ class Lyra:
         )
         
         # Generate response using local model instead of OpenAI
-        response = get_response(
-            prompt=enriched_prompt,
-            temperature=0.9 + (self.personality_engine.current_mood["arousal"] * 0.3),  # Higher arousal = more randomness
-            context_type=context_type
-        )
+        with span("get_response", context_type=context_type, prompt_chars=len(enriched_prompt)):
+            response = get_response(
+                prompt=enriched_prompt,
+                temperature=0.9 + (self.personality_engine.current_mood["arousal"] * 0.3),  # Higher arousal = more randomness
+                context_type=context_type
+            )
         
         # Save to memory systems
-        bot_tags = detect_tags(response)
+        with span("detect_tags"):
+            bot_tags = detect_tags(response)
         combined_tags = list(set(tags + bot_tags))
         
         self.memory_manager.add_memory(user_input, response, combined_tags)
         
         # Log to SQL backend
-        log_conversation(
-            user_input, 
-            response, 
-            tags=combined_tags,
-            sentiment={"polarity": sentiment.polarity, "subjectivity": sentiment.subjectivity}
-        )
+        with span("log_conversation"):
+            log_conversation(
+                user_input, 
+                response, 
+                tags=combined_tags,
+                sentiment={"polarity": sentiment.polarity, "subjectivity": sentiment.subjectivity}
+            )
         
         # If we've had at least 3 interactions, perform self-reflection occasionally
         if self.interaction_count % 5 == 0 and self.interaction_count >= 3:
@@ -330,6 +348,7 @@ class Lyra:
             print(f"Error generating video: {e}")
             return f"Error generating video: {str(e)}"
 
+    @traced("reflection")
     def _perform_background_reflection(self, user_input: str, bot_response: str, tags: List[str]) -> None:
         """
         Perform background self-reflection and learning from the conversation
@@ -0,0 +1,444 @@
+"""
+Resumable, parallel downloads for model files
+
+Large files are fetched with HTTP Range requests over several connections
+into a preallocated "<target>.part" file. Progress is checkpointed to a
+"<target>.part.json" manifest, so an interrupted download resumes where it
+stopped. The file is hashed while it downloads, and the hash is ready as
+soon as the last byte has arrived. Servers that ignore Range get a single
+streamed request.
+"""
+import os
+import json
+import errno
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, List
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOWNLOAD_SETTINGS = {
+    "connections": 4,
+    "chunk_size": 1 << 20,          # bytes read from the socket at a time
+    "min_part_size": 16 << 20,      # don't split files into parts smaller than this
+    "checkpoint_bytes": 8 << 20,    # progress written to the manifest every this many bytes per part
+    "retries": 3,                   # per part, with exponential backoff
+    "timeout": 30.0
+}
+
+MANIFEST_VERSION = 1
+
+class DownloadError(Exception):
+    """Raised when a download fails or does not verify; partial progress is kept when resumable"""
+
+def _new_hash(hash_type: str):
+    if hash_type not in ("md5", "sha256"):
+        raise ValueError(f"Unsupported hash type: {hash_type}")
+    return hashlib.new(hash_type)
+
+class _FrontierHasher:
+    """
+    Hashes the file in order as the downloaded prefix grows
+
+    Parts finish out of order, so a background thread follows the contiguous
+    prefix written so far, reading it back while it is still in the page cache.
+    """
+
+    def __init__(self, path: str, hash_type: str, frontier: Callable[[], int], total: int):
+        self.path = path
+        self.hash = _new_hash(hash_type)
+        self.frontier = frontier
+        self.total = total
+        self.hashed = 0
+        self.wakeup = threading.Event()
+        self.stop = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="download-hasher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def _run(self):
+        try:
+            # Unbuffered, so no read-ahead can cache bytes that are not written yet
+            with open(self.path, "rb", buffering=0) as f:
+                while self.hashed < self.total and not self.stop.is_set():
+                    available = self.frontier()
+                    if available <= self.hashed:
+                        self.wakeup.wait(0.5)
+                        self.wakeup.clear()
+                        continue
+                    f.seek(self.hashed)
+                    while self.hashed < available:
+                        data = f.read(min(1 << 20, available - self.hashed))
+                        if not data:
+                            break
+                        self.hash.update(data)
+                        self.hashed += len(data)
+        except Exception as e:
+            self.error = e
+
+    def finish(self, timeout: float = None) -> str:
+        self.notify()
+        self.thread.join(timeout)
+        if self.error:
+            raise DownloadError(f"Error hashing download: {self.error}")
+        if self.hashed != self.total:
+            raise DownloadError(f"Hashed {self.hashed} of {self.total} bytes")
+        return self.hash.hexdigest()
+
+    def cancel(self):
+        self.stop.set()
+        self.notify()
+        self.thread.join()
+
+class ParallelDownloader:
+    """Downloads one URL at a time with ranged, resumable, verified transfers"""
+
+    def __init__(self, progress: Optional[Callable[[int], None]] = None, **settings):
+        """
+        Initialize the downloader
+
+        Args:
+            progress: Called with the number of bytes received, from worker threads
+            **settings: Overrides for DEFAULT_DOWNLOAD_SETTINGS
+        """
+        self.settings = dict(DEFAULT_DOWNLOAD_SETTINGS, **settings)
+        self.progress = progress
+        self.manifest_lock = threading.Lock()
+        self.progress_lock = threading.Lock()
+
+    def download(self, url: str, target_path: str, expected_hash: Optional[str] = None,
+                 hash_type: str = "sha256", headers: Dict[str, str] = None) -> Dict[str, Any]:
+        """
+        Download url to target_path
+
+        Args:
+            url: File URL
+            target_path: Where the finished file goes
+            expected_hash: Hex digest the file must match
+            hash_type: md5 or sha256
+            headers: Extra request headers (e.g. authorization)
+
+        Returns:
+            Stats: path, bytes, downloaded, resumed_bytes, seconds,
+            throughput_mb_s, connections, ranged and hash
+
+        Raises:
+            DownloadError: The transfer failed (progress is kept for a retry)
+                or the hash did not match (partial files are removed)
+        """
+        target_dir = os.path.dirname(os.path.abspath(target_path))
+        os.makedirs(target_dir, exist_ok=True)
+        part_path = target_path + ".part"
+        manifest_path = target_path + ".part.json"
+        headers = dict(headers or {})
+        started = time.perf_counter()
+
+        with requests.Session() as session:
+            session.headers.update(headers)
+            info, response = self._probe(session, url)
+
+            if info["ranged"]:
+                manifest = self._load_manifest(manifest_path, part_path, url, info, hash_type)
+                stats = self._download_ranged(session, info, manifest, part_path, manifest_path, hash_type)
+            else:
+                logger.info(f"Server does not support ranges, downloading {url} over one connection")
+                stats = self._download_single(response, info, part_path, hash_type)
+                if os.path.exists(manifest_path):
+                    os.remove(manifest_path)
+
+        if expected_hash and stats["hash"].lower() != expected_hash.lower():
+            for path in (part_path, manifest_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise DownloadError(f"Hash verification failed for {url}! Expected: {expected_hash}, "
+                                f"Got: {stats['hash']}")
+
+        os.replace(part_path, target_path)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        seconds = time.perf_counter() - started
+        stats.update({
+            "path": target_path,
+            "seconds": seconds,
+            "throughput_mb_s": stats["downloaded"] / (1024 * 1024) / seconds if seconds > 0 else 0.0,
+            "hash_type": hash_type
+        })
+        logger.info(
+            f"Downloaded {os.path.basename(target_path)}: {stats['downloaded'] / (1024 * 1024):.1f} MB "
+            f"in {seconds:.1f}s ({stats['throughput_mb_s']:.1f} MB/s over {stats['connections']} "
+            f"connection(s), {stats['resumed_bytes'] / (1024 * 1024):.1f} MB resumed)"
+        )
+        return stats
+
+    def _probe(self, session: requests.Session, url: str):
+        """
+        Find the size, validators and range support with a one-byte ranged GET
+
+        Returns (info, response). A server that ignores the range has already
+        started sending the whole file, so that response is returned open for
+        _download_single to consume; otherwise it is None.
+        """
+        try:
+            response = session.get(url, headers={"Range": "bytes=0-0"}, stream=True,
+                                   timeout=self.settings["timeout"])
+        except requests.RequestException as e:
+            raise DownloadError(f"Could not reach {url}: {e}")
+        if response.status_code not in (200, 206):
+            response.close()
+            raise DownloadError(f"Unexpected status {response.status_code} from {url}")
+
+        size_text = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+        ranged = response.status_code == 206 and size_text.isdigit()
+        info = {
+            "url": url,
+            # Ranged requests go straight to where redirects ended up
+            "resolved_url": response.url,
+            "size": int(size_text) if ranged else int(response.headers.get("Content-Length") or 0) or None,
+            "ranged": ranged,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+        if ranged or response.status_code != 200:
+            response.close()
+            return info, None
+        return info, response
+
+    def _plan_parts(self, size: int) -> List[Dict[str, int]]:
+        count = max(1, min(self.settings["connections"], -(-size // self.settings["min_part_size"])))
+        step = -(-size // count)
+        return [{"start": start, "end": min(start + step, size) - 1, "written": 0}
+                for start in range(0, size, step)]
+
+    def _load_manifest(self, manifest_path: str, part_path: str, url: str, info: Dict[str, Any],
+                       hash_type: str) -> Dict[str, Any]:
+        """Resume from an existing manifest if it describes the same remote file"""
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            if (manifest.get("version") == MANIFEST_VERSION and manifest.get("url") == url
+                    and manifest.get("size") == info["size"] and manifest.get("etag") == info["etag"]
+                    and manifest.get("last_modified") == info["last_modified"]
+                    and os.path.exists(part_path) and os.path.getsize(part_path) == info["size"]):
+                done = sum(part["written"] for part in manifest["parts"])
+                logger.info(f"Resuming download of {url}: {done / (1024 * 1024):.1f} MB already on disk")
+                return manifest
+            logger.info("Existing partial download is for a different file, starting over")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable download manifest {manifest_path}: {e}")
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "url": url,
+            "size": info["size"],
+            "etag": info["etag"],
+            "last_modified": info["last_modified"],
+            "hash_type": hash_type,
+            "parts": self._plan_parts(info["size"])
+        }
+        self._preallocate(part_path, info["size"])
+        self._save_manifest(manifest_path, manifest)
+        return manifest
+
+    @classmethod
+    def _preallocate(cls, path: str, size: int):
+        with open(path, "wb") as f:
+            cls._preallocate_handle(f, size)
+
+    @staticmethod
+    def _preallocate_handle(f, size: int):
+        """Reserve the whole file up front so a full disk fails now, not hours in"""
+        if hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise DownloadError(f"Not enough disk space for {size} bytes at {f.name}")
+        f.truncate(size)
+
+    def _save_manifest(self, manifest_path: str, manifest: Dict[str, Any]):
+        with self.manifest_lock:
+            temp_path = manifest_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(manifest, f)
+            os.replace(temp_path, manifest_path)
+
+    def _report(self, count: int):
+        if self.progress:
+            with self.progress_lock:
+                self.progress(count)
+
+    def _download_ranged(self, session: requests.Session, info: Dict[str, Any], manifest: Dict[str, Any],
+                         part_path: str, manifest_path: str, hash_type: str) -> Dict[str, Any]:
+        parts = manifest["parts"]
+        size = info["size"]
+        resumed = sum(part["written"] for part in parts)
+        received = [0] * len(parts)  # bytes written per part in this run, ahead of the manifest
+        stop = threading.Event()
+
+        def frontier() -> int:
+            # Contiguous checkpointed (so flushed) bytes from the start of the file
+            with self.manifest_lock:
+                offset = 0
+                for part in parts:
+                    offset = part["start"] + part["written"]
+                    if offset <= part["end"]:
+                        break
+                return min(offset, size)
+
+        hasher = _FrontierHasher(part_path, hash_type, frontier, size)
+        if resumed:
+            self._report(resumed)
+        hasher.start()
+
+        def fetch(index: int):
+            part = parts[index]
+            attempt = 0
+            while part["start"] + part["written"] <= part["end"] and not stop.is_set():
+                try:
+                    self._fetch_range(session, info, part, index, received, part_path, manifest_path,
+                                      manifest, stop, hasher)
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.settings["retries"] or stop.is_set():
+                        raise DownloadError(f"Part {index} of {info['url']} failed: {e}")
+                    delay = 0.5 * (2 ** (attempt - 1))
+                    logger.warning(f"Part {index} failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+
+        pending = [index for index, part in enumerate(parts) if part["start"] + part["written"] <= part["end"]]
+        errors = []
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(pending)), thread_name_prefix="download") as pool:
+                futures = [pool.submit(fetch, index) for index in pending]
+                try:
+                    for future in futures:
+                        try:
+                            future.result()
+                        except Exception as e:
+                            errors.append(e)
+                            stop.set()
+                except BaseException:
+                    # Interrupted: let the workers stop at their next chunk
+                    stop.set()
+                    raise
+            if errors:
+                raise errors[0] if isinstance(errors[0], DownloadError) else DownloadError(str(errors[0]))
+            file_hash = hasher.finish()
+        except BaseException:
+            hasher.cancel()
+            self._save_manifest(manifest_path, manifest)
+            raise
+
+        with open(part_path, "rb+") as f:
+            os.fsync(f.fileno())
+        return {
+            "bytes": size,
+            "downloaded": size - resumed,
+            "resumed_bytes": resumed,
+            "connections": len(pending),
+            "ranged": True,
+            "hash": file_hash
+        }
+
+    def _fetch_range(self, session, info, part, index, received, part_path, manifest_path, manifest,
+                     stop, hasher):
+        """Stream one part's remaining bytes into place, checkpointing as it goes"""
+        start = part["start"] + part["written"]
+        range_headers = {"Range": f"bytes={start}-{part['end']}"}
+        # Refuse a changed file instead of mixing two versions
+        if info["etag"]:
+            range_headers["If-Range"] = info["etag"]
+        elif info["last_modified"]:
+            range_headers["If-Range"] = info["last_modified"]
+
+        with session.get(info["resolved_url"], headers=range_headers, stream=True,
+                         timeout=self.settings["timeout"]) as response:
+            if response.status_code != 206:
+                raise DownloadError(f"Expected a partial response for {range_headers['Range']}, "
+                                    f"got {response.status_code}")
+            with open(part_path, "rb+") as f:
+                f.seek(start)
+                unsaved = 0
+                try:
+                    for chunk in response.iter_content(chunk_size=self.settings["chunk_size"]):
+                        if stop.is_set():
+                            break
+                        # Never write past the part, whatever the server sends
+                        chunk = chunk[:part["end"] + 1 - (part["start"] + part["written"] + received[index])]
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        received[index] += len(chunk)
+                        unsaved += len(chunk)
+                        self._report(len(chunk))
+                        if unsaved >= self.settings["checkpoint_bytes"]:
+                            f.flush()
+                            self._checkpoint(part, index, received, manifest_path, manifest)
+                            hasher.notify()
+                            unsaved = 0
+                finally:
+                    # Keep whatever arrived, even if the connection dropped
+                    f.flush()
+                    self._checkpoint(part, index, received, manifest_path, manifest)
+                    hasher.notify()
+
+        if not stop.is_set() and part["start"] + part["written"] <= part["end"]:
+            raise DownloadError(f"Connection closed {part['end'] + 1 - part['start'] - part['written']} "
+                                f"bytes early")
+
+    def _checkpoint(self, part, index, received, manifest_path, manifest):
+        # Flushed bytes move from this run's counter into the manifest
+        with self.manifest_lock:
+            part["written"] += received[index]
+            received[index] = 0
+        self._save_manifest(manifest_path, manifest)
+
+    def _download_single(self, response, info: Dict[str, Any], part_path: str,
+                         hash_type: str) -> Dict[str, Any]:
+        """Stream the probe's full response, hashing it in memory as it is written"""
+        file_hash = _new_hash(hash_type)
+        written = 0
+        try:
+            with response, open(part_path, "wb") as f:
+                if info["size"]:
+                    self._preallocate_handle(f, info["size"])
+                for chunk in response.iter_content(chunk_size=self.settings["chunk_size"]):
+                    f.write(chunk)
+                    file_hash.update(chunk)
+                    written += len(chunk)
+                    self._report(len(chunk))
+                f.truncate(written)
+                f.flush()
+                os.fsync(f.fileno())
+        except requests.RequestException as e:
+            raise DownloadError(f"Download of {info['url']} failed: {e}")
+
+        if info["size"] and written != info["size"]:
+            raise DownloadError(f"Download of {info['url']} ended after {written} of {info['size']} bytes")
+        return {
+            "bytes": written,
+            "downloaded": written,
+            "resumed_bytes": 0,
+            "connections": 1,
+            "ranged": False,
+            "hash": file_hash.hexdigest()
+        }
+
+def download_file(url: str, target_path: str, expected_hash: Optional[str] = None, hash_type: str = "sha256",
+                  progress: Optional[Callable[[int], None]] = None, **settings) -> Dict[str, Any]:
+    """Download url to target_path with a ParallelDownloader (see ParallelDownloader.download)"""
+    return ParallelDownloader(progress=progress, **settings).download(url, target_path, expected_hash, hash_type)
@@ -10,12 +10,13 @@ import shutil
 from typing import List, Dict, Any, Optional
 import logging
 from pathlib import Path
-import requests
 from tqdm import tqdm
 import hashlib
 from huggingface_hub import hf_hub_download, snapshot_download, list_repo_files
 from huggingface_hub.utils import RepositoryNotFoundError, RevisionNotFoundError
 
+from .model_download import ParallelDownloader, DownloadError, DEFAULT_DOWNLOAD_SETTINGS
+
 # Import local LLM integration
 from .langchain_local_integration import (
     get_available_models, get_model_info, create_local_llm,
@@ -112,34 +113,39 @@ def list_hf_model_files(repo_id: str, revision: str = "main") -> List[Dict[str,
         logger.error(f"Error listing files: {e}")
         return []
 
-def download_url(url: str, target_path: str) -> str:
+def download_url(url: str, target_path: str, expected_hash: Optional[str] = None, hash_type: str = "sha256",
+                 connections: int = DEFAULT_DOWNLOAD_SETTINGS["connections"]) -> str:
     """
     Download a file from URL to target path with progress bar
     
+    Uses ranged requests over several connections when the server supports
+    them, and resumes from the "<target>.part.json" manifest if an earlier
+    download was interrupted. The file is hashed while it downloads, so
+    passing expected_hash makes a separate verify_model_file pass unnecessary.
+    
     Args:
         url: URL to download
         target_path: Target file path
+        expected_hash: Hash the file must match
+        hash_type: Hash algorithm (md5, sha256)
+        connections: Parallel connections for servers that support ranges
         
     Returns:
         Path to downloaded file
-    """
-    os.makedirs(os.path.dirname(target_path), exist_ok=True)
     
-    with requests.get(url, stream=True) as response:
-        response.raise_for_status()
-        total_size = int(response.headers.get("content-length", 0))
-        
-        with open(target_path, "wb") as f, tqdm(
-            desc=os.path.basename(target_path),
-            total=total_size,
-            unit="B",
-            unit_scale=True,
-            unit_divisor=1024,
-        ) as progress_bar:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                progress_bar.update(len(chunk))
+    Raises:
+        DownloadError: If the download fails or the hash does not match
+    """
+    with tqdm(
+        desc=os.path.basename(target_path),
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+    ) as progress_bar:
+        downloader = ParallelDownloader(progress=progress_bar.update, connections=connections)
+        stats = downloader.download(url, target_path, expected_hash, hash_type)
     
+    logger.info(f"{hash_type}: {stats['hash']}")
     return target_path
 
 def verify_model_file(file_path: str, expected_hash: Optional[str] = None, hash_type: str = "md5") -> bool:
@@ -174,7 +180,7 @@ def verify_model_file(file_path: str, expected_hash: Optional[str] = None, hash_
         unit_scale=True,
         unit_divisor=1024,
     ) as progress_bar:
-        for chunk in iter(lambda: f.read(4096), b""):
+        for chunk in iter(lambda: f.read(1 << 20), b""):
             hash_func.update(chunk)
             progress_bar.update(len(chunk))
     
@@ -239,6 +245,15 @@ def main():
     download_parser.add_argument("--type", choices=["text", "video"], default="text", 
                                 help="Model type (used for organizing models)")
     
+    # Fetch command
+    fetch_parser = subparsers.add_parser("fetch", help="Download a model file from a URL (resumable)")
+    fetch_parser.add_argument("url", help="File URL")
+    fetch_parser.add_argument("--output", help="Target path (defaults to the model directory)")
+    fetch_parser.add_argument("--hash", help="Expected hash of the file")
+    fetch_parser.add_argument("--hash-type", choices=["md5", "sha256"], default="sha256", help="Hash algorithm")
+    fetch_parser.add_argument("--connections", type=int, default=DEFAULT_DOWNLOAD_SETTINGS["connections"],
+                              help="Parallel connections")
+    
     # Info command
     info_parser = subparsers.add_parser("info", help="Get info about a model")
     info_parser.add_argument("model_path", help="Path to the model")
@@ -311,6 +326,15 @@ def main():
         except Exception as e:
             print(f"Download failed: {e}")
     
+    elif args.command == "fetch":
+        try:
+            target_path = args.output or os.path.join(MODEL_DIR, os.path.basename(args.url.split("?")[0]))
+            path = download_url(args.url, target_path, args.hash, args.hash_type, args.connections)
+            print(f"Download successful: {path}")
+        except DownloadError as e:
+            print(f"Download failed: {e}")
+            print("Run the same command again to resume")
+    
     elif args.command == "info":
         try:
             info = get_model_info(args.model_path)
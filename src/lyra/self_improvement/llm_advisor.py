@@ -2,17 +2,149 @@
 External LLM advisor for code improvements using various AI models.
 """
 import os
+import copy
 import json
 import time
+import hashlib
+import threading
 import requests
-from typing import Dict, List, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Any, Optional
 from urllib.parse import urljoin
 import logging
 
+try:
+    from modules.response_cache import get_instance as get_response_cache
+except ImportError:
+    get_response_cache = None
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Defaults for compare_suggestions, overridable under "compare" in the config
+DEFAULT_COMPARE_SETTINGS = {
+    "deadline": 30.0,          # seconds for the whole fan-out
+    "mode": "all",             # "all", "first" or "quorum"
+    "min_results": 1,          # good answers needed in "first" mode
+    "max_workers": 4,
+    "breaker_failures": 3,     # consecutive failures before a provider is skipped
+    "breaker_reset": 60.0,     # seconds before a skipped provider is retried
+    "cache_size": 256,
+    "cache_ttl": 3600.0,
+    "cache_sampled_responses": False  # also reuse sampled reviews from the persistent response cache
+}
+
+# Sampling temperature each provider is queried with
+PROVIDER_TEMPERATURES = {"openai": 0.3, "local": 0.3, "deepseek": 0.2, "anthropic": 0.2}
+
+# Upper bounds, in seconds, of the provider latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+def snippet_hash(code: str) -> str:
+    """Stable key for a code snippet"""
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+class CircuitBreaker:
+    """
+    Skips a provider after repeated failures
+
+    Closed until failure_threshold consecutive failures, then open for
+    reset_timeout seconds, then half-open: one trial call is let through and
+    its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release(self):
+        """Give back a half-open trial that ended without calling the provider"""
+        with self.lock:
+            self.trial_in_flight = False
+
+class LatencyHistogram:
+    """Bucketed latency counts for one provider"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given fraction of observations"""
+        with self.lock:
+            if not self.count:
+                return None
+            target = fraction * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= target:
+                    return bound
+            return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            buckets = {("+Inf" if bound == float("inf") else str(bound)): count
+                       for bound, count in zip(self.buckets, self.counts)}
+            count, total = self.count, self.total
+        return {
+            "count": count,
+            "mean": total / count if count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "buckets": buckets
+        }
+
 class LLMAdvisor:
     """Class to request code improvement suggestions from external LLMs"""
     
@@ -29,6 +161,12 @@ class LLMAdvisor:
             "anthropic": self.query_anthropic,
             "local": self.query_local_llm,
         }
+        self.compare_settings = dict(DEFAULT_COMPARE_SETTINGS, **self.config.get("compare", {}))
+        self.breakers = {}  # provider -> CircuitBreaker
+        self.histograms = {}  # provider -> LatencyHistogram
+        self.suggestion_cache = OrderedDict()  # (snippet hash, provider, model, prompt type) -> (time, result)
+        self.state_lock = threading.Lock()
+        self.executor = None
     
     def load_config(self) -> Dict[str, Any]:
         """Load configuration from file or create default"""
@@ -146,8 +284,15 @@ class LLMAdvisor:
         return language_map.get(ext, 'text')
     
     def get_advice(self, code: str, file_path: str = None, prompt_type: str = "code_review", 
-                  provider: str = None, timeout: int = 60) -> Dict[str, Any]:
-        """Get advice from the specified LLM provider"""
+                  provider: str = None, timeout: int = 60, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Get advice from the specified LLM provider
+        
+        Reviews of unchanged code are served from the suggestion cache (keyed
+        by a hash of the snippet) unless use_cache is False; reviews are
+        sampled, so the persistent response cache is only used when
+        cache_sampled_responses is set. Providers whose circuit breaker is open are not called.
+        """
         if not code:
             return {"success": False, "error": "No code provided", "suggestions": []}
         
@@ -159,6 +304,14 @@ class LLMAdvisor:
                 return {"success": False, "error": "No LLM providers are enabled", "suggestions": []}
             provider = available[0]
         
+        model = self.config["providers"].get(provider, {}).get("model", "")
+        cache_key = (snippet_hash(code), provider, model, prompt_type)
+        if use_cache:
+            cached = self._get_cached_suggestions(cache_key)
+            if cached is not None:
+                cached["file_path"] = file_path
+                return cached
+        
         # Format prompt with code
         language = "python"  # Default language
         if file_path:
@@ -173,15 +326,52 @@ class LLMAdvisor:
             if not provider_func:
                 return {"success": False, "error": f"Provider {provider} not supported", "suggestions": []}
             
+            breaker = self._get_breaker(provider)
+            if not breaker.allow():
+                return {"success": False, "error": f"Circuit open for provider {provider}", "provider": provider,
+                        "skipped": True, "suggestions": [], "timestamp": time.time(),
+                        "file_path": file_path, "prompt_type": prompt_type}
+            
+            called = False
+            
+            def call():
+                # Only real provider calls count towards latency and breaker state
+                nonlocal called
+                called = True
+                call_start = time.monotonic()
+                try:
+                    text = provider_func(prompt, timeout=timeout)
+                except Exception:
+                    breaker.record_failure()
+                    raise
+                finally:
+                    self._get_histogram(provider).observe(time.monotonic() - call_start)
+                breaker.record_success()
+                return text
+            
             # Track time
             start_time = time.time()
-            response_text = provider_func(prompt)
+            try:
+                if use_cache and get_response_cache is not None:
+                    response_text = get_response_cache().cached_call(
+                        f"advisor:{provider}:{model}",
+                        prompt,
+                        {"temperature": PROVIDER_TEMPERATURES.get(provider, 0.3), "max_tokens": 2000},
+                        call,
+                        allow_sampled=self.compare_settings["cache_sampled_responses"]
+                    )
+                else:
+                    response_text = call()
+            finally:
+                # A cache hit must not keep a half-open trial slot taken
+                if not called:
+                    breaker.release()
             elapsed = time.time() - start_time
             
             # Parse suggestions from response
             suggestions = self.parse_suggestions(response_text)
             
-            return {
+            result = {
                 "success": True,
                 "provider": provider,
                 "elapsed_time": elapsed,
@@ -191,6 +381,9 @@ class LLMAdvisor:
                 "response": response_text,
                 "suggestions": suggestions
             }
+            if use_cache:
+                self._cache_suggestions(cache_key, result)
+            return result
         except Exception as e:
             logger.error(f"Error getting advice from {provider}: {e}")
             return {
@@ -239,7 +432,7 @@ class LLMAdvisor:
         
         return suggestions
     
-    def query_local_llm(self, prompt: str) -> str:
+    def query_local_llm(self, prompt: str, timeout: float = 60) -> str:
         """Query the local LLM server"""
         try:
             config = self.config["providers"]["local"]
@@ -250,7 +443,7 @@ class LLMAdvisor:
             data = {
                 "model": config.get("model", "local-model"),
                 "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.3,
+                "temperature": PROVIDER_TEMPERATURES["local"],
                 "max_tokens": 2000
             }
             
@@ -259,7 +452,7 @@ class LLMAdvisor:
                     urljoin(api_base, "/chat/completions"), 
                     headers=headers,
                     json=data,
-                    timeout=60
+                    timeout=timeout
                 )
                 
                 if response.status_code == 200:
@@ -273,7 +466,7 @@ class LLMAdvisor:
             # Fallback to completion endpoint
             data = {
                 "prompt": prompt,
-                "temperature": 0.3,
+                "temperature": PROVIDER_TEMPERATURES["local"],
                 "max_tokens": 2000
             }
             
@@ -281,7 +474,7 @@ class LLMAdvisor:
                 urljoin(api_base, "/completions"), 
                 headers=headers,
                 json=data,
-                timeout=60
+                timeout=timeout
             )
             
             if response.status_code == 200:
@@ -292,7 +485,7 @@ class LLMAdvisor:
             # Try one more time with a simplified approach
             data = {"prompt": prompt}
             try:
-                response = requests.post(api_base, json=data, timeout=60)
+                response = requests.post(api_base, json=data, timeout=timeout)
                 if response.status_code == 200:
                     result = response.json()
                     return result.get("response", result.get("output", ""))
@@ -305,7 +498,7 @@ class LLMAdvisor:
             logger.error(f"Error querying local LLM: {e}")
             raise
     
-    def query_openai(self, prompt: str) -> str:
+    def query_openai(self, prompt: str, timeout: float = 60) -> str:
         """Query OpenAI API for code improvement suggestions"""
         config = self.config["providers"]["openai"]
         if not config.get("api_key"):
@@ -320,7 +513,7 @@ class LLMAdvisor:
         data = {
             "model": config.get("model", "gpt-4"),
             "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.3,
+            "temperature": PROVIDER_TEMPERATURES["openai"],
             "max_tokens": 2000
         }
         
@@ -328,7 +521,7 @@ class LLMAdvisor:
             urljoin(config["api_base"], "/chat/completions"),
             headers=headers,
             json=data,
-            timeout=60
+            timeout=timeout
         )
         
         if response.status_code == 200:
@@ -337,7 +530,7 @@ class LLMAdvisor:
         
         raise Exception(f"OpenAI request failed: {response.status_code} - {response.text}")
     
-    def query_deepseek(self, prompt: str) -> str:
+    def query_deepseek(self, prompt: str, timeout: float = 60) -> str:
         """Query DeepSeek API for code improvement suggestions"""
         config = self.config["providers"]["deepseek"]
         if not config.get("api_key"):
@@ -352,7 +545,7 @@ class LLMAdvisor:
         data = {
             "model": config.get("model", "deepseek-coder-33b-instruct"),
             "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.2,
+            "temperature": PROVIDER_TEMPERATURES["deepseek"],
             "max_tokens": 2000
         }
         
@@ -360,7 +553,7 @@ class LLMAdvisor:
             urljoin(config["api_base"], "/chat/completions"),
             headers=headers,
             json=data,
-            timeout=60
+            timeout=timeout
         )
         
         if response.status_code == 200:
@@ -369,7 +562,7 @@ class LLMAdvisor:
         
         raise Exception(f"DeepSeek request failed: {response.status_code} - {response.text}")
     
-    def query_anthropic(self, prompt: str) -> str:
+    def query_anthropic(self, prompt: str, timeout: float = 60) -> str:
         """Query Anthropic API for code improvement suggestions"""
         config = self.config["providers"]["anthropic"]
         if not config.get("api_key"):
@@ -384,7 +577,7 @@ class LLMAdvisor:
         data = {
             "model": config.get("model", "claude-3-opus-20240229"),
             "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.2,
+            "temperature": PROVIDER_TEMPERATURES["anthropic"],
             "max_tokens": 2000
         }
         
@@ -392,7 +585,7 @@ class LLMAdvisor:
             config["api_base"],
             headers=headers,
             json=data,
-            timeout=60
+            timeout=timeout
         )
         
         if response.status_code == 200:
@@ -408,42 +601,186 @@ class LLMAdvisor:
         """Get code improvement suggestions from the configured LLM provider"""
         return self.get_advice(code, file_path=file_path, prompt_type=prompt_type)
 
+    def _get_breaker(self, provider: str) -> CircuitBreaker:
+        with self.state_lock:
+            if provider not in self.breakers:
+                self.breakers[provider] = CircuitBreaker(self.compare_settings["breaker_failures"],
+                                                         self.compare_settings["breaker_reset"])
+            return self.breakers[provider]
+
+    def _get_histogram(self, provider: str) -> LatencyHistogram:
+        with self.state_lock:
+            if provider not in self.histograms:
+                self.histograms[provider] = LatencyHistogram()
+            return self.histograms[provider]
+
+    def _get_cached_suggestions(self, key) -> Optional[Dict[str, Any]]:
+        with self.state_lock:
+            entry = self.suggestion_cache.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.time() - stored_at > self.compare_settings["cache_ttl"]:
+                del self.suggestion_cache[key]
+                return None
+            self.suggestion_cache.move_to_end(key)
+        cached = copy.deepcopy(result)
+        cached["cached"] = True
+        return cached
+
+    def _cache_suggestions(self, key, result: Dict[str, Any]):
+        with self.state_lock:
+            self.suggestion_cache[key] = (time.time(), copy.deepcopy(result))
+            self.suggestion_cache.move_to_end(key)
+            while len(self.suggestion_cache) > self.compare_settings["cache_size"]:
+                self.suggestion_cache.popitem(last=False)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self.state_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.compare_settings["max_workers"],
+                                                   thread_name_prefix="llm-advisor")
+            return self.executor
+
+    def get_provider_stats(self) -> Dict[str, Any]:
+        """Circuit breaker state and latency histogram for every provider called so far"""
+        with self.state_lock:
+            providers = sorted(set(self.breakers) | set(self.histograms))
+        stats = {}
+        for provider in providers:
+            breaker = self._get_breaker(provider)
+            stats[provider] = {
+                "breaker": breaker.state,
+                "consecutive_failures": breaker.failures,
+                "latency": self._get_histogram(provider).snapshot()
+            }
+        stats["cache_entries"] = len(self.suggestion_cache)
+        return stats
+
+    def compare_suggestions(self, code: str, file_path: str = None, providers: List[str] = None,
+                            prompt_type: str = "code_review", deadline: float = None, mode: str = None,
+                            min_results: int = None, use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Get and compare suggestions from multiple LLM providers
+
+        Providers are queried concurrently. In "all" mode every provider is
+        waited for until the deadline; "first" returns once min_results
+        providers have answered with suggestions and "quorum" once a majority
+        has. Providers still running at that point are reported as cancelled
+        and their results are not waited for.
+
+        Returns:
+            Dictionary with results from each provider and a combined analysis
+        """
+        settings = self.compare_settings
+        deadline = settings["deadline"] if deadline is None else deadline
+        mode = mode or settings["mode"]
+
+        # If no providers specified, use all enabled providers
+        if not providers:
+            providers = self.get_enabled_providers()
+
+        if mode == "quorum":
+            needed = len(providers) // 2 + 1
+        elif mode == "first":
+            needed = min_results or settings["min_results"]
+        else:
+            needed = None
+
+        started = time.monotonic()
+        executor = self._get_executor()
+        futures = {
+            executor.submit(self.get_advice, code, file_path, prompt_type, provider, deadline, use_cache): provider
+            for provider in providers
+        }
+
+        results = {}
+        good = 0
+        pending = set(futures)
+        while pending:
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = futures[future]
+                try:
+                    results[provider] = future.result()
+                except Exception as e:
+                    results[provider] = {"success": False, "error": str(e), "provider": provider, "suggestions": []}
+                if results[provider].get("success") and results[provider].get("suggestions"):
+                    good += 1
+            if needed is not None and good >= needed:
+                break
+
+        # Stop waiting for stragglers; calls already in flight end at their own timeout
+        satisfied = needed is not None and good >= needed
+        for future in pending:
+            provider = futures[future]
+            future.cancel()
+            results[provider] = {
+                "success": False,
+                "error": "Cancelled after enough answers" if satisfied else f"No answer within {deadline}s",
+                "provider": provider,
+                "cancelled": True,
+                "suggestions": [],
+                "timestamp": time.time(),
+                "file_path": file_path,
+                "prompt_type": prompt_type
+            }
+        results = {provider: results[provider] for provider in providers if provider in results}
+
+        # Analyze combined results (simple implementation for now)
+        combined = {
+            "providers_consulted": providers,
+            "mode": mode,
+            "elapsed_time": time.monotonic() - started,
+            "success_count": sum(1 for p in providers if results.get(p, {}).get("success", False)),
+            "total_suggestions": sum(len(results.get(p, {}).get("suggestions", [])) for p in providers),
+            "cancelled": [p for p, r in results.items() if r.get("cancelled")],
+            "skipped": [p for p, r in results.items() if r.get("skipped")],
+            "cached": [p for p, r in results.items() if r.get("cached")],
+            "common_themes": [],  # Would require NLP to properly identify
+            "all_suggestions": []
+        }
+
+        # Combine all suggestions
+        for provider, result in results.items():
+            for suggestion in result.get("suggestions", []):
+                suggestion["provider"] = provider
+                combined["all_suggestions"].append(suggestion)
+
+        return {
+            "provider_results": results,
+            "combined": combined
+        }
+
+    def shutdown(self):
+        """Stop the fan-out worker threads"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+# Singleton instance
+_advisor_instance = None
+_advisor_lock = threading.Lock()
+
+def get_instance() -> LLMAdvisor:
+    """Get the shared advisor, so breaker state, latency and cache persist across calls"""
+    global _advisor_instance
+    with _advisor_lock:
+        if _advisor_instance is None:
+            _advisor_instance = LLMAdvisor()
+    return _advisor_instance
+
 # Helper function to compare suggestions from multiple providers
-def compare_suggestions(code: str, file_path: str = None, providers: List[str] = None) -> Dict[str, Any]:
+def compare_suggestions(code: str, file_path: str = None, providers: List[str] = None, **kwargs) -> Dict[str, Any]:
     """
     Get and compare suggestions from multiple LLM providers
     
+    See LLMAdvisor.compare_suggestions for the keyword arguments.
+    
     Returns:
         Dictionary with results from each provider and a combined analysis
     """
-    advisor = LLMAdvisor()
-    results = {}
-    
-    # If no providers specified, use all enabled providers
-    if not providers:
-        providers = advisor.get_enabled_providers()
-    
-    # Get suggestions from each provider
-    for provider in providers:
-        result = advisor.get_advice(code, file_path=file_path, provider=provider)
-        results[provider] = result
-    
-    # Analyze combined results (simple implementation for now)
-    combined = {
-        "providers_consulted": providers,
-        "success_count": sum(1 for p in providers if results.get(p, {}).get("success", False)),
-        "total_suggestions": sum(len(results.get(p, {}).get("suggestions", [])) for p in providers),
-        "common_themes": [],  # Would require NLP to properly identify
-        "all_suggestions": []
-    }
-    
-    # Combine all suggestions
-    for provider, result in results.items():
-        for suggestion in result.get("suggestions", []):
-            suggestion["provider"] = provider
-            combined["all_suggestions"].append(suggestion)
-    
-    return {
-        "provider_results": results,
-        "combined": combined
-    }
\ No newline at end of file
+    return get_instance().compare_suggestions(code, file_path=file_path, providers=providers, **kwargs)
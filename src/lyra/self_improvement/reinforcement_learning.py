@@ -158,8 +158,7 @@ class VintixRL:
         
         # We already have LLM advisor, use it directly
         try:
-            from .llm_advisor import compare_suggestions
-            results = compare_suggestions(code_snippet, file_path, providers)
+            results = self.llm_advisor.compare_suggestions(code_snippet, file_path, providers)
             self._record_expert_consultation(code_snippet, results, file_path)
             return results
         except Exception as e:
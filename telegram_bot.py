@@ -10,9 +10,12 @@ import json
 import logging
 import threading
 import argparse
+from contextlib import contextmanager
 from typing import Dict, List, Any, Optional
 from pathlib import Path
 
+from modules.chat_dispatcher import ChatDispatcher
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -33,13 +36,91 @@ except ImportError:
     logger.warning("Telegram library not available. Install with: pip install python-telegram-bot")
     TELEGRAM_AVAILABLE = False
 
+# Telegram shows a typing action for about 5 seconds
+TYPING_REFRESH_INTERVAL = 4.0
+
+class TypingIndicator:
+    """Keeps the typing action visible in every chat that is waiting for a reply"""
+    
+    def __init__(self, interval: float = TYPING_REFRESH_INTERVAL):
+        self.interval = interval
+        self.active: Dict[Any, List] = {}  # chat_id -> [bot, waiting count]
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+    
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._refresh_loop, name="telegram-typing", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=2.0)
+    
+    @contextmanager
+    def typing(self, bot, chat_id):
+        """Show the typing action in chat_id until the block exits"""
+        with self.cond:
+            entry = self.active.setdefault(chat_id, [bot, 0])
+            entry[1] += 1
+        self._send(bot, chat_id)
+        try:
+            yield
+        finally:
+            with self.cond:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    self.active.pop(chat_id, None)
+    
+    def _send(self, bot, chat_id):
+        try:
+            bot.send_chat_action(chat_id=chat_id, action=telegram.ChatAction.TYPING)
+        except Exception as e:
+            logger.debug(f"Could not send typing action to {chat_id}: {e}")
+    
+    def _refresh_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait(timeout=self.interval)
+                if not self.running:
+                    return
+                chats = [(chat_id, entry[0]) for chat_id, entry in self.active.items()]
+            for chat_id, bot in chats:
+                self._send(bot, chat_id)
+
+# Fallback model shared by all chats, created on first use
+_fallback_model = None
+_fallback_lock = threading.Lock()
+
+def _get_fallback_model():
+    """Get a cached Phi model for when no Lyra interface is connected"""
+    global _fallback_model
+    with _fallback_lock:
+        if _fallback_model is None:
+            try:
+                from model_backends.phi_backend import PhiInterface
+                phi = PhiInterface("phi-2")
+                if phi.initialize():
+                    _fallback_model = phi
+            except ImportError:
+                pass
+        return _fallback_model
+
 class LyraTelegramBot:
     """
     Telegram bot integration for Lyra
     Allows users to interact with Lyra through Telegram
     """
     
-    def __init__(self, token: str = None, config_path: str = None, lyra_interface = None):
+    def __init__(self, token: str = None, config_path: str = None, lyra_interface = None,
+                 max_workers: int = None):
         self.token = token
         self.config_path = config_path or os.path.join(
             os.path.dirname(os.path.abspath(__file__)), 
@@ -51,9 +132,15 @@ class LyraTelegramBot:
         self.active = False
         self.updater = None
         self.initialized = False
+        self.max_workers = max_workers
         
         # Load configuration
         self._load_config()
+        self.max_workers = self.max_workers or 4
+        
+        # Message pipeline: ordered per chat, concurrent across chats
+        self.dispatcher = ChatDispatcher(max_workers=self.max_workers, thread_name_prefix="telegram-chat")
+        self.typing_indicator = TypingIndicator()
         
         # Check if Telegram is available
         if not TELEGRAM_AVAILABLE:
@@ -101,6 +188,7 @@ class LyraTelegramBot:
                 # Load authorized users and chats
                 self.authorized_users = config.get("authorized_users", [])
                 self.authorized_chats = config.get("authorized_chats", [])
+                self.max_workers = self.max_workers or config.get("max_workers")
                 
                 # Still need a token
                 if not self.token:
@@ -237,7 +325,8 @@ class LyraTelegramBot:
                     f"🧠 Thinking: {thinking_state}\n"
                     f"😊 Emotional State: {emotional_state}\n"
                     f"👥 Connected Users: {len(self.authorized_users)}\n"
-                    f"🔄 Bot Active: {'Yes' if self.active else 'No'}"
+                    f"🔄 Bot Active: {'Yes' if self.active else 'No'}\n"
+                    f"💬 Chats In Progress: {self.dispatcher.get_status()['active_chats']}"
                 )
                 
                 update.message.reply_text(status_message)
@@ -255,7 +344,7 @@ class LyraTelegramBot:
             )
     
     def _handle_message(self, update: Update, context: CallbackContext):
-        """Handle regular text messages"""
+        """Handle regular text messages by queueing them for the chat's worker"""
         user = update.effective_user
         chat_id = update.effective_chat.id
         message_text = update.message.text
@@ -264,14 +353,11 @@ class LyraTelegramBot:
         if not self._is_authorized(user.id, chat_id):
             return
         
-        # Process with Lyra if interface is available
-        if self.lyra_interface:
+        def job():
             try:
-                # Send typing action while processing
-                context.bot.send_chat_action(chat_id=chat_id, action=telegram.ChatAction.TYPING)
-                
-                # Process message with Lyra
-                response = self._process_with_lyra(message_text, user.id)
+                # Keep the typing action visible while waiting for the model
+                with self.typing_indicator.typing(context.bot, chat_id):
+                    response = self._process_with_lyra(message_text, user.id, chat_id)
                 
                 # Send response
                 update.message.reply_text(response)
@@ -281,14 +367,11 @@ class LyraTelegramBot:
             except Exception as e:
                 logger.error(f"Error processing message with Lyra: {e}")
                 update.message.reply_text("Sorry, I encountered an error while processing your message.")
-        else:
-            # No Lyra interface available
-            update.message.reply_text(
-                "I'm currently disconnected from my thinking systems. "
-                "Please try again later or contact my administrator."
-            )
+        
+        if not self.dispatcher.submit(chat_id, job):
+            update.message.reply_text("I'm still working through your earlier messages. Please wait a moment.")
     
-    def _process_with_lyra(self, message: str, user_id: int) -> str:
+    def _process_with_lyra(self, message: str, user_id: int, chat_id: int = None) -> str:
         """Process a message with the Lyra interface"""
         if not self.lyra_interface:
             # Try to create a simple fallback processor if there's no interface
@@ -302,20 +385,20 @@ class LyraTelegramBot:
                 pass
                 
             # Try to use Phi model directly
-            try:
-                from model_backends.phi_backend import PhiInterface
-                phi = PhiInterface("phi-2")
-                if phi.initialize():
-                    logger.info("Using Phi model for processing")
-                    return phi.generate_text(message)
-            except ImportError:
-                pass
+            phi = _get_fallback_model()
+            if phi:
+                logger.info("Using Phi model for processing")
+                return phi.generate_text(message)
                 
             return "I'm currently disconnected from my thinking systems."
         
+        # One conversation per user per chat, so team members sharing the bot
+        # (or a group chat) do not see each other's history
+        session_id = f"telegram_{chat_id if chat_id is not None else user_id}_{user_id}"
+        
         # Check for appropriate method to handle messages
         if hasattr(self.lyra_interface, 'chat'):
-            return self.lyra_interface.chat(message, user_id=user_id, source="telegram")
+            return self.lyra_interface.chat(message, session_id=session_id, caller=f"telegram:{user_id}")
         elif hasattr(self.lyra_interface, 'process_message'):
             return self.lyra_interface.process_message(message, user_id=user_id, source="telegram")
         elif hasattr(self.lyra_interface, 'generate_response'):
@@ -367,6 +450,7 @@ class LyraTelegramBot:
             
         try:
             # Start the bot
+            self.typing_indicator.start()
             self.updater.start_polling()
             logger.info("Telegram bot started")
             self.active = True
@@ -381,8 +465,11 @@ class LyraTelegramBot:
             return
             
         try:
-            # Stop the bot
+            # Stop the bot, then let queued replies finish
             self.updater.stop()
+            self.dispatcher.shutdown(wait=True)
+            self.dispatcher = ChatDispatcher(max_workers=self.max_workers, thread_name_prefix="telegram-chat")
+            self.typing_indicator.stop()
             logger.info("Telegram bot stopped")
             self.active = False
         except Exception as e:
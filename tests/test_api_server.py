@@ -0,0 +1,190 @@
+"""
+Tests for the ASGI API server: streaming, batching, admission control and timing headers
+"""
+import os
+import sys
+import time
+import json
+import threading
+import unittest
+
+import requests
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_server import LyraAPI, FASTAPI_AVAILABLE
+from modules.inference_scheduler import InferenceScheduler, QueueFullError
+
+class StubInterface:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+
+    def chat(self, message, priority="api", caller=None):
+        self.calls.append((message, priority, caller))
+        time.sleep(self.latency)
+        return f"echo {message}"
+
+class StreamingStubInterface(StubInterface):
+    def chat_stream(self, message, priority="api", caller=None):
+        for word in ("one ", "two ", "three"):
+            time.sleep(0.02)
+            yield word
+
+class ScheduledStubInterface(StubInterface):
+    """Generates through its own scheduler, which holds one queued request"""
+    def __init__(self):
+        super().__init__()
+        self.scheduler = InferenceScheduler(max_queue_size=1)
+
+    def chat(self, message, priority="api", caller=None):
+        return self.scheduler.run("model", lambda: f"echo {message}", priority=priority, caller=caller)
+
+class StubMemory:
+    def recall_similar(self, query, limit=5):
+        return [f"{query} {i}" for i in range(limit)]
+
+def parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+@unittest.skipUnless(FASTAPI_AVAILABLE, "FastAPI and uvicorn are required")
+class TestLyraAPI(unittest.TestCase):
+    """Routes served over a real socket by uvicorn"""
+
+    def _start(self, interface=None, **settings):
+        self.api = LyraAPI(lyra_interface=interface or StubInterface(),
+                           modules={"deep_memory": StubMemory()}, load_modules=False, **settings)
+        self.base_url = f"http://127.0.0.1:{self.api.start_background(port=0)}"
+
+    def tearDown(self):
+        self.api.stop()
+
+    def test_chat_with_timing_headers(self):
+        self._start()
+        response = requests.post(f"{self.base_url}/api/chat", json={"message": "hi", "user_id": "u1"}, timeout=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["response"], "echo hi")
+        self.assertEqual(self.api.lyra_interface.calls, [("hi", "api", "u1")])
+        self.assertIn("total;dur=", response.headers["Server-Timing"])
+        self.assertGreaterEqual(float(response.headers["X-Response-Time-Ms"]), 0.0)
+        self.assertIn("X-Queue-Time-Ms", response.headers)
+
+        response = requests.post(f"{self.base_url}/api/chat", json={}, timeout=5)
+        self.assertEqual(response.status_code, 400)
+
+    def test_streamed_chat(self):
+        self._start(StreamingStubInterface())
+        response = requests.post(f"{self.base_url}/api/chat", json={"message": "hi", "stream": True}, timeout=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["Content-Type"].startswith("text/event-stream"))
+        events = parse_sse(response.text)
+        self.assertEqual([name for name, _ in events], ["start", "token", "token", "token", "done"])
+        self.assertEqual(events[-1][1]["response"], "one two three")
+        self.assertLessEqual(events[-1][1]["first_token_ms"], events[-1][1]["total_ms"])
+
+    def test_non_streaming_interface_streams_one_chunk(self):
+        self._start()
+        response = requests.post(f"{self.base_url}/api/chat", json={"message": "hi"},
+                                 headers={"Accept": "text/event-stream"}, timeout=5)
+        events = parse_sse(response.text)
+        self.assertEqual([name for name, _ in events], ["start", "token", "done"])
+        self.assertEqual(events[1][1]["text"], "echo hi")
+
+    def test_batch_fans_out_in_order(self):
+        self._start(StubInterface(latency=0.2))
+        started = time.monotonic()
+        response = requests.post(f"{self.base_url}/api/batch", json={"requests": [
+            {"type": "chat", "message": "a"},
+            {"type": "recall", "query": "q", "limit": 2},
+            {"type": "chat", "message": "b"},
+            {"type": "unknown"}
+        ]}, timeout=5)
+        self.assertLess(time.monotonic() - started, 0.39)  # the two chats ran concurrently
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [200, 200, 200, 400])
+        self.assertEqual(results[0]["body"]["response"], "echo a")
+        self.assertEqual(results[1]["body"]["results"], ["q 0", "q 1"])
+        self.assertEqual(results[2]["body"]["response"], "echo b")
+
+        response = requests.post(f"{self.base_url}/api/batch", json={"requests": []}, timeout=5)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_items_take_admission_slots(self):
+        self._start(StubInterface(latency=0.2), max_concurrent=1, max_pending=1, batch_concurrency=3)
+        started = time.monotonic()
+        response = requests.post(f"{self.base_url}/api/batch", json={"requests": [
+            {"type": "chat", "message": m} for m in "abc"
+        ]}, timeout=5)
+        # One item runs, one waits for the slot, the third is turned away
+        self.assertGreater(time.monotonic() - started, 0.39)
+        statuses = [result["status"] for result in response.json()["results"]]
+        self.assertEqual(sorted(statuses), [200, 200, 429])
+        metrics = requests.get(f"{self.base_url}/api/server/metrics", timeout=1).json()
+        self.assertEqual((metrics["admitted"], metrics["rejected"]), (2, 1))
+
+    def test_admission_rejects_with_429(self):
+        self._start(StubInterface(latency=0.4), max_concurrent=1, max_pending=1)
+        responses = []
+
+        def send():
+            responses.append(requests.post(f"{self.base_url}/api/chat", json={"message": "x"}, timeout=5))
+
+        threads = [threading.Thread(target=send) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        # Status endpoints bypass admission control
+        self.assertEqual(requests.get(f"{self.base_url}/api/health", timeout=1).status_code, 200)
+        for thread in threads:
+            thread.join()
+
+        statuses = sorted(response.status_code for response in responses)
+        self.assertEqual(statuses, [200, 200, 429, 429])
+        rejected = [response for response in responses if response.status_code == 429]
+        self.assertEqual(rejected[0].headers["Retry-After"], "1")
+        queued = [float(r.headers["X-Queue-Time-Ms"]) for r in responses if r.status_code == 200]
+        self.assertGreater(max(queued), 200)
+
+        metrics = requests.get(f"{self.base_url}/api/server/metrics", timeout=1).json()
+        self.assertEqual((metrics["rejected"], metrics["running"], metrics["waiting"]), (2, 0, 0))
+
+    def test_full_inference_queue_is_429(self):
+        interface = ScheduledStubInterface()
+        self._start(interface)
+        started, release = threading.Event(), threading.Event()
+        running = interface.scheduler.submit("model", lambda: started.set() or release.wait(5))
+        started.wait(5)
+        queued = interface.scheduler.submit("model", lambda: "queued")
+        try:
+            response = requests.post(f"{self.base_url}/api/chat", json={"message": "x"}, timeout=5)
+        finally:
+            release.set()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json(), QueueFullError("model", 1).to_dict())
+        self.assertEqual((running.result(5), queued.result(5)), (True, "queued"))
+        interface.scheduler.shutdown()
+
+    def test_missing_module_is_unavailable(self):
+        self._start()
+        self.assertEqual(requests.get(f"{self.base_url}/api/boredom/status", timeout=5).status_code, 503)
+        response = requests.post(f"{self.base_url}/api/memory/recall", json={"query": "q", "limit": 1}, timeout=5)
+        self.assertEqual(response.json()["results"], ["q 0"])
+
+@unittest.skipUnless(FASTAPI_AVAILABLE, "FastAPI and uvicorn are required")
+class TestLoadHarness(unittest.TestCase):
+    def test_small_run(self):
+        from scripts.load_test_api import run_load_test
+        results = run_load_test(clients=4, requests_per_client=5, latency=0.01)
+        self.assertEqual(results["requests"], 20)
+        self.assertEqual(results["errors"], 0)
+        self.assertGreater(results["requests_per_second"], 0)
+        self.assertEqual(results["server"]["running"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
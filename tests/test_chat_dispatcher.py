@@ -0,0 +1,88 @@
+"""
+Tests for the chat dispatcher: ordering within a chat, concurrency and
+fairness across chats, and backlog limits
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.chat_dispatcher import ChatDispatcher
+
+class TestChatDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def _job(self, chat, n, delay=0.0, wait_for=None):
+        def job():
+            if wait_for is not None:
+                wait_for.wait(5)
+            with self.lock:
+                self.events.append(("start", chat, n))
+            time.sleep(delay)
+            with self.lock:
+                self.events.append(("end", chat, n))
+        return job
+
+    def test_messages_in_a_chat_run_in_order_one_at_a_time(self):
+        dispatcher = ChatDispatcher(max_workers=4)
+        for n in range(5):
+            self.assertTrue(dispatcher.submit("a", self._job("a", n, delay=0.01)))
+        dispatcher.shutdown(wait=True, timeout=5)
+
+        expected = []
+        for n in range(5):
+            expected += [("start", "a", n), ("end", "a", n)]
+        self.assertEqual(self.events, expected)
+
+    def test_chats_are_handled_concurrently(self):
+        dispatcher = ChatDispatcher(max_workers=2)
+        # Each job only finishes once the other chat's job is running as well
+        barrier = threading.Barrier(2, timeout=5)
+        results = []
+        for chat in ("a", "b"):
+            dispatcher.submit(chat, lambda: results.append(barrier.wait()))
+        dispatcher.shutdown(wait=True, timeout=5)
+        self.assertEqual(sorted(results), [0, 1])
+
+    def test_busy_chat_does_not_starve_others(self):
+        dispatcher = ChatDispatcher(max_workers=1)
+        release = threading.Event()
+        dispatcher.submit("a", self._job("a", 0, wait_for=release))
+        dispatcher.submit("a", self._job("a", 1))
+        dispatcher.submit("a", self._job("a", 2))
+        dispatcher.submit("b", self._job("b", 0))
+        release.set()
+        dispatcher.shutdown(wait=True, timeout=5)
+
+        order = [(chat, n) for kind, chat, n in self.events if kind == "start"]
+        self.assertEqual(order, [("a", 0), ("b", 0), ("a", 1), ("a", 2)])
+
+    def test_backlog_is_bounded_and_failures_do_not_stop_a_chat(self):
+        dispatcher = ChatDispatcher(max_workers=2, max_pending_per_chat=2)
+        release = threading.Event()
+
+        def failing():
+            release.wait(5)
+            raise RuntimeError("model error")
+
+        self.assertTrue(dispatcher.submit("a", failing))
+        self.assertTrue(dispatcher.submit("a", self._job("a", 1)))
+        self.assertFalse(dispatcher.submit("a", self._job("a", 2)))
+        self.assertTrue(dispatcher.submit("b", self._job("b", 0)))
+        self.assertEqual(dispatcher.get_status()["queued_messages"], 3)
+
+        release.set()
+        dispatcher.shutdown(wait=True, timeout=5)
+        self.assertIn(("end", "a", 1), self.events)
+        self.assertNotIn(("start", "a", 2), self.events)
+        self.assertEqual(dispatcher.get_status(), {"active_chats": 0, "queued_messages": 0})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Tests for the incremental code audit and its per-file result cache
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.code_auditing import CodeAuditor
+
+class CountingAuditor(CodeAuditor):
+    """Records which files were actually analyzed rather than served from the cache"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.analyzed = []
+
+    def _analyze_sources(self, sources):
+        self.analyzed.extend(sorted(sources))
+        return super()._analyze_sources(sources)
+
+    def _run_linters(self, file_paths, batch_size=200):
+        # Keep the tests independent of whether pylint and flake8 are installed
+        return {}
+
+class TestCodeAuditor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmpdir, "data", "code_audit_cache.json")
+        self.a = self._write("a.py", "import os\n\ndef f(x):\n    return x\n")
+        self.b = self._write("b.py", "class C:\n    def m(self):\n        pass\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def _auditor(self):
+        return CountingAuditor(base_path=self.tmpdir, cache_path=self.cache_path)
+
+    def _cached_paths(self):
+        with open(self.cache_path) as f:
+            return set(json.load(f)["files"])
+
+    def test_unchanged_files_come_from_cache(self):
+        results = self._auditor().analyze_files(["a.py", "b.py"])
+        self.assertEqual(results[self.a]["status"], "analyzed")
+        self.assertEqual([c["name"] for c in results[self.b]["classes"]], ["C"])
+
+        auditor = self._auditor()
+        again = auditor.analyze_files(["a.py", "b.py"])
+        self.assertEqual(auditor.analyzed, [])
+        self.assertEqual(again[self.a]["functions"], results[self.a]["functions"])
+
+        self._write("a.py", "def g():\n    return 1\n")
+        auditor.analyze_files(["a.py", "b.py"])
+        self.assertEqual(auditor.analyzed, [self.a])
+
+    def test_parse_error_is_reported(self):
+        broken = self._write("broken.py", "def f(:\n")
+        result = self._auditor().analyze_file(broken)
+        self.assertEqual(result["status"], "parse_error")
+        self.assertTrue(result["issues"])
+
+    def test_unreadable_file_returns_error(self):
+        os.mkdir(os.path.join(self.tmpdir, "pkg.py"))
+        self.assertIn("Could not read file", self._auditor().analyze_file("pkg.py")["error"])
+        self.assertIn("File not found", self._auditor().analyze_file("missing.py")["error"])
+
+    def test_deleted_files_are_pruned_from_cache(self):
+        self._auditor().analyze_files(["a.py", "b.py"])
+        self.assertEqual(self._cached_paths(), {self.a, self.b})
+
+        os.remove(self.b)
+        auditor = self._auditor()
+        auditor.analyze_files(["a.py"])
+        self.assertEqual(auditor.analyzed, [])
+        self.assertEqual(self._cached_paths(), {self.a})
+
+if __name__ == "__main__":
+    unittest.main()
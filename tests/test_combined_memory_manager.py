@@ -0,0 +1,124 @@
+"""
+Tests for the combined memory manager's background summaries: the request
+path never waits on the LLM, and summaries are reused wherever possible
+"""
+import os
+import sys
+import time
+import queue
+import threading
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+# Add the parent directory and src to the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import lyra.combined_memory_manager as combined_memory_manager
+from lyra.combined_memory_manager import CombinedMemoryManager
+
+def entry(n):
+    return {"timestamp": f"2026-01-01T00:00:{n:02d}", "user": f"question {n}", "bot": f"answer {n}", "score": 1.0}
+
+class StubChain:
+    """Conversation chain that records prompts and can be held up"""
+    def __init__(self):
+        self.prompts = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def run(self, prompt):
+        self.release.wait(5)
+        self.prompts.append(prompt)
+        return f"summary {len(self.prompts)}"
+
+class StubFaiss:
+    def __init__(self, results):
+        self.results = results
+
+    def search(self, query_embedding, k=5):
+        return [0.0] * len(self.results), [dict(result) for result in self.results]
+
+    def deduplicate_entries(self, entries):
+        return entries
+
+class TestSummaries(unittest.TestCase):
+
+    def setUp(self):
+        # Summaries go straight to the chain, without the shared cache or scheduler
+        for name in ("get_response_cache", "get_scheduler"):
+            patcher = mock.patch.object(combined_memory_manager, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        manager = CombinedMemoryManager.__new__(CombinedMemoryManager)
+        manager.rolling_summary = ""
+        manager.summarized_ids = OrderedDict()
+        manager.summary_cache = OrderedDict()
+        manager.summary_lock = threading.Lock()
+        manager.summary_queue = queue.Queue()
+        manager.pending_sets = set()
+        manager.conversation_chain = StubChain()
+        manager.embedding_model = None
+        manager.faiss_manager = StubFaiss([entry(1), entry(2)])
+        self.manager = manager
+        self.chain = manager.conversation_chain
+
+    def start_worker(self):
+        threading.Thread(target=self.manager._summary_worker, daemon=True).start()
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_get_context_does_not_wait_for_the_llm(self):
+        self.chain.release.clear()
+        self.start_worker()
+        start = time.time()
+        context = self.manager.get_context("question")
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(context["summary"], "No summary available yet.")
+        self.assertEqual(len(context["context"]), 2)
+        self.assertEqual(self.chain.prompts, [])
+
+        # The set is summarised in the background and served from the cache next time
+        self.chain.release.set()
+        self.wait_for(lambda: not self.manager.pending_sets)
+        self.assertEqual(self.manager.get_context("question")["summary"], "summary 1")
+        self.assertEqual(self.manager.get_context("question again")["summary"], "summary 1")
+        self.assertEqual(len(self.chain.prompts), 1)
+
+    def test_rolling_summary_extends_the_previous_one(self):
+        self.manager._update_rolling_summary([entry(1), entry(2)])
+        self.manager._update_rolling_summary([entry(3)])
+        self.assertEqual(self.manager.rolling_summary, "summary 2")
+
+        first, second = self.chain.prompts
+        self.assertIn("question 1", first)
+        self.assertIn("summary 1", second)
+        self.assertIn("question 3", second)
+        self.assertNotIn("question 1", second)
+
+    def test_in_flight_sets_are_queued_once(self):
+        entries = [entry(1), entry(2)]
+        self.manager._get_summary(entries)
+        self.manager._get_summary(list(reversed(entries)))
+        self.assertEqual(self.manager.summary_queue.qsize(), 1)
+        self.assertEqual(len(self.manager.pending_sets), 1)
+
+    def test_sets_covered_by_the_rolling_summary_are_not_summarised(self):
+        self.manager._update_rolling_summary([entry(1), entry(2), entry(3)])
+        self.assertEqual(self.manager._get_summary([entry(1), entry(3)]), "summary 1")
+        self.assertTrue(self.manager.summary_queue.empty())
+        self.assertEqual(len(self.chain.prompts), 1)
+
+        # One uncovered entry is enough to summarise the set in the background
+        self.manager._get_summary([entry(1), entry(4)])
+        self.assertEqual(self.manager.summary_queue.qsize(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Tests for the ring-buffer metrics store and the health monitor's sampling
+"""
+import os
+import sys
+import time
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.metrics_store import RingBuffer, MetricsStore
+import utils.health_monitor as health_monitor
+from utils.health_monitor import HealthMonitor
+from modules.inference_scheduler import InferenceScheduler
+
+class TestMetricsStore(unittest.TestCase):
+    """Ring buffers, window aggregation and Prometheus output"""
+
+    def test_ring_buffer_wraps_in_order(self):
+        buffer = RingBuffer(capacity=5)
+        for i in range(8):
+            buffer.append(i, timestamp=100.0 + i)
+        timestamps, values = buffer.window()
+        self.assertEqual(list(values), [3, 4, 5, 6, 7])
+        self.assertEqual(list(timestamps), [103.0, 104.0, 105.0, 106.0, 107.0])
+        self.assertEqual(buffer.latest(), 7)
+
+    def test_window_summary(self):
+        buffer = RingBuffer(capacity=200)
+        for i in range(101):
+            buffer.append(i, timestamp=1000.0 + i)
+        summary = buffer.summary()
+        self.assertEqual((summary["count"], summary["p50"], summary["max"]), (101, 50.0, 100.0))
+        self.assertAlmostEqual(summary["p95"], 95.0)
+
+        recent = buffer.summary(seconds=10, now=1100.0)
+        self.assertEqual((recent["count"], recent["min"]), (11, 90.0))
+        self.assertEqual(buffer.summary(seconds=10, now=5000.0)["count"], 0)
+
+    def test_prometheus_format(self):
+        store = MetricsStore()
+        store.describe("queue_depth", "Items waiting")
+        store.describe("requests_total", "Requests served", "counter")
+        store.record("queue_depth", 3, {"queue": "inference"})
+        store.record("queue_depth", 5, {"queue": "inference"})
+        store.record("requests_total", 42)
+        text = store.to_prometheus(window=60)
+
+        self.assertIn("# TYPE lyra_queue_depth gauge", text)
+        self.assertIn('lyra_queue_depth{queue="inference"} 5', text)
+        self.assertIn('lyra_queue_depth_window{queue="inference",window="60s",quantile="0.5"} 4', text)
+        self.assertIn('lyra_queue_depth_window_count{queue="inference",window="60s"} 2', text)
+        self.assertIn("# TYPE lyra_requests_total counter", text)
+        self.assertIn("lyra_requests_total 42", text)
+        self.assertNotIn("lyra_requests_total_window", text)
+
+class TestHealthMonitorSampling(unittest.TestCase):
+    """Non-blocking sampling, the scrape endpoint and loop shutdown"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.monitor = HealthMonitor(data_dir=self.tmpdir)
+
+    def tearDown(self):
+        if self.monitor.monitoring:
+            self.monitor.stop_monitoring()
+        self.monitor.stop_exporter()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_sampling_does_not_block(self):
+        pending = queue.Queue()
+        for i in range(4):
+            pending.put(i)
+        self.monitor.register_queue("jobs", pending.qsize)
+
+        started = time.monotonic()
+        for _ in range(20):
+            sample = self.monitor.sample_metrics()
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        self.assertIn("process_cpu_percent", sample)
+        self.assertGreater(sample["python_threads"], 0)
+        self.assertGreater(sample["process_rss_bytes"], 0)
+        self.assertEqual(self.monitor.metrics.latest("queue_depth", {"queue": "jobs"}), 4)
+        self.assertEqual(self.monitor.get_metrics_summary()["python_threads"]["count"], 20)
+
+    def test_health_check_uses_latest_sample(self):
+        started = time.monotonic()
+        health = self.monitor.check_system_health()
+        self.assertLess(time.monotonic() - started, 0.3)
+        self.assertIn("process_memory_mb", health)
+
+    def test_exporter_serves_metrics(self):
+        self.monitor.sample_metrics()
+        self.assertTrue(self.monitor.start_exporter(port=0))
+        url = f"http://127.0.0.1:{self.monitor.exporter.port}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode("utf-8")
+            self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn("# TYPE lyra_python_threads gauge", body)
+        self.assertIn("lyra_monitor_cpu_seconds_total", body)
+
+    def test_monitor_loop_samples_and_stops_promptly(self):
+        self.monitor.start_monitoring(interval=60, sample_interval=0.05)
+        time.sleep(0.3)
+        started = time.monotonic()
+        self.monitor.stop_monitoring()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertGreaterEqual(self.monitor.metrics.summary("python_threads")["count"], 3)
+        self.assertEqual(len(self.monitor.metrics_history["system"]), 1)
+
+    def test_scheduler_queues_are_sampled(self):
+        previous, health_monitor._health_monitor = health_monitor._health_monitor, self.monitor
+        self.addCleanup(setattr, health_monitor, "_health_monitor", previous)
+        scheduler = InferenceScheduler(monitor_name="inference")
+        started, release = threading.Event(), threading.Event()
+        running = scheduler.submit("model", lambda: started.set() or release.wait(5))
+        started.wait(5)
+        queued = [scheduler.submit("model", lambda: None) for _ in range(3)]
+
+        self.monitor.sample_metrics()
+        self.assertEqual(self.monitor.metrics.latest("queue_depth", {"queue": "inference:model"}), 3)
+        release.set()
+        for future in [running] + queued:
+            future.result(5)
+
+        scheduler.remove_model("model")
+        self.assertNotIn("inference:model", self.monitor.queues)
+        # Private schedulers stay out of the shared monitor
+        InferenceScheduler().submit("model", lambda: None).result(5)
+        self.assertEqual(list(self.monitor.queues), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Tests for the inference scheduler
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.inference_scheduler import InferenceScheduler, QueueFullError, check_preemption, is_preemptible
+
+class TestInferenceScheduler(unittest.TestCase):
+    """Test ordering, serialization and backpressure of the scheduler"""
+
+    def setUp(self):
+        self.scheduler = InferenceScheduler(max_queue_size=4, background_cooldown=0.2)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def _blocker(self):
+        """Occupy the model worker until released"""
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+            return "blocked"
+
+        future = self.scheduler.submit("model", block, priority="interactive")
+        started.wait(5)
+        return release, future
+
+    def test_priority_order(self):
+        """Interactive requests run before API and background requests"""
+        release, _ = self._blocker()
+        order = []
+        futures = [
+            self.scheduler.submit("model", lambda: order.append("background"), priority="background"),
+            self.scheduler.submit("model", lambda: order.append("api"), priority="api"),
+            self.scheduler.submit("model", lambda: order.append("interactive"), priority="interactive"),
+        ]
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertEqual(order, ["interactive", "api", "background"])
+
+    def test_requests_are_serialized_per_model(self):
+        """Two calls on the same model never overlap"""
+        active = []
+        overlaps = []
+
+        def work():
+            active.append(1)
+            if len(active) > 1:
+                overlaps.append(True)
+            time.sleep(0.01)
+            active.pop()
+
+        futures = [self.scheduler.submit("model", work, caller=i) for i in range(4)]
+        for future in futures:
+            future.result(5)
+        self.assertEqual(overlaps, [])
+
+    def test_fair_share_between_callers(self):
+        """A caller with many queued requests does not starve another caller"""
+        release, _ = self._blocker()
+        order = []
+        futures = [self.scheduler.submit("model", lambda: order.append("a"), caller="a") for _ in range(3)]
+        futures.append(self.scheduler.submit("model", lambda: order.append("b"), caller="b"))
+        release.set()
+        for future in futures:
+            future.result(5)
+        self.assertLess(order.index("b"), 2)
+
+    def test_full_queue_sheds_background_first(self):
+        """When full, a foreground request displaces queued background work"""
+        release, _ = self._blocker()
+        background = [self.scheduler.submit("model", lambda: None, priority="background") for _ in range(4)]
+        interactive = self.scheduler.submit("model", lambda: "ok", priority="interactive")
+        release.set()
+
+        self.assertEqual(interactive.result(5), "ok")
+        with self.assertRaises(QueueFullError):
+            background[-1].result(5)
+
+        metrics = self.scheduler.get_metrics()["model"]
+        self.assertEqual(metrics["rejected"]["background"], 1)
+
+    def test_nested_call_runs_inline(self):
+        """A generation that calls back into the scheduler does not deadlock"""
+        result = self.scheduler.run(
+            "model", lambda: self.scheduler.run("model", lambda: "inner"), timeout=5
+        )
+        self.assertEqual(result, "inner")
+
+    def _token_loop(self, log, tokens=50):
+        """A background generation that checks for preemption between tokens"""
+        def generate():
+            log.append("start")
+            for _ in range(tokens):
+                check_preemption()
+                time.sleep(0.01)
+            log.append("done")
+            return "background"
+        return generate
+
+    def test_background_generation_yields_to_interactive(self):
+        """A running background generation is preempted and re-run after foreground work"""
+        scheduler = InferenceScheduler(background_cooldown=0.0)
+        self.addCleanup(scheduler.shutdown)
+        log = []
+        background = scheduler.submit("model", self._token_loop(log), priority="background")
+        while not log:
+            time.sleep(0.005)
+
+        started = time.time()
+        interactive = scheduler.submit("model", lambda: log.append("interactive") or "ok", priority="interactive")
+        self.assertEqual(interactive.result(5), "ok")
+        # Served within a token or two instead of after the whole background generation
+        self.assertLess(time.time() - started, 0.2)
+
+        self.assertEqual(background.result(5), "background")
+        self.assertEqual(log, ["start", "interactive", "start", "done"])
+        self.assertEqual(scheduler.get_metrics()["model"]["preempted"], 1)
+
+    def test_preemption_is_bounded(self):
+        """After max_preemptions a background request runs to completion"""
+        scheduler = InferenceScheduler(background_cooldown=0.0, max_preemptions=1)
+        self.addCleanup(scheduler.shutdown)
+        log = []
+        background = scheduler.submit("model", self._token_loop(log, tokens=30), priority="background")
+        for _ in range(2):
+            count = log.count("start")
+            while log.count("start") == count:
+                time.sleep(0.005)
+            scheduler.submit("model", lambda: log.append("interactive"), priority="interactive")
+
+        self.assertEqual(background.result(5), "background")
+        # The second interactive request waited for the background one to finish
+        self.assertEqual(log, ["start", "interactive", "start", "done", "interactive"])
+
+    def test_foreground_requests_are_not_preemptible(self):
+        """check_preemption is a no-op outside background requests"""
+        self.assertFalse(is_preemptible())
+        check_preemption()
+        self.assertFalse(self.scheduler.run("model", is_preemptible, priority="interactive", timeout=5))
+        self.assertTrue(self.scheduler.run("model", is_preemptible, priority="background", timeout=5))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+Tests for the framed IPC server and client
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ipc import IPCServer, IPCClient, IPCError, HEADER
+
+def echo(params, emit):
+    return params
+
+def sleepy(params, emit):
+    time.sleep(params["delay"])
+    return params["delay"]
+
+def streaming(params, emit):
+    for i in range(params["parts"]):
+        emit(i)
+    return "done"
+
+def huge(params, emit):
+    return "x" * params["size"]
+
+def broken(params, emit):
+    raise ValueError("boom")
+
+class TestIPC(unittest.TestCase):
+    """Framing, pipelining, partial responses and concurrency"""
+
+    def setUp(self):
+        handlers = {"echo": echo, "sleep": sleepy, "stream": streaming, "broken": broken, "huge": huge}
+        self.server = IPCServer(handlers, port=0, max_workers=8)
+        self.assertTrue(self.server.start())
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.stop()
+
+    def _client(self):
+        client = IPCClient(port=self.server.port, timeout=10).connect()
+        self.clients.append(client)
+        return client
+
+    def test_large_payload_is_not_truncated(self):
+        payload = {"text": "x" * 2_000_000}
+        self.assertEqual(self._client().call("echo", payload), payload)
+
+    def test_pipelined_requests_complete_out_of_order(self):
+        client = self._client()
+        started = time.monotonic()
+        slow = client.submit("sleep", {"delay": 0.5})
+        fast = client.submit("sleep", {"delay": 0.05})
+        self.assertEqual(fast.result(5)["data"], 0.05)
+        self.assertFalse(slow.done())
+        self.assertEqual(slow.result(5)["data"], 0.5)
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_partial_responses_arrive_before_final(self):
+        parts = []
+        result = self._client().call("stream", {"parts": 5}, on_partial=parts.append)
+        self.assertEqual(parts, [0, 1, 2, 3, 4])
+        self.assertEqual(result, "done")
+
+    def test_many_clients_are_served_concurrently(self):
+        clients = [self._client() for _ in range(6)]
+        started = time.monotonic()
+        futures = [client.submit("sleep", {"delay": 0.3}) for client in clients]
+        for future in futures:
+            self.assertTrue(future.result(5)["success"])
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_errors_are_reported_per_request(self):
+        client = self._client()
+        with self.assertRaises(IPCError):
+            client.call("broken")
+        with self.assertRaises(IPCError):
+            client.call("missing")
+        self.assertEqual(client.call("echo", {"still": "works"}), {"still": "works"})
+
+    def test_oversized_response_becomes_an_error(self):
+        client = self._client()
+        with mock.patch("modules.ipc.MAX_FRAME_SIZE", 1000):
+            with self.assertRaisesRegex(IPCError, "exceeds the 1000 byte limit"):
+                client.call("huge", {"size": 2000}, timeout=5)
+            self.assertEqual(client.call("echo", {"a": 1}, timeout=5), {"a": 1})
+
+    def test_malformed_frame_gets_an_error_frame(self):
+        sock = socket.create_connection(("localhost", self.server.port), timeout=5)
+        reader = sock.makefile("rb")
+
+        def read_frame():
+            (length,) = HEADER.unpack(reader.read(HEADER.size))
+            return json.loads(reader.read(length))
+
+        try:
+            bad = b"{not json"
+            sock.sendall(HEADER.pack(len(bad)) + bad)
+            response = read_frame()
+            self.assertFalse(response["success"])
+            self.assertIn("Invalid request", response["error"])
+
+            # The connection stays usable
+            good = json.dumps({"id": 7, "action": "echo", "params": {"a": 1}}).encode("utf-8")
+            sock.sendall(HEADER.pack(len(good)) + good)
+            self.assertEqual(read_frame(), {"success": True, "data": {"a": 1}, "id": 7})
+        finally:
+            reader.close()
+            sock.close()
+
+    def test_legacy_unframed_request(self):
+        sock = socket.create_connection(("localhost", self.server.port), timeout=5)
+        sock.sendall(json.dumps({"action": "echo", "params": {"a": 1}}).encode("utf-8"))
+        data = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        sock.close()
+        self.assertEqual(json.loads(data), {"success": True, "data": {"a": 1}})
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix sockets not available")
+    def test_unix_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            server = IPCServer({"echo": echo}, unix_path=os.path.join(tmpdir, "lyra.sock"))
+            self.assertTrue(server.start())
+            with IPCClient(unix_path=server.unix_path) as client:
+                self.assertEqual(client.call("echo", {"b": 2}), {"b": 2})
+            server.stop()
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+"""
+Tests for knowledge query caching against a local stub Wikipedia API
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.knowledge_integration import KnowledgeCache, KnowledgeIntegrator, LocalKnowledgeIndex
+
+class StubWikipedia:
+    """Answers every request with one search result and counts requests"""
+
+    def __init__(self):
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                body = json.dumps({"query": {"pages": {"1": {"title": "Otters", "extract": "Otters swim."}}}})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode("utf-8"))
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/w/api.php"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class TestKnowledgeQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wikipedia = StubWikipedia()
+        self.facts_path = os.path.join(self.tmpdir, "facts.json")
+        self._write_facts([{"title": "Otters", "content": "Otters hold hands while sleeping.",
+                            "keywords": ["otter"]}])
+        config_path = os.path.join(self.tmpdir, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({
+                "cache_dir": os.path.join(self.tmpdir, "cache"),
+                "sources": {
+                    "wikipedia": {"enabled": True, "api_url": self.wikipedia.url, "max_results": 1},
+                    "arxiv": {"enabled": False},
+                    "local_database": {"enabled": True, "path": self.facts_path},
+                    "unsupported": {"enabled": True}
+                }
+            }, f)
+        self.integrator = KnowledgeIntegrator(config_path)
+
+    def tearDown(self):
+        self.integrator.executor.shutdown(wait=True)
+        self.wikipedia.stop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write_facts(self, facts):
+        with open(self.facts_path, "w") as f:
+            json.dump(facts, f)
+
+    def test_successful_results_are_cached(self):
+        first = self.integrator.query_knowledge("otters", sources=["wikipedia"])
+        second = self.integrator.query_knowledge("otters", sources=["wikipedia"])
+        self.assertEqual(first["wikipedia"]["results"][0]["title"], "Otters")
+        self.assertEqual(second, first)
+        self.assertEqual(self.wikipedia.requests, 1)
+
+    def test_returned_errors_are_not_cached(self):
+        first = self.integrator.query_knowledge("otters", sources=["wikipedia", "unsupported"])
+        self.assertIn("error", first["unsupported"])
+        self.integrator.query_knowledge("otters", sources=["wikipedia", "unsupported"])
+        self.assertEqual(self.wikipedia.requests, 2)
+        self.assertEqual(self.integrator.get_cache_stats()["hits"], 0)
+
+    def test_local_database_edits_show_up_immediately(self):
+        first = self.integrator.query_knowledge("otter", sources=["wikipedia", "local_database"])
+        self.assertEqual(first["local_database"]["results"][0]["title"], "Otters")
+
+        self._write_facts([{"title": "Sea otters", "content": "Sea otters use rocks as tools.",
+                            "keywords": ["otter"]}])
+        second = self.integrator.query_knowledge("otter", sources=["wikipedia", "local_database"])
+        self.assertEqual(second["local_database"]["results"][0]["title"], "Sea otters")
+        # The remote source still came from the cache
+        self.assertEqual(self.wikipedia.requests, 1)
+
+class TestKnowledgeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _accessed(self, key):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT accessed FROM cache WHERE key = ?", (key,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_memory_hits_keep_entries_from_eviction(self):
+        cache = KnowledgeCache(self.db_path, max_entries=2, memory_entries=2)
+        cache.set("a", 1)
+        time.sleep(0.01)
+        cache.set("b", 2)
+        time.sleep(0.01)
+        # Served from memory; the access is written to SQLite with the next set
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+        reopened = KnowledgeCache(self.db_path)
+        self.assertEqual(reopened.get("a"), 1)
+        self.assertIsNone(reopened.get("b"))
+
+    def test_memory_hits_are_flushed_after_the_interval(self):
+        cache = KnowledgeCache(self.db_path, access_flush_interval=0.1)
+        cache.set("a", 1)
+        stored = self._accessed("a")
+        time.sleep(0.15)
+        cache.get("a")
+        self.assertGreater(self._accessed("a"), stored)
+
+        # Within the interval hits only accumulate in memory
+        stored = self._accessed("a")
+        cache.get("a")
+        self.assertEqual(self._accessed("a"), stored)
+        cache.flush_access()
+        self.assertGreater(self._accessed("a"), stored)
+
+class StubEmbedder:
+    """Embeds text by length and counts calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_text(self, text):
+        self.calls += 1
+        return [float(len(text))]
+
+    def compute_similarity(self, a, b):
+        return 1.0 / (1.0 + abs(a[0] - b[0]))
+
+class TestLocalKnowledgeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.facts_path = os.path.join(self.tmpdir, "facts.json")
+        facts = [
+            {"title": "Notes", "content": "Badgers dig burrows at night near rivers."},
+            {"title": "Badgers", "content": "They dig burrows at night near rivers."},
+        ]
+        # Facts without the term give it a non-zero inverse document frequency
+        facts += [{"title": f"Otters {i}", "content": "Otters swim in cold water all day long."} for i in range(4)]
+        with open(self.facts_path, "w") as f:
+            json.dump(facts, f)
+        self.index = LocalKnowledgeIndex(self.facts_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_title_match_outranks_body_match(self):
+        results = self.index.search("badgers", max_results=2)
+        self.assertEqual([item["title"] for item in results], ["Badgers", "Notes"])
+        self.assertGreater(results[0]["relevance_score"], results[1]["relevance_score"])
+
+    def test_embedding_cache_is_bounded(self):
+        self.index.embedder = StubEmbedder()
+        self.index.EMBEDDING_CACHE_SIZE = 3
+        self.index.search("otters", max_results=4, rerank=True)
+        self.assertEqual(len(self.index.embedding_cache), 3)
+
+        # Cached facts are not embedded again, only the query is
+        self.index.search("badgers", max_results=2, rerank=True)
+        calls = self.index.embedder.calls
+        self.index.search("badgers", max_results=2, rerank=True)
+        self.assertEqual(self.index.embedder.calls, calls + 1)
+        self.assertEqual(len(self.index.embedding_cache), 3)
+
+if __name__ == "__main__":
+    unittest.main()
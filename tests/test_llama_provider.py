@@ -0,0 +1,258 @@
+"""
+Tests for the llama.cpp provider that do not need llama-cpp-python or a model
+"""
+import os
+import sys
+import time
+import types
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.inference_scheduler import InferenceScheduler
+from modules.llm_providers.llama_provider import LlamaModel, PromptStateCache, _MeteredDraftModel
+
+class FakeLlama:
+    """Streams one chunk per token like llama_cpp.Llama(stream=True)"""
+
+    def __init__(self, tokens=20, delay=0.01):
+        self.tokens = tokens
+        self.delay = delay
+        self.calls = []
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return list(range(len(text.split())))
+
+    def __call__(self, prompt, stream=False, **kwargs):
+        self.calls.append(stream)
+        if not stream:
+            return {"choices": [{"text": "whole"}], "usage": {"prompt_tokens": 1, "completion_tokens": 1}}
+        return self._stream()
+
+    def _stream(self):
+        for i in range(self.tokens):
+            time.sleep(self.delay)
+            yield {"choices": [{"text": f"t{i} "}]}
+
+def make_provider(model):
+    """A LlamaModel around an already-loaded model, skipping _initialize"""
+    provider = LlamaModel.__new__(LlamaModel)
+    provider.config = SimpleNamespace(model_name="fake", model_path="fake.gguf", parameters={})
+    provider.model = model
+    provider.prompt_cache = None
+    provider.draft_model = None
+    provider.last_generation_stats = {}
+    provider.speculative_totals = {"generations": 0, "completion_tokens": 0, "draft_steps": 0,
+                                   "draft_proposed": 0, "draft_accepted": 0}
+    return provider
+
+class TestPreemptibleGeneration(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = InferenceScheduler(background_cooldown=0.0)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def test_foreground_generation_does_not_stream(self):
+        model = FakeLlama()
+        provider = make_provider(model)
+        self.assertEqual(self.scheduler.run("fake", lambda: provider.generate("hi"), priority="interactive",
+                                            timeout=5), "whole")
+        self.assertEqual(model.calls, [False])
+
+    def test_on_token_streams_each_piece(self):
+        model = FakeLlama(tokens=5, delay=0.0)
+        provider = make_provider(model)
+        pieces = []
+        text = self.scheduler.run("fake", lambda: provider.generate("hi", on_token=pieces.append),
+                                  priority="interactive", timeout=5)
+        self.assertEqual(model.calls, [True])
+        self.assertEqual(pieces, [f"t{i} " for i in range(5)])
+        self.assertEqual(text, "".join(pieces))
+
+    def test_background_generation_is_preempted_and_rerun(self):
+        model = FakeLlama()
+        provider = make_provider(model)
+        background = self.scheduler.submit("fake", lambda: provider.generate("a long prompt"),
+                                           priority="background")
+        while not model.calls:
+            time.sleep(0.005)
+        self.assertEqual(self.scheduler.run("fake", lambda: "chat", priority="interactive", timeout=5), "chat")
+
+        text = background.result(5)
+        self.assertEqual(text, "".join(f"t{i} " for i in range(20)))
+        self.assertEqual(model.calls, [True, True])
+        self.assertEqual(provider.get_generation_stats()["completion_tokens"], 20)
+        self.assertEqual(provider.get_generation_stats()["prompt_tokens"], 3)
+
+def state(size, tag=None):
+    return SimpleNamespace(llama_state_size=size, tag=tag)
+
+class TestPromptStateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.system = tuple(range(1000, 1040))  # shared system prompt, 2.5 blocks
+
+    def test_exact_and_prefix_hits(self):
+        cache = PromptStateCache(capacity_bytes=100)
+        turn1 = self.system + (1, 2, 3)
+        cache[turn1] = state(10, "turn1")
+        self.assertIs(cache[turn1].tag, "turn1")
+
+        # The next turn extends the previous one and restores its state
+        turn2 = turn1 + tuple(range(50, 80))
+        self.assertIn(turn2, cache)
+        self.assertEqual(cache[turn2].tag, "turn1")
+        stats = cache.get_stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["tokens_reused"], 2 * len(turn1))
+
+    def test_longest_prefix_wins_and_short_prefixes_miss(self):
+        cache = PromptStateCache(capacity_bytes=100)
+        cache[self.system[:16]] = state(10, "short")
+        cache[self.system + (7,) * 20] = state(10, "long")
+        self.assertEqual(cache[self.system + (7,) * 20 + (9,)].tag, "long")
+        self.assertEqual(cache[self.system[:20] + (5,) * 20].tag, "short")
+        with self.assertRaises(KeyError):
+            cache[self.system[:10] + (5,) * 20]
+        self.assertNotIn((1, 2, 3), cache)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = PromptStateCache(capacity_bytes=25)
+        a, b, c = (self.system + (i,) * 16 for i in range(3))
+        cache[a] = state(10, "a")
+        cache[b] = state(10, "b")
+        cache[a]  # a is now most recent
+        cache[c] = state(10, "c")
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertEqual(cache.get_stats()["ram_bytes"], 20)
+        # b is gone; its prompt now only matches the shared system blocks of a or c
+        self.assertIn(cache[b].tag, ("a", "c"))
+        self.assertEqual(cache[a].tag, "a")
+
+    def test_oversized_state_is_not_kept(self):
+        cache = PromptStateCache(capacity_bytes=25)
+        cache[self.system] = state(10, "small")
+        cache[self.system + (1,) * 16] = state(30, "huge")
+        stats = cache.get_stats()
+        self.assertEqual(stats["oversized"], 1)
+        self.assertEqual(stats["evictions"], 0)
+        self.assertEqual(stats["ram_entries"], 1)
+        self.assertEqual(cache[self.system + (1,) * 16].tag, "small")
+
+    def test_evicted_states_spill_to_disk_and_come_back(self):
+        disk = {}
+        cache = PromptStateCache(capacity_bytes=15, disk_cache=disk)
+        a, b = self.system + (1,) * 16, self.system + (2,) * 16
+        cache[a] = state(10, "a")
+        cache[b] = state(10, "b")
+        self.assertEqual(list(disk), [a])
+
+        self.assertEqual(cache[a].tag, "a")
+        self.assertEqual(cache.get_stats()["disk_hits"], 1)
+
+        # A new process indexes what is already on disk
+        reopened = PromptStateCache(capacity_bytes=15, disk_cache=disk)
+        self.assertEqual(reopened[b + (3,)].tag, "b")
+
+        # Entries the disk cache dropped on its own are treated as misses
+        disk.clear()
+        fresh = PromptStateCache(capacity_bytes=15, disk_cache={a: state(10, "a")})
+        fresh.disk_cache.clear()
+        with self.assertRaises(KeyError):
+            fresh[a]
+
+class SpeculativeLlama:
+    """Calls the draft model a few times per completion like llama.cpp's speculative loop"""
+
+    def __init__(self, steps, completion_tokens):
+        self.draft_model = None
+        self.steps = steps
+        self.completion_tokens = completion_tokens
+
+    def __call__(self, prompt, **kwargs):
+        for _ in range(self.steps):
+            self.draft_model([1, 2, 3])
+        return {"choices": [{"text": "ok"}],
+                "usage": {"prompt_tokens": 5, "completion_tokens": self.completion_tokens}}
+
+class TestSpeculativeDecoding(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.model_path = os.path.join(self.tmpdir, "main.gguf")
+        open(self.model_path, "wb").close()
+        self.events = []
+        events = self.events
+
+        class Llama:
+            fail = False
+
+            def __init__(self, **params):
+                events.append(("main", params))
+                if Llama.fail:
+                    raise RuntimeError("out of memory")
+                self.draft_model = None
+
+        self.Llama = Llama
+        # Only the Llama class is needed; llama-cpp-python is not installed here
+        self.modules = mock.patch.dict(sys.modules, {"llama_cpp": types.SimpleNamespace(Llama=Llama)})
+        self.modules.start()
+
+    def tearDown(self):
+        self.modules.stop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _load(self):
+        events = self.events
+
+        class RecordingModel(LlamaModel):
+            def _create_draft_model(self, context_size):
+                events.append(("draft", context_size))
+                self.draft_model = _MeteredDraftModel(lambda ids, **kwargs: [7, 8])
+                return self.draft_model
+
+        config = SimpleNamespace(model_name="main", model_path=self.model_path,
+                                 parameters={"speculative": "draft", "context_size": 2048})
+        return RecordingModel(config)
+
+    def test_draft_model_loads_after_main_model(self):
+        provider = self._load()
+        self.assertEqual([event[0] for event in self.events], ["main", "draft"])
+        self.assertTrue(self.events[0][1]["logits_all"])
+        self.assertNotIn("draft_model", self.events[0][1])
+        self.assertIs(provider.model.draft_model, provider.draft_model)
+
+    def test_failed_main_load_leaves_no_draft_model(self):
+        self.Llama.fail = True
+        with self.assertRaises(RuntimeError):
+            self._load()
+        self.assertEqual([event[0] for event in self.events], ["main"])
+
+    def test_acceptance_is_reported_and_accumulated(self):
+        provider = make_provider(SpeculativeLlama(steps=4, completion_tokens=10))
+        provider.config.parameters["speculative"] = "draft"
+        provider.draft_model = provider.model.draft_model = _MeteredDraftModel(lambda ids, **kwargs: [1, 2, 3])
+
+        with self.assertLogs("llama_provider", level="INFO") as logs:
+            provider.generate("hi")
+        stats = provider.get_generation_stats()
+        # 4 steps produced 10 tokens: 6 of the 12 proposed draft tokens were accepted
+        self.assertEqual((stats["draft_steps"], stats["draft_proposed"], stats["draft_accepted"]), (4, 12, 6))
+        self.assertAlmostEqual(stats["acceptance_rate"], 0.5)
+        self.assertTrue(any("draft acceptance 50%" in line for line in logs.output))
+
+        provider.generate("again")
+        totals = provider.get_generation_stats()["speculative_totals"]
+        self.assertEqual((totals["generations"], totals["draft_proposed"], totals["draft_accepted"]), (2, 24, 12))
+        self.assertAlmostEqual(totals["acceptance_rate"], 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
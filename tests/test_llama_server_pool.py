@@ -0,0 +1,222 @@
+"""
+Tests for the llama-server pool using stub HTTP servers
+"""
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.llm_providers.llama_server_pool import (
+    LlamaServerPool, ServerWorker, NoHealthyWorkerError, plan_workers
+)
+
+class StubServer:
+    """Minimal llama-server stand-in with /health and /completion"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.healthy = True
+        self.hits = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    if stub.healthy:
+                        self._reply(200, {"status": "ok"})
+                    else:
+                        self._reply(503, {"status": "loading model"})
+                else:
+                    self._reply(404, {})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                with stub.lock:
+                    stub.hits += 1
+                time.sleep(stub.delay)
+                self._reply(200, {"content": f"{stub.port}:{payload.get('prompt')}"})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeProcess:
+    """Stands in for a launched llama-server process"""
+
+    def __init__(self):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = 0
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+class TestLlamaServerPool(unittest.TestCase):
+    """Routing, affinity, health checks and restarts"""
+
+    def setUp(self):
+        self.stubs = []
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool:
+            self.pool.shutdown()
+        for stub in self.stubs:
+            stub.close()
+
+    def _make_pool(self, count, delay=0.0, **kwargs):
+        self.stubs = [StubServer(delay) for _ in range(count)]
+        self.pool = LlamaServerPool.from_urls([stub.url for stub in self.stubs], health_interval=60, **kwargs)
+        self.pool.start(launch=False, ready_timeout=5)
+        return self.pool
+
+    def test_least_outstanding_spreads_concurrent_requests(self):
+        pool = self._make_pool(3, delay=0.2)
+        threads = [
+            threading.Thread(target=pool.post, args=("/completion", {"prompt": str(i)}))
+            for i in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([stub.hits for stub in self.stubs], [2, 2, 2])
+
+    def test_session_affinity(self):
+        pool = self._make_pool(3)
+        first = pool.post("/completion", {"prompt": "a"}, session_key="chat-1")
+        port = first["content"].split(":")[0]
+        for _ in range(5):
+            result = pool.post("/completion", {"prompt": "b"}, session_key="chat-1")
+            self.assertEqual(result["content"].split(":")[0], port)
+
+    def test_unhealthy_worker_is_skipped(self):
+        pool = self._make_pool(2)
+        self.stubs[0].healthy = False
+        pool.check_health()
+        for _ in range(4):
+            pool.post("/completion", {"prompt": "x"})
+        self.assertEqual(self.stubs[0].hits, 0)
+        self.assertEqual(self.stubs[1].hits, 4)
+
+    def test_failover_when_worker_goes_down(self):
+        pool = self._make_pool(2)
+        self.stubs[0].close()
+        for _ in range(4):
+            result = pool.post("/completion", {"prompt": "x"}, session_key="s")
+            self.assertTrue(result["content"].startswith(str(self.stubs[1].port)))
+
+    def test_no_healthy_workers(self):
+        pool = LlamaServerPool([ServerWorker("http://127.0.0.1:9")], health_interval=60)
+        pool.check_health()
+        with self.assertRaises(NoHealthyWorkerError):
+            pool.post("/completion", {"prompt": "x"})
+
+    def test_dead_worker_is_restarted(self):
+        launched = []
+
+        def launcher(worker):
+            process = FakeProcess()
+            launched.append(process)
+            return process
+
+        stub = StubServer()
+        self.stubs = [stub]
+        worker = ServerWorker(stub.url)
+        self.pool = LlamaServerPool([worker], launcher=launcher, health_interval=60, restart_backoff=0)
+        self.pool.start(ready_timeout=5)
+        self.assertEqual(len(launched), 1)
+
+        launched[0].returncode = 1
+        self.pool.check_health()
+        self.assertEqual(worker.restarts, 1)
+        deadline = time.time() + 5
+        while worker.restarting and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(launched), 2)
+
+    def test_slow_restart_does_not_block_health_checks(self):
+        release = threading.Event()
+        processes = {}
+
+        def launcher(worker):
+            if worker in processes:
+                release.wait(5)
+            processes[worker] = FakeProcess()
+            return processes[worker]
+
+        self.stubs = [StubServer(), StubServer()]
+        dying, other = ServerWorker(self.stubs[0].url), ServerWorker(self.stubs[1].url)
+        self.pool = LlamaServerPool([dying, other], launcher=launcher, health_interval=60, restart_backoff=0)
+        self.pool.start(ready_timeout=5)
+
+        processes[dying].returncode = 1
+        self.stubs[1].healthy = False
+        started = time.time()
+        self.pool.check_health()
+        self.pool.check_health()
+        self.assertLess(time.time() - started, 2)
+        self.assertTrue(dying.restarting)
+        self.assertEqual(dying.restarts, 1)
+        self.assertFalse(other.healthy)
+
+        release.set()
+        deadline = time.time() + 5
+        while dying.restarting and time.time() < deadline:
+            time.sleep(0.01)
+        self.pool.check_health()
+        self.assertTrue(dying.healthy)
+
+    def test_session_key_follows_the_conversation(self):
+        from modules.llm_providers.llama_server_provider import LlamaServerModel
+
+        model = LlamaServerModel.__new__(LlamaServerModel)
+        system = {"role": "system", "content": "You are Lyra. " * 500}
+        chat_a = [system, {"role": "user", "content": "hi, I am A"}, {"role": "assistant", "content": "hello"}]
+        chat_b = [system, {"role": "user", "content": "hi, I am B"}, {"role": "assistant", "content": "hello"}]
+
+        key_a = model._session_key({}, chat_a)
+        self.assertEqual(model._session_key({}, chat_a + [{"role": "user", "content": "more"}]), key_a)
+        # A long shared system prompt does not merge different conversations
+        self.assertNotEqual(model._session_key({}, chat_b), key_a)
+        self.assertEqual(model._session_key({"session_id": "telegram-42"}, chat_a), "telegram-42")
+        self.assertIsNone(model._session_key({}, [system, {"role": "user", "content": "one-off"}]))
+        self.assertIsNone(model._session_key({}))
+
+    def test_plan_workers_splits_cpus(self):
+        workers = plan_workers(2, base_port=9000, cpu_count=8)
+        self.assertEqual([w.port for w in workers], [9000, 9001])
+        self.assertEqual(workers[0].cpu_set, [0, 1, 2, 3])
+        self.assertEqual(workers[1].cpu_set, [4, 5, 6, 7])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+"""
+Tests for concurrent provider fan-out in the LLM advisor using local stub servers
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory and src to the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+try:
+    from lyra.self_improvement import llm_advisor
+    from lyra.self_improvement.llm_advisor import LLMAdvisor, CircuitBreaker, LatencyHistogram
+    from modules.response_cache import ResponseCache
+    HAS_ADVISOR = True
+except ImportError:
+    HAS_ADVISOR = False
+
+class StubProvider:
+    """OpenAI/Anthropic-compatible endpoint with an injectable delay and status"""
+
+    def __init__(self, text="1. Use a list comprehension\n2. Fix the off-by-one error", delay=0.0, status=200):
+        self.text = text
+        self.delay = delay
+        self.status = status
+        self.calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.calls += 1
+                time.sleep(stub.delay)
+                body = json.dumps({"choices": [{"message": {"content": stub.text}}],
+                                   "content": [{"text": stub.text}]}).encode("utf-8")
+                try:
+                    self.send_response(stub.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@unittest.skipUnless(HAS_ADVISOR, "LLM advisor dependencies not installed")
+class TestCompareSuggestions(unittest.TestCase):
+    """Concurrent dispatch, deadlines, racing modes, breakers and caching"""
+
+    CODE = "def total(items):\n    return sum([i for i in items])\n"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_cache = llm_advisor.get_response_cache
+        llm_advisor.get_response_cache = None
+        self.stubs = {}
+        self.advisor = None
+
+    def tearDown(self):
+        llm_advisor.get_response_cache = self.saved_cache
+        if self.advisor:
+            self.advisor.shutdown()
+        for stub in self.stubs.values():
+            stub.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _advisor(self, **stubs):
+        self.stubs = stubs
+        config = {
+            "default_provider": "openai",
+            "providers": {
+                name: {"api_key": "test", "model": f"{name}-model", "api_base": stub.url, "enabled": True}
+                for name, stub in stubs.items()
+            },
+            "prompts": {"code_review": "Review:\n```{language}\n{code}\n```"},
+            "compare": {"breaker_failures": 2, "breaker_reset": 0.3, "deadline": 5.0}
+        }
+        path = os.path.join(self.tmpdir, "advisor_config.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        self.advisor = LLMAdvisor(config_path=path)
+        return self.advisor
+
+    def test_providers_are_queried_concurrently(self):
+        advisor = self._advisor(openai=StubProvider(delay=0.4), deepseek=StubProvider(delay=0.4),
+                                anthropic=StubProvider(delay=0.4))
+        started = time.monotonic()
+        result = advisor.compare_suggestions(self.CODE, use_cache=False)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(result["combined"]["success_count"], 3)
+        self.assertEqual(result["combined"]["total_suggestions"], 6)
+        self.assertEqual(list(result["provider_results"]), ["openai", "deepseek", "anthropic"])
+
+    def test_hung_provider_is_cut_off_at_deadline(self):
+        advisor = self._advisor(openai=StubProvider(), deepseek=StubProvider(delay=3.0))
+        started = time.monotonic()
+        result = advisor.compare_suggestions(self.CODE, deadline=0.5, use_cache=False)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertTrue(result["provider_results"]["openai"]["success"])
+        self.assertEqual(result["combined"]["cancelled"], ["deepseek"])
+
+    def test_first_mode_returns_after_fastest_answer(self):
+        advisor = self._advisor(openai=StubProvider(delay=1.5), deepseek=StubProvider(delay=0.05),
+                                anthropic=StubProvider(delay=1.5))
+        started = time.monotonic()
+        result = advisor.compare_suggestions(self.CODE, mode="first", use_cache=False)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertTrue(result["provider_results"]["deepseek"]["success"])
+        self.assertEqual(sorted(result["combined"]["cancelled"]), ["anthropic", "openai"])
+
+    def test_quorum_ignores_failures_and_stragglers(self):
+        advisor = self._advisor(openai=StubProvider(delay=0.05), deepseek=StubProvider(status=500),
+                                anthropic=StubProvider(delay=0.2), local=StubProvider(delay=2.0))
+        started = time.monotonic()
+        result = advisor.compare_suggestions(self.CODE, providers=["openai", "deepseek", "anthropic"],
+                                             mode="quorum", use_cache=False)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(result["combined"]["success_count"], 2)
+        self.assertFalse(result["provider_results"]["deepseek"]["success"])
+
+    def test_circuit_breaker_skips_failing_provider(self):
+        failing = StubProvider(status=500)
+        advisor = self._advisor(openai=StubProvider(), deepseek=failing)
+        for _ in range(2):
+            advisor.compare_suggestions(self.CODE, use_cache=False)
+        calls = failing.calls
+        result = advisor.compare_suggestions(self.CODE, use_cache=False)
+        self.assertEqual(failing.calls, calls)
+        self.assertEqual(result["combined"]["skipped"], ["deepseek"])
+        self.assertEqual(advisor.get_provider_stats()["deepseek"]["breaker"], "open")
+
+        # After the reset timeout one trial call is let through
+        failing.status = 200
+        time.sleep(0.35)
+        result = advisor.compare_suggestions(self.CODE, use_cache=False)
+        self.assertTrue(result["provider_results"]["deepseek"]["success"])
+        self.assertEqual(advisor.get_provider_stats()["deepseek"]["breaker"], "closed")
+
+    def test_suggestions_are_cached_by_snippet(self):
+        stub = StubProvider()
+        advisor = self._advisor(openai=stub)
+        first = advisor.compare_suggestions(self.CODE)
+        second = advisor.compare_suggestions(self.CODE)
+        self.assertEqual(stub.calls, 1)
+        self.assertEqual(second["combined"]["cached"], ["openai"])
+        self.assertEqual(first["combined"]["total_suggestions"], second["combined"]["total_suggestions"])
+        advisor.compare_suggestions(self.CODE + "# changed\n")
+        self.assertEqual(stub.calls, 2)
+
+    def test_cached_response_releases_half_open_trial(self):
+        stub = StubProvider()
+        advisor = self._advisor(openai=stub)
+        advisor.compare_settings["cache_sampled_responses"] = True
+        cache = ResponseCache(db_path=os.path.join(self.tmpdir, "cache.db"))
+        llm_advisor.get_response_cache = lambda: cache
+        self.assertTrue(advisor.get_advice(self.CODE, provider="openai")["success"])
+        advisor.suggestion_cache.clear()
+
+        breaker = advisor._get_breaker("openai")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        time.sleep(0.35)
+        # The half-open trial is answered by the response cache, not the provider
+        self.assertTrue(advisor.get_advice(self.CODE, provider="openai")["success"])
+        self.assertEqual(stub.calls, 1)
+        self.assertFalse(breaker.trial_in_flight)
+        self.assertTrue(breaker.allow())
+
+    def test_latency_histogram_records_provider_calls(self):
+        advisor = self._advisor(openai=StubProvider(delay=0.3))
+        advisor.compare_suggestions(self.CODE, use_cache=False)
+        latency = advisor.get_provider_stats()["openai"]["latency"]
+        self.assertEqual(latency["count"], 1)
+        self.assertEqual(latency["p50"], 0.5)
+
+@unittest.skipUnless(HAS_ADVISOR, "LLM advisor dependencies not installed")
+class TestAdvisorHelpers(unittest.TestCase):
+    """CircuitBreaker and LatencyHistogram on their own"""
+
+    def test_half_open_allows_single_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+    def test_histogram_percentiles(self):
+        histogram = LatencyHistogram()
+        for seconds in [0.05] * 90 + [4.0] * 10:
+            histogram.observe(seconds)
+        self.assertEqual(histogram.percentile(0.5), 0.1)
+        self.assertEqual(histogram.percentile(0.95), 5.0)
+        self.assertEqual(histogram.snapshot()["count"], 100)
+
+if __name__ == "__main__":
+    unittest.main()
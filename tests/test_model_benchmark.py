@@ -0,0 +1,130 @@
+"""
+Tests for the inference benchmark in model_tester, run against the stub backend
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.model_tester import (
+    StubLlama, benchmark_model, run_benchmarks, expand_param_grid, load_benchmark_history,
+    select_benchmark_run, compare_benchmark_runs, format_comparison, PSUTIL_AVAILABLE
+)
+
+def stub_loader(**rates):
+    def load(model_path, **params):
+        return StubLlama(model_path, **dict(params, load_seconds=0.01, **rates))
+    return load
+
+class TestBenchmark(unittest.TestCase):
+    """Measurements and history"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.history = os.path.join(self.tmpdir, "history.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_param_grid(self):
+        grid = expand_param_grid({"n_gpu_layers": 8}, n_ctx=[512, 2048], n_batch=[64, 256], n_threads=None)
+        self.assertEqual(len(grid), 4)
+        self.assertEqual({(p["n_ctx"], p["n_batch"]) for p in grid}, {(512, 64), (512, 256), (2048, 64), (2048, 256)})
+        self.assertTrue(all(p["n_gpu_layers"] == 8 for p in grid))
+
+    def test_benchmark_measures_each_prompt(self):
+        results = benchmark_model("stub", {}, [{"n_ctx": 2048, "n_batch": 256}], repeats=2, max_tokens=8,
+                                  loader=stub_loader(gen_tps=400.0), verbose=False)
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertIsNone(result["error"])
+        self.assertGreaterEqual(result["load_s"], 0.01)
+        self.assertGreater(result["peak_rss_mb"], 0)
+        self.assertEqual(set(result["prompts"]), {"short_chat", "long_context_recall", "code"})
+        for summary in result["prompts"].values():
+            self.assertEqual(summary["completion_tokens"], 8)
+            self.assertGreater(summary["ttft_ms"], 0)
+            self.assertGreater(summary["prompt_tps"], 0)
+            self.assertLess(summary["gen_tps"], 400.0)
+        recall = result["prompts"]["long_context_recall"]
+        self.assertGreater(recall["prompt_tokens"], 500)
+        self.assertGreater(recall["ttft_ms"], result["prompts"]["short_chat"]["ttft_ms"])
+
+    @unittest.skipUnless(PSUTIL_AVAILABLE, "psutil is needed for per-set memory growth")
+    def test_memory_growth_is_measured_per_parameter_set(self):
+        # 64 MB of stub KV cache, then 1 MB
+        results = benchmark_model("stub", {}, [{"n_ctx": 65536}, {"n_ctx": 1024}], prompts=["short_chat"],
+                                  repeats=1, max_tokens=4, loader=stub_loader(), verbose=False)
+        large, small = (result["rss_growth_mb"] for result in results)
+        self.assertGreater(large, 48)
+        self.assertLess(small, 16)
+
+    def test_prompt_too_long_for_context_is_skipped(self):
+        results = benchmark_model("stub", {}, [{"n_ctx": 256}], repeats=1, max_tokens=4,
+                                  loader=stub_loader(), verbose=False)
+        self.assertIn("skipped", results[0]["prompts"]["long_context_recall"])
+        self.assertIn("ttft_ms", results[0]["prompts"]["short_chat"])
+
+    def test_load_failure_is_recorded(self):
+        results = benchmark_model("missing", {"model_path": "/nonexistent.gguf"}, [{"n_ctx": 512}],
+                                  loader=lambda path, **params: open(path), verbose=False)
+        self.assertIn("nonexistent", results[0]["error"])
+        self.assertEqual(results[0]["prompts"], {})
+
+    def test_runs_append_to_history(self):
+        grid = {"n_ctx": [1024, 2048]}
+        first = run_benchmarks({"stub": {}}, grid, ["short_chat"], repeats=1, max_tokens=4,
+                               loader=stub_loader(), label="before", history_file=self.history, verbose=False)
+        second = run_benchmarks({"stub": {}}, grid, ["short_chat"], repeats=1, max_tokens=4,
+                                loader=stub_loader(), label="after", history_file=self.history, verbose=False)
+        history = load_benchmark_history(self.history)
+        self.assertEqual([run["run_id"] for run in history], [first["run_id"], second["run_id"]])
+        self.assertEqual(len(history[0]["results"]), 2)
+        self.assertEqual(select_benchmark_run(history, "-2")["label"], "before")
+        self.assertEqual(select_benchmark_run(history, "after")["run_id"], second["run_id"])
+        self.assertEqual(select_benchmark_run(history, first["run_id"])["label"], "before")
+        with self.assertRaises(KeyError):
+            select_benchmark_run(history, "nope")
+
+class TestCompare(unittest.TestCase):
+    """Regression flags"""
+
+    def _run(self, run_id, load_s=1.0, ttft_ms=100.0, gen_tps=20.0, n_ctx=2048):
+        return {"run_id": run_id, "results": [{
+            "model": "m",
+            "params": {"n_ctx": n_ctx},
+            "load_s": load_s,
+            "peak_rss_mb": 500.0,
+            "rss_growth_mb": 300.0,
+            "prompts": {"short_chat": {"ttft_ms": ttft_ms, "prompt_tps": 200.0, "gen_tps": gen_tps}},
+            "error": None
+        }]}
+
+    def test_slower_generation_is_a_regression(self):
+        comparison = compare_benchmark_runs(self._run("a"), self._run("b", gen_tps=15.0, ttft_ms=80.0), 0.10)
+        self.assertEqual([row["metric"] for row in comparison["regressions"]], ["short_chat.gen_tps"])
+        self.assertEqual([row["metric"] for row in comparison["improvements"]], ["short_chat.ttft_ms"])
+        self.assertAlmostEqual(comparison["regressions"][0]["change"], -0.25)
+        text = format_comparison(comparison)
+        self.assertIn("REGRESSION", text)
+        self.assertIn("1 regressions, 1 improvements", text)
+
+    def test_changes_within_threshold_or_noise_pass(self):
+        # 5% slower load is inside the threshold; +1.5 ms TTFT is under the noise floor
+        comparison = compare_benchmark_runs(self._run("a", ttft_ms=5.0),
+                                            self._run("b", load_s=1.05, ttft_ms=6.5), 0.10)
+        self.assertEqual(comparison["regressions"], [])
+
+    def test_unmatched_params_are_reported_missing(self):
+        comparison = compare_benchmark_runs(self._run("a"), self._run("b", n_ctx=4096))
+        self.assertEqual(comparison["rows"], [])
+        self.assertEqual(len(comparison["missing"]), 2)
+        json.dumps(comparison)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+"""
+Tests for the GGUF header reader and the model catalog index, using
+synthetic headers instead of real model files
+"""
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.model_catalog import ModelCatalog, read_gguf_metadata, summarize_gguf
+
+def gguf_string(text):
+    data = text.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+def gguf_kv(key, value_type, payload):
+    return gguf_string(key) + struct.pack("<I", value_type) + payload
+
+def gguf_header(version=3, extra=()):
+    """A llama-style GGUF header: a GQA model with a ChatML template and a long token list"""
+    tokens = b"".join(gguf_string(f"tok{i}") for i in range(100))
+    kvs = [
+        gguf_kv("general.architecture", 8, gguf_string("llama")),
+        gguf_kv("general.name", 8, gguf_string("Tiny Test")),
+        gguf_kv("general.file_type", 4, struct.pack("<I", 15)),
+        gguf_kv("llama.context_length", 4, struct.pack("<I", 8192)),
+        gguf_kv("llama.block_count", 4, struct.pack("<I", 32)),
+        gguf_kv("llama.embedding_length", 4, struct.pack("<I", 4096)),
+        gguf_kv("llama.attention.head_count", 4, struct.pack("<I", 32)),
+        gguf_kv("llama.attention.head_count_kv", 4, struct.pack("<I", 8)),
+        gguf_kv("llama.rope.freq_base", 6, struct.pack("<f", 10000.0)),
+        gguf_kv("tokenizer.chat_template", 8, gguf_string("{% for m in messages %}<|im_start|>{% endfor %}")),
+        gguf_kv("tokenizer.ggml.tokens", 9, struct.pack("<IQ", 8, 100) + tokens),
+        gguf_kv("tokenizer.ggml.scores", 9, struct.pack("<IQ", 6, 100) + struct.pack("<100f", *range(100))),
+        gguf_kv("tokenizer.ggml.bos_ids", 9, struct.pack("<IQ", 5, 2) + struct.pack("<2i", 1, 2)),
+    ] + list(extra)
+    count_fmt = "<I" if version == 1 else "<Q"
+    return (b"GGUF" + struct.pack("<I", version) + struct.pack(count_fmt, 291)
+            + struct.pack(count_fmt, len(kvs)) + b"".join(kvs))
+
+class TestGGUFReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_v3_header(self):
+        # Weights after the header are never read
+        path = self._write("tiny.gguf", gguf_header() + b"\0" * 4096)
+        header = read_gguf_metadata(path)
+        self.assertEqual(header["version"], 3)
+        self.assertEqual(header["tensor_count"], 291)
+        metadata = header["metadata"]
+        self.assertEqual(metadata["tokenizer.ggml.tokens"], {"array_length": 100})
+        self.assertEqual(metadata["tokenizer.ggml.scores"], {"array_length": 100})
+        self.assertEqual(metadata["tokenizer.ggml.bos_ids"], [1, 2])
+        self.assertAlmostEqual(metadata["llama.rope.freq_base"], 10000.0)
+
+        summary = summarize_gguf(header)
+        self.assertEqual(summary["architecture"], "llama")
+        self.assertEqual(summary["model_name"], "Tiny Test")
+        self.assertEqual(summary["context_length"], 8192)
+        self.assertEqual(summary["quantization"], "Q4_K_M")
+        self.assertEqual(summary["chat_format"], "chatml")
+        # 32 layers x (4096 / 32 heads * 8 KV heads) x K and V x 2 bytes
+        self.assertEqual(summary["kv_bytes_per_token"], 32 * 1024 * 2 * 2)
+
+    def test_v1_header_uses_32_bit_counts(self):
+        header = read_gguf_metadata(self._write("old.gguf", gguf_header(version=1)))
+        self.assertEqual(header["tensor_count"], 291)
+        self.assertEqual(header["metadata"]["general.name"], "Tiny Test")
+
+    def test_truncated_header(self):
+        data = gguf_header()
+        # Header fields, a skipped string array, a skipped float array, the last value
+        inside_scores = data.index(b"tokenizer.ggml.bos_ids") - 100
+        for cut in (2, 10, len(data) // 2, inside_scores, len(data) - 3):
+            with self.subTest(cut=cut):
+                path = self._write("cut.gguf", data[:cut])
+                with self.assertRaises(ValueError):
+                    read_gguf_metadata(path)
+
+    def test_unsupported_version_and_magic(self):
+        with self.assertRaisesRegex(ValueError, "Unsupported GGUF version: 4"):
+            read_gguf_metadata(self._write("future.gguf", gguf_header(version=4)))
+        with self.assertRaisesRegex(ValueError, "Not a GGUF file"):
+            read_gguf_metadata(self._write("fake.gguf", b"GGML" + gguf_header()[4:]))
+
+    def test_unknown_value_type(self):
+        path = self._write("odd.gguf", gguf_header(extra=[gguf_kv("odd.key", 42, b"")]))
+        with self.assertRaisesRegex(ValueError, "Unknown GGUF value type"):
+            read_gguf_metadata(path)
+
+class TestModelCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.models = os.path.join(self.tmpdir, "models")
+        os.makedirs(os.path.join(self.models, "sub"))
+        self.index = os.path.join(self.tmpdir, "catalog.json")
+        with open(os.path.join(self.models, "sub", "good.gguf"), "wb") as f:
+            f.write(gguf_header())
+        with open(os.path.join(self.models, "broken.gguf"), "wb") as f:
+            f.write(gguf_header()[:40])
+        with open(os.path.join(self.models, "notes.txt"), "w") as f:
+            f.write("not a model")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_scan_records_headers_and_errors(self):
+        entries = {os.path.basename(e["path"]): e for e in ModelCatalog(self.index).scan([self.models])}
+        self.assertEqual(set(entries), {"good.gguf", "broken.gguf"})
+        self.assertEqual(entries["good.gguf"]["architecture"], "llama")
+        self.assertIn("Unexpected end", entries["broken.gguf"]["error"])
+
+    def test_unchanged_files_are_not_reparsed(self):
+        ModelCatalog(self.index).scan([self.models])
+        catalog = ModelCatalog(self.index)
+        calls = []
+        original = catalog._describe
+        catalog._describe = lambda *args: calls.append(args[0]) or original(*args)
+        catalog.scan([self.models])
+        self.assertEqual(calls, [])
+
+        # A changed file is parsed again; a deleted one is dropped
+        good = os.path.join(self.models, "sub", "good.gguf")
+        with open(good, "ab") as f:
+            f.write(b"\0" * 16)
+        os.remove(os.path.join(self.models, "broken.gguf"))
+        entries = catalog.scan([self.models])
+        self.assertEqual(calls, [good])
+        self.assertEqual([e["path"] for e in entries], [good])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Tests for resumable, parallel model downloads against a local stub HTTP server
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory and src to the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from lyra.model_download import ParallelDownloader, DownloadError, download_file
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)
+
+class StubFileServer:
+    """
+    Serves PAYLOAD at /model.gguf
+
+    ranges: honour Range headers (otherwise always send the whole file)
+    cut_after: close ranged responses after sending this many bytes
+    """
+
+    def __init__(self, ranges=True, cut_after=None, etag='"v1"'):
+        self.ranges = ranges
+        self.cut_after = cut_after
+        self.etag = etag
+        self.requests = []
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                range_header = self.headers.get("Range")
+                with server.lock:
+                    server.requests.append(range_header)
+                if server.ranges and range_header:
+                    start, end = range_header.split("=")[1].split("-")
+                    start, end = int(start), min(int(end), len(PAYLOAD) - 1)
+                    body = PAYLOAD[start:end + 1]
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+                else:
+                    body = PAYLOAD
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", server.etag)
+                self.end_headers()
+
+                if server.cut_after is not None and len(body) > 1:
+                    body = body[:server.cut_after]
+                    self.close_connection = True
+                try:
+                    for offset in range(0, len(body), 65536):
+                        chunk = body[offset:offset + 65536]
+                        self.wfile.write(chunk)
+                        with server.lock:
+                            server.bytes_sent += len(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/model.gguf"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class TestParallelDownloader(unittest.TestCase):
+    """Ranged, single-stream and resumed downloads"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.target = os.path.join(self.tmpdir, "models", "model.gguf")
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _server(self, **kwargs):
+        server = StubFileServer(**kwargs)
+        self.servers.append(server)
+        return server
+
+    def _read_target(self):
+        with open(self.target, "rb") as f:
+            return f.read()
+
+    def test_ranged_download_uses_parallel_parts(self):
+        server = self._server()
+        received = []
+        downloader = ParallelDownloader(progress=received.append, connections=4,
+                                        min_part_size=512 * 1024, checkpoint_bytes=256 * 1024)
+        stats = downloader.download(server.url, self.target, hashlib.sha256(PAYLOAD).hexdigest())
+
+        self.assertEqual(self._read_target(), PAYLOAD)
+        self.assertTrue(stats["ranged"])
+        self.assertEqual((stats["connections"], stats["bytes"], stats["resumed_bytes"]), (4, len(PAYLOAD), 0))
+        self.assertEqual(sum(received), len(PAYLOAD))
+        self.assertGreater(stats["throughput_mb_s"], 0)
+        # The probe plus one ranged request per part
+        self.assertEqual(len(server.requests), 5)
+        self.assertFalse(os.path.exists(self.target + ".part"))
+        self.assertFalse(os.path.exists(self.target + ".part.json"))
+
+    def test_server_without_ranges_streams_once(self):
+        server = self._server(ranges=False)
+        stats = download_file(server.url, self.target, hashlib.md5(PAYLOAD).hexdigest(), hash_type="md5")
+        self.assertEqual(self._read_target(), PAYLOAD)
+        self.assertFalse(stats["ranged"])
+        self.assertEqual(stats["connections"], 1)
+        # The probe's response is the download
+        self.assertEqual(len(server.requests), 1)
+
+    def test_interrupted_download_resumes(self):
+        server = self._server(cut_after=300 * 1024)
+        settings = {"connections": 2, "min_part_size": 512 * 1024, "chunk_size": 64 * 1024,
+                    "checkpoint_bytes": 64 * 1024}
+        with self.assertRaises(DownloadError):
+            ParallelDownloader(retries=0, **settings).download(server.url, self.target)
+
+        with open(self.target + ".part.json") as f:
+            manifest = json.load(f)
+        saved = sum(part["written"] for part in manifest["parts"])
+        self.assertGreater(saved, 0)
+        self.assertEqual(os.path.getsize(self.target + ".part"), len(PAYLOAD))  # preallocated
+
+        # The server recovers
+        server.cut_after = None
+        server.bytes_sent = 0
+        stats = ParallelDownloader(**settings).download(server.url, self.target,
+                                                        hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertEqual(self._read_target(), PAYLOAD)
+        self.assertEqual(stats["resumed_bytes"], saved)
+        self.assertEqual(stats["downloaded"], len(PAYLOAD) - saved)
+        self.assertLess(server.bytes_sent, len(PAYLOAD))
+
+    def test_changed_file_restarts(self):
+        server = self._server(cut_after=300 * 1024)
+        settings = {"connections": 2, "min_part_size": 512 * 1024, "chunk_size": 64 * 1024,
+                    "checkpoint_bytes": 64 * 1024}
+        with self.assertRaises(DownloadError):
+            ParallelDownloader(retries=0, **settings).download(server.url, self.target)
+
+        # The file is replaced on the server
+        server.cut_after = None
+        server.etag = '"v2"'
+        stats = ParallelDownloader(**settings).download(server.url, self.target)
+        self.assertEqual(stats["resumed_bytes"], 0)
+        self.assertEqual(self._read_target(), PAYLOAD)
+
+    def test_hash_mismatch_discards_download(self):
+        server = self._server()
+        with self.assertRaises(DownloadError):
+            download_file(server.url, self.target, "0" * 64, min_part_size=512 * 1024)
+        self.assertFalse(os.path.exists(self.target))
+        self.assertFalse(os.path.exists(self.target + ".part"))
+        self.assertFalse(os.path.exists(self.target + ".part.json"))
+
+if __name__ == "__main__":
+    unittest.main()
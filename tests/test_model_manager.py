@@ -0,0 +1,180 @@
+"""
+Tests for model residency in ModelManager: eviction, reservations and
+scheduler requests keeping a model loaded
+"""
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.response_cache as response_cache
+from modules.inference_scheduler import get_scheduler, QueueFullError
+from modules.model_manager import ModelConfig, ModelManager
+
+GB = 1024**3
+
+class FakeModel:
+    def __init__(self, name):
+        self.model_name = name
+        self.cleaned_up = False
+
+    def generate(self, prompt, **kwargs):
+        return f"{self.model_name}: {prompt}"
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+class StreamingFakeModel(FakeModel):
+    streams_tokens = True
+
+    def generate(self, prompt, on_token=None, **kwargs):
+        words = [f"{self.model_name}: ", prompt]
+        for word in words:
+            if on_token:
+                on_token(word)
+        return "".join(words)
+
+class FakeManager(ModelManager):
+    """Loads FakeModels sized by the "gb" config parameter, optionally slowly"""
+
+    def __init__(self, config_dir, **kwargs):
+        super().__init__(config_dir=config_dir, models_dir="no such models dir", **kwargs)
+        self.instances = {}
+        self.load_delay = 0.0
+
+    def estimate_model_memory(self, config):
+        return int(config.parameters["gb"] * GB)
+
+    def _create_model_instance(self, model_name):
+        time.sleep(self.load_delay)
+        model_class = StreamingFakeModel if self.model_configs[model_name].parameters.get("stream") else FakeModel
+        self.instances[model_name] = model_class(model_name)
+        return self.instances[model_name]
+
+    def add(self, name, gb, stream=False):
+        self.register_model(ModelConfig(name, f"{name}.gguf", "llama", gb=gb, stream=stream))
+
+class TestModelResidency(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        response_cache._cache_instance = response_cache.ResponseCache(db_path=os.path.join(self.tmpdir, "cache.db"))
+        self.manager = FakeManager(os.path.join(self.tmpdir, "configs"), memory_budget_gb=13)
+        self.prefix = f"m{id(self)}-"
+
+    def tearDown(self):
+        response_cache._cache_instance = None
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def name(self, short):
+        # Scheduler queues are process-wide, keep model keys unique per test
+        return self.prefix + short
+
+    def test_concurrent_loads_reserve_memory(self):
+        a, b, c = self.name("a"), self.name("b"), self.name("c")
+        for model in (a, b, c):
+            self.manager.add(model, 6)
+        self.manager.load_model(c)
+
+        # Each load alone fits next to c; together they must evict it
+        self.manager.load_delay = 0.2
+        threads = [threading.Thread(target=self.manager.load_model, args=(m,)) for m in (a, b)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(set(self.manager.resident), {a, b})
+        self.assertTrue(self.manager.instances[c].cleaned_up)
+        self.assertLessEqual(self.manager._resident_bytes(), self.manager.memory_budget)
+
+    def test_scheduled_requests_keep_model_resident(self):
+        a, b = self.name("a"), self.name("b")
+        self.manager.add(a, 6)
+        self.manager.add(b, 6)
+        instance = self.manager.load_model(a)
+
+        # A direct scheduler caller, outside ModelManager.generate
+        release = threading.Event()
+        future = get_scheduler().submit(a, lambda: release.wait(5) and instance.generate("hi"))
+        self.manager.memory_budget = 10 * GB
+        self.manager.load_model(b)
+        self.assertIn(a, self.manager.resident)
+
+        # Unloading waits for the outstanding request instead of cancelling it
+        self.manager.unload_model(a)
+        self.assertIn(a, self.manager.resident)
+        release.set()
+        self.assertEqual(future.result(5), f"{a}: hi")
+        deadline = time.time() + 5
+        while a in self.manager.resident and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn(a, self.manager.resident)
+        self.assertTrue(instance.cleaned_up)
+
+    def test_generate_on_named_resident_model(self):
+        a, b = self.name("a"), self.name("b")
+        self.manager.add(a, 1)
+        self.manager.add(b, 1)
+        self.manager.load_model(a)
+        self.manager.load_model(b)
+        self.assertEqual(self.manager.active_model, b)
+        self.assertEqual(self.manager.generate("hello", model_name=a, cache=False), f"{a}: hello")
+        self.assertEqual(self.manager.generate("hello", cache=False), f"{b}: hello")
+
+    def test_tokens_are_passed_to_on_token(self):
+        a, b = self.name("a"), self.name("b")
+        self.manager.add(a, 1, stream=True)
+        self.manager.add(b, 1)
+        self.manager.load_model(a)
+        self.manager.load_model(b)
+
+        pieces = []
+        self.manager.generate("hi", model_name=a, on_token=pieces.append, cache=False)
+        self.assertEqual(pieces, [f"{a}: ", "hi"])
+
+        # Models that cannot stream, and cache hits, arrive in one piece
+        pieces.clear()
+        self.manager.generate("hi", model_name=b, on_token=pieces.append, cache=False)
+        self.assertEqual(pieces, [f"{b}: hi"])
+        pieces.clear()
+        for _ in range(2):
+            self.manager.generate("cached", model_name=a, on_token=pieces.append, temperature=0)
+        self.assertEqual(pieces, [f"{a}: ", "cached", f"{a}: cached"])
+
+    def test_full_queue_is_raised_not_returned(self):
+        a = self.name("a")
+        self.manager.add(a, 1)
+        self.manager.load_model(a)
+
+        scheduler = get_scheduler()
+        started, release = threading.Event(), threading.Event()
+        futures = [scheduler.submit(a, lambda: started.set() or release.wait(5))]
+        started.wait(5)
+        # Interactive work is never shed for another interactive request
+        futures += [scheduler.submit(a, lambda: None, priority="interactive")
+                    for _ in range(scheduler.max_queue_size)]
+        try:
+            with self.assertRaises(QueueFullError):
+                self.manager.generate("hi", model_name=a, cache=False)
+        finally:
+            release.set()
+        for future in futures:
+            future.result(5)
+
+    def test_registered_config_is_kept_unless_replaced(self):
+        a = self.name("a")
+        self.manager.add(a, 1)
+        self.manager.register_model(ModelConfig(a, "other.gguf", "llama", gb=2))
+        self.assertEqual(self.manager.model_configs[a].model_path, f"{a}.gguf")
+        self.manager.register_model(ModelConfig(a, "other.gguf", "llama", gb=2), replace=True)
+        self.assertEqual(self.manager.model_configs[a].model_path, "other.gguf")
+
+if __name__ == "__main__":
+    unittest.main()
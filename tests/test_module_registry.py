@@ -0,0 +1,118 @@
+"""
+Tests for lazy and parallel module loading in the module registry
+"""
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+import unittest
+
+# Add the parent directory to the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.module_registry import ModuleRegistry, LazyModule
+
+class FakeModule:
+    def __init__(self, name):
+        self.name = name
+
+    def greet(self):
+        return f"hello from {self.name}"
+
+def slow_getter(name, delay, log):
+    def getter():
+        log.append((name, "start", time.monotonic()))
+        time.sleep(delay)
+        log.append((name, "end", time.monotonic()))
+        return FakeModule(name)
+    return getter
+
+class TestModuleRegistry(unittest.TestCase):
+    """Dependency order, parallel loading and deferred modules"""
+
+    def test_independent_modules_load_in_parallel(self):
+        registry = ModuleRegistry()
+        log = []
+        for name in ("a", "b", "c"):
+            registry.register_module(name, slow_getter(name, 0.3, log), autoload=False)
+        started = time.monotonic()
+        results = registry.load_all_modules(parallel=True)
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertEqual(results, {"a": True, "b": True, "c": True})
+        self.assertGreater(registry.get_timings()["a"]["init"], 0.25)
+
+    def test_dependencies_finish_first(self):
+        registry = ModuleRegistry()
+        log = []
+        registry.register_module("child", slow_getter("child", 0.05, log), ["base"], autoload=False)
+        registry.register_module("base", slow_getter("base", 0.2, log), autoload=False)
+        registry.load_all_modules(parallel=True)
+        events = [(name, kind) for name, kind, _ in log]
+        self.assertLess(events.index(("base", "end")), events.index(("child", "start")))
+
+    def test_concurrent_load_runs_getter_once(self):
+        registry = ModuleRegistry()
+        calls = []
+        registry.register_module("once", lambda: calls.append(1) or time.sleep(0.1) or FakeModule("once"),
+                                 autoload=False)
+        threads = [threading.Thread(target=registry.load_module, args=("once",)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_lazy_module_loads_on_first_use(self):
+        registry = ModuleRegistry()
+        log = []
+        registry.register_module("base", slow_getter("base", 0, log), autoload=False, lazy=True)
+        registry.register_module("heavy", slow_getter("heavy", 0, log), ["base"], autoload=False, lazy=True)
+        registry.load_all_modules()
+        self.assertEqual(log, [])
+        self.assertEqual(registry.get_status("heavy"), "deferred")
+
+        proxy = registry.get_module("heavy")
+        self.assertIsInstance(proxy, LazyModule)
+        self.assertEqual(proxy.greet(), "hello from heavy")
+        self.assertEqual(registry.get_status("base"), "loaded")
+        self.assertIsInstance(registry.get_module("heavy"), FakeModule)
+
+    def test_failed_module_reports_status(self):
+        registry = ModuleRegistry()
+
+        def broken():
+            raise RuntimeError("boom")
+
+        registry.register_module("broken", broken, autoload=False)
+        registry.register_module("dependent", lambda: FakeModule("dependent"), ["broken"], autoload=False)
+        results = registry.load_all_modules()
+        self.assertFalse(results["broken"])
+        self.assertEqual(registry.get_status("dependent"), "dependency_failed")
+        self.assertIn("broken", registry.get_startup_report())
+
+    def test_registering_by_path_does_not_import(self):
+        registry = ModuleRegistry()
+        registry.register_module("json_module", "json:JSONDecoder", autoload=False, lazy=True)
+        registry.load_all_modules()
+        self.assertEqual(registry.get_status("json_module"), "deferred")
+        self.assertIsInstance(registry.get_module("json_module").decode('{"a": 1}'), dict)
+
+    def test_startup_skips_deferred_modules(self):
+        """Initializing the real registry must not import the deferred modules"""
+        script = (
+            "import sys, json\n"
+            "from modules.module_registry import initialize_all_modules, CORE_MODULES\n"
+            "initialize_all_modules()\n"
+            "paths = {name: path.split(':')[0] for name, path, _, lazy in CORE_MODULES if lazy}\n"
+            "print(json.dumps({name: path in sys.modules for name, path in paths.items()}))\n"
+        )
+        output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True,
+                                text=True, timeout=120)
+        imported = json.loads(output.stdout.strip().splitlines()[-1])
+        self.assertEqual([name for name, loaded in imported.items() if loaded], [])
+
+if __name__ == "__main__":
+    unittest.main()
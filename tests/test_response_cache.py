@@ -0,0 +1,186 @@
+"""
+Tests for the response cache: exact and semantic hits, expiry, eviction and
+which calls are cached at all
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import modules.response_cache as response_cache
+from modules.response_cache import ResponseCache
+
+GREEDY = {"temperature": 0.0, "max_tokens": 64}
+
+def keyword_embedder(text):
+    """Embeds a prompt by the animals it mentions, so rewordings land on the same vector"""
+    text = text.lower()
+    return [float("otter" in text), float("badger" in text), float("heron" in text)]
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "cache.db")
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _cache(self, **kwargs):
+        return ResponseCache(db_path=self.db_path, **kwargs)
+
+    def _generate(self, text):
+        def generate():
+            self.calls.append(text)
+            return text
+        return generate
+
+    def test_default_location_is_outside_the_source_tree(self):
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        default = os.path.abspath(response_cache.DEFAULT_DB_PATH)
+        self.assertFalse(default.startswith(repo + os.sep))
+
+    def test_exact_hits_survive_a_restart(self):
+        cache = self._cache()
+        self.assertEqual(cache.cached_call("m", "Tell me  about otters", GREEDY, self._generate("a")), "a")
+        # Whitespace-only differences share an entry; other models and parameters do not
+        self.assertEqual(cache.cached_call("m", "Tell me about otters\n", GREEDY, self._generate("b")), "a")
+        cache.cached_call("other", "Tell me about otters", GREEDY, self._generate("c"))
+        cache.cached_call("m", "Tell me about otters", dict(GREEDY, max_tokens=8), self._generate("d"))
+        self.assertEqual(self.calls, ["a", "c", "d"])
+
+        reopened = self._cache()
+        self.assertEqual(reopened.get("m", "Tell me about otters", GREEDY), "a")
+        self.assertEqual(reopened.get_stats()["hits"], 1)
+
+    def test_sampled_calls_are_only_cached_when_allowed(self):
+        cache = self._cache()
+        sampled = {"temperature": 0.3}
+        cache.cached_call("m", "otters", sampled, self._generate("a"))
+        cache.cached_call("m", "otters", sampled, self._generate("b"))
+        self.assertEqual(self.calls, ["a", "b"])
+        self.assertEqual(cache.get_stats()["bypassed"], 2)
+
+        self.assertEqual(cache.cached_call("m", "otters", sampled, self._generate("c"), allow_sampled=True), "c")
+        self.assertEqual(cache.cached_call("m", "otters", sampled, self._generate("d"), allow_sampled=True), "c")
+        # Sampled entries never answer a lookup for the same parameters without the opt-in
+        self.assertIsNone(cache.get("m", "otters", sampled))
+
+    def test_errors_and_opt_outs_are_not_cached(self):
+        cache = self._cache()
+        cache.cached_call("m", "otters", GREEDY, self._generate("Error: model not loaded"))
+        cache.cached_call("m", "otters", dict(GREEDY, cache=False), self._generate("a"))
+        self.assertIsNone(cache.get("m", "otters", GREEDY))
+
+    def test_semantic_hits_stay_within_a_scope(self):
+        cache = self._cache(embedder=keyword_embedder, semantic_threshold=0.9)
+        cache.cached_call("m", "What do otters eat?", GREEDY, self._generate("fish"))
+        self.assertEqual(cache.cached_call("m", "Otters: what is their diet?", GREEDY, self._generate("x")), "fish")
+        self.assertEqual(cache.get_stats()["semantic_hits"], 1)
+
+        cache.cached_call("m", "What do badgers eat?", GREEDY, self._generate("worms"))
+        cache.cached_call("other", "Otters: what is their diet?", GREEDY, self._generate("y"))
+        self.assertEqual(self.calls, ["fish", "worms", "y"])
+
+    def test_semantic_tier_can_be_enabled_later(self):
+        cache = self._cache()
+        cache.set("m", "What do otters eat?", GREEDY, "fish")
+        self.assertIsNone(cache.get("m", "Otters: what is their diet?", GREEDY))
+        self.assertTrue(cache.enable_semantic(keyword_embedder))
+        # Entries stored before the tier was enabled have no embedding
+        cache.set("m", "What do herons eat?", GREEDY, "frogs")
+        self.assertEqual(cache.get("m", "Herons: what is their diet?", GREEDY), "frogs")
+
+    def test_entries_expire_after_ttl(self):
+        cache = self._cache(ttl=0.2)
+        cache.set("m", "otters", GREEDY, "a")
+        self.assertEqual(cache.get("m", "otters", GREEDY), "a")
+        time.sleep(0.3)
+        self.assertIsNone(cache.get("m", "otters", GREEDY))
+        self.assertIsNone(self._cache(ttl=0.2).get("m", "otters", GREEDY))
+
+        # Expired rows are dropped on the next write
+        cache.set("m", "herons", GREEDY, "b")
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self._cache(max_entries=2, memory_entries=1)
+        cache.set("m", "otters", GREEDY, "a")
+        cache.set("m", "badgers", GREEDY, "b")
+        cache.get("m", "otters", GREEDY)
+        cache.set("m", "herons", GREEDY, "c")
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertIsNone(cache.get("m", "badgers", GREEDY))
+        self.assertEqual(cache.get("m", "otters", GREEDY), "a")
+
+        # The byte limit evicts too
+        small = ResponseCache(db_path=os.path.join(self.tmpdir, "small.db"), max_bytes=10)
+        small.set("m", "otters", GREEDY, "x" * 6)
+        small.set("m", "badgers", GREEDY, "y" * 6)
+        self.assertIsNone(small.get("m", "otters", GREEDY))
+        self.assertEqual(small.get("m", "badgers", GREEDY), "y" * 6)
+
+    def test_memory_hits_keep_entries_from_eviction(self):
+        cache = self._cache(max_entries=2, memory_entries=2)
+        cache.set("m", "otters", GREEDY, "a")
+        time.sleep(0.01)
+        cache.set("m", "badgers", GREEDY, "b")
+        time.sleep(0.01)
+        # Served from memory; the access is written to SQLite before the next eviction
+        self.assertEqual(cache.get("m", "otters", GREEDY), "a")
+        cache.set("m", "herons", GREEDY, "c")
+
+        reopened = self._cache()
+        self.assertEqual(reopened.get("m", "otters", GREEDY), "a")
+        self.assertIsNone(reopened.get("m", "badgers", GREEDY))
+
+    def test_size_totals_follow_every_change(self):
+        def totals():
+            conn = sqlite3.connect(self.db_path)
+            try:
+                return (conn.execute("SELECT entries, bytes FROM totals").fetchone(),
+                        conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone())
+            finally:
+                conn.close()
+
+        cache = self._cache(max_bytes=10)
+        cache.set("m", "otters", GREEDY, "x" * 4)
+        cache.set("m", "otters", GREEDY, "x" * 5)
+        cache.set("m", "badgers", GREEDY, "y" * 3)
+        tracked, actual = totals()
+        self.assertEqual(tracked, actual)
+        self.assertEqual(tracked, (2, 8))
+
+        cache.set("m", "herons", GREEDY, "z" * 6)
+        tracked, actual = totals()
+        self.assertEqual(tracked, actual)
+        self.assertEqual(tracked, (2, 9))
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+
+        cache.clear()
+        self.assertEqual(totals(), ((0, 0), (0, 0)))
+
+    def test_existing_caches_are_counted_once(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, scope TEXT NOT NULL, response TEXT NOT NULL, "
+                     "embedding TEXT, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        now = time.time()
+        conn.executemany("INSERT INTO responses VALUES (?, 's', 'r', NULL, ?, ?, ?)",
+                         [(f"k{i}", 4, now, now + i) for i in range(3)])
+        conn.commit()
+        conn.close()
+
+        cache = self._cache(max_entries=3)
+        cache.set("m", "otters", GREEDY, "a")
+        self.assertEqual(cache.get_stats()["evictions"], 1)
+        self.assertEqual(cache.get("m", "otters", GREEDY), "a")
+
+if __name__ == "__main__":
+    unittest.main()
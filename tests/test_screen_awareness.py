@@ -0,0 +1,154 @@
+"""
+Tests for incremental screen observation: change detection, band OCR and reading order
+"""
+import os
+import sys
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import numpy as np
+    from PIL import Image, ImageDraw
+    IMAGING_AVAILABLE = True
+except ImportError:
+    IMAGING_AVAILABLE = False
+
+from modules.screen_awareness import ScreenObserver
+
+class Scene:
+    """
+    A synthetic screen: every word is a solid rectangle in its own colour
+
+    Stands in for both the screen grabber and the OCR engine. A word is only
+    "recognized" when its whole rectangle is inside the region, like text cut
+    at a region edge.
+    """
+
+    def __init__(self, size=(512, 384)):
+        self.size = size
+        self.words = {}  # colour -> (text, box, line id)
+        self.next_colour = 1
+
+    def add(self, text, left, top, width=40, height=16, line=1):
+        colour = (self.next_colour, 0, 0)
+        self.next_colour += 1
+        self.words[colour] = (text, (left, top, width, height), line)
+        return colour
+
+    def replace(self, colour, text):
+        _, box, line = self.words.pop(colour)
+        new = (self.next_colour, 0, 0)
+        self.next_colour += 1
+        self.words[new] = (text, box, line)
+        return new
+
+    def grab_frame(self):
+        image = Image.new("RGB", self.size, "white")
+        draw = ImageDraw.Draw(image)
+        for colour, (_, (left, top, width, height), _) in self.words.items():
+            draw.rectangle((left, top, left + width - 1, top + height - 1), fill=colour)
+        return image
+
+    def ocr(self, region):
+        pixels = np.asarray(region.convert("RGB"))
+        found = []
+        for colour, (text, (_, _, width, height), line) in self.words.items():
+            ys, xs = np.nonzero(np.all(pixels == colour, axis=2))
+            if len(ys) != width * height:
+                continue
+            found.append({"text": text, "left": int(xs.min()), "top": int(ys.min()),
+                          "width": width, "height": height, "line": (1, 1, line)})
+        return found
+
+class SceneObserver(ScreenObserver):
+    def __init__(self, scene, **kwargs):
+        super().__init__(scene, **kwargs)
+        self.regions = []
+
+    def _ocr_region(self, region):
+        self.regions.append(region.size)
+        return self.capture.ocr(region)
+
+@unittest.skipUnless(IMAGING_AVAILABLE, "Pillow and numpy are required")
+class TestScreenObserver(unittest.TestCase):
+
+    def setUp(self):
+        self.scene = Scene(size=(512, 768))
+        # Straddles the tile row boundary at y=128 and three tile columns
+        self.scene.add("alpha", 100, 120, line=1)
+        self.beta = self.scene.add("beta", 200, 120, line=1)
+        self.scene.add("gamma", 300, 120, line=1)
+        # Two panes on one row: the right one is read after the left one
+        self.scene.add("right", 300, 250, line=2)
+        self.scene.add("left", 20, 252, line=3)
+        self.scene.add("header", 20, 10, line=4)
+        self.observer = SceneObserver(self.scene, tile_size=128, band_margin=24)
+
+    def test_reading_order_across_tiles(self):
+        observation = self.observer.observe()
+        self.assertEqual(observation["text"], "header\nalpha beta gamma\nleft\nright")
+        self.assertEqual(observation["changed_tiles"], observation["total_tiles"])
+
+    def test_unchanged_frame_skips_ocr(self):
+        self.observer.observe()
+        ocr_calls = len(self.observer.regions)
+        observation = self.observer.observe()
+        self.assertEqual(observation["changed_tiles"], 0)
+        self.assertEqual(len(self.observer.regions), ocr_calls)
+        self.assertEqual(self.observer.get_stats()["unchanged_frames"], 1)
+
+    def test_small_edit_rereads_only_its_band(self):
+        self.observer.observe()
+        self.observer.regions.clear()
+        # A one-word edit of a few hundred pixels on a mostly white tile
+        self.scene.replace(self.beta, "delta")
+        observation = self.observer.observe()
+
+        self.assertGreater(observation["changed_tiles"], 0)
+        self.assertEqual(observation["text"], "header\nalpha delta gamma\nleft\nright")
+        # One full-width band around the edited line, not the whole frame
+        self.assertEqual(len(self.observer.regions), 1)
+        width, height = self.observer.regions[0]
+        self.assertEqual(width, self.scene.size[0])
+        self.assertLess(height, self.scene.size[1])
+
+    def test_find_phrase_crossing_tiles(self):
+        self.observer.observe()
+        matches = self.observer.find("Beta gamma")
+        self.assertEqual(matches, [{"text": "alpha beta gamma", "position": (100, 120)}])
+        self.assertEqual(self.observer.find("gam")[0]["text"], "alpha beta gamma")
+        self.assertEqual(self.observer.find("beta header"), [])
+
+    def test_large_change_reads_full_frame(self):
+        self.observer.observe()
+        self.observer.regions.clear()
+        for row in range(0, 768, 40):
+            self.scene.add(f"word{row}", 450, row, line=100 + row)
+        self.observer.observe()
+        self.assertEqual(self.observer.regions, [self.scene.size])
+        self.assertIn("word200", self.observer.get_text())
+
+    def test_repeated_content_hits_cache(self):
+        self.observer.observe()
+        beta = self.scene.words[self.beta]
+        delta = self.scene.replace(self.beta, "delta")
+        delta_word = self.scene.words[delta]
+        self.observer.observe()
+
+        # Flip back and forth: the second "delta" band is identical to the first
+        self.scene.words.pop(delta)
+        self.scene.words[self.beta] = beta
+        self.observer.observe()
+        self.scene.words.pop(self.beta)
+        self.scene.words[delta] = delta_word
+        self.observer.regions.clear()
+        observation = self.observer.observe()
+
+        self.assertEqual(self.observer.regions, [])
+        self.assertEqual(self.observer.get_stats()["ocr_cache_hits"], 1)
+        self.assertIn("alpha delta gamma", observation["text"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Tests for incremental, journaled state persistence
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.state_manager import StateManager
+
+class Component:
+    def __init__(self, state=None, delay=0.0):
+        self.state = state or {}
+        self.delay = delay
+        self.loaded = None
+
+    def get_state(self):
+        time.sleep(self.delay)
+        return dict(self.state)
+
+    def set_state(self, state):
+        self.loaded = state
+        return True
+
+class TestStateManager(unittest.TestCase):
+    """Delta journaling, compaction and recovery"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _manager(self, **kwargs):
+        manager = StateManager(data_dir=self.tmpdir, **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def _journal(self, name):
+        with open(os.path.join(self.tmpdir, f"{name}.journal")) as f:
+            return [json.loads(line) for line in f]
+
+    def test_only_changed_keys_are_journaled(self):
+        manager = self._manager()
+        component = Component({"big": "x" * 10000, "counter": 1})
+        manager.register_component("memory", component.get_state, component.set_state)
+        self.assertTrue(manager.save_state("memory", wait=True))
+
+        component.state["counter"] = 2
+        self.assertTrue(manager.save_state("memory", wait=True))
+        self.assertTrue(manager.save_state("memory", wait=True))
+
+        records = self._journal("memory")
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1]["set"], {"counter": 2})
+        self.assertEqual(manager.stats["unchanged"], 1)
+
+    def test_nested_values_mutated_in_place_are_detected(self):
+        manager = self._manager()
+        nested = {"items": [1]}
+        manager.register_component("nested", lambda: {"data": nested, "flag": True})
+        manager.save_state("nested")
+        nested["items"].append(2)
+        manager.save_state("nested")
+        manager.save_state("nested", keys=["flag"], wait=True)
+
+        records = self._journal("nested")
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1]["set"], {"data": {"items": [1, 2]}})
+
+    def test_compaction_writes_snapshot_and_clears_journal(self):
+        manager = self._manager(compact_every=3)
+        component = Component({"counter": 0})
+        manager.register_component("counter", component.get_state, component.set_state)
+        for i in range(3):
+            component.state["counter"] = i + 1
+            manager.save_state("counter", wait=True)
+
+        with open(os.path.join(self.tmpdir, "counter.json")) as f:
+            snapshot = json.load(f)
+        self.assertEqual((snapshot["seq"], snapshot["state"]), (3, {"counter": 3}))
+        self.assertEqual(self._journal("counter"), [])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "counter.json.tmp")))
+
+    def test_recovery_replays_journal_and_ignores_torn_record(self):
+        manager = self._manager(compact_every=2)
+        component = Component({"a": 1, "b": 1})
+        manager.register_component("comp", component.get_state, component.set_state)
+        manager.save_state("comp", wait=True)
+        component.state["a"] = 2
+        manager.save_state("comp", wait=True)  # compacted here
+        component.state["b"] = 3
+        del component.state["a"]
+        manager.save_state("comp", wait=True)
+
+        # Simulate a crash in the middle of the next journal write
+        with open(os.path.join(self.tmpdir, "comp.journal"), "a") as f:
+            f.write('{"seq": 4, "set": {"b": ')
+
+        restored = Component()
+        recovered = StateManager(data_dir=self.tmpdir)
+        self.managers.append(recovered)
+        recovered.register_component("comp", restored.get_state, restored.set_state)
+        self.assertTrue(recovered.load_state("comp"))
+        self.assertEqual(restored.loaded, {"b": 3})
+
+    def test_legacy_snapshot_is_loaded(self):
+        with open(os.path.join(self.tmpdir, "old.json"), "w") as f:
+            json.dump({"component_id": "old", "timestamp": 0, "version": "1.0", "state": {"k": "v"}}, f)
+        manager = self._manager()
+        component = Component({"k": "v"})
+        manager.register_component("old", component.get_state, component.set_state)
+        self.assertTrue(manager.load_state("old"))
+        self.assertEqual(component.loaded, {"k": "v"})
+
+        # Unchanged state is not rewritten after loading
+        manager.save_state("old", wait=True)
+        self.assertEqual(manager.stats["unchanged"], 1)
+
+    def test_slow_component_does_not_block_others(self):
+        manager = self._manager()
+        slow = Component({"x": 1}, delay=0.5)
+        fast = Component({"y": 1})
+        manager.register_component("slow", slow.get_state, slow.set_state)
+        manager.register_component("fast", fast.get_state, fast.set_state)
+
+        thread = threading.Thread(target=manager.save_state, args=("slow",))
+        thread.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        self.assertTrue(manager.save_state("fast"))
+        self.assertLess(time.monotonic() - started, 0.2)
+        thread.join()
+
+    def test_close_compacts_everything(self):
+        manager = self._manager()
+        component = Component({"k": 1})
+        manager.register_component("comp", component.get_state, component.set_state)
+        manager.save_state("comp")
+        manager.close()
+        with open(os.path.join(self.tmpdir, "comp.json")) as f:
+            self.assertEqual(json.load(f)["state"], {"k": 1})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+Tests for the Telegram notification dispatcher using a stub Bot API server
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.telegram_notify import TelegramNotifier, TokenBucket
+
+class StubBotAPI:
+    """Minimal Telegram Bot API stand-in"""
+
+    def __init__(self, users):
+        self.users = users
+        self.sent = []
+        self.get_updates_calls = 0
+        self.fail_next = []
+        self.send_delay = 0.0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                method = self.path.rsplit("/", 1)[-1]
+                if method == "getMe":
+                    self._reply(200, {"ok": True, "result": {"username": "lyra_test_bot"}})
+                elif method == "getUpdates":
+                    with stub.lock:
+                        stub.get_updates_calls += 1
+                    updates = [
+                        {"update_id": i, "message": {"from": {"username": name}, "chat": {"id": chat_id}}}
+                        for i, (name, chat_id) in enumerate(stub.users.items())
+                    ]
+                    self._reply(200, {"ok": True, "result": updates})
+                else:
+                    self._reply(404, {"ok": False, "description": "Not Found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                time.sleep(stub.send_delay)
+                with stub.lock:
+                    failure = stub.fail_next.pop(0) if stub.fail_next else None
+                    if failure is None:
+                        stub.sent.append((payload["chat_id"], payload["text"], time.monotonic()))
+                if failure == 429:
+                    self._reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                      "parameters": {"retry_after": 0.2}})
+                elif failure:
+                    self._reply(failure, {"ok": False, "error_code": failure, "description": "Stub failure"})
+                else:
+                    self._reply(200, {"ok": True, "result": {"message_id": len(stub.sent)}})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def texts(self):
+        with self.lock:
+            return [text for _, text, _ in self.sent]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestTelegramNotifier(unittest.TestCase):
+    """Ordering, rate limiting, retries and the chat id cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stub = StubBotAPI({"alice": 111, "bob": 222})
+        self.notifier = self._make_notifier()
+
+    def tearDown(self):
+        self.notifier.stop_notification_thread()
+        self.stub.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _make_notifier(self):
+        notifier = TelegramNotifier(config_path=os.path.join(self.tmpdir, "telegram_config.json"),
+                                    api_base=self.stub.url)
+        notifier.api_token = "TEST"
+        notifier.enabled = True
+        notifier.RETRY_BASE_DELAY = 0.05
+        return notifier
+
+    def _wait_for(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while len(self.stub.texts()) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.stub.texts()
+
+    def test_higher_priority_sent_first(self):
+        # Hold back the first send until everything is queued
+        self.notifier.global_bucket = TokenBucket(rate=5.0, capacity=5)
+        self.notifier.global_bucket.tokens = 0
+        for i in range(3):
+            self.notifier.send_message("alice", f"low {i}", priority=0)
+        self.notifier.send_message("bob", "urgent", priority=10)
+        texts = self._wait_for(4)
+        self.assertEqual(texts[0], "urgent")
+        self.assertEqual(texts[1:], ["low 0", "low 1", "low 2"])
+
+    def test_send_message_does_not_block_on_network(self):
+        self.stub.send_delay = 0.5
+        self.notifier.send_message("alice", "first")
+        time.sleep(0.1)
+        started = time.monotonic()
+        self.assertTrue(self.notifier.send_message("alice", "second"))
+        self.assertLess(time.monotonic() - started, 0.2)
+
+    def test_per_chat_rate_limit(self):
+        self.notifier.CHAT_RATE = 10.0
+        self.notifier.CHAT_BURST = 1
+        for i in range(4):
+            self.notifier.send_message("alice", f"m{i}")
+        self._wait_for(4)
+        times = [t for chat_id, _, t in self.stub.sent if chat_id == "111"]
+        self.assertEqual(len(times), 4)
+        self.assertGreaterEqual(times[-1] - times[0], 0.25)
+
+    def test_rate_limited_chat_does_not_block_others(self):
+        self.notifier.CHAT_RATE = 1.0
+        self.notifier.CHAT_BURST = 1
+        self.notifier.send_message("alice", "a1", priority=5)
+        self.notifier.send_message("alice", "a2", priority=5)
+        self.notifier.send_message("bob", "b1")
+        texts = self._wait_for(2, timeout=0.8)
+        self.assertEqual(texts[:2], ["a1", "b1"])
+
+    def test_retry_after_flood_control(self):
+        self.stub.fail_next = [429, 500]
+        self.notifier.send_message("alice", "eventually")
+        self.assertEqual(self._wait_for(1), ["eventually"])
+        self.assertEqual(self.notifier.get_status()["stats"]["retried"], 2)
+
+    def test_permanent_failure_is_not_retried(self):
+        self.stub.fail_next = [400]
+        self.notifier.send_message("alice", "bad markdown")
+        self.notifier.send_message("alice", "next")
+        self.assertEqual(self._wait_for(1), ["next"])
+        self.assertEqual(self.notifier.get_status()["stats"]["failed"], 1)
+
+    def test_chat_ids_are_cached_and_persisted(self):
+        for i in range(3):
+            self.notifier.send_message("alice", f"m{i}")
+        self.notifier.send_message("bob", "hi")
+        self._wait_for(4)
+        self.assertEqual(self.stub.get_updates_calls, 1)
+
+        self.notifier.stop_notification_thread()
+        self.notifier = self._make_notifier()
+        self.assertEqual(self.notifier._get_chat_id("bob"), "222")
+        self.assertEqual(self.stub.get_updates_calls, 1)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2.0, capacity=2)
+        now = bucket.updated
+        bucket.consume(now)
+        bucket.consume(now)
+        self.assertAlmostEqual(bucket.wait_time(now), 0.5)
+        self.assertEqual(bucket.wait_time(now + 0.5), 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
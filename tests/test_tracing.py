@@ -0,0 +1,153 @@
+"""
+Tests for per-turn tracing spans, context propagation and trace summaries
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import tracing
+from modules.tracing import span, traced
+from modules.turn_pipeline import StageRunner, PostTurnQueue
+from modules.inference_scheduler import InferenceScheduler
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(span.to_dict() for span in spans)
+
+    def by_name(self, name):
+        return [span for span in self.spans if span["name"] == name]
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.exporter = ListExporter()
+        tracing.configure(exporter=self.exporter)
+
+    def tearDown(self):
+        tracing.get_tracer().disable()
+
+class TestSpans(TracingTestCase):
+    """Span nesting, sampling and the disabled fast path"""
+
+    def test_nested_spans_share_trace(self):
+        @traced("inner")
+        def inner():
+            return 42
+
+        with span("turn", user="test") as root:
+            with span("stage"):
+                self.assertEqual(inner(), 42)
+        self.assertEqual(len(self.exporter.spans), 3)
+
+        turn, stage, leaf = (self.exporter.by_name(name)[0] for name in ("turn", "stage", "inner"))
+        self.assertEqual({s["trace_id"] for s in self.exporter.spans}, {root.trace_id})
+        self.assertIsNone(turn["parent_id"])
+        self.assertEqual(stage["parent_id"], turn["span_id"])
+        self.assertEqual(leaf["parent_id"], stage["span_id"])
+        self.assertEqual(turn["attributes"], {"user": "test"})
+        self.assertGreaterEqual(turn["duration_ms"], stage["duration_ms"])
+        self.assertIsNone(tracing.current_span())
+
+    def test_error_is_recorded(self):
+        with self.assertRaises(ValueError):
+            with span("turn"):
+                raise ValueError("boom")
+        self.assertEqual(self.exporter.spans[0]["attributes"]["error"], "ValueError: boom")
+
+    def test_disabled_and_unsampled_spans_are_noops(self):
+        tracing.configure(exporter=self.exporter, sample_rate=0.0)
+        with span("turn") as root:
+            self.assertIsNone(root.trace_id)
+            self.assertIs(span("stage"), tracing.NOOP_SPAN)
+        self.assertEqual(self.exporter.spans, [])
+
+        tracing.get_tracer().disable()
+        self.assertIs(span("turn"), tracing.NOOP_SPAN)
+
+class TestPropagation(TracingTestCase):
+    """Spans opened on worker threads join the caller's trace"""
+
+    def test_stage_runner_stages_are_children(self):
+        runner = StageRunner()
+        with span("turn") as root:
+            results, _ = runner.run({"a": lambda: tracing.current_trace_id(), "b": lambda: 2})
+        self.assertEqual(results["a"], root.trace_id)
+        turn_id = self.exporter.by_name("turn")[0]["span_id"]
+        for name in ("stage.a", "stage.b"):
+            self.assertEqual(self.exporter.by_name(name)[0]["parent_id"], turn_id)
+
+    def test_scheduler_call_joins_trace(self):
+        scheduler = InferenceScheduler()
+
+        @traced("provider.generate")
+        def generate():
+            return "reply"
+
+        try:
+            with span("turn") as root:
+                self.assertEqual(scheduler.run("model", generate, priority="interactive"), "reply")
+        finally:
+            scheduler.shutdown()
+        inference = self.exporter.by_name("inference")[0]
+        self.assertEqual(inference["trace_id"], root.trace_id)
+        self.assertEqual(inference["attributes"]["priority"], "interactive")
+        self.assertEqual(self.exporter.by_name("provider.generate")[0]["parent_id"], inference["span_id"])
+
+    def test_post_turn_job_links_to_turn(self):
+        post_turn = PostTurnQueue()
+        with span("turn") as root:
+            post_turn.submit(lambda: None, name="store")
+        self.assertTrue(post_turn.join(timeout=5))
+        job = self.exporter.by_name("post_turn")[0]
+        self.assertIsNone(job["parent_id"])
+        self.assertEqual(job["attributes"]["turn_trace_id"], root.trace_id)
+
+class TestExportAndSummary(unittest.TestCase):
+    """File formats, loading and the summarize CLI"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tracing.get_tracer().disable()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _record_turns(self, path, turns=3):
+        tracing.configure(path)
+        for _ in range(turns):
+            with span("turn"):
+                with span("generate"):
+                    pass
+        tracing.get_tracer().disable()
+        return tracing.load_spans(path)
+
+    def test_chrome_trace_round_trip(self):
+        path = os.path.join(self.tmpdir, "trace.json")
+        spans = self._record_turns(path)
+        self.assertEqual(len(spans), 6)
+        with open(path) as f:
+            events = json.loads(f.read().rstrip().rstrip(",") + "]")
+        self.assertEqual({event["ph"] for event in events}, {"X"})
+        self.assertEqual(spans[0]["name"], "generate")
+        self.assertEqual(spans[0]["parent_id"], spans[1]["span_id"])
+
+    def test_summarize_jsonl(self):
+        path = os.path.join(self.tmpdir, "trace.jsonl")
+        spans = self._record_turns(path, turns=4)
+        rows = {row["name"]: row for row in tracing.summarize(spans)}
+        self.assertEqual((rows["turn"]["count"], rows["generate"]["count"]), (4, 4))
+        self.assertAlmostEqual(rows["turn"]["share"], 1.0)
+        self.assertLessEqual(rows["generate"]["p50"], rows["generate"]["p95"])
+        self.assertEqual(tracing.summarize(spans, root="other"), [])
+        self.assertEqual(tracing.main(["summarize", path, "--json"]), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+Tests for the staged turn pipeline in LyraCore using stub components
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.lyra_core import LyraCore
+from modules.turn_pipeline import StageRunner, PostTurnQueue
+
+class StubModel:
+    def __init__(self, name="stub-model"):
+        self.name = name
+        self.prompts = []
+
+    def generate(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return "base reply"
+
+class StubModelManager:
+    def __init__(self):
+        self.model = StubModel()
+
+    def get_active_model(self):
+        return self.model
+
+class StubArchitecture:
+    """Each analysis sleeps for a configurable time"""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.stored = []
+        self.post_turn_delay = 0.0
+
+    def _stage(self, name, value):
+        time.sleep(self.delays.get(name, 0))
+        return value
+
+    def analyze_metacognition(self, message):
+        return self._stage("metacognition", {"insights": ["meta insight"]})
+
+    def analyze_emotion(self, message):
+        return self._stage("emotional", {"dominant_emotion": "curious"})
+
+    def recall_memories(self, message):
+        return self._stage("memories", [])
+
+    def combine_analyses(self, meta, emotion, memories):
+        insights = list(meta["insights"]) if meta else []
+        return {"metacognition": meta, "emotional": emotion, "memories": memories,
+                "insights": insights, "should_reflect": False}
+
+    def store_interaction_with_response(self, user_message, response, reflection=None, processing_results=None):
+        time.sleep(self.post_turn_delay)
+        self.stored.append(response)
+        return len(self.stored)
+
+class StubIntegration:
+    def __init__(self):
+        self.calls = []
+
+    def enhance_cognitive_response(self, base_response, user_message, context=None, priority="interactive"):
+        self.calls.append(priority)
+        return base_response + " (enhanced)"
+
+class TestLyraCorePipeline(unittest.TestCase):
+    """Concurrent analyses, deadlines and post-turn work"""
+
+    def _make_core(self, delays, **kwargs):
+        self.architecture = StubArchitecture(delays)
+        self.integration = StubIntegration()
+        core = LyraCore(model_manager=StubModelManager(), cognitive_architecture=self.architecture,
+                        model_integration=self.integration, **kwargs)
+        core.stage_deadlines = {"metacognition": 1.0, "emotional": 1.0, "memories": 1.0}
+        return core
+
+    def test_analyses_run_concurrently(self):
+        core = self._make_core({"metacognition": 0.3, "emotional": 0.3, "memories": 0.3})
+        started = time.monotonic()
+        result = core.process_message("hello")
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(result["response"], "base reply")
+        self.assertEqual(result["insights"], ["meta insight"])
+        self.assertIn("The user seems to be feeling curious", core.model_manager.model.prompts[0])
+
+    def test_slow_stage_is_skipped_at_deadline(self):
+        core = self._make_core({"memories": 2.0})
+        core.stage_deadlines["memories"] = 0.2
+        started = time.monotonic()
+        result = core.process_message("hello")
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(result["timings"]["memories"]["status"], "timeout")
+        self.assertEqual(result["timings"]["metacognition"]["status"], "ok")
+
+    def test_storage_happens_after_reply(self):
+        core = self._make_core({})
+        self.architecture.post_turn_delay = 0.5
+        started = time.monotonic()
+        core.process_message("hello")
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(self.architecture.stored, [])
+        self.assertTrue(core.post_turn_queue.join(timeout=5))
+        self.assertEqual(self.architecture.stored, ["base reply"])
+
+    def test_enhancement_is_opt_in_and_published(self):
+        core = self._make_core({})
+        core.process_message("hello")
+        self.assertTrue(core.post_turn_queue.join(timeout=5))
+        self.assertEqual(self.integration.calls, [])
+
+        updates = []
+        result = core.process_message("hello", {"enhance": True, "on_update": updates.append})
+        self.assertEqual(result["response"], "base reply")
+        self.assertTrue(result["enhancement_pending"])
+        self.assertTrue(core.post_turn_queue.join(timeout=5))
+        self.assertEqual(self.integration.calls, ["background"])
+        self.assertEqual(updates[0]["turn_id"], result["turn_id"])
+        self.assertEqual(updates[0]["response"], "base reply (enhanced)")
+        self.assertEqual(self.architecture.stored[-1], "base reply (enhanced)")
+
+class TestTurnPipelineHelpers(unittest.TestCase):
+    """StageRunner and PostTurnQueue on their own"""
+
+    def test_failing_stage_returns_none(self):
+        runner = StageRunner()
+
+        def broken():
+            raise RuntimeError("boom")
+
+        results, timings = runner.run({"ok": lambda: 1, "broken": broken})
+        self.assertEqual(results, {"ok": 1, "broken": None})
+        self.assertEqual(timings["broken"]["status"], "error")
+
+    def test_hung_stage_is_skipped_until_it_returns(self):
+        runner = StageRunner(default_deadline=0.05)
+        release = threading.Event()
+        stages = {"hung": lambda: release.wait(5) and "late", "quick": lambda: 1}
+
+        results, timings = runner.run(stages)
+        self.assertEqual(results, {"hung": None, "quick": 1})
+        self.assertEqual(timings["hung"]["status"], "timeout")
+        self.assertEqual(runner.get_status(), {"hung": 1})
+
+        # The next turn does not wait behind the hung call or start another one
+        started = time.monotonic()
+        results, timings = runner.run(stages)
+        self.assertLess(time.monotonic() - started, 0.04)
+        self.assertEqual(timings["hung"]["status"], "skipped")
+        self.assertEqual(results["quick"], 1)
+
+        release.set()
+        deadline = time.time() + 5
+        while runner.get_status() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(runner.get_status(), {})
+        results, timings = runner.run(stages)
+        self.assertEqual(results["hung"], "late")
+
+    def test_post_turn_queue_back_pressure(self):
+        post_turn = PostTurnQueue(maxsize=1, put_timeout=0.05)
+        release = threading.Event()
+        self.assertTrue(post_turn.submit(release.wait))
+        time.sleep(0.05)
+        self.assertTrue(post_turn.submit(lambda: None))
+        self.assertFalse(post_turn.submit(lambda: None))
+        release.set()
+        self.assertTrue(post_turn.join(timeout=5))
+        status = post_turn.get_status()
+        self.assertEqual((status["completed"], status["dropped"]), (2, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+"""
+Tests for streaming speech: sentence segmentation, the persistent Piper
+process and speaking replies from a token stream
+"""
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+import unittest
+from unittest import mock
+
+# Add the parent directory to the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import voice_interface
+from voice_interface import SentenceSegmenter, PiperProcess, VoiceInterface
+
+# Stands in for piper: after an optional delay, writes 100 bytes of audio per input character
+PIPER_STUB = """
+import sys, time
+delay = float(sys.argv[1])
+for line in sys.stdin:
+    time.sleep(delay)
+    sys.stdout.buffer.write(b"\\0" * (100 * len(line.strip())))
+    sys.stdout.buffer.flush()
+"""
+
+# Stands in for aplay: appends everything it is given to a file
+PLAYER_STUB = """
+import sys
+with open(sys.argv[1], "ab") as out:
+    while True:
+        chunk = sys.stdin.buffer.read1(4096)
+        if not chunk:
+            break
+        out.write(chunk)
+        out.flush()
+"""
+
+class TestSentenceSegmenter(unittest.TestCase):
+
+    def feed_all(self, segmenter, text, size=3):
+        sentences = []
+        for i in range(0, len(text), size):
+            sentences += segmenter.feed(text[i:i + size])
+        return sentences
+
+    def test_abbreviations_and_decimals_do_not_end_a_sentence(self):
+        segmenter = SentenceSegmenter(min_chars=1)
+        sentences = self.feed_all(segmenter, "Dr. Smith paid 3.50 dollars, e.g. for tea. Then he left. ")
+        self.assertEqual(sentences, ["Dr. Smith paid 3.50 dollars, e.g. for tea.", "Then he left."])
+        self.assertEqual(segmenter.flush(), [])
+
+    def test_short_sentences_merge_with_the_next(self):
+        segmenter = SentenceSegmenter(min_chars=12)
+        self.assertEqual(self.feed_all(segmenter, "Hi. Yes! This one is long enough. "),
+                         ["Hi. Yes! This one is long enough."])
+
+    def test_long_run_on_text_is_split(self):
+        segmenter = SentenceSegmenter(max_chars=20)
+        sentences = self.feed_all(segmenter, "one two three, four five six seven eight nine")
+        self.assertEqual(sentences[0], "one two three,")
+        self.assertTrue(all(len(sentence) <= 20 for sentence in sentences))
+        rest = segmenter.flush()
+        self.assertEqual(" ".join(sentences + rest), "one two three, four five six seven eight nine")
+
+    def test_flush_returns_the_unfinished_sentence_once(self):
+        segmenter = SentenceSegmenter()
+        self.assertEqual(segmenter.feed("The answer is"), [])
+        self.assertEqual(segmenter.flush(), ["The answer is"])
+        self.assertEqual(segmenter.flush(), [])
+
+@unittest.skipUnless(platform.system() == "Linux", "PiperProcess only plays audio on Linux")
+class TestPiperProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.played = os.path.join(self.tmpdir, "played.raw")
+        self.delay = 0.0
+        popen = subprocess.Popen
+
+        def fake_popen(cmd, **kwargs):
+            if cmd[0] == "aplay":
+                return popen([sys.executable, "-c", PLAYER_STUB, self.played], **kwargs)
+            return popen([sys.executable, "-c", PIPER_STUB, str(self.delay)], **kwargs)
+
+        patcher = mock.patch.object(voice_interface.subprocess, "Popen", side_effect=fake_popen)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # A high sample rate keeps the estimated playback time negligible
+        self.piper = PiperProcess("piper", "voice.onnx", sample_rate=1000000, buffer_chunks=2, chunk_size=256)
+
+    def tearDown(self):
+        self.piper.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def played_bytes(self, expected, timeout=5.0):
+        deadline = time.time() + timeout
+        size = 0
+        while time.time() < deadline:
+            size = os.path.getsize(self.played) if os.path.exists(self.played) else 0
+            if size >= expected:
+                break
+            time.sleep(0.02)
+        return size
+
+    def test_audio_passes_through_the_bounded_buffer(self):
+        self.assertTrue(self.piper.synthesize("Hello there."))
+        self.assertTrue(self.piper.synthesize("How  are\nyou?"))
+        self.piper.wait_until_idle(idle_time=0.1, timeout=5)
+        # 12 + 12 characters, far more than the two 256-byte chunks the buffer holds
+        self.assertEqual(self.played_bytes(2400), 2400)
+        self.assertTrue(self.piper.audio_queue.empty())
+
+    def test_wait_until_idle_waits_for_late_audio(self):
+        self.delay = 0.4
+        start = time.time()
+        self.piper.synthesize("Hello there.")
+        self.piper.wait_until_idle(idle_time=0.1, timeout=5)
+        self.assertGreaterEqual(time.time() - start, 0.4)
+        self.assertEqual(self.played_bytes(1200), 1200)
+
+    def test_wait_until_idle_gives_up_without_audio(self):
+        self.delay = 5.0
+        self.piper.synthesize("Hello there.")
+        start = time.time()
+        self.piper.wait_until_idle(timeout=5, first_audio_timeout=0.2)
+        self.assertLess(time.time() - start, 1.0)
+
+    def test_close_restarts_on_next_use(self):
+        self.piper.synthesize("Hello there.")
+        self.piper.wait_until_idle(idle_time=0.1, timeout=5)
+        self.piper.close()
+        self.assertFalse(self.piper.is_alive())
+        self.assertTrue(self.piper.synthesize("Again."))
+        self.assertTrue(self.piper.is_alive())
+        self.piper.wait_until_idle(idle_time=0.1, timeout=5)
+        self.assertEqual(self.played_bytes(1800), 1800)
+
+class StreamingBot:
+    def __init__(self):
+        self.calls = []
+
+    def chat(self, message, **kwargs):
+        self.calls.append(("chat", message))
+        return "Hello there. How are you?"
+
+    def chat_stream(self, message, **kwargs):
+        self.calls.append(("chat_stream", message))
+        for piece in ("Hello ", "there. ", "How are ", "you?"):
+            yield piece
+
+class RecordingSpeech:
+    """Consumes streams on a thread, like TextToSpeech.speak_stream"""
+    def __init__(self):
+        self.spoken = []
+        self.threads = []
+
+    def speak(self, text):
+        self.spoken.append(text)
+
+    def speak_stream(self, chunks):
+        thread = threading.Thread(target=lambda: self.spoken.append(list(chunks)))
+        thread.start()
+        self.threads.append(thread)
+
+class TestRespond(unittest.TestCase):
+
+    def _interface(self, stream_replies):
+        interface = VoiceInterface.__new__(VoiceInterface)
+        interface.text_to_speech = RecordingSpeech()
+        interface.enabled = True
+        interface.stream_replies = stream_replies
+        return interface
+
+    def test_streamed_reply_is_spoken_as_it_arrives(self):
+        interface, bot = self._interface(True), StreamingBot()
+        self.assertEqual(interface.respond(bot, "hi"), "Hello there. How are you?")
+        interface.text_to_speech.threads[0].join(5)
+        self.assertEqual(bot.calls, [("chat_stream", "hi")])
+        self.assertEqual(interface.text_to_speech.spoken, [["Hello ", "there. ", "How are ", "you?"]])
+        self.assertEqual(interface.last_spoken_text, "Hello there. How are you?")
+
+    def test_reply_is_spoken_whole_without_the_flag(self):
+        interface, bot = self._interface(False), StreamingBot()
+        self.assertEqual(interface.respond(bot, "hi"), "Hello there. How are you?")
+        self.assertEqual(bot.calls, [("chat", "hi")])
+        self.assertEqual(interface.text_to_speech.spoken, ["Hello there. How are you?"])
+
+if __name__ == "__main__":
+    unittest.main()
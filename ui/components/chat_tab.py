@@ -6,6 +6,7 @@ from pathlib import Path
 from typing import Dict, List, Tuple, Any
 
 from .base import TabComponent
+from modules.inference_scheduler import QueueFullError
 
 # Check Gradio version to handle compatibility
 GRADIO_VERSION = getattr(gr, "__version__", "0.0.0")
@@ -271,14 +272,17 @@ class ChatTab(TabComponent):
                     active_attachment_ids.append(row[1])  # Add the ID
         
         # Get response from bot
-        response = self.bot.chat(
-            message=message,
-            gen_config=gen_config,
-            include_profile=include_profile,
-            include_system_instructions=include_system,
-            include_extras=include_extras,
-            active_attachments=active_attachment_ids
-        )
+        try:
+            response = self.bot.chat(
+                message=message,
+                gen_config=gen_config,
+                include_profile=include_profile,
+                include_system_instructions=include_system,
+                include_extras=include_extras,
+                active_attachments=active_attachment_ids
+            )
+        except QueueFullError as e:
+            response = f"{e.message}. Please try again shortly."
         
         # Update history with response
         history[-1] = (message, response)
@@ -6,6 +6,7 @@ from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Any
 
 from .base import TabComponent
+from modules.inference_scheduler import QueueFullError
 
 class PersonalityTab(TabComponent):
     """Personality tab UI component"""
@@ -387,11 +388,14 @@ class PersonalityTab(TabComponent):
         self.bot.update_personality(**settings)
         
         # Generate a response with current settings
-        response = self.bot.chat(
-            message=prompt,
-            include_profile=False,
-            include_system_instructions=False,
-            include_extras=False
-        )
+        try:
+            response = self.bot.chat(
+                message=prompt,
+                include_profile=False,
+                include_system_instructions=False,
+                include_extras=False
+            )
+        except QueueFullError as e:
+            response = f"{e.message}. Please try again shortly."
         
         return response
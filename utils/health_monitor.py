@@ -1,14 +1,21 @@
 """
 Health monitoring system for Lyra
 Tracks system health, resource usage, and component status
+
+Resource samples (CPU, RSS, threads, GPU memory, queue depths) are taken
+every few seconds without blocking and kept in fixed-size ring buffers; the
+slower health checks run on top of the latest samples. The samples can be
+scraped in Prometheus text format from a local HTTP endpoint.
 """
 
 import os
+import sys
 import time
 import logging
 import threading
 import platform
 import json
+from collections import deque
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Callable
 from datetime import datetime
@@ -24,18 +31,51 @@ except ImportError:
     logger.warning("psutil not available, system resource monitoring will be limited")
     PSUTIL_AVAILABLE = False
 
+from utils.metrics_store import MetricsStore, MetricsServer
+
+# Help text and Prometheus type of the sampled metrics
+METRIC_DESCRIPTIONS = {
+    "cpu_percent": ("System-wide CPU usage percent", "gauge"),
+    "process_cpu_percent": ("CPU used by the Lyra process, percent of one core", "gauge"),
+    "memory_percent": ("System memory usage percent", "gauge"),
+    "process_rss_bytes": ("Resident set size of the Lyra process", "gauge"),
+    "python_threads": ("Live Python threads", "gauge"),
+    "os_threads": ("OS threads of the Lyra process", "gauge"),
+    "gpu_memory_allocated_bytes": ("GPU memory allocated by torch", "gauge"),
+    "queue_depth": ("Items waiting in a registered queue", "gauge"),
+    "component_response_seconds": ("Health check response time per component", "gauge"),
+    "monitor_cpu_seconds_total": ("CPU time spent by the health monitor itself", "counter")
+}
+
+def _read_rss_bytes() -> Optional[float]:
+    """Current RSS without psutil (Linux), or peak RSS elsewhere"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None
+
 class HealthMonitor:
     """
     Monitors the health and performance of the Lyra system
     Collects metrics and generates health reports
     """
     
-    def __init__(self, data_dir: str = "data/health"):
+    def __init__(self, data_dir: str = "data/health", sample_interval: float = 5.0,
+                 sample_capacity: int = 720):
         """
         Initialize the health monitor
         
         Args:
             data_dir: Directory for health data storage
+            sample_interval: Seconds between resource samples
+            sample_capacity: Samples kept per metric (1 hour at 5 second intervals)
         """
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True, parents=True)
@@ -44,6 +84,23 @@ class HealthMonitor:
         self.monitoring = False
         self.monitor_thread = None
         self.monitor_interval = 60  # 1 minute by default
+        self.sample_interval = sample_interval
+        self.stop_event = threading.Event()
+        
+        # Sampled metrics in ring buffers
+        self.metrics = MetricsStore(capacity=sample_capacity)
+        for name, (help_text, metric_type) in METRIC_DESCRIPTIONS.items():
+            self.metrics.describe(name, help_text, metric_type)
+        self.queues = {}  # name -> function returning the queue depth
+        self.exporter = None
+        self.monitor_cpu_seconds = 0.0
+        self.last_sample = {}
+        self._last_cpu = None  # (monotonic, process_time) of the previous sample
+        self.process = None
+        if PSUTIL_AVAILABLE:
+            self.process = psutil.Process()
+            # The first call only sets the baseline for later non-blocking calls
+            psutil.cpu_percent(interval=None)
         
         # System resources thresholds
         self.thresholds = {
@@ -56,15 +113,15 @@ class HealthMonitor:
         # Registered components
         self.components = {}
         
+        # Max history entries (per component)
+        self.max_history = 60  # 1 hour at 1 minute intervals
+        
         # Metrics history
         self.metrics_history = {
-            "system": [],
+            "system": deque(maxlen=self.max_history),
             "components": {}
         }
         
-        # Max history entries (per component)
-        self.max_history = 60  # 1 hour at 1 minute intervals
-        
         # Alert callbacks
         self.alert_callbacks = []
     
@@ -87,10 +144,24 @@ class HealthMonitor:
         
         # Initialize metrics history for this component
         if component_id not in self.metrics_history["components"]:
-            self.metrics_history["components"][component_id] = []
+            self.metrics_history["components"][component_id] = deque(maxlen=self.max_history)
         
         logger.info(f"Registered component for health monitoring: {component_id}")
     
+    def register_queue(self, name: str, depth_func: Callable[[], int]):
+        """
+        Register a queue whose depth is sampled with the other metrics
+        
+        Args:
+            name: Queue name, exported as the "queue" label
+            depth_func: Function returning the number of waiting items (e.g. queue.qsize)
+        """
+        self.queues[name] = depth_func
+    
+    def unregister_queue(self, name: str):
+        """Stop sampling a queue registered with register_queue"""
+        self.queues.pop(name, None)
+    
     def register_alert_callback(self, callback: Callable[[str, Dict[str, Any]], None]):
         """
         Register a callback for health alerts
@@ -100,12 +171,13 @@ class HealthMonitor:
         """
         self.alert_callbacks.append(callback)
     
-    def start_monitoring(self, interval: int = None):
+    def start_monitoring(self, interval: int = None, sample_interval: float = None):
         """
         Start health monitoring
         
         Args:
             interval: Monitoring interval in seconds
+            sample_interval: Seconds between resource samples
         """
         if self.monitoring:
             logger.warning("Health monitoring is already running")
@@ -113,8 +185,11 @@ class HealthMonitor:
         
         if interval is not None:
             self.monitor_interval = interval
+        if sample_interval is not None:
+            self.sample_interval = sample_interval
         
         self.monitoring = True
+        self.stop_event.clear()
         self.monitor_thread = threading.Thread(target=self._monitoring_loop, daemon=True)
         self.monitor_thread.start()
         
@@ -127,6 +202,7 @@ class HealthMonitor:
             return
         
         self.monitoring = False
+        self.stop_event.set()
         if self.monitor_thread:
             self.monitor_thread.join(timeout=2.0)
             self.monitor_thread = None
@@ -134,53 +210,165 @@ class HealthMonitor:
         logger.info("Health monitoring stopped")
     
     def _monitoring_loop(self):
-        """Main monitoring loop"""
+        """Main monitoring loop: sample every sample_interval, check health every monitor_interval"""
+        next_check = time.monotonic()
         while self.monitoring:
             try:
-                # Check system resources
-                system_health = self.check_system_health()
-                
-                # Check component health
-                component_health = self.check_components_health()
-                
-                # Combine into overall health status
-                health_status = {
-                    "timestamp": time.time(),
-                    "system": system_health,
-                    "components": component_health,
-                    "overall_status": "healthy"  # Default to healthy
-                }
-                
-                # Determine overall status based on individual statuses
-                if system_health.get("status") == "warning" or any(comp.get("status") == "warning" for comp in component_health.values()):
-                    health_status["overall_status"] = "warning"
-                
-                if system_health.get("status") == "critical" or any(comp.get("status") == "critical" for comp in component_health.values()):
-                    health_status["overall_status"] = "critical"
-                
-                # Update metrics history
-                self._update_metrics_history(health_status)
-                
-                # Check for alerts
-                self._check_for_alerts(health_status)
-                
-                # Save status to file periodically (every 10 checks)
-                if int(time.time()) % (self.monitor_interval * 10) < self.monitor_interval:
-                    self._save_health_status(health_status)
-                
+                sample = self.sample_metrics()
             except Exception as e:
-                logger.error(f"Error in health monitoring loop: {e}")
+                logger.error(f"Error sampling metrics: {e}")
+                sample = None
+            
+            if time.monotonic() >= next_check:
+                next_check = time.monotonic() + self.monitor_interval
+                self._run_health_check(sample)
+            
+            # Sleep until the next sample; stop_monitoring wakes us immediately
+            self.stop_event.wait(min(self.sample_interval, self.monitor_interval))
+    
+    def _run_health_check(self, sample: Dict[str, float] = None):
+        """Check system and component health and raise alerts"""
+        try:
+            # Check system resources
+            system_health = self.check_system_health(sample)
+            
+            # Check component health
+            component_health = self.check_components_health()
+            
+            # Combine into overall health status
+            health_status = {
+                "timestamp": time.time(),
+                "system": system_health,
+                "components": component_health,
+                "overall_status": "healthy"  # Default to healthy
+            }
+            
+            # Determine overall status based on individual statuses
+            if system_health.get("status") == "warning" or any(comp.get("status") == "warning" for comp in component_health.values()):
+                health_status["overall_status"] = "warning"
+            
+            if system_health.get("status") == "critical" or any(comp.get("status") == "critical" for comp in component_health.values()):
+                health_status["overall_status"] = "critical"
+            
+            # Update metrics history
+            self._update_metrics_history(health_status)
+            
+            # Check for alerts
+            self._check_for_alerts(health_status)
             
-            # Sleep until next check
-            time.sleep(self.monitor_interval)
+            # Save status to file periodically (every 10 checks)
+            if int(time.time()) % (self.monitor_interval * 10) < self.monitor_interval:
+                self._save_health_status(health_status)
+            
+        except Exception as e:
+            logger.error(f"Error in health check: {e}")
+    
+    def sample_metrics(self) -> Dict[str, float]:
+        """
+        Take one sample of every resource metric without blocking
+        
+        CPU usage is computed from the change in CPU time since the previous
+        sample rather than by sleeping for a measurement interval.
+        
+        Returns:
+            Dictionary of the sampled values
+        """
+        cost_started = time.thread_time()
+        now = time.time()
+        sample = {}
+        
+        # Process CPU from process_time deltas (all threads of this process)
+        wall, cpu = time.monotonic(), time.process_time()
+        if self._last_cpu is not None and wall > self._last_cpu[0]:
+            sample["process_cpu_percent"] = 100.0 * (cpu - self._last_cpu[1]) / (wall - self._last_cpu[0])
+        self._last_cpu = (wall, cpu)
+        
+        if PSUTIL_AVAILABLE:
+            try:
+                # Non-blocking: usage since the previous call
+                sample["cpu_percent"] = psutil.cpu_percent(interval=None)
+                sample["memory_percent"] = psutil.virtual_memory().percent
+                sample["process_rss_bytes"] = self.process.memory_info().rss
+                sample["os_threads"] = self.process.num_threads()
+            except Exception as e:
+                logger.debug(f"Error sampling process metrics: {e}")
+        else:
+            sample["process_rss_bytes"] = _read_rss_bytes()
+        sample["python_threads"] = threading.active_count()
+        
+        for name, value in sample.items():
+            self.metrics.record(name, value, timestamp=now)
+        
+        # GPU memory, only if torch is already loaded by someone else
+        torch = sys.modules.get("torch")
+        if torch is not None:
+            try:
+                if torch.cuda.is_available():
+                    for device in range(torch.cuda.device_count()):
+                        allocated = torch.cuda.memory_allocated(device)
+                        self.metrics.record("gpu_memory_allocated_bytes", allocated, {"device": str(device)}, now)
+                        sample[f"gpu{device}_memory_allocated_bytes"] = allocated
+            except Exception as e:
+                logger.debug(f"Error sampling GPU metrics: {e}")
+        
+        for name, depth_func in list(self.queues.items()):
+            try:
+                depth = depth_func()
+                self.metrics.record("queue_depth", depth, {"queue": name}, now)
+                sample[f"queue_depth:{name}"] = depth
+            except Exception as e:
+                logger.debug(f"Error sampling depth of queue {name}: {e}")
+        
+        self.monitor_cpu_seconds += time.thread_time() - cost_started
+        self.metrics.record("monitor_cpu_seconds_total", self.monitor_cpu_seconds, timestamp=now)
+        self.last_sample = sample
+        return sample
+    
+    def get_metrics_summary(self, window: float = 300.0) -> Dict[str, Any]:
+        """
+        Percentiles, mean, min and max of every sampled metric over a rolling window
+        
+        Args:
+            window: Window in seconds
+        """
+        return self.metrics.snapshot(window)
     
-    def check_system_health(self) -> Dict[str, Any]:
+    def start_exporter(self, port: int = 9464, host: str = "127.0.0.1", window: float = 300.0) -> bool:
+        """
+        Serve the sampled metrics in Prometheus text format at http://host:port/metrics
+        
+        Args:
+            port: Port to listen on (0 picks a free port)
+            host: Interface to bind, local only by default
+            window: Window in seconds of the exported summaries
+        """
+        if self.exporter is not None:
+            return True
+        exporter = MetricsServer(self.metrics, host=host, port=port, window=window)
+        if not exporter.start():
+            return False
+        self.exporter = exporter
+        return True
+    
+    def stop_exporter(self):
+        """Stop the metrics endpoint"""
+        if self.exporter is not None:
+            self.exporter.stop()
+            self.exporter = None
+    
+    def check_system_health(self, sample: Dict[str, float] = None) -> Dict[str, Any]:
         """
         Check system health metrics
         
+        Args:
+            sample: Resource sample to use; a new one is taken if not given
+        
         Returns:
             Dictionary with system health data
         """
+        if sample is None:
+            sample = self.sample_metrics()
+        
         health_data = {
             "timestamp": time.time(),
             "status": "healthy",
@@ -196,7 +384,7 @@ class HealthMonitor:
         if PSUTIL_AVAILABLE:
             try:
                 # CPU usage
-                cpu_percent = psutil.cpu_percent(interval=0.5)
+                cpu_percent = sample.get("cpu_percent", 0.0)
                 health_data["cpu_percent"] = cpu_percent
                 
                 if cpu_percent > self.thresholds["cpu_percent"]:
@@ -224,9 +412,9 @@ class HealthMonitor:
                     health_data["status"] = "warning"
                 
                 # Process info
-                process = psutil.Process()
-                health_data["process_memory_mb"] = process.memory_info().rss / (1024 * 1024)
-                health_data["process_cpu_percent"] = process.cpu_percent(interval=0.1)
+                process = self.process
+                health_data["process_memory_mb"] = sample.get("process_rss_bytes", 0) / (1024 * 1024)
+                health_data["process_cpu_percent"] = sample.get("process_cpu_percent", 0.0)
                 health_data["process_create_time"] = process.create_time()
                 health_data["process_uptime"] = time.time() - process.create_time()
                 
@@ -243,13 +431,9 @@ class HealthMonitor:
             # Limited information without psutil
             health_data["warnings"].append("psutil not available, limited system monitoring")
             
-            # Try to get process memory using resource module
-            try:
-                import resource
-                rusage = resource.getrusage(resource.RUSAGE_SELF)
-                health_data["process_memory_mb"] = rusage.ru_maxrss / 1024  # Convert KB to MB
-            except ImportError:
-                pass
+            if sample.get("process_rss_bytes") is not None:
+                health_data["process_memory_mb"] = sample["process_rss_bytes"] / (1024 * 1024)
+            health_data["process_cpu_percent"] = sample.get("process_cpu_percent", 0.0)
         
         return health_data
     
@@ -336,14 +520,10 @@ class HealthMonitor:
             "status": health_status["system"].get("status", "unknown")
         })
         
-        # Trim system history if needed
-        if len(self.metrics_history["system"]) > self.max_history:
-            self.metrics_history["system"] = self.metrics_history["system"][-self.max_history:]
-        
         # Update component metrics history
         for component_id, component_data in health_status["components"].items():
             if component_id not in self.metrics_history["components"]:
-                self.metrics_history["components"][component_id] = []
+                self.metrics_history["components"][component_id] = deque(maxlen=self.max_history)
             
             # Extract key metrics depending on what's available
             metrics = {
@@ -357,12 +537,10 @@ class HealthMonitor:
                 if isinstance(value, (int, float)) and key not in metrics:
                     metrics[key] = value
             
-            # Add to history
+            # Add to history (the deque drops the oldest entry)
             self.metrics_history["components"][component_id].append(metrics)
-            
-            # Trim component history if needed
-            if len(self.metrics_history["components"][component_id]) > self.max_history:
-                self.metrics_history["components"][component_id] = self.metrics_history["components"][component_id][-self.max_history:]
+            self.metrics.record("component_response_seconds", metrics["response_time"],
+                                {"component": component_id}, metrics["timestamp"])
     
     def _check_for_alerts(self, health_status: Dict[str, Any]):
         """
@@ -564,9 +742,15 @@ class HealthMonitor:
                 "monitoring_period": latest["timestamp"] - oldest["timestamp"]
             }
         
+        # Rolling-window aggregates of the sampled metrics
+        report["metrics_summary"] = self.get_metrics_summary()
+        
         # Add history if requested
         if include_history:
-            report["metrics_history"] = self.metrics_history
+            report["metrics_history"] = {
+                "system": list(self.metrics_history["system"]),
+                "components": {comp_id: list(metrics) for comp_id, metrics in self.metrics_history["components"].items()}
+            }
         
         return report
 
@@ -596,6 +780,16 @@ def register_component(component_id: str, health_check_func: Callable[[], Dict[s
     hm = get_health_monitor()
     hm.register_component(component_id, health_check_func)
 
+def register_queue(name: str, depth_func: Callable[[], int]):
+    """Sample a queue's depth with the other metrics"""
+    hm = get_health_monitor()
+    hm.register_queue(name, depth_func)
+
+def unregister_queue(name: str):
+    """Stop sampling a queue"""
+    hm = get_health_monitor()
+    hm.unregister_queue(name)
+
 def start_monitoring(interval: int = None):
     """Start health monitoring"""
     hm = get_health_monitor()
@@ -615,3 +809,13 @@ def get_health_report(include_history: bool = False) -> Dict[str, Any]:
     """Get health report"""
     hm = get_health_monitor()
     return hm.get_health_report(include_history)
+
+def start_exporter(port: int = 9464, host: str = "127.0.0.1") -> bool:
+    """Serve health metrics for Prometheus at http://host:port/metrics"""
+    hm = get_health_monitor()
+    return hm.start_exporter(port, host)
+
+def stop_exporter():
+    """Stop the metrics endpoint"""
+    hm = get_health_monitor()
+    hm.stop_exporter()
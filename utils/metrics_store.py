@@ -0,0 +1,266 @@
+"""
+Metrics store for Lyra
+Fixed-size ring buffers of timestamped samples with rolling-window
+aggregation, and a Prometheus text-format exporter served over local HTTP.
+
+Appending a sample is O(1) and never allocates; aggregations only look at
+the samples inside the requested window.
+"""
+
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger("metrics_store")
+
+# NumPy makes window aggregation cheap; plain lists are used without it
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class RingBuffer:
+    """Fixed-capacity buffer of (timestamp, value) samples"""
+
+    def __init__(self, capacity: int = 720):
+        self.capacity = capacity
+        if NUMPY_AVAILABLE:
+            self.timestamps = np.zeros(capacity, dtype=np.float64)
+            self.values = np.zeros(capacity, dtype=np.float64)
+        else:
+            self.timestamps = [0.0] * capacity
+            self.values = [0.0] * capacity
+        self.index = 0  # next slot to write
+        self.count = 0
+        self.total = 0.0  # sum of every value ever appended
+        self.appended = 0  # number of values ever appended
+        self.lock = threading.Lock()
+
+    def append(self, value: float, timestamp: float = None):
+        with self.lock:
+            self.timestamps[self.index] = time.time() if timestamp is None else timestamp
+            self.values[self.index] = value
+            self.index = (self.index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.total += value
+            self.appended += 1
+
+    def latest(self) -> Optional[float]:
+        with self.lock:
+            if not self.count:
+                return None
+            return float(self.values[self.index - 1])
+
+    def window(self, seconds: float = None, now: float = None) -> Tuple[Any, Any]:
+        """Samples in chronological order, optionally only the last `seconds`"""
+        with self.lock:
+            start = (self.index - self.count) % self.capacity
+            if start + self.count <= self.capacity:
+                timestamps = self.timestamps[start:start + self.count]
+                values = self.values[start:start + self.count]
+            elif NUMPY_AVAILABLE:
+                timestamps = np.concatenate((self.timestamps[start:], self.timestamps[:self.index]))
+                values = np.concatenate((self.values[start:], self.values[:self.index]))
+            else:
+                timestamps = self.timestamps[start:] + self.timestamps[:self.index]
+                values = self.values[start:] + self.values[:self.index]
+            # Copy out of the lock so later appends can't change the result
+            if NUMPY_AVAILABLE:
+                timestamps, values = timestamps.copy(), values.copy()
+
+        if seconds is not None:
+            cutoff = (time.time() if now is None else now) - seconds
+            if NUMPY_AVAILABLE:
+                first = int(np.searchsorted(timestamps, cutoff, side="left"))
+            else:
+                first = next((i for i, ts in enumerate(timestamps) if ts >= cutoff), len(timestamps))
+            timestamps, values = timestamps[first:], values[first:]
+        return timestamps, values
+
+    def summary(self, seconds: float = None, quantiles=(0.5, 0.95, 0.99), now: float = None) -> Dict[str, Any]:
+        """Count, mean, min, max and quantiles over a rolling window"""
+        _, values = self.window(seconds, now)
+        result = {"count": len(values)}
+        if not len(values):
+            result.update({"mean": None, "min": None, "max": None})
+            result.update({f"p{int(q * 100)}": None for q in quantiles})
+            return result
+        if NUMPY_AVAILABLE:
+            result.update({"mean": float(values.mean()), "min": float(values.min()), "max": float(values.max())})
+            for q, value in zip(quantiles, np.quantile(values, quantiles)):
+                result[f"p{int(q * 100)}"] = float(value)
+        else:
+            ordered = sorted(values)
+            result.update({"mean": sum(ordered) / len(ordered), "min": ordered[0], "max": ordered[-1]})
+            for q in quantiles:
+                # Linear interpolation, matching numpy's default
+                position = q * (len(ordered) - 1)
+                low = int(position)
+                high = min(low + 1, len(ordered) - 1)
+                result[f"p{int(q * 100)}"] = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+        return result
+
+class MetricsStore:
+    """
+    Named series of samples, each held in its own ring buffer
+
+    A series is identified by a metric name plus optional labels, so
+    record("queue_depth", 3, {"queue": "inference"}) and the same metric with
+    another queue label are kept apart.
+    """
+
+    def __init__(self, capacity: int = 720, prefix: str = "lyra_"):
+        """
+        Initialize the store
+
+        Args:
+            capacity: Samples kept per series
+            prefix: Prepended to metric names in the Prometheus output
+        """
+        self.capacity = capacity
+        self.prefix = prefix
+        self.series = {}  # (name, sorted label items) -> RingBuffer
+        self.metadata = {}  # name -> {"type", "help"}
+        self.lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str, metric_type: str = "gauge"):
+        """Set the help text and Prometheus type (gauge or counter) of a metric"""
+        self.metadata[name] = {"type": metric_type, "help": help_text}
+
+    def _buffer(self, name: str, labels: Dict[str, str] = None) -> RingBuffer:
+        key = (name, tuple(sorted((labels or {}).items())))
+        buffer = self.series.get(key)
+        if buffer is None:
+            with self.lock:
+                buffer = self.series.setdefault(key, RingBuffer(self.capacity))
+        return buffer
+
+    def record(self, name: str, value: float, labels: Dict[str, str] = None, timestamp: float = None):
+        """Append a sample to a series"""
+        if value is None:
+            return
+        self._buffer(name, labels).append(float(value), timestamp)
+
+    def latest(self, name: str, labels: Dict[str, str] = None) -> Optional[float]:
+        return self._buffer(name, labels).latest()
+
+    def summary(self, name: str, labels: Dict[str, str] = None, window: float = None) -> Dict[str, Any]:
+        """Rolling-window aggregation of one series"""
+        return self._buffer(name, labels).summary(window)
+
+    def names(self) -> List[str]:
+        return sorted({name for name, _ in self.series})
+
+    def snapshot(self, window: float = None) -> Dict[str, Any]:
+        """Summaries of every series, keyed by name and label string"""
+        with self.lock:
+            items = list(self.series.items())
+        result = {}
+        for (name, labels), buffer in sorted(items):
+            label_text = ",".join(f"{k}={v}" for k, v in labels)
+            result[f"{name}{{{label_text}}}" if label_text else name] = buffer.summary(window)
+        return result
+
+    @staticmethod
+    def _format_labels(labels, extra=()) -> str:
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in items)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+    def to_prometheus(self, window: float = 300.0) -> str:
+        """
+        Render every series in the Prometheus text exposition format
+
+        Each gauge is exported with its latest value, plus a summary over the
+        window (quantiles, _sum and _count) named <metric>_window.
+        """
+        with self.lock:
+            items = list(self.series.items())
+        by_name = {}
+        for (name, labels), buffer in items:
+            by_name.setdefault(name, []).append((labels, buffer))
+
+        lines = []
+        window_label = (("window", f"{int(window)}s"),)
+        for name in sorted(by_name):
+            meta = self.metadata.get(name, {"type": "gauge", "help": name.replace("_", " ")})
+            metric = self.prefix + name
+            lines.append(f"# HELP {metric} {meta['help']}")
+            lines.append(f"# TYPE {metric} {meta['type']}")
+            for labels, buffer in by_name[name]:
+                latest = buffer.latest()
+                if latest is not None:
+                    lines.append(f"{metric}{self._format_labels(labels)} {latest:g}")
+
+            if meta["type"] != "gauge":
+                continue
+            lines.append(f"# HELP {metric}_window {meta['help']} over the last {int(window)}s")
+            lines.append(f"# TYPE {metric}_window summary")
+            for labels, buffer in by_name[name]:
+                summary = buffer.summary(window)
+                if not summary["count"]:
+                    continue
+                for quantile in ("0.5", "0.95", "0.99"):
+                    value = summary[f"p{int(float(quantile) * 100)}"]
+                    quantile_labels = window_label + (("quantile", quantile),)
+                    lines.append(f"{metric}_window{self._format_labels(labels, quantile_labels)} {value:g}")
+                lines.append(f"{metric}_window_sum{self._format_labels(labels, window_label)} "
+                             f"{summary['mean'] * summary['count']:g}")
+                lines.append(f"{metric}_window_count{self._format_labels(labels, window_label)} {summary['count']}")
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves a MetricsStore at /metrics for Prometheus to scrape"""
+
+    def __init__(self, store: MetricsStore, host: str = "127.0.0.1", port: int = 9464,
+                 window: float = 300.0):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.window = window
+        self.httpd = None
+        self.thread = None
+
+    def start(self) -> bool:
+        store, window = self.store, self.window
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = store.to_prometheus(window).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            logger.error(f"Error starting metrics server on {self.host}:{self.port}: {e}")
+            return False
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+        logger.info(f"Serving metrics at http://{self.host}:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -1,35 +1,71 @@
 """
 State preservation and recovery system for Lyra
 Allows components to save and restore their state
+
+Saves are incremental: each save compares the component's state with what
+was last persisted and journals only the keys that changed. A background
+writer appends journal records (one fsync per batch) and periodically
+compacts each journal into a full snapshot, written to a temporary file,
+fsynced and renamed into place. Loading replays the journal on top of the
+snapshot, so a crash loses at most the records that were not yet written.
+
+    data/state/<component>.json      snapshot {"seq": n, "state": {...}}
+    data/state/<component>.journal   one JSON record per line {"seq", "set", "unset"}
 """
 
 import os
 import json
 import time
+import queue
 import logging
 import threading
-import pickle
 from pathlib import Path
 from typing import Dict, Any, Optional, List, Callable
 
 # Set up logging
 logger = logging.getLogger("state_manager")
 
+SNAPSHOT_VERSION = "2.0"
+
+# Immutable values that can be compared with their last persisted value directly
+SCALAR_TYPES = (str, int, float, bool, type(None))
+_MISSING = object()
+
+def _fsync_dir(path: Path):
+    """Make a rename in path durable (not supported on every platform)"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
 class StateManager:
     """
     Manages state preservation and recovery for Lyra components
-    Provides automatic backup and restoration of component state
+    Provides incremental, journaled persistence of component state
     """
     
-    def __init__(self, data_dir: str = "data/state"):
+    def __init__(self, data_dir: str = "data/state", compact_every: int = 100,
+                 compact_interval: float = 60.0, fsync: bool = True):
         """
         Initialize the state manager
         
         Args:
             data_dir: Directory for state storage
+            compact_every: Journal records after which a component is compacted into a snapshot
+            compact_interval: Seconds after which any journaled changes are compacted
+            fsync: Whether to fsync journal batches and snapshots
         """
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True, parents=True)
+        self.compact_every = compact_every
+        self.compact_interval = compact_interval
+        self.fsync = fsync
         
         # Track registered components
         self.components = {}
@@ -39,10 +75,23 @@ class StateManager:
         self.autosave_timer = None
         self.autosave_running = False
         
-        # Thread lock for saving/loading operations
+        # Guards the component table only; each component has its own locks
         self.lock = threading.RLock()
+        
+        # Background writer for journal records and snapshots
+        self.write_queue = queue.Queue()
+        self.pending_writes = 0
+        self.write_cond = threading.Condition()
+        self.stats = {"saves": 0, "unchanged": 0, "records": 0, "batches": 0, "snapshots": 0}
+        self.writer_thread = threading.Thread(target=self._writer_loop, name="state-writer", daemon=True)
+        self.writer_thread.start()
+    
+    def _paths(self, component_id: str):
+        return (self.data_dir / f"{component_id}.json",
+                self.data_dir / f"{component_id}.journal",
+                self.data_dir / f"{component_id}.backup.json")
     
-    def register_component(self, component_id: str, 
+    def register_component(self, component_id: str,
                          get_state_func: Callable[[], Dict[str, Any]],
                          set_state_func: Callable[[Dict[str, Any]], bool] = None):
         """
@@ -59,44 +108,62 @@ class StateManager:
                 "get_state": get_state_func,
                 "set_state": set_state_func,
                 "last_save_time": 0,
-                "save_count": 0
+                "save_count": 0,
+                "lock": threading.Lock(),  # guards persisted/seq
+                "io_lock": threading.Lock(),  # guards this component's files
+                "persisted": None,  # key -> JSON text as last persisted, None until loaded or saved
+                "scalars": {},  # key -> scalar value matching its persisted text
+                "seq": 0,
+                "journal_entries": 0,
+                "last_compact_time": time.time()
             }
             logger.info(f"Registered component for state management: {component_id}")
     
-    def save_state(self, component_id: str = None) -> bool:
+    def save_state(self, component_id: str = None, wait: bool = False, keys: List[str] = None) -> bool:
         """
         Save the state of a component or all components
         
+        Only keys that changed since the last save are journaled; the write
+        itself happens on the background writer unless wait is set.
+        
         Args:
             component_id: Optional component ID (saves all if None)
-            
+            wait: Block until the changes are on disk
+            keys: Keys known to have changed; only these are compared and
+                journaled (requires component_id)
+        
         Returns:
             True if state was saved successfully
         """
         with self.lock:
-            if component_id is not None:
-                # Save a specific component
-                if component_id not in self.components:
-                    logger.warning(f"Component not registered: {component_id}")
-                    return False
-                
-                return self._save_component_state(component_id)
-            else:
-                # Save all components
-                success = True
-                for comp_id in self.components:
-                    if not self._save_component_state(comp_id):
-                        success = False
-                
-                return success
+            if component_id is not None and component_id not in self.components:
+                logger.warning(f"Component not registered: {component_id}")
+                return False
+            component_ids = [component_id] if component_id is not None else list(self.components)
+        
+        success = True
+        for comp_id in component_ids:
+            if not self._save_component_state(comp_id, keys):
+                success = False
+        
+        if wait:
+            success = self.flush() and success
+        return success
     
-    def _save_component_state(self, component_id: str) -> bool:
+    def _load_persisted(self, component_id: str) -> Dict[str, str]:
+        """Encoded view of what is on disk for a component that has not been loaded or saved yet"""
+        state, seq, _ = self._recover(component_id)
+        self.components[component_id]["seq"] = seq
+        return {key: json.dumps(value, sort_keys=True) for key, value in (state or {}).items()}
+    
+    def _save_component_state(self, component_id: str, keys: List[str] = None) -> bool:
         """
-        Save the state of a specific component
+        Journal the changed keys of a specific component
         
         Args:
             component_id: Component ID to save
-            
+            keys: Optional keys to compare instead of the whole state
+        
         Returns:
             True if state was saved successfully
         """
@@ -110,46 +177,257 @@ class StateManager:
                 logger.warning(f"Empty state returned for component: {component_id}")
                 return False
             
-            # Add metadata
-            state_with_meta = {
-                "component_id": component_id,
-                "timestamp": time.time(),
-                "version": "1.0",
-                "state": state
-            }
+            with component["lock"]:
+                if component["persisted"] is None:
+                    component["persisted"] = self._load_persisted(component_id)
+                    component["scalars"] = {}
+                persisted = component["persisted"]
+                scalars = component["scalars"]
+                
+                # Unchanged scalars are recognised without encoding them;
+                # everything else is compared by its JSON encoding
+                changed = {}
+                for key in (state if keys is None else [key for key in keys if key in state]):
+                    value = state[key]
+                    is_scalar = type(value) in SCALAR_TYPES
+                    if is_scalar:
+                        previous = scalars.get(key, _MISSING)
+                        if type(previous) is type(value) and previous == value:
+                            continue
+                    text = json.dumps(value, sort_keys=True)
+                    if persisted.get(key) != text:
+                        changed[key] = text
+                    if is_scalar:
+                        scalars[key] = value
+                    else:
+                        scalars.pop(key, None)
+                
+                if keys is None:
+                    removed = [key for key in persisted if key not in state]
+                else:
+                    removed = [key for key in keys if key in persisted and key not in state]
+                for key in removed:
+                    scalars.pop(key, None)
+                
+                component["last_save_time"] = time.time()
+                component["save_count"] += 1
+                self.stats["saves"] += 1
+                if not changed and not removed:
+                    self.stats["unchanged"] += 1
+                    return True
+                
+                component["seq"] += 1
+                persisted.update(changed)
+                for key in removed:
+                    del persisted[key]
+                
+                # Values are already encoded, so the record is assembled as text
+                record = '{"seq": %d, "timestamp": %f, "set": {%s}, "unset": %s}\n' % (
+                    component["seq"], time.time(),
+                    ", ".join(f"{json.dumps(key)}: {text}" for key, text in changed.items()),
+                    json.dumps(removed)
+                )
+                
+                # Enqueued under the component lock so records stay in seq order
+                with self.write_cond:
+                    self.pending_writes += 1
+                self.write_queue.put((component_id, record))
+            
+            logger.debug(f"Journaled {len(changed)} changed and {len(removed)} removed keys for {component_id}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error saving state for component {component_id}: {e}")
+            return False
+    
+    def _writer_loop(self):
+        """Append journal records in batches and compact journals that are due"""
+        while True:
+            try:
+                item = self.write_queue.get(timeout=min(self.compact_interval, 5.0))
+            except queue.Empty:
+                self._compact_due()
+                continue
             
-            # Determine file paths
-            state_file = self.data_dir / f"{component_id}.json"
-            backup_file = self.data_dir / f"{component_id}.backup.json"
+            batch = [item]
+            while len(batch) < 1000:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
             
-            # If current state file exists, make a backup
-            if state_file.exists():
-                if backup_file.exists():
-                    backup_file.unlink()
-                state_file.rename(backup_file)
+            stop = None in batch
+            records = {}
+            for entry in batch:
+                if entry is not None:
+                    records.setdefault(entry[0], []).append(entry[1])
             
-            # Save the new state
-            with open(state_file, 'w') as f:
-                json.dump(state_with_meta, f, indent=2)
+            for component_id, lines in records.items():
+                self._append_journal(component_id, lines)
             
-            # Update component metadata
-            component["last_save_time"] = time.time()
-            component["save_count"] += 1
+            self._compact_due()
             
-            logger.info(f"State saved for component: {component_id}")
-            return True
+            with self.write_cond:
+                self.pending_writes -= sum(len(lines) for lines in records.values())
+                self.write_cond.notify_all()
+            if stop:
+                return
+    
+    def _append_journal(self, component_id: str, lines: List[str]):
+        component = self.components[component_id]
+        _, journal_file, _ = self._paths(component_id)
+        try:
+            with component["io_lock"]:
+                with open(journal_file, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                component["journal_entries"] += len(lines)
+            self.stats["records"] += len(lines)
+            self.stats["batches"] += 1
+        except Exception as e:
+            logger.error(f"Error writing state journal for component {component_id}: {e}")
+    
+    def _compact_due(self):
+        now = time.time()
+        with self.lock:
+            components = list(self.components.values())
+        for component in components:
+            entries = component["journal_entries"]
+            if entries >= self.compact_every or (
+                    entries and now - component["last_compact_time"] >= self.compact_interval):
+                self.compact(component["id"])
+    
+    def compact(self, component_id: str) -> bool:
+        """
+        Write a full snapshot of a component and clear its journal
         
+        Args:
+            component_id: Component ID to compact
+        
+        Returns:
+            True if the snapshot was written
+        """
+        component = self.components.get(component_id)
+        if component is None or component["persisted"] is None:
+            return False
+        
+        state_file, journal_file, _ = self._paths(component_id)
+        tmp_file = self.data_dir / f"{component_id}.json.tmp"
+        try:
+            with component["io_lock"]:
+                with component["lock"]:
+                    persisted = dict(component["persisted"])
+                    seq = component["seq"]
+                
+                text = '{"component_id": %s, "timestamp": %f, "version": "%s", "seq": %d, "state": {%s}}' % (
+                    json.dumps(component_id), time.time(), SNAPSHOT_VERSION, seq,
+                    ", ".join(f"{json.dumps(key)}: {value}" for key, value in persisted.items())
+                )
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    f.write(text)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                os.replace(tmp_file, state_file)
+                if self.fsync:
+                    _fsync_dir(self.data_dir)
+                
+                # Every record in the journal is covered by the snapshot; records
+                # for later seqs are appended by the writer after this
+                with open(journal_file, "w", encoding="utf-8"):
+                    pass
+                component["journal_entries"] = 0
+                component["last_compact_time"] = time.time()
+            self.stats["snapshots"] += 1
+            logger.info(f"State snapshot written for component: {component_id}")
+            return True
         except Exception as e:
-            logger.error(f"Error saving state for component {component_id}: {e}")
+            logger.error(f"Error writing state snapshot for component {component_id}: {e}")
             return False
     
+    def flush(self, timeout: float = 30.0) -> bool:
+        """
+        Wait until every queued journal record has been written, along with
+        any compaction it triggered
+        
+        Returns:
+            True if the queue drained within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self.write_cond:
+            while self.pending_writes > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.write_cond.wait(remaining)
+        return True
+    
+    def close(self):
+        """Stop autosave, write everything out and compact all journals"""
+        self.stop_autosave()
+        self.flush()
+        with self.lock:
+            component_ids = list(self.components)
+        for component_id in component_ids:
+            if self.components[component_id]["journal_entries"]:
+                self.compact(component_id)
+        self.write_queue.put(None)
+        self.writer_thread.join(timeout=5.0)
+    
+    def _read_snapshot(self, path: Path):
+        with open(path, 'r') as f:
+            state_with_meta = json.load(f)
+        return state_with_meta.get("state", {}), state_with_meta.get("seq", 0)
+    
+    def _recover(self, component_id: str):
+        """
+        Rebuild a component's persisted state from its snapshot and journal
+        
+        Returns:
+            (state or None, seq, replayed record count)
+        """
+        state_file, journal_file, backup_file = self._paths(component_id)
+        state, seq = None, 0
+        
+        for path in (state_file, backup_file):
+            if not path.exists():
+                continue
+            try:
+                state, seq = self._read_snapshot(path)
+                break
+            except (json.JSONDecodeError, OSError) as e:
+                logger.error(f"Invalid state file {path.name} for component {component_id}: {e}")
+        
+        replayed = 0
+        if journal_file.exists():
+            with open(journal_file, 'r', encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write from a crash; nothing after it can be trusted
+                        logger.warning(f"Ignoring incomplete journal record for component: {component_id}")
+                        break
+                    if record["seq"] <= seq:
+                        continue
+                    state = state if state is not None else {}
+                    state.update(record.get("set", {}))
+                    for key in record.get("unset", []):
+                        state.pop(key, None)
+                    seq = record["seq"]
+                    replayed += 1
+        
+        return state, seq, replayed
+    
     def load_state(self, component_id: str) -> bool:
         """
         Load the state of a component
         
         Args:
             component_id: Component ID to load
-            
+        
         Returns:
             True if state was loaded successfully
         """
@@ -157,70 +435,42 @@ class StateManager:
             if component_id not in self.components:
                 logger.warning(f"Component not registered: {component_id}")
                 return False
-            
             component = self.components[component_id]
+        
+        if component["set_state"] is None:
+            logger.warning(f"Component {component_id} does not support state loading")
+            return False
+        
+        # Make sure nothing queued for this component is missed by the replay
+        self.flush()
+        
+        try:
+            with component["io_lock"]:
+                state, seq, replayed = self._recover(component_id)
             
-            if component["set_state"] is None:
-                logger.warning(f"Component {component_id} does not support state loading")
+            if state is None:
+                logger.warning(f"No state file found for component: {component_id}")
                 return False
+            if replayed:
+                logger.info(f"Replayed {replayed} journal records for component: {component_id}")
             
-            # Check for state file
-            state_file = self.data_dir / f"{component_id}.json"
-            backup_file = self.data_dir / f"{component_id}.backup.json"
-            
-            if not state_file.exists():
-                if not backup_file.exists():
-                    logger.warning(f"No state file found for component: {component_id}")
-                    return False
-                
-                # Use backup file if main file doesn't exist
-                state_file = backup_file
-            
-            try:
-                # Load the state
-                with open(state_file, 'r') as f:
-                    state_with_meta = json.load(f)
-                
-                # Extract the actual state
-                state = state_with_meta.get("state", {})
-                
-                # Set the component's state
-                result = component["set_state"](state)
-                
-                if result:
-                    logger.info(f"State loaded for component: {component_id}")
-                else:
-                    logger.warning(f"Component {component_id} rejected state")
-                
-                return result
+            # Set the component's state
+            result = component["set_state"](state)
             
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON in state file for component: {component_id}")
-                
-                # Try to use backup
-                if state_file != backup_file and backup_file.exists():
-                    logger.info(f"Trying backup file for component: {component_id}")
-                    try:
-                        with open(backup_file, 'r') as f:
-                            state_with_meta = json.load(f)
-                        
-                        state = state_with_meta.get("state", {})
-                        result = component["set_state"](state)
-                        
-                        if result:
-                            logger.info(f"State loaded from backup for component: {component_id}")
-                        else:
-                            logger.warning(f"Component {component_id} rejected backup state")
-                        
-                        return result
-                    except:
-                        logger.error(f"Error loading backup state for component: {component_id}")
-                
-                return False
+            if result:
+                with component["lock"]:
+                    component["persisted"] = {key: json.dumps(value, sort_keys=True) for key, value in state.items()}
+                    component["scalars"] = {}
+                    component["seq"] = seq
+                logger.info(f"State loaded for component: {component_id}")
+            else:
+                logger.warning(f"Component {component_id} rejected state")
             
-            except Exception as e:
-                logger.error(f"Error loading state for component {component_id}: {e}")
-                return False
+            return result
+        
+        except Exception as e:
+            logger.error(f"Error loading state for component {component_id}: {e}")
+            return False
     
     def start_autosave(self, interval: int = None):
         """
@@ -285,13 +535,13 @@ class StateManager:
             "autosave": {
                 "running": self.autosave_running,
                 "interval": self.autosave_interval
-            }
+            },
+            "writer": dict(self.stats, pending_writes=self.pending_writes)
         }
         
         # Get info for each component
-        for comp_id, component in self.components.items():
-            state_file = self.data_dir / f"{comp_id}.json"
-            backup_file = self.data_dir / f"{comp_id}.backup.json"
+        for comp_id, component in list(self.components.items()):
+            state_file, journal_file, backup_file = self._paths(comp_id)
             
             info["components"][comp_id] = {
                 "registered": True,
@@ -299,6 +549,8 @@ class StateManager:
                 "backup_file_exists": backup_file.exists(),
                 "last_save_time": component["last_save_time"],
                 "save_count": component["save_count"],
+                "seq": component["seq"],
+                "journal_entries": component["journal_entries"],
                 "supports_loading": component["set_state"] is not None
             }
             
@@ -327,7 +579,7 @@ def get_state_manager() -> StateManager:
         _state_manager = StateManager()
     return _state_manager
 
-def register_component(component_id: str, 
+def register_component(component_id: str,
                       get_state_func: Callable[[], Dict[str, Any]],
                       set_state_func: Callable[[Dict[str, Any]], bool] = None):
     """
@@ -347,7 +599,7 @@ def save_component_state(component_id: str) -> bool:
     
     Args:
         component_id: Component ID to save
-        
+    
     Returns:
         True if successful
     """
@@ -360,7 +612,7 @@ def load_component_state(component_id: str) -> bool:
     
     Args:
         component_id: Component ID to load
-        
+    
     Returns:
         True if successful
     """
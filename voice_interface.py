@@ -4,13 +4,15 @@ Enables speech recognition and text-to-speech capabilities
 """
 
 import os
+import re
 import time
 import json
 import queue
+import argparse
 import logging
 import threading
 import subprocess
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Iterable
 from pathlib import Path
 
 # Set up logging
@@ -270,6 +272,288 @@ class SpeechRecognizer:
             logger.error(f"Error in speech recognition: {e}")
             return None
 
+class SentenceSegmenter:
+    """Splits an incremental text/token stream into speakable sentences"""
+    
+    # Abbreviations that end with a period but do not end a sentence
+    ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "e.g", "i.e", "approx", "no"}
+    
+    _BOUNDARY = re.compile(r'[.!?…]+["\')\]]*(?=\s)|\n+')
+    
+    def __init__(self, min_chars: int = 12, max_chars: int = 300):
+        """
+        Initialize the segmenter
+        
+        Args:
+            min_chars: Segments shorter than this are merged with the next one
+            max_chars: Force a split (at a comma or space) once the buffer grows past this
+        """
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+    
+    def feed(self, text: str) -> List[str]:
+        """
+        Add text to the buffer and return any sentences that are now complete
+        
+        Args:
+            text: Next chunk of the stream (a token, word or partial sentence)
+            
+        Returns:
+            List of complete sentences, possibly empty
+        """
+        if not text:
+            return []
+        
+        self.buffer += text
+        sentences = []
+        start = 0
+        
+        for match in self._BOUNDARY.finditer(self.buffer):
+            end = match.end()
+            candidate = self.buffer[start:end].strip()
+            
+            if not candidate:
+                start = end
+                continue
+            if len(candidate) < self.min_chars or self._ends_with_abbreviation(candidate):
+                continue
+            
+            sentences.append(candidate)
+            start = end
+        
+        self.buffer = self.buffer[start:]
+        
+        # Long run-on text without punctuation: split at the last comma or space
+        while len(self.buffer) > self.max_chars:
+            cut = self.buffer.rfind(",", 0, self.max_chars)
+            if cut <= 0:
+                cut = self.buffer.rfind(" ", 0, self.max_chars)
+            if cut <= 0:
+                cut = self.max_chars
+            sentences.append(self.buffer[:cut + 1].strip())
+            self.buffer = self.buffer[cut + 1:]
+        
+        return sentences
+    
+    def flush(self) -> List[str]:
+        """Return whatever is left in the buffer as a final sentence"""
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        return [remainder] if remainder else []
+    
+    def _ends_with_abbreviation(self, sentence: str) -> bool:
+        """Check if the sentence only ends because of an abbreviation"""
+        if not sentence.endswith("."):
+            return False
+        last_word = sentence.rstrip(".").rsplit(None, 1)[-1].lower()
+        return last_word in self.ABBREVIATIONS
+
+
+class PiperProcess:
+    """Persistent Piper subprocess that streams raw audio into a persistent player"""
+    
+    def __init__(self, piper_path: str, model_path: str, sample_rate: int = None,
+                 buffer_chunks: int = 64, chunk_size: int = 4096):
+        """
+        Initialize the Piper process wrapper
+        
+        Args:
+            piper_path: Path to the piper executable
+            model_path: Path to the .onnx voice model
+            sample_rate: Output sample rate (read from the model's .json if omitted)
+            buffer_chunks: Maximum number of audio chunks held between synthesis and playback
+            chunk_size: Size in bytes of each audio chunk read from Piper
+        """
+        self.piper_path = piper_path
+        self.model_path = model_path
+        self.sample_rate = sample_rate or self._read_sample_rate()
+        self.chunk_size = chunk_size
+        self.buffer_chunks = buffer_chunks
+        self.audio_queue = queue.Queue(maxsize=buffer_chunks)
+        
+        self.process = None
+        self.player = None
+        self.reader_thread = None
+        self.player_thread = None
+        self.last_audio_time = 0.0
+        self.last_submit_time = 0.0
+        # Wall-clock time at which audio already handed to the player finishes playing
+        self.playback_until = 0.0
+        self.lock = threading.Lock()
+    
+    def _read_sample_rate(self) -> int:
+        """Read the sample rate from the voice model config, defaulting to 22050"""
+        config_file = f"{self.model_path}.json"
+        try:
+            with open(config_file, 'r') as f:
+                return int(json.load(f).get("audio", {}).get("sample_rate", 22050))
+        except Exception:
+            return 22050
+    
+    def is_alive(self) -> bool:
+        """Check if the Piper process is running"""
+        return self.process is not None and self.process.poll() is None
+    
+    def start(self) -> bool:
+        """Start Piper and the audio player if they are not already running"""
+        with self.lock:
+            if self.is_alive():
+                return True
+            
+            import platform
+            system = platform.system()
+            if system != "Linux":
+                logger.error(f"Piper TTS output playback not implemented for {system}")
+                return False
+            
+            try:
+                self.process = subprocess.Popen(
+                    [self.piper_path, "--model", self.model_path, "--output_raw"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    bufsize=0
+                )
+                self.player = subprocess.Popen(
+                    ["aplay", "-q", "-r", str(self.sample_rate), "-f", "S16_LE", "-t", "raw", "-c", "1"],
+                    stdin=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    bufsize=0
+                )
+            except Exception as e:
+                logger.error(f"Error starting Piper TTS: {e}")
+                self._terminate()
+                return False
+            
+            # Each process pair gets its own buffer so stale audio never leaks across restarts
+            self.audio_queue = queue.Queue(maxsize=self.buffer_chunks)
+            self.reader_thread = threading.Thread(
+                target=self._read_audio, args=(self.process, self.audio_queue), daemon=True
+            )
+            self.player_thread = threading.Thread(
+                target=self._play_audio, args=(self.player, self.audio_queue), daemon=True
+            )
+            self.reader_thread.start()
+            self.player_thread.start()
+            logger.info("Started persistent Piper TTS process")
+            return True
+    
+    def synthesize(self, text: str) -> bool:
+        """
+        Queue text for synthesis; audio is played as soon as Piper produces it
+        
+        Args:
+            text: Sentence to synthesize (newlines are collapsed)
+            
+        Returns:
+            True if the text was handed to Piper
+        """
+        if not self.start():
+            return False
+        
+        line = " ".join(text.split()) + "\n"
+        try:
+            self.last_submit_time = time.time()
+            self.process.stdin.write(line.encode("utf-8"))
+            self.process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError) as e:
+            logger.error(f"Piper TTS process died: {e}")
+            self.close()
+            return False
+    
+    def _read_audio(self, process: subprocess.Popen, audio_queue: queue.Queue):
+        """Move raw audio from Piper into the bounded playback buffer"""
+        while True:
+            try:
+                chunk = process.stdout.read(self.chunk_size)
+            except (OSError, ValueError):
+                break
+            if not chunk:
+                break
+            self.last_audio_time = time.time()
+            # Blocks when the buffer is full, which in turn throttles Piper
+            audio_queue.put(chunk)
+        audio_queue.put(None)
+    
+    def _play_audio(self, player: subprocess.Popen, audio_queue: queue.Queue):
+        """Feed buffered audio to the player process"""
+        while True:
+            chunk = audio_queue.get()
+            if chunk is None:
+                break
+            try:
+                player.stdin.write(chunk)
+                now = time.time()
+                self.last_audio_time = now
+                # 16-bit mono: the player still has this much audio to play after the write returns
+                self.playback_until = max(self.playback_until, now) + len(chunk) / (2.0 * self.sample_rate)
+            except (BrokenPipeError, OSError, ValueError):
+                break
+        # Keep draining so the reader thread can never block on a full buffer
+        self._drain(audio_queue)
+    
+    def wait_until_idle(self, idle_time: float = 0.3, timeout: float = 60.0,
+                        first_audio_timeout: float = 10.0):
+        """
+        Block until everything submitted so far has been played
+        
+        Audio must have arrived after the latest synthesize() call, the buffer
+        must be empty, the player must have played what it was given, and Piper
+        must have been quiet for idle_time seconds.
+        
+        Args:
+            idle_time: Quiet period that counts as finished
+            timeout: Maximum time to wait
+            first_audio_timeout: Give up if Piper produces no audio for the
+                latest utterance within this many seconds
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline and self.is_alive():
+            now = time.time()
+            if self.last_audio_time < self.last_submit_time:
+                # Piper has not started on the latest utterance yet
+                if now - self.last_submit_time >= first_audio_timeout:
+                    return
+            elif (self.audio_queue.empty() and now >= self.playback_until
+                  and now - self.last_audio_time >= idle_time):
+                return
+            time.sleep(0.05)
+    
+    @staticmethod
+    def _drain(audio_queue: queue.Queue):
+        """Discard everything currently in an audio buffer"""
+        try:
+            while True:
+                audio_queue.get_nowait()
+        except queue.Empty:
+            pass
+    
+    def _terminate(self):
+        """Kill the Piper and player processes"""
+        for proc in (self.process, self.player):
+            if proc is None:
+                continue
+            try:
+                proc.kill()
+            except Exception:
+                pass
+        self.process = None
+        self.player = None
+    
+    def close(self):
+        """Stop playback immediately and shut down the subprocesses"""
+        with self.lock:
+            self._terminate()
+            self.playback_until = 0.0
+            self._drain(self.audio_queue)
+            # Unblock the player thread if it is waiting for audio
+            try:
+                self.audio_queue.put_nowait(None)
+            except queue.Full:
+                pass
+
 class TextToSpeech:
     """Handles text-to-speech for voice output"""
     
@@ -284,6 +568,7 @@ class TextToSpeech:
         self.speaking = False
         self.speak_thread = None
         self.stop_speaking = threading.Event()
+        self.piper = None
         
         # Try to load text-to-speech modules
         try:
@@ -341,6 +626,9 @@ class TextToSpeech:
             "speech_rate": 175,
             "volume": 1.0,
             "pitch": 1.0,
+            "stream_min_chars": 12,
+            "stream_max_chars": 300,
+            "stream_audio_buffer": 4,
             "api_keys": {}
         }
         
@@ -389,6 +677,121 @@ class TextToSpeech:
         self.speak_thread = threading.Thread(target=self._speak_thread, args=(text,), daemon=True)
         self.speak_thread.start()
     
+    def speak_stream(self, chunks: Iterable[str]):
+        """
+        Speak a text stream (e.g. LLM tokens) sentence by sentence as it arrives
+        
+        The stream is segmented into sentences on one thread, each sentence is
+        synthesized while the next one is still being generated, and audio is
+        played from a bounded buffer so playback never waits for the full reply.
+        
+        Args:
+            chunks: Iterable of text fragments in generation order
+        """
+        if not self.initialized:
+            logger.error("Text-to-speech not initialized")
+            return
+        
+        # Stop any current speech
+        self.stop_speaking.set()
+        if self.speak_thread and self.speak_thread.is_alive():
+            self.speak_thread.join(timeout=1.0)
+        
+        self.stop_speaking.clear()
+        self.speak_thread = threading.Thread(target=self._speak_stream_thread, args=(chunks,), daemon=True)
+        self.speak_thread.start()
+    
+    def _speak_stream_thread(self, chunks: Iterable[str]):
+        """Background thread running the segment -> synthesize -> play pipeline"""
+        self.speaking = True
+        tts_engine = self.config.get("tts_engine", "system").lower()
+        sentences = queue.Queue()
+        # Bounded so synthesis never runs too far ahead of playback
+        audio = queue.Queue(maxsize=self.config.get("stream_audio_buffer", 4))
+        
+        segmenter = SentenceSegmenter(
+            min_chars=self.config.get("stream_min_chars", 12),
+            max_chars=self.config.get("stream_max_chars", 300)
+        )
+        
+        def segment():
+            # Text is cheap, so the sentence queue is unbounded and never stalls the generator
+            try:
+                for chunk in chunks:
+                    if self.stop_speaking.is_set():
+                        break
+                    for sentence in segmenter.feed(chunk):
+                        sentences.put(sentence)
+                for sentence in segmenter.flush():
+                    sentences.put(sentence)
+            except Exception as e:
+                logger.error(f"Error reading text stream for TTS: {e}")
+            finally:
+                sentences.put(None)
+        
+        def play():
+            while True:
+                item = audio.get()
+                if item is None:
+                    break
+                if self.stop_speaking.is_set():
+                    continue
+                try:
+                    self._play_segment(tts_engine, item)
+                except Exception as e:
+                    logger.error(f"Error playing TTS segment: {e}")
+        
+        segment_thread = threading.Thread(target=segment, daemon=True)
+        play_thread = threading.Thread(target=play, daemon=True)
+        segment_thread.start()
+        play_thread.start()
+        
+        try:
+            while True:
+                sentence = sentences.get()
+                if sentence is None or self.stop_speaking.is_set():
+                    break
+                item = self._synthesize_segment(tts_engine, sentence)
+                if item is not None:
+                    audio.put(item)
+        except Exception as e:
+            logger.error(f"Error in streaming text-to-speech: {e}")
+        finally:
+            audio.put(None)
+            play_thread.join()
+            if tts_engine == "piper" and self.piper and not self.stop_speaking.is_set():
+                self.piper.wait_until_idle()
+            self.speaking = False
+    
+    def _synthesize_segment(self, tts_engine: str, text: str):
+        """
+        Synthesize one sentence for the streaming pipeline
+        
+        Returns:
+            A (kind, payload) tuple for _play_segment, or None if the engine
+            plays the audio itself (Piper streams straight into its player)
+        """
+        if tts_engine == "piper":
+            piper = self._get_piper()
+            if piper:
+                piper.synthesize(text)
+            return None
+        if tts_engine == "elevenlabs":
+            content = self._elevenlabs_synthesize(text)
+            return ("mp3", content) if content else None
+        # System and Azure engines synthesize and play in a single call
+        return ("text", text)
+    
+    def _play_segment(self, tts_engine: str, item: Tuple[str, Any]):
+        """Play one item produced by _synthesize_segment"""
+        kind, payload = item
+        if kind == "mp3":
+            self._play_audio_file(payload, ".mp3")
+        elif tts_engine == "azure":
+            self._azure_tts(payload)
+        else:
+            self._system_tts(payload)
+    
     def _speak_thread(self, text: str):
         """Background thread for speech synthesis"""
         self.speaking = True
@@ -432,13 +835,19 @@ class TextToSpeech:
     
     def _elevenlabs_tts(self, text: str):
         """Use ElevenLabs for TTS"""
+        content = self._elevenlabs_synthesize(text)
+        if content:
+            self._play_audio_file(content, ".mp3")
+    
+    def _elevenlabs_synthesize(self, text: str) -> Optional[bytes]:
+        """Fetch synthesized audio for text from ElevenLabs"""
         try:
             import requests
             
             api_key = self.config.get("api_keys", {}).get("elevenlabs")
             if not api_key:
                 logger.error("ElevenLabs API key not found in config")
-                return
+                return None
             
             voice_id = self.config.get("elevenlabs_voice_id", "21m00Tcm4TlvDq8ikWAM")
             
@@ -461,37 +870,39 @@ class TextToSpeech:
             response = requests.post(url, json=data, headers=headers)
             
             if response.status_code == 200:
-                # Play the audio
-                import tempfile
-                import platform
-                import subprocess
-                
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_file:
-                    temp_file.write(response.content)
-                    temp_path = temp_file.name
-                
-                system = platform.system()
-                
-                try:
-                    if system == "Windows":
-                        os.startfile(temp_path)
-                    elif system == "Darwin":  # macOS
-                        subprocess.run(["afplay", temp_path], check=False)
-                    else:  # Linux
-                        subprocess.run(["mpg123", temp_path], check=False)
-                finally:
-                    # Wait a bit before deleting the file to allow playback to start
-                    time.sleep(0.5)
-                    try:
-                        os.unlink(temp_path)
-                    except:
-                        pass
-            else:
-                logger.error(f"ElevenLabs API error: {response.status_code} {response.text}")
+                return response.content
+            logger.error(f"ElevenLabs API error: {response.status_code} {response.text}")
         except ImportError:
             logger.error("requests module not available for ElevenLabs TTS")
         except Exception as e:
             logger.error(f"Error in ElevenLabs TTS: {e}")
+        return None
+    
+    def _play_audio_file(self, content: bytes, suffix: str):
+        """Write audio bytes to a temporary file and play it"""
+        import tempfile
+        import platform
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            temp_file.write(content)
+            temp_path = temp_file.name
+        
+        system = platform.system()
+        
+        try:
+            if system == "Windows":
+                os.startfile(temp_path)
+            elif system == "Darwin":  # macOS
+                subprocess.run(["afplay", temp_path], check=False)
+            else:  # Linux
+                subprocess.run(["mpg123", temp_path], check=False)
+        finally:
+            # Wait a bit before deleting the file to allow playback to start
+            time.sleep(0.5)
+            try:
+                os.unlink(temp_path)
+            except:
+                pass
     
     def _azure_tts(self, text: str):
         """Use Azure for TTS"""
@@ -525,43 +936,30 @@ class TextToSpeech:
         except Exception as e:
             logger.error(f"Error in Azure TTS: {e}")
     
-    def _piper_tts(self, text: str):
-        """Use local Piper TTS"""
-        try:
+    def _get_piper(self) -> Optional[PiperProcess]:
+        """Get the persistent Piper process, creating it on first use"""
+        if self.piper is None:
             piper_path = self.config.get("piper_path")
             model_path = self.config.get("piper_model")
             
             if not piper_path or not model_path:
                 logger.error("Piper path or model not specified in config")
-                return
-            
-            # Create piper command
-            cmd = [piper_path, "--model", model_path, "--output_raw"]
+                return None
             
-            # Run piper command
-            process = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
+            self.piper = PiperProcess(
+                piper_path,
+                model_path,
+                sample_rate=self.config.get("piper_sample_rate"),
+                buffer_chunks=self.config.get("piper_buffer_chunks", 64)
             )
-            
-            # Send text to piper
-            stdout, stderr = process.communicate(input=text)
-            
-            if process.returncode != 0:
-                logger.error(f"Piper TTS error: {stderr}")
-            
-            # Play the audio (requires aplay on Linux, etc.)
-            # This is a simplified example
-            import platform
-            system = platform.system()
-            
-            if system == "Linux":
-                subprocess.run(["aplay"], input=stdout.encode(), check=False)
-            else:
-                logger.error(f"Piper TTS output playback not implemented for {system}")
+        return self.piper
+    
+    def _piper_tts(self, text: str):
+        """Use local Piper TTS"""
+        try:
+            piper = self._get_piper()
+            if piper and piper.synthesize(text):
+                piper.wait_until_idle()
         except Exception as e:
             logger.error(f"Error in Piper TTS: {e}")
     
@@ -569,6 +967,10 @@ class TextToSpeech:
         """Stop current speech"""
         self.stop_speaking.set()
         
+        # Dropping the Piper process discards any audio still buffered; it restarts on next use
+        if self.piper:
+            self.piper.close()
+        
         # Try to stop the engine
         try:
             import platform
@@ -636,6 +1038,8 @@ class VoiceInterface:
         
         # Start if configuration specifies
         config = self._load_config()
+        # Speak replies sentence by sentence while they are generated
+        self.stream_replies = config.get("stream_replies", False)
         if config.get("auto_start", False):
             self.start()
     
@@ -650,7 +1054,8 @@ class VoiceInterface:
             "auto_start": False,
             "always_listen": False,
             "wake_word": "lyra",
-            "voice_commands_enabled": True
+            "voice_commands_enabled": True,
+            "stream_replies": False
         }
         
         if not os.path.exists(config_path):
@@ -735,6 +1140,66 @@ class VoiceInterface:
         # Store the last spoken text for repeat command
         self.last_spoken_text = text
     
+    def speak_stream(self, chunks: Iterable[str]):
+        """
+        Speak a text stream as it is generated
+        
+        Args:
+            chunks: Iterable of text fragments, e.g. tokens from a streaming LLM call
+        """
+        if not self.enabled:
+            logger.warning("Voice interface not enabled")
+            return
+        
+        spoken = []
+        self.last_spoken_text = ""
+        
+        def record(stream):
+            try:
+                for chunk in stream:
+                    spoken.append(chunk)
+                    yield chunk
+            finally:
+                # Store the last spoken text for repeat command
+                self.last_spoken_text = "".join(spoken)
+        
+        self.text_to_speech.speak_stream(record(chunks))
+    
+    def respond(self, bot, text: str, **chat_kwargs) -> str:
+        """
+        Get the bot's reply to recognized speech and speak it
+        
+        With stream_replies set and a bot that supports chat_stream, the reply
+        is spoken while it is still being generated; otherwise it is spoken
+        once complete.
+        
+        Args:
+            bot: Chat interface (e.g. LyraBot)
+            text: Recognized user speech
+            **chat_kwargs: Passed on to the bot's chat method
+            
+        Returns:
+            The full reply text
+        """
+        if not self.enabled:
+            return bot.chat(text, **chat_kwargs)
+        
+        if not (self.stream_replies and hasattr(bot, "chat_stream")):
+            response = bot.chat(text, **chat_kwargs)
+            self.speak(response)
+            return response
+        
+        pieces = []
+        tokens = queue.Queue()
+        self.speak_stream(iter(tokens.get, None))
+        try:
+            for piece in bot.chat_stream(text, **chat_kwargs):
+                pieces.append(piece)
+                tokens.put(piece)
+        finally:
+            tokens.put(None)
+        return "".join(pieces)
+    
     def stop_speaking(self):
         """Stop current speech"""
         self.text_to_speech.stop()
@@ -850,6 +1315,9 @@ def main():
     parser = argparse.ArgumentParser(description="Lyra Voice Interface")
     parser.add_argument("--speak", type=str, help="Text to speak")
     parser.add_argument("--listen", action="store_true", help="Listen for speech")
+    parser.add_argument("--chat", action="store_true", help="Talk to Lyra: listen and speak her replies")
+    parser.add_argument("--stream-replies", action="store_true",
+                        help="With --chat, speak replies while they are generated")
     args = parser.parse_args()
     
     voice_interface = get_instance()
@@ -859,6 +1327,23 @@ def main():
         voice_interface.speak(args.speak)
         time.sleep(5)  # Wait for speech to complete
         voice_interface.stop()
+    elif args.chat:
+        from lyra_bot import LyraBot
+        bot = LyraBot()
+        voice_interface.stream_replies = voice_interface.stream_replies or args.stream_replies
+        voice_interface.start()
+        print("Listening... Press Ctrl+C to stop")
+        try:
+            while True:
+                is_command, text = voice_interface.process_speech()
+                if text:
+                    print(f"You: {text}")
+                    print(f"Lyra: {voice_interface.respond(bot, text)}")
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            print("Stopping...")
+        finally:
+            voice_interface.stop()
     elif args.listen:
         voice_interface.start()
         print("Listening... Press Ctrl+C to stop")